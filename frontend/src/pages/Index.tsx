@@ -4,7 +4,7 @@ import WelcomeWidget from "@/components/dashboard/WelcomeWidget";
 import ChatInterface from "@/components/chat/ChatInterface";
 import RunAgent from "@/components/dashboard/RunAgent";
 import { useEffect, useState } from "react";
-import { runAgent, getAgentStatus, stopAgent, executeSandboxCommand } from "@/services/api"; 
+import { runAgent, getAgentStatus, stopAgent, executeSandboxCommand, subscribeAgentEvents } from "@/services/api"; 
 import { toast } from "@/components/ui/use-toast";
 
 const Index = () => {
@@ -15,7 +15,7 @@ const Index = () => {
     sandbox_status: false
   });
 
-  // Poll for agent status
+  // Refresh the agent status when a run starts, is paused or resumed, or ends
   useEffect(() => {
     const checkStatus = async () => {
       try {
@@ -29,9 +29,11 @@ const Index = () => {
     // Initial check
     checkStatus();
     
-    // Set up polling
-    const interval = setInterval(checkStatus, 3000);
-    return () => clearInterval(interval);
+    return subscribeAgentEvents((event) => {
+      if (event.type !== "step" && event.type !== "step_end") {
+        checkStatus();
+      }
+    });
   }, []);
 
   // Initialize sandbox on page load
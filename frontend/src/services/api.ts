@@ -153,32 +153,45 @@ export async function runAgent(task: string, additionalInfo?: string) {
     throw new Error(`Failed to run agent: ${response.statusText}`);
   }
 
-  const result = await response.json();
-  
-  // Handle browser automation actions
-  if (result.type === 'browser_automation') {
-    const actions = result.actions || [];
-    for (const action of actions) {
-      // Wait for each action to complete and get its status
-      const actionStatus = await fetch(`${API_URL}/browser/action-status/${action.id}`, {
-        method: 'GET',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-      });
-      
-      if (!actionStatus.ok) {
-        throw new Error(`Failed to get action status: ${actionStatus.statusText}`);
-      }
-      
-      const status = await actionStatus.json();
-      if (!status.success) {
-        throw new Error(`Browser automation failed: ${status.error || 'Unknown error'}`);
-      }
-    }
+  return await response.json();
+}
+
+export type AgentEvent = {
+  run_id: string;
+  seq: number;
+  type: string;
+  timestamp: number;
+  [key: string]: any;
+};
+
+const AGENT_EVENT_TYPES = ["run_started", "step", "step_end", "control", "run_finished"];
+
+// Live agent events over server-sent events: every run when runId is omitted,
+// otherwise one run (EventSource resumes after the last event on reconnect).
+// Returns a function that closes the subscription.
+export function subscribeAgentEvents(onEvent: (event: AgentEvent) => void, runId?: string) {
+  const url = runId ? `${API_URL}/agent/runs/${runId}/events` : `${API_URL}/agent/events`;
+  const source = new EventSource(url);
+  const listener = (message: MessageEvent) => onEvent(JSON.parse(message.data));
+  for (const type of AGENT_EVENT_TYPES) {
+    source.addEventListener(type, listener);
+  }
+  return () => source.close();
+}
+
+export async function controlAgentRun(runId: string, action: "pause" | "resume" | "stop") {
+  const response = await fetch(`${API_URL}/agent/runs/${runId}/${action}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to ${action} agent run: ${response.statusText}`);
   }
 
-  return result;
+  return await response.json();
 }
 
 export async function stopAgent() {
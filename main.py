@@ -6,10 +6,6 @@ import sys
 # Add the src directory to the path
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
 
-# Import the API server and webui modules
-from src.api.api_server import start_api_server
-from webui import create_ui, main as webui_main
-
 def start_api_server_thread(host, port):
     """Start the API server in a separate thread"""
     from src.api.api_server import start_api_server
@@ -23,12 +19,35 @@ def main():
     parser.add_argument("--ui-port", type=int, default=7789, help="UI server port")
     parser.add_argument("--frontend-only", action="store_true", help="Start only the frontend")
     parser.add_argument("--api-only", action="store_true", help="Start only the API server")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("JOB_PROCESSES", "0")),
+                        help="Run agent jobs in this many worker processes, 0 runs them in the API server")
     args = parser.parse_args()
 
     if args.frontend_only and args.api_only:
         print("Error: Cannot specify both --frontend-only and --api-only")
         return
 
+    supervisor = None
+    if args.workers > 0 and not args.frontend_only:
+        from src.utils.job_workers import JobSupervisor
+        # set before the API server is imported, it queues jobs in the store instead of running them
+        os.environ["JOB_STORE_PATH"] = os.path.abspath(os.getenv("JOB_STORE_PATH") or "./tmp/jobs.db")
+        print(f"Starting {args.workers} job worker processes on {os.environ['JOB_STORE_PATH']}")
+        supervisor = JobSupervisor(args.workers, os.environ["JOB_STORE_PATH"])
+        supervisor.start()
+
+    try:
+        run(args)
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+
+def run(args):
+    """Start the API server and the Gradio UI"""
+    # Import the API server and webui modules
+    from src.api.api_server import start_api_server
+    from webui import create_ui
+
     # Start API server
     if not args.frontend_only:
         print(f"Starting API server at http://{args.api_host}:{args.api_port}")
@@ -0,0 +1,367 @@
+"""
+Live events of agent runs, pushed to the API instead of polled.
+
+A run gets an AgentEventStream whose callbacks are handed to CustomAgent
+(register_new_step_callback and register_step_end_callback). Every step then
+publishes:
+- "step": evaluation of the previous goal, the memory it added, the thought,
+  the next goal, the actions about to run, the page and the timings of the
+  phases so far (browser state, planner, LLM).
+- "step_end": the action results and the timings of all phases.
+- the step's screenshot as a binary PNG frame.
+and the run publishes "run_started", "control" (pause, resume, stop) and
+"run_finished".
+
+Subscribers may live on other event loops (the webui and the API server run
+on separate loops). Backpressure per subscriber: events wait in a bounded
+queue (AGENT_EVENTS_QUEUE_SIZE) whose oldest events are dropped, and counted,
+when a consumer falls behind; frames are conflated, a subscriber only ever
+gets the latest one. The last AGENT_EVENTS_HISTORY events of a run are kept
+so a late subscriber, or a reconnecting one (SSE Last-Event-ID), catches up.
+
+The stream also controls the run: pause, resume and stop are forwarded to the
+attached agent on its own loop.
+"""
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+CONTROLS = ("pause", "resume", "stop")
+
+
+def _events_queue_size() -> int:
+    return max(1, int(os.getenv("AGENT_EVENTS_QUEUE_SIZE", "256")))
+
+
+def _events_history() -> int:
+    return max(1, int(os.getenv("AGENT_EVENTS_HISTORY", "200")))
+
+
+def _finished_runs_kept() -> int:
+    return max(0, int(os.getenv("AGENT_EVENTS_KEEP_FINISHED", "20")))
+
+
+@dataclass
+class AgentEvent:
+    """One event of a run, seq orders the events of a run"""
+    run_id: str
+    seq: int
+    type: str
+    data: Dict[str, Any]
+    timestamp: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"run_id": self.run_id, "seq": self.seq, "type": self.type, "timestamp": self.timestamp, **self.data}
+
+
+@dataclass
+class AgentFrame:
+    """A screenshot of the page at a step"""
+    run_id: str
+    step: int
+    png: bytes
+    timestamp: float
+
+
+class AgentEventSubscription:
+    """Event queue and latest-frame slot of one consumer, read it from the loop that created it"""
+
+    def __init__(self, on_close, frames: bool = True):
+        self._on_close = on_close
+        self.frames = frames
+        self._loop = asyncio.get_running_loop()
+        self._events: deque = deque()
+        self._frame: Optional[AgentFrame] = None
+        self._wakeup = asyncio.Event()
+        self._ended = False
+        self.max_queued = _events_queue_size()
+        self.dropped = 0
+        self.closed = False
+
+    def _offer(self, item: Union[AgentEvent, AgentFrame, None]):
+        # runs on the subscriber loop, None signals the end of the stream
+        if item is None:
+            self._ended = True
+        elif isinstance(item, AgentFrame):
+            self._frame = item
+        else:
+            self._events.append(item)
+            while len(self._events) > self.max_queued:
+                self._events.popleft()
+                self.dropped += 1
+        self._wakeup.set()
+
+    def push(self, item: Union[AgentEvent, AgentFrame, None]):
+        if self.closed:
+            return
+        if isinstance(item, AgentFrame) and not self.frames:
+            return
+        if self._loop.is_closed():
+            self.closed = True
+            return
+        self._loop.call_soon_threadsafe(self._offer, item)
+
+    async def next(self, timeout: Optional[float] = None) -> Union[AgentEvent, AgentFrame, None]:
+        """
+        Wait for the next event or frame, events first.
+
+        Args:
+            timeout: Seconds to wait, None waits until something arrives
+
+        Returns:
+            The event or frame, None on timeout or once the stream ended (then `closed` is set)
+        """
+        while not self.closed:
+            if self._events:
+                return self._events.popleft()
+            if self._frame is not None:
+                frame, self._frame = self._frame, None
+                return frame
+            if self._ended:
+                self.closed = True
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return None
+
+    def close(self):
+        self.closed = True
+        self._on_close(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Union[AgentEvent, AgentFrame]:
+        item = await self.next()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+
+class AgentEventStream:
+    """Events, latest frame and controls of one agent run"""
+
+    def __init__(self, run_id: Optional[str] = None, task: str = ""):
+        self.run_id = run_id or uuid.uuid4().hex[:16]
+        self.task = task
+        self.status = "running"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.history: deque = deque(maxlen=_events_history())
+        self.latest_frame: Optional[AgentFrame] = None
+        self.agent = None
+        self._agent_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: List[AgentEventSubscription] = []
+        self._seq = 0
+        self._steps = 0
+        self._lock = threading.Lock()
+
+    def attach(self, agent):
+        """Attach the agent the controls act on, from the loop the agent runs on"""
+        self.agent = agent
+        self._agent_loop = asyncio.get_running_loop()
+
+    def publish(self, event_type: str, data: Optional[Dict[str, Any]] = None) -> AgentEvent:
+        """Publish an event to every subscriber, from any thread"""
+        with self._lock:
+            self._seq += 1
+            event = AgentEvent(self.run_id, self._seq, event_type, data or {}, time.time())
+            self.history.append(event)
+            # pushed under the lock, subscribers get the events in seq order
+            for subscription in self._subscribers + _hub_subscribers():
+                subscription.push(event)
+        return event
+
+    def publish_frame(self, step: int, png: bytes):
+        frame = AgentFrame(self.run_id, step, png, time.time())
+        with self._lock:
+            self.latest_frame = frame
+            for subscription in self._subscribers:
+                subscription.push(frame)
+
+    def subscribe(self, after_seq: int = 0, frames: bool = True) -> AgentEventSubscription:
+        """
+        Subscribe from any event loop.
+
+        Args:
+            after_seq: Replay the kept events after this one, 0 replays all of them
+            frames: Also deliver screenshot frames, starting with the latest one
+
+        Returns:
+            AgentEventSubscription: The subscription, close it when done
+        """
+        subscription = AgentEventSubscription(self.unsubscribe, frames)
+        with self._lock:
+            backlog = [event for event in self.history if event.seq > after_seq]
+            # the replay itself is never dropped
+            subscription.max_queued += len(backlog)
+            for event in backlog:
+                subscription.push(event)
+            if self.latest_frame is not None:
+                subscription.push(self.latest_frame)
+            if self.finished_at is None:
+                self._subscribers.append(subscription)
+            else:
+                subscription.push(None)
+        return subscription
+
+    def unsubscribe(self, subscription: AgentEventSubscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def control(self, action: str) -> Dict[str, Any]:
+        """
+        Pause, resume or stop the run.
+
+        Args:
+            action: "pause", "resume" or "stop"
+
+        Returns:
+            dict: Result with the new status, or an error
+        """
+        if action not in CONTROLS:
+            return {"success": False, "error": f"Unknown control {action}, use one of {', '.join(CONTROLS)}"}
+        if self.agent is None or self.status not in ("running", "paused"):
+            return {"success": False, "error": f"Run {self.run_id} is {self.status}, it can not be controlled"}
+        method = getattr(self.agent, action)
+        if self._agent_loop is not None and not self._agent_loop.is_closed():
+            self._agent_loop.call_soon_threadsafe(method)
+        else:
+            method()
+        self.status = {"pause": "paused", "resume": "running", "stop": "stopping"}[action]
+        self.publish("control", {"action": action, "status": self.status})
+        return {"success": True, "run_id": self.run_id, "status": self.status}
+
+    async def on_step(self, state, model_output, n_steps: int):
+        """register_new_step_callback of CustomAgent: the model output of a step, before its actions run"""
+        self._steps = n_steps - 1
+        brain = getattr(model_output, "current_state", None)
+        memory = getattr(brain, "important_contents", "") or ""
+        self.publish("step", {
+            "step": n_steps - 1,
+            "url": getattr(state, "url", None),
+            "title": getattr(state, "title", None),
+            "evaluation_previous_goal": getattr(brain, "evaluation_previous_goal", None),
+            # only what this step added to the memory
+            "memory": memory if memory and "None" not in memory else None,
+            "thought": getattr(brain, "thought", None),
+            "next_goal": getattr(brain, "next_goal", None),
+            "actions": [action.model_dump(exclude_unset=True) for action in model_output.action],
+            "timings": dict(getattr(self.agent, "step_timings", {}) or {}),
+            # requests the network filter saw and blocked since the previous step, None when it is off
+            "network": getattr(getattr(self.agent, "browser_context", None), "network_stats", None),
+        })
+        screenshot = getattr(state, "screenshot", None)
+        if screenshot:
+            try:
+                self.publish_frame(n_steps - 1, base64.b64decode(screenshot))
+            except ValueError as e:
+                logger.debug(f"Undecodable screenshot of step {n_steps - 1}: {e}")
+
+    async def on_step_end(self, results, timings: Dict[str, float], n_steps: int):
+        """register_step_end_callback of CustomAgent: the results and phase timings of a step"""
+        self.publish("step_end", {
+            "step": self._steps,
+            "results": [{
+                "is_done": result.is_done,
+                "extracted_content": result.extracted_content,
+                "error": result.error,
+            } for result in results or []],
+            "timings": timings,
+        })
+
+    def finish(self, status: str = "finished", result: Optional[Any] = None, error: Optional[str] = None):
+        """
+        End the run, subscribers get the final event and then the end of the stream.
+        Only the first call counts, later ones are ignored.
+        """
+        if self.finished_at is not None:
+            return
+        if status == "finished" and self.agent is not None and getattr(self.agent.state, "stopped", False):
+            status = "stopped"
+        self.publish("run_finished", {"status": status, "result": result, "error": error,
+                                      "duration": round(time.time() - self.created_at, 3)})
+        with self._lock:
+            self.status = status
+            self.finished_at = time.time()
+            subscribers, self._subscribers = self._subscribers, []
+        self.agent = None
+        for subscription in subscribers:
+            subscription.push(None)
+        _forget_finished_streams()
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "task": self.task,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "steps": self._steps,
+            "events": self._seq,
+            "subscribers": len(self._subscribers),
+        }
+
+
+# Streams by run id and subscribers to every run, shared across event loops
+_streams: "OrderedDict[str, AgentEventStream]" = OrderedDict()
+_hub: List[AgentEventSubscription] = []
+_registry_lock = threading.Lock()
+
+
+def create_event_stream(run_id: Optional[str] = None, task: str = "") -> AgentEventStream:
+    """Create and register the event stream of a new run"""
+    stream = AgentEventStream(run_id, task)
+    with _registry_lock:
+        _streams[stream.run_id] = stream
+    stream.publish("run_started", {"task": task})
+    return stream
+
+
+def get_event_stream(run_id: str) -> Optional[AgentEventStream]:
+    return _streams.get(run_id)
+
+
+def list_event_streams() -> List[Dict[str, Any]]:
+    with _registry_lock:
+        streams = list(_streams.values())
+    return [stream.get_info() for stream in streams]
+
+
+def subscribe_all() -> AgentEventSubscription:
+    """Subscribe to the events of every run, without frames"""
+    subscription = AgentEventSubscription(_unsubscribe_all, frames=False)
+    with _registry_lock:
+        _hub.append(subscription)
+    return subscription
+
+
+def _unsubscribe_all(subscription: AgentEventSubscription):
+    with _registry_lock:
+        if subscription in _hub:
+            _hub.remove(subscription)
+
+
+def _hub_subscribers() -> List[AgentEventSubscription]:
+    with _registry_lock:
+        return list(_hub)
+
+
+def _forget_finished_streams():
+    with _registry_lock:
+        finished = [run_id for run_id, stream in _streams.items() if stream.finished_at is not None]
+        for run_id in finished[:max(0, len(finished) - _finished_runs_kept())]:
+            del _streams[run_id]
@@ -48,6 +48,7 @@ from browser_use.agent.prompts import PlannerPrompt
 
 from json_repair import repair_json
 from src.utils.agent_state import AgentState
+from src.browser.custom_context import CustomBrowserContext
 
 from .custom_message_manager import CustomMessageManager, CustomMessageManagerSettings
 from .custom_views import CustomAgentOutput, CustomAgentStepInfo, CustomAgentState
@@ -73,6 +74,7 @@ class CustomAgent(Agent):
             # Cloud Callbacks
             register_new_step_callback: Callable[['BrowserState', 'AgentOutput', int], Awaitable[None]] | None = None,
             register_done_callback: Callable[['AgentHistoryList'], Awaitable[None]] | None = None,
+            register_step_end_callback: Callable[[List['ActionResult'], Dict[str, float], int], Awaitable[None]] | None = None,
             register_external_agent_status_raise_error_callback: Callable[[], Awaitable[bool]] | None = None,
             # Agent settings
             use_vision: bool = True,
@@ -143,6 +145,9 @@ class CustomAgent(Agent):
         )
         self.state = injected_agent_state or CustomAgentState()
         self.add_infos = add_infos
+        self.register_step_end_callback = register_step_end_callback
+        # seconds spent per phase of the current step: browser_state, planner, llm, actions, step
+        self.step_timings: Dict[str, float] = {}
         self._message_manager = CustomMessageManager(
             task=task,
             system_message=self.settings.system_prompt_class(
@@ -308,9 +313,21 @@ class CustomAgent(Agent):
         result: list[ActionResult] = []
         step_start_time = time.time()
         tokens = 0
+        self.step_timings = {}
+        phase_start = time.monotonic()
+
+        def end_phase(phase: str):
+            nonlocal phase_start
+            now = time.monotonic()
+            self.step_timings[phase] = round(now - phase_start, 3)
+            phase_start = now
 
         try:
+            if isinstance(self.browser_context, CustomBrowserContext):
+                # between steps nothing holds element handles, the one safe point to swap the context
+                await self.browser_context.recycle_if_needed()
             state = await self.browser_context.get_state()
+            end_phase("browser_state")
             await self._raise_if_stopped_or_paused()
 
             self.message_manager.add_state_message(state, self.state.last_action, self.state.last_result, step_info,
@@ -318,12 +335,16 @@ class CustomAgent(Agent):
 
             # Run planner at specified intervals if planner is configured
             if self.settings.planner_llm and self.state.n_steps % self.settings.planner_interval == 0:
+                phase_start = time.monotonic()
                 await self._run_planner()
+                end_phase("planner")
             input_messages = self.message_manager.get_messages()
             tokens = self._message_manager.state.history.current_tokens
 
             try:
+                phase_start = time.monotonic()
                 model_output = await self.get_next_action(input_messages)
+                end_phase("llm")
                 self.update_step_info(model_output, step_info)
                 self.state.n_steps += 1
 
@@ -344,7 +365,9 @@ class CustomAgent(Agent):
                 self.message_manager._remove_state_message_by_index(-1)
                 raise e
 
+            phase_start = time.monotonic()
             result: list[ActionResult] = await self.multi_act(model_output.action)
+            end_phase("actions")
             for ret_ in result:
                 if ret_.extracted_content and "Extracted page" in ret_.extracted_content:
                     # record every extracted page
@@ -386,6 +409,12 @@ class CustomAgent(Agent):
                     step_error=[r.error for r in result if r.error] if result else ['No result'],
                 )
             )
+            self.step_timings["step"] = round(step_end_time - step_start_time, 3)
+            if self.register_step_end_callback:
+                try:
+                    await self.register_step_end_callback(result, dict(self.step_timings), self.state.n_steps)
+                except Exception as e:
+                    logger.debug(f"Step end callback failed: {e}")
             if not result:
                 return
 
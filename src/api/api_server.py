@@ -1,25 +1,104 @@
-from fastapi import FastAPI, HTTPException, Body, Request, Depends
+from fastapi import FastAPI, HTTPException, Body, Request, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 from typing import Dict, List, Optional, Any
 import os
 import sys
+import asyncio
 import logging
 import json
+import base64
+import mimetypes
+import time
 
 # Add the parent directory to sys.path to allow imports from other modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.agent_state import AgentState
 from utils import utils
 from controller import Controller
 from utils.agent_controller import AgentController
-from sandbox import Sandbox
+from utils.job_queue import JobQueue, JobQueueFull
+from utils.job_store import JobStore, StoreJobQueue, job_store_path
+from utils.admission import (AdmissionController, AdmissionGate, AdmissionMiddleware, FunctionProbe, MemoryProbe,
+                             SubmissionQuota, gate_limits, is_provider_throttle)
+from src.agent.agent_events import AgentFrame, create_event_stream, get_event_stream, list_event_streams, subscribe_all
+from src.utils.session_registry import DEFAULT_SESSION_ID, get_session_registry
+from src.sandbox import get_sandbox_manager
+from src.sandbox.executor import get_command_executor
+from src.sandbox.file_transfer import parse_range
+from src.sandbox.shell_session import get_shell_session_pool
+from src.sandbox.python_kernel import get_kernel_pool
+from src.browser.browser_pool import get_browser_pool, get_browser_pools, close_browser_pools, browser_pool_enabled
+from src.browser.screencast import get_screencast, list_screencasts
+from src.browser.resource_watchdog import get_resource_watchdog
 
 app = FastAPI(title="Browser Use API", description="API for Browser Use Web UI")
 
-# Configure CORS to allow requests from the frontend
+# Create global state instances
+config_manager = utils.ConfigManager()
+controller = Controller()
+agent_controller = AgentController()
+sandbox_manager = get_sandbox_manager()
+
+# one agent controller per job worker, each with the worker's sandbox and browser
+job_controllers: Dict[int, AgentController] = {}
+
+async def run_agent_job(job, worker):
+    """Run a queued agent task on a worker"""
+    agent = job_controllers.get(worker.index)
+    if agent is None:
+        agent = AgentController(sandbox_key=worker.sandbox_key, browser_lease=await worker.lease_browser())
+        job_controllers[worker.index] = agent
+    event_stream = create_event_stream(job.job_id, job.task)
+    try:
+        result = await agent.execute_task(job.task, job.additional_info)
+    except asyncio.CancelledError:
+        event_stream.finish("cancelled")
+        raise
+    except Exception as e:
+        event_stream.finish("failed", error=str(e))
+        raise
+    event_stream.finish("finished" if result.get("success", True) else "failed",
+                        result=result.get("output"), error=result.get("error") or None)
+    if not result.get("success", True) and is_provider_throttle(result.get("error")):
+        submission_quota.throttle()
+    return result
+
+# with worker processes (main.py --workers) they run the jobs, the API server only queues them in the store
+job_queue = StoreJobQueue(JobStore(job_store_path())) if job_store_path() else JobQueue(run_agent_job)
+
+async def free_job_capacity() -> int:
+    """Jobs that can start or wait now: idle job workers, each with its own browser, and room in the job queue"""
+    stats = await job_queue.get_stats()
+    return max(0, stats["workers"] - stats["running"]) + max(0, stats["max_queued"] - stats["queued"])
+
+# Admission control of the endpoints that start browsers and processes. Agent runs wait for job
+# capacity, a waiting run-agent call holds its slot until the job finished; streams and WebSockets
+# hold their slot until they close.
+submission_quota = SubmissionQuota()
+agent_memory_mb = int(os.environ.get("ADMISSION_AGENT_MEMORY_MB", "600"))
+command_memory_mb = int(os.environ.get("ADMISSION_COMMAND_MEMORY_MB", "64"))
+admission = AdmissionController()
+admission.add("/api/run-agent", AdmissionGate(
+    "run-agent", *gate_limits("run-agent", 64, 32), probes=[FunctionProbe("jobs", free_job_capacity), submission_quota]))
+admission.add("/api/research", AdmissionGate(
+    "research", *gate_limits("research", 2, 8), probes=[MemoryProbe(agent_memory_mb), submission_quota]))
+sandbox_execute = admission.add(["/api/sandbox/execute", "/api/sandbox/execute/stream"], AdmissionGate(
+    "sandbox-execute", *gate_limits("sandbox-execute", 16, 64), probes=[MemoryProbe(command_memory_mb)]))
+admission.add("/api/sandbox/ws", sandbox_execute, methods=("WEBSOCKET",))
+admission.add("/api/sandbox/batch", AdmissionGate(
+    "sandbox-batch", *gate_limits("sandbox-batch", 4, 16), probes=[MemoryProbe(command_memory_mb)]))
+admission.add(["/api/sandbox/python", "/api/sandbox/python/stream"], AdmissionGate(
+    "sandbox-python", *gate_limits("sandbox-python", 8, 32), probes=[MemoryProbe(command_memory_mb)]))
+admission.add("/api/sandbox/processes", AdmissionGate(
+    "sandbox-processes", *gate_limits("sandbox-processes", 4, 16), probes=[MemoryProbe(command_memory_mb)]))
+
+# a pure ASGI middleware, an HTTP one would free the slot once the response headers are out
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Configure CORS to allow requests from the frontend, added last so it also wraps the refusals
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Update to allow requests from any origin during development
@@ -28,13 +107,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create global state instances
-agent_state = AgentState()
-config_manager = utils.ConfigManager()
-controller = Controller()
-agent_controller = AgentController()
-sandbox = Sandbox()
-
 # Security settings
 enable_auth = os.environ.get("ENABLE_AUTH", "false").lower() == "true"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
@@ -46,6 +118,26 @@ async def get_token(request: Request, token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=401, detail="Not authenticated")
     return token
 
+@app.on_event("startup")
+async def warm_browser_pool():
+    """Pre-launch pooled browsers so the first task does not pay for a cold start"""
+    if browser_pool_enabled() and os.environ.get("BROWSER_POOL_WARM_ON_STARTUP", "false").lower() == "true":
+        await get_browser_pool().start()
+
+@app.on_event("shutdown")
+async def shutdown_job_queue():
+    # before the browser pools, workers hand their browsers back
+    await job_queue.close()
+
+@app.on_event("shutdown")
+async def shutdown_browser_pool():
+    await close_browser_pools()
+
+@app.on_event("shutdown")
+async def shutdown_shell_sessions():
+    await get_shell_session_pool().close_all()
+    await get_kernel_pool().close_all()
+
 # LLM API routes
 @app.get("/api/llm/providers")
 async def get_llm_providers():
@@ -90,6 +182,43 @@ async def save_browser_settings(settings: Dict[str, Any] = Body(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/browser/pool")
+async def get_browser_pool_stats():
+    """Get the state of the warm browser pools"""
+    return {
+        "enabled": browser_pool_enabled(),
+        "pools": [pool.get_stats() for pool in get_browser_pools()]
+    }
+
+@app.get("/api/browser/resources")
+async def get_browser_resources():
+    """Get the latest resource sample (RSS, CPU, pages, JS heap) of every tracked browser"""
+    return get_resource_watchdog().get_metrics()
+
+@app.get("/api/browser/screencasts")
+async def get_browser_screencasts():
+    """List the live browser views that can be streamed"""
+    return {"screencasts": list_screencasts()}
+
+@app.get("/api/browser/screencast/{context_id}")
+async def stream_browser_screencast(context_id: str):
+    """Stream the live view of a browser context as MJPEG, frames are only sent when the page changed"""
+    source = get_screencast(context_id)
+    if source is None:
+        raise HTTPException(status_code=404, detail="No screencast for this browser context")
+
+    async def frames():
+        subscription = source.subscribe()
+        try:
+            async for frame in subscription:
+                jpeg = frame.jpeg
+                yield (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                       + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+        finally:
+            subscription.close()
+
+    return StreamingResponse(frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+
 # Sandbox API routes
 @app.get("/api/settings/sandbox")
 async def get_sandbox_settings():
@@ -110,12 +239,17 @@ async def save_sandbox_settings(settings: Dict[str, Any] = Body(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_sandbox_key(request: Request, data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Client or run id selecting the caller's sandbox: client_id in the body, else the X-Client-Id header"""
+    return (data or {}).get("client_id") or request.headers.get("X-Client-Id")
+
 @app.post("/api/sandbox/execute")
-async def execute_sandbox_command(data: Dict[str, str] = Body(...)):
+async def execute_sandbox_command(request: Request, data: Dict[str, str] = Body(...)):
     """Execute a command in the sandbox"""
     try:
         command = data.get("command", "")
         timeout = data.get("timeout", None)
+        session_id = data.get("session_id", None)
         
         if not command:
             raise HTTPException(status_code=400, detail="Command is required")
@@ -123,49 +257,514 @@ async def execute_sandbox_command(data: Dict[str, str] = Body(...)):
         if timeout:
             timeout = int(timeout)
             
-        result = controller.execute_sandbox_command(command, timeout)
+        result = await controller.execute_sandbox_command_async(command, timeout, session_id,
+                                                                get_sandbox_key(request, data))
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Agent API routes
-@app.post("/api/run-agent")
-async def run_agent(data: Dict[str, str] = Body(...)):
-    """Run the agent with a task"""
+@app.post("/api/sandbox/batch")
+async def execute_sandbox_batch(request: Request, data: Dict[str, Any] = Body(...)):
+    """Run a DAG of commands, {"nodes": [{"id", "command", "depends_on"}], "max_parallel", "cancel_on_failure"}"""
+    nodes = data.get("nodes")
+    if not isinstance(nodes, list) or not nodes:
+        raise HTTPException(status_code=400, detail="nodes is required")
+    max_parallel = int(data["max_parallel"]) if data.get("max_parallel") else None
+    result = await controller.execute_sandbox_dag(nodes, max_parallel, bool(data.get("cancel_on_failure")),
+                                                  get_sandbox_key(request, data))
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/execute/stream")
+async def stream_sandbox_command(request: Request, data: Dict[str, str] = Body(...)):
+    """Execute a command in the sandbox, streaming stdout/stderr as server-sent events"""
+    command = data.get("command", "")
+    timeout = data.get("timeout", None)
+    if not command:
+        raise HTTPException(status_code=400, detail="Command is required")
+    timeout = int(timeout) if timeout else None
+    session_id = data.get("session_id", None)
+    client_id = get_sandbox_key(request, data)
+
+    async def events():
+        # closing the generator on client disconnect kills the process group
+        async for event in controller.stream_sandbox_command(command, timeout, session_id, client_id):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/sandbox/ws")
+async def sandbox_websocket(websocket: WebSocket):
+    """Execute commands sent as {"command": ..., "timeout": ..., "session_id": ..., "client_id": ...}, replying with output events"""
+    await websocket.accept()
     try:
-        task = data.get("task", "")
-        additional_info = data.get("additionalInfo", "")
-        
-        if not task:
-            raise HTTPException(status_code=400, detail="Task is required")
-        
-        # Start agent with task
-        agent_state.set_state("running")
-        
-        # Use the new agent controller to run the task
-        result = await agent_controller.execute_task(task, additional_info)
-        
-        return result
+        while True:
+            data = await websocket.receive_json()
+            command = data.get("command", "")
+            if not command:
+                await websocket.send_json({"type": "error", "error": "Command is required"})
+                continue
+            timeout = int(data["timeout"]) if data.get("timeout") else None
+            client_id = data.get("client_id") or websocket.headers.get("X-Client-Id")
+            async for event in controller.stream_sandbox_command(command, timeout, data.get("session_id"), client_id):
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/api/sandbox/sessions")
+async def list_sandbox_sessions(request: Request):
+    """List the persistent shell sessions of the caller's sandbox"""
+    return {"sessions": controller.get_sandbox(get_sandbox_key(request)).list_shell_sessions()}
+
+@app.delete("/api/sandbox/sessions/{session_id}")
+async def close_sandbox_session(session_id: str, request: Request):
+    """Close a persistent shell session"""
+    result = await controller.get_sandbox(get_sandbox_key(request)).close_shell_session(session_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/python")
+async def execute_sandbox_python(request: Request, data: Dict[str, Any] = Body(...)):
+    """Run a code cell in a persistent Python kernel of the sandbox"""
+    code = data.get("code", "")
+    if not code:
+        raise HTTPException(status_code=400, detail="Code is required")
+    timeout = int(data["timeout"]) if data.get("timeout") else None
+    try:
+        sandbox = controller.get_sandbox(get_sandbox_key(request, data))
+        return await sandbox.execute_python(code, data.get("session_id") or "default", timeout)
     except Exception as e:
-        agent_state.set_state("error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/sandbox/python/stream")
+async def stream_sandbox_python(request: Request, data: Dict[str, Any] = Body(...)):
+    """Run a code cell in a persistent Python kernel, streaming its output as server-sent events"""
+    code = data.get("code", "")
+    if not code:
+        raise HTTPException(status_code=400, detail="Code is required")
+    timeout = int(data["timeout"]) if data.get("timeout") else None
+    sandbox = controller.get_sandbox(get_sandbox_key(request, data))
+
+    async def events():
+        async for event in sandbox.stream_python(code, data.get("session_id") or "default", timeout):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/sandbox/kernels")
+async def list_sandbox_kernels(request: Request):
+    """List the persistent Python kernels of the caller's sandbox"""
+    return {"kernels": controller.get_sandbox(get_sandbox_key(request)).list_python_kernels()}
+
+@app.delete("/api/sandbox/kernels/{session_id}")
+async def close_sandbox_kernel(session_id: str, request: Request):
+    """Shut down a persistent Python kernel"""
+    result = await controller.get_sandbox(get_sandbox_key(request)).close_python_kernel(session_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/outputs/{output_id}")
+async def read_sandbox_output(output_id: str, request: Request, stream: str = "stdout",
+                              offset: int = 0, length: int = 65536):
+    """Read a byte range of the full output of a command whose result was truncated"""
+    length = min(max(length, 0), 16 * 1024 * 1024)
+    result = controller.get_sandbox(get_sandbox_key(request)).read_output(output_id, stream, offset, length)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.put("/api/sandbox/files/{file_path:path}")
+async def upload_sandbox_file(file_path: str, request: Request, append: bool = False):
+    """Upload a file as the raw request body, streamed to disk; X-Content-SHA256 verifies the upload"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    result = await sandbox.write_file_stream(file_path, request.stream(), append,
+                                             request.headers.get("X-Content-SHA256"))
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/files/{file_path:path}")
+async def download_sandbox_file(file_path: str, request: Request):
+    """Download a file, streamed, honouring a single range Range header"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    info = sandbox.file_info(file_path)
+    if not info["success"]:
+        raise HTTPException(status_code=404, detail=info["error"])
+    if info["is_dir"]:
+        raise HTTPException(status_code=400, detail=f"{file_path} is a directory")
+    size = info["size"]
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{size}"})
+    offset, length = byte_range or (0, size)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(length), "ETag": f'"{info["etag"]}"'}
+    if byte_range:
+        headers["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+    media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    # a sync iterator, starlette reads it in the thread pool
+    return StreamingResponse(sandbox.iter_file(file_path, offset, length), status_code=206 if byte_range else 200,
+                             media_type=media_type, headers=headers)
+
+@app.get("/api/sandbox/file-info/{file_path:path}")
+async def get_sandbox_file_info(file_path: str, request: Request, hash: bool = False):
+    """Size, modification time and optionally the SHA-256 of a file"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    result = await asyncio.to_thread(sandbox.file_info, file_path, hash) if hash else sandbox.file_info(file_path)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/list")
+async def list_sandbox_files(request: Request, directory: str = "", recursive: bool = False,
+                             offset: int = 0, limit: Optional[int] = None):
+    """List a directory with sizes and modification times, one page at a time"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    result = await asyncio.to_thread(sandbox.list_files, directory, recursive, offset, limit)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/processes")
+async def start_sandbox_process(request: Request, data: Dict[str, Any] = Body(...)):
+    """Start a background process, {"command", "name", "port": number | "auto", "ready", "ready_timeout"}"""
+    command = data.get("command", "")
+    if not command:
+        raise HTTPException(status_code=400, detail="Command is required")
+    port = data.get("port")
+    port = 0 if port == "auto" else (int(port) if port is not None else None)
+    result = await asyncio.to_thread(controller.start_sandbox_process, command, data.get("name"), port,
+                                     data.get("ready"), float(data.get("ready_timeout", 30)),
+                                     get_sandbox_key(request, data))
+    if not result["success"] and "id" not in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/processes")
+async def list_sandbox_processes(request: Request):
+    """List the background processes of the caller's sandbox"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    return {"processes": await asyncio.to_thread(sandbox.list_processes)}
+
+@app.get("/api/sandbox/processes/{process}/logs")
+async def get_sandbox_process_logs(process: str, request: Request, lines: int = 100):
+    """The last lines of the log of a background process"""
+    result = controller.get_sandbox(get_sandbox_key(request)).process_logs(process, min(max(lines, 1), 10000))
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/processes/{process}/stop")
+async def stop_sandbox_process(process: str, request: Request):
+    """Stop a background process"""
+    result = await asyncio.to_thread(controller.get_sandbox(get_sandbox_key(request)).stop_process, process)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/processes/{process}/restart")
+async def restart_sandbox_process(process: str, request: Request):
+    """Restart a background process with the same command, port and readiness probe"""
+    result = await asyncio.to_thread(controller.get_sandbox(get_sandbox_key(request)).restart_process, process)
+    if not result["success"] and "id" not in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.post("/api/sandbox/snapshots")
+async def create_sandbox_snapshot(request: Request, data: Dict[str, Any] = Body(default={})):
+    """Snapshot the working directory of the caller's sandbox"""
+    result = await asyncio.to_thread(controller.snapshot_sandbox, data.get("name"), get_sandbox_key(request, data))
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/snapshots")
+async def list_sandbox_snapshots(request: Request):
+    """List the snapshots of the caller's sandbox"""
+    return {"snapshots": controller.get_sandbox(get_sandbox_key(request)).list_snapshots()}
+
+@app.post("/api/sandbox/snapshots/{snapshot_id}/restore")
+async def restore_sandbox_snapshot(snapshot_id: str, request: Request):
+    """Reset the working directory of the caller's sandbox to a snapshot"""
+    result = await asyncio.to_thread(controller.restore_sandbox_snapshot, snapshot_id, get_sandbox_key(request))
+    if not result["success"]:
+        raise HTTPException(status_code=404 if result["error"].startswith("No snapshot") else 409,
+                            detail=result["error"])
+    return result
+
+@app.delete("/api/sandbox/snapshots/{snapshot_id}")
+async def delete_sandbox_snapshot(snapshot_id: str, request: Request):
+    """Delete a snapshot"""
+    result = controller.get_sandbox(get_sandbox_key(request)).delete_snapshot(snapshot_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/packages")
+async def get_sandbox_package_cache(request: Request):
+    """Hit and miss counts of the shared package cache, overall and for the caller's sandbox"""
+    sandbox = controller.get_sandbox(get_sandbox_key(request))
+    if sandbox.package_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **sandbox.package_cache.get_stats(), "sandbox": sandbox.package_stats}
+
+@app.post("/api/sandbox/packages/publish")
+async def publish_sandbox_packages(request: Request):
+    """Promote the wheels of the caller's sandbox overlay into the shared wheelhouse"""
+    result = await asyncio.to_thread(controller.get_sandbox(get_sandbox_key(request)).publish_packages)
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.get("/api/sandbox/manager")
+async def get_sandbox_manager_stats():
+    """List the sandboxes of all clients with their disk usage and idle time"""
+    return {**sandbox_manager.get_stats(), "sandboxes": await asyncio.to_thread(sandbox_manager.list_sessions)}
+
+@app.delete("/api/sandbox")
+async def close_client_sandbox(request: Request):
+    """Close the caller's sandbox and delete its files"""
+    key = get_sandbox_key(request)
+    if not key or not await asyncio.to_thread(sandbox_manager.close, key):
+        raise HTTPException(status_code=404, detail="No sandbox for this client")
+    return {"success": True, "message": "Sandbox closed"}
+
+@app.get("/api/sandbox/executor")
+async def get_sandbox_executor_stats():
+    """Get how many sandbox commands are running and waiting for a slot"""
+    return get_command_executor().get_stats()
+
+# Agent API routes
+@app.post("/api/run-agent")
+async def run_agent(data: Dict[str, Any] = Body(...)):
+    """Queue an agent task, wait for its result unless "async" is set"""
+    task = data.get("task", "")
+    additional_info = data.get("additionalInfo", "")
+    
+    if not task:
+        raise HTTPException(status_code=400, detail="Task is required")
+    
+    try:
+        job = await job_queue.submit(task, additional_info)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if data.get("async"):
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    
+    job = await job_queue.wait(job.job_id)
+    if job.result is None:
+        raise HTTPException(status_code=409 if job.status == "cancelled" else 500, detail=job.error)
+    return {**job.result, "job_id": job.job_id}
+
+@app.get("/api/admission/metrics")
+async def get_admission_metrics():
+    """Get running, waiting and refused requests and the capacity left per gated endpoint"""
+    return admission.get_stats()
+
+@app.get("/api/jobs")
+async def list_jobs(status: Optional[str] = None):
+    """List queued, running and finished jobs"""
+    return {"jobs": await job_queue.list(status)}
+
+@app.get("/api/jobs/metrics")
+async def get_job_metrics():
+    """Get queue depth, busy workers and job counts"""
+    return await job_queue.get_stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Get the status and result of a job, optionally waiting up to `wait` seconds for it to finish"""
+    job = await job_queue.wait(job_id, min(wait, 300)) if wait else await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job.to_dict()
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    # a running job is cancelled at its next await
+    await asyncio.sleep(0)
+    return job.to_dict()
+
+def sse_message(event_type: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """Format a server-sent event"""
+    message = f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
+
+def frame_message(frame: AgentFrame) -> Dict[str, Any]:
+    return {"run_id": frame.run_id, "step": frame.step, "timestamp": frame.timestamp}
+
+async def sse_events(subscription, with_ids: bool = True):
+    """Server-sent events of a subscription, with a keep-alive comment while nothing happens"""
+    try:
+        while True:
+            item = await subscription.next(timeout=15)
+            if item is None:
+                if subscription.closed:
+                    break
+                yield ": keep-alive\n\n"
+            elif isinstance(item, AgentFrame):
+                yield sse_message("frame", {**frame_message(item), "png": base64.b64encode(item.png).decode()})
+            else:
+                yield sse_message(item.type, item.to_dict(), item.seq if with_ids else None)
+    finally:
+        subscription.close()
+
+@app.get("/api/agent/runs")
+async def list_agent_runs():
+    """List the agent runs with live events, running and recently finished"""
+    return {"runs": list_event_streams()}
+
+@app.get("/api/agent/events")
+async def stream_all_agent_events():
+    """Stream the events of every run as server-sent events, without screenshots"""
+    return StreamingResponse(sse_events(subscribe_all(), with_ids=False), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/agent/runs/{run_id}/events")
+async def stream_agent_events(run_id: str, request: Request, after: int = 0, frames: bool = False):
+    """Stream the events of a run as server-sent events, resuming after Last-Event-ID; screenshots with frames=true"""
+    event_stream = get_event_stream(run_id)
+    if event_stream is None:
+        raise HTTPException(status_code=404, detail=f"No agent run {run_id}")
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    return StreamingResponse(sse_events(event_stream.subscribe(after, frames)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/agent/runs/{run_id}/ws")
+async def agent_events_websocket(websocket: WebSocket, run_id: str):
+    """Events of a run as JSON, each screenshot as a "frame" message followed by the PNG as a binary message;
+    {"action": "pause" | "resume" | "stop"} controls the run"""
+    event_stream = get_event_stream(run_id)
+    await websocket.accept()
+    if event_stream is None:
+        await websocket.send_json({"type": "error", "error": f"No agent run {run_id}"})
+        await websocket.close()
+        return
+    subscription = event_stream.subscribe(int(websocket.query_params.get("after", 0)))
+
+    async def receive_controls():
+        try:
+            while True:
+                data = await websocket.receive_json()
+                result = event_stream.control(data.get("action", "") if isinstance(data, dict) else "")
+                if not result["success"]:
+                    await websocket.send_json({"type": "error", "error": result["error"]})
+        except (WebSocketDisconnect, ValueError):
+            pass
+
+    controls = asyncio.create_task(receive_controls())
+    try:
+        # a slow client does not hold up the agent, its subscription drops old events and skips frames
+        while True:
+            receive = asyncio.create_task(subscription.next())
+            await asyncio.wait([receive, controls], return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                # the client went away
+                receive.cancel()
+                break
+            item = receive.result()
+            if item is None:
+                break
+            if isinstance(item, AgentFrame):
+                await websocket.send_json({"type": "frame", **frame_message(item)})
+                await websocket.send_bytes(item.png)
+            else:
+                await websocket.send_json(item.to_dict())
+        if not controls.done():
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        controls.cancel()
+        subscription.close()
+
+@app.post("/api/agent/runs/{run_id}/{action}")
+async def control_agent_run(run_id: str, action: str):
+    """Pause, resume or stop a run"""
+    event_stream = get_event_stream(run_id)
+    if event_stream is None:
+        raise HTTPException(status_code=404, detail=f"No agent run {run_id}")
+    result = event_stream.control(action)
+    if not result["success"]:
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
+
+@app.get("/api/sessions")
+async def list_sessions():
+    """Sessions of webui users, each with its own agent and browser"""
+    registry = get_session_registry()
+    return {"sessions": registry.list(), "stats": registry.get_stats()}
+
+@app.post("/api/sessions/{session_id}/stop")
+async def stop_session(session_id: str):
+    """Stop the agent and research of one session, leaving the other sessions running"""
+    session = get_session_registry().find(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"No session {session_id}")
+    session.stop()
+    return {"success": True, "session_id": session_id}
+
+@app.delete("/api/sessions/{session_id}")
+async def close_session(session_id: str):
+    """Stop a session and release its browser"""
+    if not await get_session_registry().close(session_id):
+        raise HTTPException(status_code=404, detail=f"No session {session_id}")
+    return {"success": True, "session_id": session_id}
+
+def get_session_id(request: Request, session_id: Optional[str] = None) -> Optional[str]:
+    """Session of the caller: the session_id parameter, else the X-Client-Id header"""
+    return session_id or request.headers.get("X-Client-Id")
+
 @app.post("/api/agent/stop")
-async def stop_agent():
-    """Stop the running agent"""
+async def stop_agent(request: Request, session_id: Optional[str] = None, job_id: Optional[str] = None):
+    """Stop the agent of a session or a job, or without either the API agent and every running job"""
+    if job_id:
+        job = await job_queue.cancel(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"No job {job_id}")
+        return {"success": True, "job_id": job_id, "status": job.status}
+    session_id = get_session_id(request, session_id)
+    if session_id:
+        session = get_session_registry().find(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"No session {session_id}")
+        session.stop()
+        return {"success": True, "session_id": session_id}
     try:
         result = agent_controller.stop_execution()
-        agent_state.set_state("stopped")
+        for job in await job_queue.list("running"):
+            await job_queue.cancel(job["job_id"])
+        session = get_session_registry().find(DEFAULT_SESSION_ID)
+        if session is not None:
+            session.stop()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/agent/status")
-async def get_agent_status():
-    """Get the current status of the agent"""
-    status = agent_state.get_state()
+async def get_agent_status(request: Request, session_id: Optional[str] = None):
+    """Get the status of the agent of a session (the default session without one)"""
+    session_id = get_session_id(request, session_id)
+    session = get_session_registry().find(session_id or DEFAULT_SESSION_ID)
+    if session_id and session is None:
+        raise HTTPException(status_code=404, detail=f"No session {session_id}")
+    status = session.agent_state.get_state() if session else {"stop_requested": False, "last_valid_state": None}
     controller_status = controller.get_status()
-    return {"status": status, **controller_status}
+    return {"status": status, "session": session.get_info() if session else None, **controller_status,
+            "jobs": await job_queue.get_stats(), "sessions": get_session_registry().get_stats()}
 
 # Research API routes
 @app.post("/api/research")
@@ -1,9 +1,60 @@
 import logging
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
 from playwright.async_api import Page
 
 logger = logging.getLogger(__name__)
 
+# Sets every field of a form in one round trip. Values go through the native
+# setter and input/change events are dispatched so framework bindings (React,
+# Vue) see the change. Fields that cannot be handled here are reported back so
+# the caller can retry them with Playwright's own fill.
+FILL_FORM_JS = """
+(fields) => fields.map(([selector, value]) => {
+    let el;
+    try {
+        el = document.querySelector(selector);
+    } catch (e) {
+        return {selector, success: false, retry: true, error: "not a CSS selector"};
+    }
+    if (!el) return {selector, success: false, retry: true, error: "element not found"};
+    if (el.disabled || el.readOnly) return {selector, success: false, error: "element is not editable"};
+
+    const fire = (type) => el.dispatchEvent(new Event(type, {bubbles: true}));
+    const tag = el.tagName.toLowerCase();
+    const type = (el.type || "").toLowerCase();
+    const text = String(value);
+
+    if (type === "checkbox" || type === "radio") {
+        const wanted = value === true || ["true", "on", "1", el.value].includes(text);
+        if (el.checked !== wanted) el.click();
+    } else if (tag === "select") {
+        const options = [...el.options];
+        const option = options.find((o) => o.value === text) || options.find((o) => o.text.trim() === text);
+        if (!option) return {selector, success: false, error: `no option ${text}`};
+        el.value = option.value;
+        fire("input");
+        fire("change");
+    } else if (el.isContentEditable) {
+        el.focus();
+        el.textContent = text;
+        fire("input");
+    } else if (tag === "input" || tag === "textarea") {
+        const proto = tag === "textarea" ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+        el.focus();
+        Object.getOwnPropertyDescriptor(proto, "value").set.call(el, text);
+        fire("input");
+        fire("change");
+        el.blur();
+    } else {
+        return {selector, success: false, error: `cannot fill <${tag}>`};
+    }
+    return {selector, success: true};
+})
+"""
+
+LOAD_STATES = ("load", "domcontentloaded", "networkidle")
+
 class BrowserAutomation:
     def __init__(self, page: Page):
         self.page = page
@@ -38,6 +89,164 @@ class BrowserAutomation:
             logger.error(f"Failed to click element: {e}")
             return {"success": False, "error": str(e)}
     
+    async def fill_form(self, fields: Union[Dict[str, Any], Sequence[Tuple[str, Any]]]) -> Dict[str, Any]:
+        """
+        Fill many form fields at once.
+
+        Args:
+            fields: Mapping of selector to value, or (selector, value) pairs
+                filled in order, the same selector may repeat. Checkboxes and
+                radios take a boolean, selects an option value or label.
+
+        Returns:
+            Dict[str, Any]: Result with the outcome of every field, in order
+        """
+        try:
+            pairs = [[selector, value] for selector, value in (fields.items() if isinstance(fields, dict) else fields)]
+            logger.info(f"Filling {len(pairs)} form field(s)")
+            results = await self.page.evaluate(FILL_FORM_JS, pairs)
+            for (selector, value), result in zip(pairs, results):
+                if result["success"] or not result.pop("retry", False):
+                    continue
+                # Playwright selector syntax or an element that is not there yet: let fill() wait for it
+                try:
+                    await self.page.fill(selector, str(value))
+                    result.update(success=True)
+                    result.pop("error", None)
+                except Exception as e:
+                    result["error"] = str(e)
+            failed = [result for result in results if not result["success"]]
+            if failed:
+                logger.error(f"Failed to fill {len(failed)} form field(s): {failed}")
+                return {"success": False, "error": f"Failed to fill {len(failed)} field(s)", "fields": results}
+            return {"success": True, "message": f"Successfully filled {len(pairs)} field(s)", "fields": results}
+        except Exception as e:
+            logger.error(f"Failed to fill form: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _wait_for(self, condition: Union[str, Dict[str, Any]], timeout: Optional[float] = None):
+        """
+        Wait for a condition after an action.
+
+        Args:
+            condition: A load state ("load", "domcontentloaded", "networkidle"),
+                {"selector": css, "state": "visible"}, {"url": pattern} or {"delay": ms}
+            timeout: Milliseconds before giving up, Playwright's default when None
+        """
+        if isinstance(condition, str):
+            condition = {"load_state": condition}
+        if "load_state" in condition:
+            if condition["load_state"] not in LOAD_STATES:
+                raise ValueError(f"Unknown load state: {condition['load_state']}")
+            await self.page.wait_for_load_state(condition["load_state"], timeout=timeout)
+        elif "selector" in condition:
+            await self.page.wait_for_selector(condition["selector"], state=condition.get("state", "visible"),
+                                              timeout=timeout)
+        elif "url" in condition:
+            await self.page.wait_for_url(condition["url"], timeout=timeout)
+        elif "delay" in condition:
+            await self.page.wait_for_timeout(condition["delay"])
+        else:
+            raise ValueError(f"Unknown wait condition: {condition}")
+
+    async def _run_single(self, action: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        # the round trip itself, without the per-action logging of execute_action
+        if action == "navigate":
+            await self.page.goto(params["url"], wait_until=params.get("wait_until", "load"))
+        elif action == "input_text":
+            await self.page.fill(params["selector"], params.get("text", ""))
+        elif action == "click":
+            await self.page.click(params["selector"])
+        elif action == "press":
+            await self.page.press(params["selector"], params["key"])
+        elif action == "select_option":
+            await self.page.select_option(params["selector"], params["value"])
+        elif action == "fill_form":
+            return await self.fill_form(params.get("fields", {}))
+        elif action == "wait":
+            pass
+        else:
+            return {"success": False, "error": f"Unknown action: {action}"}
+        return {"success": True}
+
+    async def execute_batch(self, actions: List[Dict[str, Any]], stop_on_error: bool = True) -> Dict[str, Any]:
+        """
+        Execute a list of actions as one sequence.
+
+        Every action is {"action": name, "params": {...}, "wait_for": condition,
+        "timeout": ms}. Supported actions are navigate, input_text, click,
+        press, select_option, fill_form and wait (only its wait_for). Runs of
+        input_text actions without a wait condition are sent as a single
+        fill_form evaluate.
+
+        Args:
+            actions: The actions to run in order
+            stop_on_error: Skip the remaining actions after the first failure
+
+        Returns:
+            Dict[str, Any]: Overall result with one entry per action, each with its duration in seconds
+        """
+        logger.info(f"Executing batch of {len(actions)} browser action(s)")
+        batch_start = time.perf_counter()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(actions)
+        failed = False
+        index = 0
+        while index < len(actions):
+            if failed and stop_on_error:
+                for skipped in range(index, len(actions)):
+                    results[skipped] = {"action": actions[skipped].get("action"), "success": False,
+                                        "skipped": True, "duration": 0.0}
+                break
+
+            group = [index]
+            if actions[index].get("action") == "input_text" and not actions[index].get("wait_for"):
+                while group[-1] + 1 < len(actions) and actions[group[-1] + 1].get("action") == "input_text" \
+                        and not actions[group[-1] + 1].get("wait_for"):
+                    group.append(group[-1] + 1)
+
+            start = time.perf_counter()
+            if len(group) > 1:
+                # pairs, not a dict: two fills of one selector both run, in order
+                fields = [(actions[i]["params"]["selector"], actions[i]["params"].get("text", "")) for i in group]
+                form_result = await self.fill_form(fields)
+                duration = time.perf_counter() - start
+                field_results = form_result.get("fields") or [{"success": False, "error": form_result.get("error")}
+                                                              for _ in group]
+                for i, field in zip(group, field_results):
+                    results[i] = {"action": "input_text", "success": field["success"], "batched": True,
+                                  "duration": duration / len(group)}
+                    if not field["success"]:
+                        results[i]["error"] = field.get("error")
+                        failed = True
+                index = group[-1] + 1
+                continue
+
+            spec = actions[index]
+            action = spec.get("action")
+            try:
+                result = await self._run_single(action, spec.get("params", {}))
+                if result["success"] and spec.get("wait_for"):
+                    await self._wait_for(spec["wait_for"], spec.get("timeout"))
+            except Exception as e:
+                logger.debug(f"Batch action {index} ({action}) failed: {e}")
+                result = {"success": False, "error": str(e)}
+            result = {"action": action, **result, "duration": time.perf_counter() - start}
+            results[index] = result
+            failed = failed or not result["success"]
+            index += 1
+
+        duration = time.perf_counter() - batch_start
+        completed = sum(1 for result in results if result and result["success"])
+        if completed < len(actions):
+            logger.error(f"Batch finished with {len(actions) - completed} failed action(s) in {duration:.2f}s")
+        return {
+            "success": completed == len(actions),
+            "completed": completed,
+            "duration": duration,
+            "results": results,
+            "url": self.page.url,
+        }
+
     async def get_current_url(self) -> str:
         """Get the current page URL"""
         return self.page.url
@@ -52,6 +261,10 @@ class BrowserAutomation:
             return await self.input_text(params.get("selector", ""), params.get("text", ""))
         elif action == "click":
             return await self.click(params.get("selector", ""))
+        elif action == "fill_form":
+            return await self.fill_form(params.get("fields", {}))
+        elif action == "execute_batch":
+            return await self.execute_batch(params.get("actions", []), params.get("stop_on_error", True))
         else:
             logger.error(f"Unknown browser action: {action}")
             return {"success": False, "error": f"Unknown action: {action}"}
\ No newline at end of file
@@ -0,0 +1,457 @@
+"""
+Warm browser pool shared by the API server, webui and deep research.
+
+Launching Chromium and creating a context costs seconds per task, so the pool
+keeps a number of browsers pre-launched, each with a pre-created context.
+Pools are keyed on the browser launch configuration only: a lease gets the
+warm context in the configuration it asks for, and the context is replaced
+by a fresh one when the lease is returned, so no cookies, storage or tabs
+carry over to the next task. Traced, HAR-recorded and video-recorded runs get
+a context of their own, their output is written when it closes. Browsers are
+health checked while idle and relaunched after a configurable number of uses.
+"""
+import asyncio
+import logging
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from browser_use.browser.browser import BrowserConfig
+from browser_use.browser.context import BrowserContextConfig
+
+from .custom_browser import CustomBrowser
+from .custom_context import CustomBrowserContext
+from .resource_watchdog import get_resource_watchdog, resource_watchdog_enabled
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BrowserPoolConfig:
+    """
+    Configuration for the BrowserPool.
+
+    size: number of browsers kept warm
+    max_size: upper bound of browsers alive at once, extra browsers above
+        `size` are launched on demand and closed when returned
+    max_uses_per_browser: relaunch a browser after it served this many leases
+    health_check_interval: seconds between health checks of idle browsers
+    checkout_timeout: seconds to wait for a free browser before giving up
+    """
+    size: int = 2
+    max_size: int = 4
+    max_uses_per_browser: int = 50
+    health_check_interval: float = 30.0
+    checkout_timeout: float = 120.0
+    browser_config: BrowserConfig = field(default_factory=lambda: BrowserConfig(headless=True))
+    context_config: BrowserContextConfig = field(default_factory=BrowserContextConfig)
+
+    @classmethod
+    def from_env(cls, **overrides) -> "BrowserPoolConfig":
+        """Build a config from the BROWSER_POOL_* environment variables"""
+        values = {
+            "size": int(os.getenv("BROWSER_POOL_SIZE", "2")),
+            "max_size": int(os.getenv("BROWSER_POOL_MAX_SIZE", "4")),
+            "max_uses_per_browser": int(os.getenv("BROWSER_POOL_MAX_USES", "50")),
+            "health_check_interval": float(os.getenv("BROWSER_POOL_HEALTH_CHECK_INTERVAL", "30")),
+            "checkout_timeout": float(os.getenv("BROWSER_POOL_CHECKOUT_TIMEOUT", "120")),
+        }
+        values.update(overrides)
+        values["max_size"] = max(values["max_size"], values["size"])
+        return cls(**values)
+
+
+def browser_pool_enabled() -> bool:
+    """The pool can be switched off with BROWSER_POOL_ENABLED=false"""
+    return os.getenv("BROWSER_POOL_ENABLED", "true").lower() == "true"
+
+
+class _LaunchFailed:
+    """Put in the idle queue to hand a launch error to a caller waiting for that browser"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+        self.created = time.monotonic()
+
+
+class PooledBrowser:
+    """A pre-launched browser together with its pre-created context"""
+
+    def __init__(self, browser_config: BrowserConfig, context_config: BrowserContextConfig):
+        self.browser = CustomBrowser(config=browser_config)
+        self.context_config = context_config
+        self.context: Optional[CustomBrowserContext] = None
+        self.uses = 0
+        self.created_at = time.time()
+
+    async def start(self):
+        await self.browser.get_playwright_browser()
+        self.context = await self.browser.new_context(config=self.context_config)
+        await self.context.get_session()
+
+    async def replace_context(self, context_config: BrowserContextConfig):
+        """Replace the warm context with one in another configuration, kept for the next leases"""
+        old, self.context = self.context, None
+        if old is not None:
+            await old.close()
+        self.context_config = context_config
+        self.context = await self.browser.new_context(config=context_config)
+        await self.context.get_session()
+
+    async def is_healthy(self) -> bool:
+        playwright_browser = self.browser.playwright_browser
+        if playwright_browser is None or not playwright_browser.is_connected():
+            return False
+        if self.context is None:
+            return False
+        return await self.context.is_alive()
+
+    async def close(self):
+        try:
+            if self.context:
+                await self.context.close()
+        except Exception as e:
+            logger.debug(f"Failed to close pooled browser context: {e}")
+        finally:
+            self.context = None
+            await self.browser.close()
+
+
+@dataclass
+class BrowserLease:
+    """A browser checked out of the pool. Hand it back with BrowserPool.release()"""
+    pooled: PooledBrowser
+    browser_context: CustomBrowserContext
+    owns_context: bool = False
+    acquired_at: float = field(default_factory=time.time)
+
+    @property
+    def browser(self) -> CustomBrowser:
+        return self.pooled.browser
+
+
+class BrowserPool:
+    def __init__(self, config: Optional[BrowserPoolConfig] = None):
+        self.config = config or BrowserPoolConfig.from_env()
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._alive = 0
+        self._launching = 0
+        self._waiting = 0
+        self._failures = 0
+        self._in_use = 0
+        self._launch_tasks: Set[asyncio.Task] = set()
+        self._started = False
+        self._closed = False
+        self._health_task: Optional[asyncio.Task] = None
+        self._stats = {
+            "launched": 0,
+            "recycled": 0,
+            "unhealthy": 0,
+            "checkouts": 0,
+            "checkout_wait_total": 0.0,
+        }
+
+    async def start(self):
+        """Launch the warm browsers in the background. Safe to call repeatedly."""
+        if self._started:
+            return
+        self._started = True
+        for _ in range(self.config.size):
+            self._spawn()
+        if self.config.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_check_loop())
+        logger.info(f"Browser pool warming up {self.config.size} browser(s)")
+
+    def _spawn(self):
+        self._alive += 1
+        self._launching += 1
+        task = asyncio.create_task(self._launch_into_pool())
+        self._launch_tasks.add(task)
+        task.add_done_callback(self._launch_tasks.discard)
+
+    def _idle_browsers(self) -> int:
+        return self._idle.qsize() - self._failures
+
+    async def _launch(self) -> PooledBrowser:
+        pooled = PooledBrowser(self.config.browser_config, self.config.context_config)
+        try:
+            await pooled.start()
+        except Exception:
+            await pooled.close()
+            raise
+        self._stats["launched"] += 1
+        return pooled
+
+    async def _launch_into_pool(self):
+        try:
+            pooled = await self._launch()
+        except Exception as e:
+            self._launching -= 1
+            self._alive -= 1
+            logger.error(f"Failed to launch pooled browser: {e}")
+            # callers waiting with no other browser on its way get the error instead of sitting out
+            # the checkout timeout
+            for _ in range(self._waiting - self._idle.qsize() - self._launching):
+                self._failures += 1
+                self._idle.put_nowait(_LaunchFailed(e))
+            return
+        self._launching -= 1
+        if self._closed:
+            self._alive -= 1
+            await pooled.close()
+            return
+        self._idle.put_nowait(pooled)
+
+    async def acquire(
+            self,
+            context_config: Optional[BrowserContextConfig] = None,
+            timeout: Optional[float] = None
+    ) -> BrowserLease:
+        """
+        Check out a browser.
+
+        Args:
+            context_config: Context configuration the caller needs. The warm context
+                is replaced by one in this configuration when it differs; traced and
+                recorded runs get a context of their own, closed on release.
+            timeout: Seconds to wait for a free browser (defaults to checkout_timeout)
+
+        Returns:
+            BrowserLease: The checked out browser and context
+        """
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        await self.start()
+
+        wait_start = time.monotonic()
+        # only burst above the warm size when every idle or launching browser is already spoken for
+        if self._waiting >= self._idle_browsers() + self._launching and self._alive < self.config.max_size:
+            self._spawn()
+        deadline = wait_start + (timeout or self.config.checkout_timeout)
+        self._waiting += 1
+        try:
+            while True:
+                pooled = await asyncio.wait_for(self._idle.get(), max(0.0, deadline - time.monotonic()))
+                if not isinstance(pooled, _LaunchFailed):
+                    break
+                self._failures -= 1
+                # a failure that happened before this caller waited was meant for one that gave up since
+                if pooled.created >= wait_start:
+                    raise RuntimeError(f"Failed to launch a pooled browser: {pooled.error}") from pooled.error
+        finally:
+            self._waiting -= 1
+
+        if not await pooled.is_healthy():
+            self._stats["unhealthy"] += 1
+            logger.warning("Pooled browser failed health check, relaunching")
+            await pooled.close()
+            try:
+                pooled = await self._launch()
+            except Exception:
+                self._alive -= 1
+                raise
+
+        pooled.uses += 1
+        self._in_use += 1
+        self._stats["checkouts"] += 1
+        self._stats["checkout_wait_total"] += time.monotonic() - wait_start
+
+        context_config = context_config or self.config.context_config
+        try:
+            if _needs_own_context(context_config):
+                browser_context = await pooled.browser.new_context(config=context_config)
+                return BrowserLease(pooled=pooled, browser_context=browser_context, owns_context=True)
+            if context_config != pooled.context_config:
+                await pooled.replace_context(context_config)
+        except Exception:
+            self._in_use -= 1
+            await self.recycle(pooled)
+            raise
+        return BrowserLease(pooled=pooled, browser_context=pooled.context)
+
+    async def release(self, lease: BrowserLease):
+        """Return a browser to the pool, resetting or recycling it as needed"""
+        self._in_use -= 1
+        pooled = lease.pooled
+
+        if lease.owns_context:
+            try:
+                await lease.browser_context.close()
+            except Exception as e:
+                logger.debug(f"Failed to close leased browser context: {e}")
+
+        healthy = True
+        if not lease.owns_context:
+            try:
+                await pooled.context.reset_for_reuse()
+            except Exception as e:
+                logger.warning(f"Failed to reset pooled browser context: {e}")
+                healthy = False
+
+        if self._closed or self._alive > self.config.size:
+            self._alive -= 1
+            await pooled.close()
+            return
+
+        if not healthy or pooled.uses >= self.config.max_uses_per_browser:
+            await self.recycle(pooled)
+            return
+
+        over_limit = await self._over_resource_limit(pooled)
+        if over_limit:
+            logger.warning(f"Pooled browser over its resource limit: {over_limit}")
+            await self.recycle(pooled)
+            return
+
+        self._idle.put_nowait(pooled)
+
+    @staticmethod
+    async def _over_resource_limit(pooled: PooledBrowser) -> Optional[str]:
+        if not resource_watchdog_enabled():
+            return None
+        try:
+            return await get_resource_watchdog().check_browser(pooled.browser)
+        except Exception as e:
+            logger.debug(f"Resource check of pooled browser failed: {e}")
+            return None
+
+    async def recycle(self, pooled: PooledBrowser):
+        """Close a browser and launch a replacement in the background"""
+        self._stats["recycled"] += 1
+        if resource_watchdog_enabled():
+            get_resource_watchdog().record_browser_recycle(pooled.browser)
+        logger.info(f"Recycling pooled browser after {pooled.uses} use(s)")
+        await pooled.close()
+        self._alive -= 1
+        if not self._closed:
+            self._spawn()
+
+    @asynccontextmanager
+    async def checkout(self, context_config: Optional[BrowserContextConfig] = None,
+                       timeout: Optional[float] = None):
+        """
+        Async context manager around acquire()/release():
+
+            async with pool.checkout() as lease:
+                agent = CustomAgent(browser=lease.browser, browser_context=lease.browser_context, ...)
+        """
+        lease = await self.acquire(context_config=context_config, timeout=timeout)
+        try:
+            yield lease
+        finally:
+            await self.release(lease)
+
+    async def _health_check_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self.config.health_check_interval)
+            for _ in range(self._idle.qsize()):
+                try:
+                    pooled = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if isinstance(pooled, _LaunchFailed):
+                    # whoever waited for it has timed out by now
+                    if time.monotonic() - pooled.created < self.config.checkout_timeout:
+                        self._idle.put_nowait(pooled)
+                    else:
+                        self._failures -= 1
+                    continue
+                if not await pooled.is_healthy():
+                    self._stats["unhealthy"] += 1
+                    logger.warning("Idle pooled browser failed health check, relaunching")
+                    await self.recycle(pooled)
+                    continue
+                over_limit = await self._over_resource_limit(pooled)
+                if over_limit:
+                    logger.warning(f"Idle pooled browser over its resource limit: {over_limit}")
+                    await self.recycle(pooled)
+                else:
+                    self._idle.put_nowait(pooled)
+
+    async def close(self):
+        """Close every idle browser. Leased browsers are closed when released."""
+        self._closed = True
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        while not self._idle.empty():
+            pooled = self._idle.get_nowait()
+            if isinstance(pooled, _LaunchFailed):
+                self._failures -= 1
+                continue
+            self._alive -= 1
+            await pooled.close()
+
+    def free_browsers(self) -> int:
+        """Browsers that can be checked out without waiting for one to be released"""
+        return max(0, self._idle_browsers() + self.config.max_size - self._alive - self._waiting)
+
+    def get_stats(self) -> Dict:
+        checkouts = self._stats["checkouts"]
+        return {
+            "size": self.config.size,
+            "max_size": self.config.max_size,
+            "alive": self._alive,
+            "idle": self._idle_browsers(),
+            "free": self.free_browsers(),
+            "in_use": self._in_use,
+            "launched": self._stats["launched"],
+            "recycled": self._stats["recycled"],
+            "unhealthy": self._stats["unhealthy"],
+            "checkouts": checkouts,
+            "avg_checkout_wait": self._stats["checkout_wait_total"] / checkouts if checkouts else 0.0,
+        }
+
+
+def _needs_own_context(context_config: BrowserContextConfig) -> bool:
+    # traces, recorded HARs and videos are only written when their context or page closes
+    return bool(
+        context_config.trace_path
+        or context_config.save_recording_path
+        or getattr(context_config, "har_mode", "off") == "record"
+    )
+
+
+# Playwright objects are bound to the event loop that created them, so the
+# webui (Gradio loop) and the API server (uvicorn loop) each get their own pools.
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, BrowserPool]]" = weakref.WeakKeyDictionary()
+
+
+def get_browser_pool(browser_config: Optional[BrowserConfig] = None) -> BrowserPool:
+    """
+    Get the shared pool for the running event loop and browser launch configuration.
+    Pass the context configuration a task needs to acquire() or checkout().
+
+    Args:
+        browser_config: Launch configuration of the pooled browsers
+
+    Returns:
+        BrowserPool: The shared pool
+    """
+    browser_config = browser_config or BrowserConfig(headless=True)
+    loop = asyncio.get_running_loop()
+    pools = _pools.setdefault(loop, {})
+    key = (
+        browser_config.headless,
+        browser_config.disable_security,
+        tuple(browser_config.extra_chromium_args),
+        browser_config.chrome_instance_path,
+    )
+    if key not in pools:
+        pools[key] = BrowserPool(BrowserPoolConfig.from_env(browser_config=browser_config))
+    return pools[key]
+
+
+def get_browser_pools() -> list:
+    """All pools created on the running event loop"""
+    return list(_pools.get(asyncio.get_running_loop(), {}).values())
+
+
+async def close_browser_pools():
+    """Close every pool created on the running event loop"""
+    pools = _pools.pop(asyncio.get_running_loop(), {})
+    for pool in pools.values():
+        await pool.close()
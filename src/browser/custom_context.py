@@ -1,15 +1,70 @@
 import json
 import logging
 import os
+import weakref
+from dataclasses import dataclass, field
+from typing import Optional
 
 from browser_use.browser.browser import Browser
 from browser_use.browser.context import BrowserContext, BrowserContextConfig
+from browser_use.browser.views import BrowserError, BrowserState
+from browser_use.dom.service import DomService
 from playwright.async_api import Browser as PlaywrightBrowser
 from playwright.async_api import BrowserContext as PlaywrightBrowserContext
+from playwright.async_api import Page
+
+from .dom_snapshot import STATE_EXTRACTORS, DOMSnapshotService
+from .dom_tracker import DOM_TRACKER_JS, DomTracker
+from .network_filter import NetworkFilter, block_images_for_vision
+from .resource_watchdog import get_resource_watchdog, resource_watchdog_enabled
+from .screencast import ScreencastSource, register_screencast, unregister_screencast
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class CustomBrowserContextConfig(BrowserContextConfig):
+    """
+    BrowserContextConfig with the extra knobs of CustomBrowserContext.
+
+    network_filter_profile: "off", "balanced" (fonts, media, ad/tracker domains)
+        or "aggressive", defaults to NETWORK_FILTER_PROFILE
+    network_filter_block_images: also block images, None resolves
+        NETWORK_FILTER_BLOCK_IMAGES ("false", "true" or "auto") with block_images_for_vision()
+    use_vision: whether the agent driving the context uses vision, lets "auto"
+        block images only for agents without it
+    network_filter_blocklist_file: extra domains to block, one per line
+    har_mode: "off", "record" (write all traffic to har_path when the context
+        closes) or "replay" (serve every request from har_path), defaults to BROWSER_HAR_MODE
+    har_path: HAR archive, a ".zip" path stores bodies as separate entries.
+        "{run_id}" is replaced with har_run_id, so a replay finds what a record
+        run with the same id wrote, defaults to BROWSER_HAR_PATH
+    har_run_id: stable id of the recorded run, defaults to BROWSER_HAR_RUN_ID
+    har_url_filter: glob limiting which URLs are recorded or replayed
+    har_not_found: "abort" keeps replay fully offline, "fallback" lets
+        requests missing from the archive go to the network
+    state_extractor: "js" (browser_use's injected DOM walk) or "cdp_snapshot"
+        (DOMSnapshot.captureSnapshot, see dom_snapshot.py), defaults to BROWSER_STATE_EXTRACTOR
+    dom_snapshot_accessibility: let the snapshot extractor consult the accessibility tree
+    dom_cache: reuse the element tree while a MutationObserver reports no
+        change, see dom_tracker.py, defaults to BROWSER_DOM_CACHE
+    """
+    network_filter_profile: str = field(default_factory=lambda: os.getenv("NETWORK_FILTER_PROFILE", "off").lower())
+    network_filter_block_images: Optional[bool] = None
+    use_vision: bool = True
+    network_filter_blocklist_file: Optional[str] = field(
+        default_factory=lambda: os.getenv("NETWORK_FILTER_BLOCKLIST_FILE") or None)
+    har_mode: str = field(default_factory=lambda: os.getenv("BROWSER_HAR_MODE", "off").lower())
+    har_path: Optional[str] = field(default_factory=lambda: os.getenv("BROWSER_HAR_PATH") or None)
+    har_run_id: str = field(default_factory=lambda: os.getenv("BROWSER_HAR_RUN_ID") or "default")
+    har_url_filter: Optional[str] = None
+    har_not_found: str = "abort"
+    state_extractor: str = field(default_factory=lambda: os.getenv("BROWSER_STATE_EXTRACTOR", "js").lower())
+    dom_snapshot_accessibility: bool = field(
+        default_factory=lambda: os.getenv("DOM_SNAPSHOT_ACCESSIBILITY", "true").lower() == "true")
+    dom_cache: bool = field(default_factory=lambda: os.getenv("BROWSER_DOM_CACHE", "true").lower() == "true")
+
+
 class CustomBrowserContext(BrowserContext):
     def __init__(
             self,
@@ -17,3 +72,297 @@ class CustomBrowserContext(BrowserContext):
             config: BrowserContextConfig = BrowserContextConfig()
     ):
         super(CustomBrowserContext, self).__init__(browser=browser, config=config)
+        self.network_filter: Optional[NetworkFilter] = None
+        self.network_stats: Optional[dict] = None
+        self.dom_tracker: Optional[DomTracker] = None
+        self.screencast: Optional[ScreencastSource] = None
+        self._snapshot_services: "weakref.WeakKeyDictionary[Page, DOMSnapshotService]" = weakref.WeakKeyDictionary()
+        if isinstance(config, CustomBrowserContextConfig):
+            network_filter = NetworkFilter(
+                profile=config.network_filter_profile,
+                block_images=(config.network_filter_block_images
+                              if config.network_filter_block_images is not None
+                              else block_images_for_vision(config.use_vision)),
+                blocklist_file=config.network_filter_blocklist_file,
+            )
+            if network_filter.enabled:
+                self.network_filter = network_filter
+            if config.har_mode not in ("off", "record", "replay"):
+                raise ValueError(f"Unknown HAR mode: {config.har_mode}")
+            if config.har_mode != "off" and not config.har_path:
+                raise ValueError(f"HAR mode '{config.har_mode}' needs a har_path")
+            if config.har_mode == "replay" and "{context_id}" in config.har_path:
+                # context ids are fresh for every context, a replay would never find the recording
+                raise ValueError("HAR replay needs a stable har_path, use {run_id} instead of {context_id}")
+            if config.state_extractor not in STATE_EXTRACTORS:
+                raise ValueError(f"Unknown state extractor: {config.state_extractor}")
+            if config.dom_cache:
+                self.dom_tracker = DomTracker()
+
+    @property
+    def har_path(self) -> Optional[str]:
+        """Resolved HAR archive of this context, None when record/replay is off"""
+        if not isinstance(self.config, CustomBrowserContextConfig) or self.config.har_mode == "off":
+            return None
+        return self.config.har_path.format(run_id=self.config.har_run_id, context_id=self.context_id)
+
+    async def _create_context(self, browser: PlaywrightBrowser):
+        context = await super()._create_context(browser)
+        # the HAR route goes first: routes run last-registered-first, so blocked
+        # requests never reach the archive and allowed ones fall back to it
+        if self.har_path:
+            await self._attach_har(context)
+        if self.network_filter:
+            await self.network_filter.attach(context)
+        if self.dom_tracker:
+            await context.add_init_script(DOM_TRACKER_JS)
+            # pages of an attached browser were loaded before the init script existed
+            for page in context.pages:
+                await DomTracker.install(page)
+        if resource_watchdog_enabled():
+            get_resource_watchdog().register_context(self)
+        return context
+
+    async def _attach_har(self, context: PlaywrightBrowserContext):
+        har_path = self.har_path
+        if self.config.har_mode == "record":
+            har_dir = os.path.dirname(har_path)
+            if har_dir:
+                os.makedirs(har_dir, exist_ok=True)
+            await context.route_from_har(
+                har_path,
+                url=self.config.har_url_filter,
+                update=True,
+                update_content="attach" if har_path.endswith(".zip") else "embed",
+                update_mode="minimal",
+            )
+            logger.info(f"Recording network traffic to {har_path}")
+        else:
+            if not os.path.exists(har_path):
+                raise BrowserError(f"HAR archive not found: {har_path}")
+            await context.route_from_har(
+                har_path,
+                url=self.config.har_url_filter,
+                not_found=self.config.har_not_found,
+            )
+            logger.info(f"Replaying network traffic from {har_path}")
+
+    async def get_state(self) -> BrowserState:
+        state = await super().get_state()
+        if self.network_filter:
+            # requests issued since the previous step: the last actions plus this page load
+            self.network_stats = self.network_filter.take_step_stats()
+            if self.network_stats["requests_blocked"]:
+                logger.info(
+                    f"🛡️ Network filter blocked {self.network_stats['requests_blocked']}/"
+                    f"{self.network_stats['requests_seen']} requests, "
+                    f"~{self.network_stats['estimated_bytes_saved'] // 1024} KB saved (estimated)"
+                )
+        if self.dom_tracker and self.dom_tracker.last_step.get("outcome") in ("hit", "patch"):
+            logger.debug(f"DOM unchanged ({self.dom_tracker.last_step['outcome']}), reused the element tree, "
+                         f"saved {self.dom_tracker.last_step['time_saved'] * 1000:.0f} ms")
+        return state
+
+    def get_dom_cache_stats(self) -> Optional[dict]:
+        """Hit ratio and time saved by the element tree cache, None when it is off"""
+        if self.dom_tracker is None:
+            return None
+        return {**self.dom_tracker.get_stats(), "last_step": dict(self.dom_tracker.last_step)}
+
+    async def start_screencast(self, **kwargs) -> ScreencastSource:
+        """
+        Start the live view of this context, see ScreencastSource for the options.
+        The source is registered under the context id so the API can serve it.
+        """
+        if self.screencast is None:
+            self.screencast = ScreencastSource(self, **kwargs)
+        await self.screencast.start()
+        register_screencast(self.screencast)
+        return self.screencast
+
+    async def stop_screencast(self):
+        if self.screencast is None:
+            return
+        screencast, self.screencast = self.screencast, None
+        unregister_screencast(self.context_id)
+        await screencast.stop()
+
+    async def close(self):
+        await self.stop_screencast()
+        await super().close()
+
+    async def _update_state(self, focus_element: int = -1) -> BrowserState:
+        """Same as BrowserContext._update_state, with a choice of DOM extractor"""
+        session = await self.get_session()
+
+        # Check if current page is still valid, if not switch to another available page
+        try:
+            page = await self.get_current_page()
+            # Test if page is still accessible
+            await page.evaluate('1')
+        except Exception as e:
+            logger.debug(f'Current page is no longer accessible: {str(e)}')
+            # Get all available pages
+            pages = session.context.pages
+            if pages:
+                self.state.target_id = None
+                page = await self._get_current_page(session)
+                logger.debug(f'Switched to page: {await page.title()}')
+            else:
+                raise BrowserError('Browser closed: no valid pages available')
+
+        try:
+            if self.dom_tracker and focus_element == -1:
+                content = await self.dom_tracker.get_dom_state(
+                    page,
+                    page.url,
+                    build=lambda: self._build_dom_state(page, focus_element),
+                    highlight_elements=self.config.highlight_elements,
+                )
+            else:
+                content = await self._build_dom_state(page, focus_element)
+
+            screenshot_b64 = await self.take_screenshot()
+            pixels_above, pixels_below = await self.get_scroll_info(page)
+
+            self.current_state = BrowserState(
+                element_tree=content.element_tree,
+                selector_map=content.selector_map,
+                url=page.url,
+                title=await page.title(),
+                tabs=await self.get_tabs_info(),
+                screenshot=screenshot_b64,
+                pixels_above=pixels_above,
+                pixels_below=pixels_below,
+            )
+
+            return self.current_state
+        except Exception as e:
+            logger.error(f'Failed to update state: {str(e)}')
+            # Return last known good state if available
+            if hasattr(self, 'current_state'):
+                return self.current_state
+            raise
+
+    async def _build_dom_state(self, page: Page, focus_element: int = -1):
+        await self.remove_highlights()
+        return await self._get_clickable_elements(page, focus_element)
+
+    async def _get_clickable_elements(self, page: Page, focus_element: int = -1):
+        options = dict(
+            focus_element=focus_element,
+            viewport_expansion=self.config.viewport_expansion,
+            highlight_elements=self.config.highlight_elements,
+        )
+        if getattr(self.config, "state_extractor", "js") == "cdp_snapshot":
+            service = self._snapshot_services.get(page)
+            if service is None:
+                service = DOMSnapshotService(page, use_accessibility_tree=self.config.dom_snapshot_accessibility)
+                self._snapshot_services[page] = service
+            try:
+                return await service.get_clickable_elements(**options)
+            except Exception as e:
+                logger.warning(f'DOM snapshot extraction failed, falling back to the JS walker: {e}')
+        return await DomService(page).get_clickable_elements(**options)
+
+    def can_recycle(self) -> bool:
+        """
+        Contexts of an attached browser are the user's own, and traced or
+        HAR-recorded contexts would overwrite their output when reopened.
+        """
+        if self.browser.config.cdp_url or self.browser.config.wss_url or self.browser.config.chrome_instance_path:
+            return False
+        if self.config.trace_path:
+            return False
+        return self.har_path is None or self.config.har_mode != "record"
+
+    async def recycle_if_needed(self) -> Optional[str]:
+        """
+        Recycle the context when the resource watchdog finds it over its limits.
+        Only call this between agent steps.
+
+        Returns:
+            Optional[str]: Why the context was recycled, None when it was not
+        """
+        if not resource_watchdog_enabled() or self.session is None or not self.can_recycle():
+            return None
+        watchdog = get_resource_watchdog()
+        reason = await watchdog.check_context(self)
+        if reason is None:
+            return None
+        logger.warning(f"♻️ Recycling browser context: {reason}")
+        await self.recycle()
+        watchdog.record_context_recycle(self)
+        return reason
+
+    async def recycle(self):
+        """
+        Replace the Playwright context with a fresh one, carrying over cookies,
+        local storage and the open tabs, so the memory held by the old
+        renderers is handed back without the agent noticing.
+        """
+        session = await self.get_session()
+        storage_state = await session.context.storage_state()
+        current_page = await self.get_current_page()
+        pages = session.context.pages
+        urls = [page.url for page in pages]
+        current_index = pages.index(current_page) if current_page in pages else len(pages) - 1
+
+        # the base close keeps a running screencast, it follows the current page onto the new context
+        await BrowserContext.close(self)
+        if hasattr(self, 'current_state'):
+            del self.current_state
+        self.state.target_id = None
+
+        session = await self.get_session()
+        context = session.context
+        if storage_state.get("cookies"):
+            await context.add_cookies(storage_state["cookies"])
+        local_storage = {
+            origin["origin"]: {item["name"]: item["value"] for item in origin.get("localStorage", [])}
+            for origin in storage_state.get("origins", [])
+        }
+        if local_storage:
+            # values the page wrote itself after the restore win
+            await context.add_init_script(
+                "(() => { const items = (%s)[location.origin]; if (!items) return;"
+                " for (const [k, v] of Object.entries(items)) { if (localStorage.getItem(k) === null)"
+                " localStorage.setItem(k, v); } })();" % json.dumps(local_storage)
+            )
+
+        restored = context.pages
+        for index, url in enumerate(urls):
+            page = restored[0] if index == 0 and restored else await context.new_page()
+            if url and url != "about:blank":
+                try:
+                    await page.goto(url)
+                except Exception as e:
+                    logger.debug(f"Failed to reopen {url} after recycling: {e}")
+        await self.switch_to_tab(min(current_index, len(context.pages) - 1))
+
+    async def is_alive(self) -> bool:
+        """Check that the underlying Playwright context can still run JavaScript"""
+        if self.session is None:
+            return False
+        try:
+            pages = self.session.context.pages
+            if not pages:
+                await self.session.context.new_page()
+                return True
+            return await pages[0].evaluate('1') == 1
+        except Exception as e:
+            logger.debug(f'Browser context health check failed: {e}')
+            return False
+
+    async def reset_for_reuse(self):
+        """
+        Replace the Playwright context with a fresh one so the next task starts
+        from a clean slate: the tabs, cookies, permissions, local and session
+        storage, IndexedDB and cache of the previous task go with the old context.
+        """
+        await self.stop_screencast()
+        await BrowserContext.close(self)
+        self.state.target_id = None
+        if hasattr(self, 'current_state'):
+            del self.current_state
+        await self.get_session()
@@ -0,0 +1,603 @@
+"""
+Browser state extraction from CDP DOMSnapshot.captureSnapshot.
+
+The default extractor of browser_use injects buildDomTree.js, which walks the
+DOM and queries layout node by node (getBoundingClientRect, getComputedStyle,
+elementFromPoint). On large pages that walk dominates the non-LLM time of a
+step. Chromium can hand over the whole DOM with layout boxes, the computed
+styles we ask for and paint order as flat arrays in a single call, so here
+visibility, viewport and occlusion tests run in Python over those arrays,
+vectorized with numpy when it is installed.
+
+The result is the same DOMState (DOMElementNode / DOMTextNode tree and
+selector map) the JS walker produces, following its rules for which nodes are
+kept, how xpaths are built and which elements get a highlight index, so
+prompts and actions work unchanged.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from browser_use.dom.views import DOMElementNode, DOMState, DOMTextNode
+from playwright.async_api import CDPSession, Page
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+STATE_EXTRACTORS = ("js", "cdp_snapshot")
+
+# Order matters, layout styles come back as one string index per entry
+_COMPUTED_STYLES = ["display", "visibility", "opacity", "pointer-events"]
+_DISPLAY, _VISIBILITY, _OPACITY, _POINTER_EVENTS = range(len(_COMPUTED_STYLES))
+
+_NODE_ELEMENT = 1
+_NODE_TEXT = 3
+_NODE_DOCUMENT_FRAGMENT = 11
+
+HIGHLIGHT_CONTAINER_ID = "playwright-highlight-container"
+
+# The rules below mirror buildDomTree.js of browser_use
+_ALWAYS_ACCEPT = {"body", "div", "main", "article", "section", "nav", "header", "footer"}
+_LEAF_DENY_LIST = {"svg", "script", "style", "link", "meta", "noscript", "template"}
+_CANDIDATE_TAGS = {"a", "button", "input", "select", "textarea", "details", "summary"}
+_CANDIDATE_ATTRIBUTES = ("onclick", "role", "tabindex", "data-action")
+_INTERACTIVE_TAGS = {
+    "a", "button", "details", "embed", "input", "menu", "menuitem", "object", "select", "textarea",
+    "canvas", "summary",
+}
+_INTERACTIVE_ROLES = {
+    "button", "menu", "menuitem", "link", "checkbox", "radio", "slider", "tab", "tabpanel", "textbox",
+    "combobox", "grid", "listbox", "option", "progressbar", "scrollbar", "searchbox", "switch", "tree",
+    "treeitem", "spinbutton", "tooltip", "a-button-inner", "a-dropdown-button", "click",
+    "menuitemcheckbox", "menuitemradio", "a-button-text", "button-text", "button-icon",
+    "button-icon-only", "button-text-icon-only", "dropdown",
+}
+_CLICK_ATTRIBUTES = ("onclick", "ng-click", "@click", "v-on:click")
+_ARIA_STATE_ATTRIBUTES = ("aria-expanded", "aria-pressed", "aria-selected", "aria-checked")
+_DROPDOWN_ACTIONS = {"a-dropdown-select", "a-dropdown-button"}
+
+# Accessibility roles that mark a focusable element as a control
+_AX_INTERACTIVE_ROLES = {
+    "button", "link", "checkbox", "radio", "textbox", "combobox", "listbox", "option", "menuitem",
+    "menuitemcheckbox", "menuitemradio", "searchbox", "slider", "spinbutton", "switch", "tab", "treeitem",
+}
+
+_HIGHLIGHT_JS = """
+(boxes) => {
+    const colors = ["#FF0000", "#00FF00", "#0000FF", "#FFA500", "#800080", "#008080",
+                    "#FF69B4", "#4B0082", "#FF4500", "#2E8B57", "#DC143C", "#4682B4"];
+    let container = document.getElementById("%s");
+    if (!container) {
+        container = document.createElement("div");
+        container.id = "%s";
+        container.style.cssText = "position:fixed;pointer-events:none;top:0;left:0;width:100%%;height:100%%;z-index:2147483647";
+        document.body.appendChild(container);
+    }
+    const fragment = document.createDocumentFragment();
+    for (const [index, left, top, width, height] of boxes) {
+        const color = colors[index %% colors.length];
+        const overlay = document.createElement("div");
+        overlay.style.cssText = `position:fixed;border:2px solid ${color};background-color:${color}1A;` +
+            `pointer-events:none;box-sizing:border-box;top:${top}px;left:${left}px;width:${width}px;height:${height}px`;
+        const label = document.createElement("div");
+        label.className = "playwright-highlight-label";
+        const small = width < 24 || height < 20;
+        label.style.cssText = `position:fixed;background:${color};color:white;padding:1px 4px;border-radius:4px;` +
+            `font-size:${Math.min(12, Math.max(8, height / 2))}px;` +
+            `top:${small ? top - 18 : top + 2}px;left:${small ? left + width - 20 : left + width - 22}px`;
+        label.textContent = index;
+        fragment.appendChild(overlay);
+        fragment.appendChild(label);
+    }
+    container.appendChild(fragment);
+}
+""" % (HIGHLIGHT_CONTAINER_ID, HIGHLIGHT_CONTAINER_ID)
+
+
+@dataclass
+class _Viewport:
+    width: float
+    height: float
+    expansion: int
+
+
+class _SnapshotDocument:
+    """Column arrays of one document of the snapshot, plus the geometry derived from them"""
+
+    def __init__(self, doc: dict, strings: List[str], viewport: _Viewport):
+        nodes = doc["nodes"]
+        self.strings = strings
+        self.parent: List[int] = nodes["parentIndex"]
+        self.node_type: List[int] = nodes["nodeType"]
+        self.node_name: List[int] = nodes["nodeName"]
+        self.node_value: List[int] = nodes["nodeValue"]
+        self.raw_attributes: List[List[int]] = nodes.get("attributes", [[] for _ in self.parent])
+        self.backend_id: List[int] = nodes.get("backendNodeId", [0] * len(self.parent))
+        self.scroll_x = doc.get("scrollOffsetX", 0)
+        self.scroll_y = doc.get("scrollOffsetY", 0)
+
+        size = len(self.parent)
+        self.pseudo = set(nodes.get("pseudoType", {}).get("index", []))
+        self.shadow_roots = set(nodes.get("shadowRootType", {}).get("index", []))
+        self.clickable = set(nodes.get("isClickable", {}).get("index", []))
+        content_documents = nodes.get("contentDocumentIndex", {"index": [], "value": []})
+        self.content_document = dict(zip(content_documents["index"], content_documents["value"]))
+
+        self.children: List[List[int]] = [[] for _ in range(size)]
+        for index, parent in enumerate(self.parent):
+            if parent >= 0:
+                self.children[parent].append(index)
+
+        layout = doc["layout"]
+        self.layout_node: List[int] = layout["nodeIndex"]
+        self.layout_of = [-1] * size
+        for layout_index, node_index in enumerate(self.layout_node):
+            if self.layout_of[node_index] == -1:
+                # the first box is the node's own, later ones belong to its continuation
+                self.layout_of[node_index] = layout_index
+        self.bounds: List[List[float]] = layout["bounds"]
+        self.styles: List[List[int]] = layout["styles"]
+        self.paint_order: List[int] = layout.get("paintOrders", [0] * len(self.layout_node))
+
+        self._compute_geometry(viewport)
+        self._sibling_index: Dict[int, int] = {}
+        self._xpaths: Dict[int, str] = {}
+
+    def _style_is(self, value: str) -> int:
+        try:
+            return self.strings.index(value)
+        except ValueError:
+            return -2
+
+    def _compute_geometry(self, viewport: _Viewport):
+        """Per layout box: non-empty, inside the (expanded) viewport and styled visible"""
+        count = len(self.layout_node)
+        hidden, none, zero = self._style_is("hidden"), self._style_is("none"), self._style_is("0")
+        expansion = viewport.expansion
+        if np is not None and count:
+            bounds = np.asarray(self.bounds, dtype=np.float64).reshape(count, 4)
+            styles = np.asarray(self.styles, dtype=np.int64).reshape(count, len(_COMPUTED_STYLES))
+            left = bounds[:, 0] - self.scroll_x
+            top = bounds[:, 1] - self.scroll_y
+            right, bottom = left + bounds[:, 2], top + bounds[:, 3]
+            self.rects = np.stack([left, top, right, bottom], axis=1)
+            self.has_size = (bounds[:, 2] > 0) & (bounds[:, 3] > 0)
+            self.styled_visible = (styles[:, _VISIBILITY] != hidden) & (styles[:, _DISPLAY] != none)
+            self.transparent = styles[:, _OPACITY] == zero
+            self.pointer_events = styles[:, _POINTER_EVENTS] != none
+            self.in_viewport = (left < viewport.width) & (right > 0) & (top < viewport.height) & (bottom > 0)
+            if expansion == -1:
+                self.in_expanded = np.ones(count, dtype=bool)
+            else:
+                self.in_expanded = ~((bottom < -expansion) | (top > viewport.height + expansion)
+                                     | (right < -expansion) | (left > viewport.width + expansion))
+            for name in ("has_size", "styled_visible", "transparent", "pointer_events", "in_viewport", "in_expanded"):
+                setattr(self, name, getattr(self, name).tolist())
+            self.rects = self.rects.tolist()
+            return
+
+        self.rects, self.has_size, self.styled_visible = [], [], []
+        self.transparent, self.pointer_events, self.in_viewport, self.in_expanded = [], [], [], []
+        for (x, y, width, height), style in zip(self.bounds, self.styles):
+            left, top = x - self.scroll_x, y - self.scroll_y
+            right, bottom = left + width, top + height
+            self.rects.append([left, top, right, bottom])
+            self.has_size.append(width > 0 and height > 0)
+            self.styled_visible.append(style[_VISIBILITY] != hidden and style[_DISPLAY] != none)
+            self.transparent.append(style[_OPACITY] == zero)
+            self.pointer_events.append(style[_POINTER_EVENTS] != none)
+            self.in_viewport.append(left < viewport.width and right > 0 and top < viewport.height and bottom > 0)
+            self.in_expanded.append(expansion == -1 or not (
+                    bottom < -expansion or top > viewport.height + expansion
+                    or right < -expansion or left > viewport.width + expansion))
+
+    def string(self, index: int) -> str:
+        return self.strings[index] if index >= 0 else ""
+
+    def tag(self, node: int) -> str:
+        return self.string(self.node_name[node]).lower()
+
+    def attributes(self, node: int) -> Dict[str, str]:
+        raw = self.raw_attributes[node]
+        return {self.strings[raw[i]]: self.strings[raw[i + 1]] for i in range(0, len(raw) - 1, 2)}
+
+    def dom_children(self, node: int) -> List[int]:
+        """childNodes: shadow roots and pseudo elements are not part of it"""
+        return [child for child in self.children[node]
+                if child not in self.pseudo and self.node_type[child] != _NODE_DOCUMENT_FRAGMENT]
+
+    def shadow_root(self, node: int) -> Optional[int]:
+        for child in self.children[node]:
+            if child in self.shadow_roots:
+                return child
+        return None
+
+    def xpath(self, node: int) -> str:
+        """Same xpath as getXPathTree(): relative to the enclosing document or shadow root"""
+        cached = self._xpaths.get(node)
+        if cached is not None:
+            return cached
+        segment = self.tag(node)
+        index = self._position(node)
+        if index > 0:
+            segment += f"[{index + 1}]"
+        parent = self.parent[node]
+        if parent >= 0 and self.node_type[parent] == _NODE_ELEMENT:
+            segment = f"{self.xpath(parent)}/{segment}"
+        self._xpaths[node] = segment
+        return segment
+
+    def _position(self, node: int) -> int:
+        if node not in self._sibling_index:
+            parent = self.parent[node]
+            if parent < 0:
+                return 0
+            counts: Dict[int, int] = {}
+            for sibling in self.dom_children(parent):
+                if self.node_type[sibling] != _NODE_ELEMENT:
+                    continue
+                name = self.node_name[sibling]
+                self._sibling_index[sibling] = counts.get(name, 0)
+                counts[name] = counts.get(name, 0) + 1
+        return self._sibling_index.get(node, 0)
+
+
+@dataclass
+class _Candidate:
+    """An element that passed the attribute checks, waiting for the occlusion test"""
+    element: DOMElementNode
+    document: _SnapshotDocument
+    node: int
+    frame_offset: Tuple[float, float]
+    needs_hit_test: bool
+    removed: bool = False
+
+
+class _SnapshotTreeBuilder:
+    def __init__(self, snapshot: dict, viewport: _Viewport, ax_interactive: Set[int]):
+        self.strings = snapshot["strings"]
+        self.viewport = viewport
+        self.documents = [_SnapshotDocument(doc, self.strings, viewport) for doc in snapshot["documents"]]
+        self.ax_interactive = ax_interactive
+        self.candidates: List[_Candidate] = []
+
+    def _find_body(self) -> int:
+        doc = self.documents[0]
+        for node, parent in enumerate(doc.parent):
+            if doc.node_type[node] == _NODE_ELEMENT and doc.tag(node) == "body" \
+                    and parent >= 0 and doc.tag(parent) == "html":
+                return node
+        raise ValueError("Page has no <body> to extract")
+
+    def build(self) -> Tuple[DOMElementNode, Dict[int, DOMElementNode]]:
+        main = self.documents[0]
+        body = self._find_body()
+        root = DOMElementNode(
+            tag_name="body", xpath="/body", attributes={}, children=[], is_visible=False, parent=None,
+        )
+        # explicit stack instead of recursion, real-world DOMs can nest deeper than the recursion limit
+        # frames: (document, node index, parent element, frame offset, inherited editable, inherited transparent)
+        stack = [(main, child, root, (0.0, 0.0), False, False) for child in reversed(main.dom_children(body))]
+
+        while stack:
+            item = stack.pop()
+            if item[0] is None:
+                # exit marker of an anchor: drop it when it ended up empty
+                self._exit_anchor(item[1], item[2])
+                continue
+            doc, node, parent_element, offset, editable, transparent = item
+            node_type = doc.node_type[node]
+
+            if node_type == _NODE_TEXT:
+                text_node = self._text_node(doc, node, parent_element, transparent)
+                if text_node is not None:
+                    parent_element.children.append(text_node)
+                continue
+            if node_type != _NODE_ELEMENT or node in doc.pseudo:
+                continue
+
+            tag = doc.tag(node)
+            if tag not in _ALWAYS_ACCEPT and tag in _LEAF_DENY_LIST:
+                continue
+            layout = doc.layout_of[node]
+            # nodes without a box measure as an empty rect at the origin and stay, as in the JS walker
+            if layout >= 0 and not doc.in_expanded[layout]:
+                continue
+
+            attributes = doc.attributes(node)
+            element = DOMElementNode(
+                tag_name=tag,
+                xpath=doc.xpath(node),
+                attributes=attributes if self._is_candidate(tag, attributes) or tag in ("iframe", "body") else {},
+                children=[],
+                is_visible=layout >= 0 and doc.has_size[layout] and doc.styled_visible[layout],
+                parent=parent_element,
+            )
+            parent_element.children.append(element)
+
+            contenteditable = attributes.get("contenteditable")
+            node_editable = contenteditable in ("true", "", "plaintext-only") or (
+                    editable and contenteditable != "false")
+            node_transparent = transparent or (layout >= 0 and doc.transparent[layout])
+
+            if element.is_visible and self._is_interactive(doc, node, tag, attributes, node_editable):
+                needs_hit_test = doc is main and doc.in_viewport[layout]
+                self.candidates.append(_Candidate(element, doc, node, offset, needs_hit_test))
+
+            if tag == "a":
+                stack.append((None, element, parent_element, None, None, None))
+
+            children: List[Tuple[_SnapshotDocument, int]] = []
+            child_offset = offset
+            if doc.content_document.get(node) is not None:
+                frame_doc = self.documents[doc.content_document[node]]
+                if layout >= 0:
+                    left, top = doc.rects[layout][0], doc.rects[layout][1]
+                    child_offset = (offset[0] + left, offset[1] + top)
+                children = [(frame_doc, child) for child in frame_doc.dom_children(0)]
+                node_editable = False
+            elif node_editable or attributes.get("id") == "tinymce" \
+                    or "mce-content-body" in attributes.get("class", "").split():
+                children = [(doc, child) for child in doc.dom_children(node)]
+            else:
+                shadow = doc.shadow_root(node)
+                if shadow is not None:
+                    element.shadow_root = True
+                    children = [(doc, child) for child in doc.dom_children(shadow)]
+                else:
+                    children = [(doc, child) for child in doc.dom_children(node)]
+
+            for child_doc, child in reversed(children):
+                stack.append((child_doc, child, element, child_offset, node_editable, node_transparent))
+
+        selector_map = self._assign_highlight_indices()
+        return root, selector_map
+
+    @staticmethod
+    def _exit_anchor(element: DOMElementNode, parent_element: DOMElementNode):
+        # skip empty anchor tags, like the JS walker
+        if element.children or element.attributes.get("href"):
+            return
+        if parent_element.children and parent_element.children[-1] is element:
+            parent_element.children.pop()
+        element.parent = None
+
+    def _text_node(self, doc: _SnapshotDocument, node: int, parent_element: DOMElementNode,
+                   transparent: bool) -> Optional[DOMTextNode]:
+        text = doc.string(doc.node_value[node]).strip()
+        if not text:
+            return None
+        parent = doc.parent[node]
+        if parent < 0 or doc.node_type[parent] != _NODE_ELEMENT or doc.tag(parent) == "script":
+            return None
+
+        layout = doc.layout_of[node]
+        parent_layout = doc.layout_of[parent]
+        is_visible = (
+                layout >= 0 and doc.has_size[layout] and doc.in_expanded[layout]
+                and parent_layout >= 0 and doc.styled_visible[parent_layout]
+                and not transparent and not doc.transparent[parent_layout]
+        )
+        return DOMTextNode(text=text, is_visible=is_visible, parent=parent_element)
+
+    @staticmethod
+    def _is_candidate(tag: str, attributes: Dict[str, str]) -> bool:
+        return tag in _CANDIDATE_TAGS or any(name in attributes for name in _CANDIDATE_ATTRIBUTES)
+
+    def _is_interactive(self, doc: _SnapshotDocument, node: int, tag: str, attributes: Dict[str, str],
+                        editable: bool) -> bool:
+        role = attributes.get("role")
+        tab_index = attributes.get("tabindex")
+        parent = doc.parent[node]
+        if (
+                tag in _INTERACTIVE_TAGS
+                or role in _INTERACTIVE_ROLES
+                or attributes.get("aria-role") in _INTERACTIVE_ROLES
+                or "address-input__container__input" in attributes.get("class", "").split()
+                or (tab_index is not None and tab_index != "-1" and not (parent >= 0 and doc.tag(parent) == "body"))
+                or attributes.get("data-action") in _DROPDOWN_ACTIONS
+        ):
+            return True
+
+        # isClickable covers listeners added with addEventListener, which the JS walker cannot see
+        if node in doc.clickable or any(name in attributes for name in _CLICK_ATTRIBUTES):
+            return True
+        if any(name in attributes for name in _ARIA_STATE_ATTRIBUTES):
+            return True
+        if editable or attributes.get("id") == "tinymce" or "mce-content-body" in attributes.get("class", "").split():
+            return True
+        if tag == "body" and attributes.get("data-id", "").startswith("mce_"):
+            return True
+        draggable = attributes.get("draggable")
+        if draggable == "true" or (draggable != "false" and (tag == "img" or (tag == "a" and "href" in attributes))):
+            return True
+        return doc.backend_id[node] in self.ax_interactive
+
+    def _assign_highlight_indices(self) -> Dict[int, DOMElementNode]:
+        hit_candidates = [candidate for candidate in self.candidates
+                          if candidate.needs_hit_test and candidate.element.parent is not None]
+        on_top = self._hit_test(hit_candidates)
+        selector_map = {}
+        highlight_index = 0
+        for candidate in self.candidates:
+            element = candidate.element
+            # anchors dropped by _exit_anchor are no longer in the tree and take no index
+            if element.parent is None:
+                continue
+            if candidate.needs_hit_test and not on_top.get(id(candidate), False):
+                continue
+            element.is_top_element = True
+            element.is_interactive = True
+            element.is_in_viewport = True
+            element.highlight_index = highlight_index
+            highlight_index += 1
+            selector_map[element.highlight_index] = element
+        return selector_map
+
+    def _hit_test(self, candidates: List[_Candidate]) -> Dict[int, bool]:
+        """
+        Replacement for elementFromPoint at the center of every candidate: the
+        topmost box under the point is the one painted last.
+        """
+        if not candidates:
+            return {}
+        doc = self.documents[0]
+        hittable = [
+            index for index in range(len(doc.layout_node))
+            if doc.has_size[index] and doc.styled_visible[index] and doc.pointer_events[index]
+        ]
+        rects = [doc.rects[index] for index in hittable]
+        # ties go to the later box in document order, which is painted above its ancestors
+        keys = [doc.paint_order[index] * len(doc.layout_node) + index for index in hittable]
+        points = []
+        for candidate in candidates:
+            left, top, right, bottom = doc.rects[doc.layout_of[candidate.node]]
+            points.append(((left + right) / 2, (top + bottom) / 2))
+
+        top_boxes = _topmost_boxes(points, rects, keys)
+        result = {}
+        for candidate, box in zip(candidates, top_boxes):
+            if box < 0:
+                result[id(candidate)] = False
+                continue
+            # the hit is on top when it is the candidate itself or one of its descendants
+            node = doc.layout_node[hittable[box]]
+            while node >= 0 and node != candidate.node:
+                node = doc.parent[node]
+            result[id(candidate)] = node == candidate.node
+        return result
+
+    def highlight_boxes(self, focus_element: int = -1) -> List[List[float]]:
+        boxes = []
+        for candidate in self.candidates:
+            index = candidate.element.highlight_index
+            if index is None or (focus_element >= 0 and index != focus_element):
+                continue
+            doc = candidate.document
+            left, top, right, bottom = doc.rects[doc.layout_of[candidate.node]]
+            boxes.append([index, left + candidate.frame_offset[0], top + candidate.frame_offset[1],
+                          right - left, bottom - top])
+        return boxes
+
+
+def _topmost_boxes(points: List[Tuple[float, float]], rects: List[List[float]], keys: List[int]) -> List[int]:
+    """Index of the box with the highest key containing each point, -1 when none does"""
+    if not rects:
+        return [-1] * len(points)
+    if np is not None:
+        boxes = np.asarray(rects, dtype=np.float64)
+        box_keys = np.asarray(keys, dtype=np.int64)
+        result = []
+        # bound the candidates x boxes matrix to a few million cells
+        chunk = max(1, 4_000_000 // len(rects))
+        for start in range(0, len(points), chunk):
+            xy = np.asarray(points[start:start + chunk], dtype=np.float64)
+            x, y = xy[:, 0:1], xy[:, 1:2]
+            contains = (boxes[:, 0] <= x) & (x < boxes[:, 2]) & (boxes[:, 1] <= y) & (y < boxes[:, 3])
+            masked = np.where(contains, box_keys, -1)
+            best = masked.argmax(axis=1)
+            found = masked[np.arange(len(best)), best] >= 0
+            result.extend(np.where(found, best, -1).tolist())
+        return result
+
+    result = []
+    for x, y in points:
+        best, best_key = -1, -1
+        for index, (left, top, right, bottom) in enumerate(rects):
+            if left <= x < right and top <= y < bottom and keys[index] > best_key:
+                best, best_key = index, keys[index]
+        result.append(best)
+    return result
+
+
+class DOMSnapshotService:
+    """
+    Drop-in alternative to browser_use's DomService backed by
+    DOMSnapshot.captureSnapshot.
+
+    Args:
+        page: Page to extract
+        use_accessibility_tree: Also treat focusable elements with a control
+            role in the accessibility tree as interactive. This catches
+            custom widgets the attribute rules miss, at the cost of one more
+            CDP call.
+    """
+
+    def __init__(self, page: Page, use_accessibility_tree: bool = True):
+        self.page = page
+        self.use_accessibility_tree = use_accessibility_tree
+        self._cdp: Optional[CDPSession] = None
+
+    async def _session(self) -> CDPSession:
+        if self._cdp is None:
+            self._cdp = await self.page.context.new_cdp_session(self.page)
+        return self._cdp
+
+    async def detach(self):
+        if self._cdp is not None:
+            try:
+                await self._cdp.detach()
+            except Exception:
+                pass
+            self._cdp = None
+
+    async def _capture(self) -> Tuple[dict, dict, Set[int]]:
+        cdp = await self._session()
+        requests = [
+            cdp.send("DOMSnapshot.captureSnapshot", {
+                "computedStyles": _COMPUTED_STYLES,
+                "includePaintOrder": True,
+                "includeDOMRects": False,
+            }),
+            cdp.send("Page.getLayoutMetrics"),
+        ]
+        if self.use_accessibility_tree:
+            requests.append(cdp.send("Accessibility.getFullAXTree"))
+        results = await asyncio.gather(*requests)
+        ax_interactive = _ax_interactive_nodes(results[2]) if self.use_accessibility_tree else set()
+        return results[0], results[1], ax_interactive
+
+    async def get_clickable_elements(
+            self,
+            highlight_elements: bool = True,
+            focus_element: int = -1,
+            viewport_expansion: int = 0,
+    ) -> DOMState:
+        """Same contract as DomService.get_clickable_elements()"""
+        try:
+            snapshot, metrics, ax_interactive = await self._capture()
+        except Exception:
+            # the session dies with navigations to another process, retry on a fresh one
+            await self.detach()
+            snapshot, metrics, ax_interactive = await self._capture()
+
+        layout_viewport = metrics.get("cssLayoutViewport") or metrics["layoutViewport"]
+        viewport = _Viewport(layout_viewport["clientWidth"], layout_viewport["clientHeight"], viewport_expansion)
+        builder = _SnapshotTreeBuilder(snapshot, viewport, ax_interactive)
+        element_tree, selector_map = builder.build()
+
+        if highlight_elements:
+            boxes = builder.highlight_boxes(focus_element)
+            if boxes:
+                await self.page.evaluate(_HIGHLIGHT_JS, boxes)
+        return DOMState(element_tree=element_tree, selector_map=selector_map)
+
+
+def _ax_interactive_nodes(ax_tree: dict) -> Set[int]:
+    nodes = set()
+    for ax_node in ax_tree.get("nodes", []):
+        if ax_node.get("ignored") or "backendDOMNodeId" not in ax_node:
+            continue
+        role = ax_node.get("role", {}).get("value")
+        if role not in _AX_INTERACTIVE_ROLES:
+            continue
+        for prop in ax_node.get("properties", []):
+            if prop.get("name") == "focusable" and prop.get("value", {}).get("value"):
+                nodes.add(ax_node["backendDOMNodeId"])
+                break
+    return nodes
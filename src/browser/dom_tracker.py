@@ -0,0 +1,327 @@
+"""
+Incremental DOM tracking: skip rebuilding the element tree when the page did
+not change since the previous step.
+
+An init script installs a MutationObserver in every document that bumps a
+version counter on any change outside the highlight overlay, and on pointer,
+focus and transition events that can change what is visible through CSS
+alone. Text-only edits in the main document are additionally recorded as the
+xpaths of the elements whose text changed.
+
+Each step the tracker is probed with one evaluate call. When the document,
+version, scroll position, viewport and URL match the cached tree it is reused
+as is. When only text changed, the affected text nodes are patched in place.
+Anything else is a structural change: highlight indices are assigned in
+document order across the whole page, so a new or removed element shifts the
+index of every element after it and the tree is rebuilt.
+"""
+import logging
+import time
+import weakref
+from typing import Dict, Optional
+
+from browser_use.dom.views import DOMElementNode, DOMState, DOMTextNode
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+HIGHLIGHT_CONTAINER_ID = "playwright-highlight-container"
+
+# Text-only changes above this many elements are treated as a structural change
+MAX_DIRTY_TEXT_ELEMENTS = 64
+
+DOM_TRACKER_JS = """
+(() => {
+    if (window.__domTracker) return;
+    const HIGHLIGHT_ID = "%s";
+    const MAX_DIRTY = %d;
+
+    if (window.top !== window) {
+        // frames report to the top document, which owns the version
+        const bump = () => {
+            try { window.top.postMessage({__domTrackerBump: true}, "*"); } catch (e) {}
+        };
+        window.__domTracker = {frame: true};
+        new MutationObserver(bump).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+        for (const type of ["mouseover", "focusin", "transitionend", "animationend"]) {
+            window.addEventListener(type, bump, true);
+        }
+        return;
+    }
+
+    const tracker = {
+        id: Math.random().toString(36).slice(2),
+        version: 0,
+        structural: false,
+        dirty: new Set(),
+    };
+    window.__domTracker = tracker;
+
+    const xpathOf = (element) => {
+        const segments = [];
+        let current = element;
+        while (current && current.nodeType === Node.ELEMENT_NODE) {
+            if (current.parentNode instanceof ShadowRoot) return null;
+            let index = 0;
+            let sibling = current.previousSibling;
+            while (sibling) {
+                if (sibling.nodeType === Node.ELEMENT_NODE && sibling.nodeName === current.nodeName) index++;
+                sibling = sibling.previousSibling;
+            }
+            segments.unshift(current.nodeName.toLowerCase() + (index > 0 ? `[${index + 1}]` : ""));
+            current = current.parentNode;
+        }
+        return segments.join("/");
+    };
+
+    const isHighlight = (node) => {
+        const container = document.getElementById(HIGHLIGHT_ID);
+        return node.id === HIGHLIGHT_ID || (container !== null && container.contains(node));
+    };
+
+    const onMutations = (mutations) => {
+        let changed = false;
+        for (const mutation of mutations) {
+            const target = mutation.target;
+            if (isHighlight(target)) continue;
+            if (mutation.type === "childList") {
+                const nodes = [...mutation.addedNodes, ...mutation.removedNodes];
+                if (nodes.length && nodes.every((node) => node.id === HIGHLIGHT_ID)) continue;
+                tracker.structural = true;
+            } else if (mutation.type === "attributes") {
+                if (mutation.attributeName === "browser-user-highlight-id") continue;
+                tracker.structural = true;
+            } else {
+                const parent = target.parentElement;
+                if (parent && (parent.tagName === "SCRIPT" || parent.tagName === "STYLE")) continue;
+                const xpath = parent ? xpathOf(parent) : null;
+                if (xpath === null || tracker.dirty.size >= MAX_DIRTY) {
+                    tracker.structural = true;
+                } else {
+                    tracker.dirty.add(xpath);
+                }
+            }
+            changed = true;
+        }
+        if (changed) tracker.version++;
+    };
+
+    const bump = () => { tracker.version++; tracker.structural = true; };
+    new MutationObserver(onMutations).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    for (const type of ["mouseover", "focusin", "transitionend", "animationend"]) {
+        window.addEventListener(type, bump, true);
+    }
+    window.addEventListener("message", (event) => {
+        if (event.data && event.data.__domTrackerBump) bump();
+    });
+})();
+""" % (HIGHLIGHT_CONTAINER_ID, MAX_DIRTY_TEXT_ELEMENTS)
+
+# Reads the tracker and starts a new dirty window in one go, so no mutation
+# can slip in between the read and the reset
+_PROBE_JS = """
+() => {
+    const tracker = window.__domTracker;
+    if (!tracker || tracker.frame) return null;
+    const probe = {
+        id: tracker.id,
+        version: tracker.version,
+        structural: tracker.structural,
+        dirty: [...tracker.dirty],
+        scroll: [window.scrollX, window.scrollY],
+        viewport: [window.innerWidth, window.innerHeight],
+    };
+    tracker.structural = false;
+    tracker.dirty.clear();
+    return probe;
+}
+"""
+
+_TEXTS_JS = """
+(xpaths) => xpaths.map((xpath) => {
+    const element = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!element) return null;
+    return [...element.childNodes]
+        .filter((node) => node.nodeType === Node.TEXT_NODE)
+        .map((node) => node.textContent.trim())
+        .filter((text) => text);
+})
+"""
+
+_SAVE_HIGHLIGHTS_JS = """
+() => {
+    const container = document.getElementById("%s");
+    return container ? container.outerHTML : null;
+}
+""" % HIGHLIGHT_CONTAINER_ID
+
+_RESTORE_HIGHLIGHTS_JS = """
+(html) => {
+    document.getElementById("%s")?.remove();
+    const template = document.createElement("template");
+    template.innerHTML = html;
+    document.body.appendChild(template.content.firstChild);
+}
+""" % HIGHLIGHT_CONTAINER_ID
+
+
+class DomTreeCache:
+    """The element tree of one page, valid for as long as its tracker probe matches"""
+
+    def __init__(self):
+        self.key: Optional[tuple] = None
+        self.dom_state: Optional[DOMState] = None
+        self.highlight_html: Optional[str] = None
+        self.build_time = 0.0
+        self._xpath_index: Optional[Dict[str, DOMElementNode]] = None
+
+    def store(self, key: Optional[tuple], dom_state: DOMState, highlight_html: Optional[str], build_time: float):
+        self.key = key
+        self.dom_state = dom_state
+        self.highlight_html = highlight_html
+        self.build_time = build_time
+        self._xpath_index = None
+
+    def invalidate(self):
+        self.key = None
+        self.dom_state = None
+        self.highlight_html = None
+        self._xpath_index = None
+
+    def xpath_index(self) -> Dict[str, DOMElementNode]:
+        """Elements of the main document by xpath, elements in frames and shadow roots are left out"""
+        if self._xpath_index is None:
+            root = self.dom_state.element_tree
+            index = {"html/body": root}
+            stack = [root]
+            while stack:
+                element = stack.pop()
+                if element.tag_name in ("iframe", "frame") or element.shadow_root:
+                    continue
+                for child in element.children:
+                    if isinstance(child, DOMElementNode):
+                        index[child.xpath] = child
+                        stack.append(child)
+            self._xpath_index = index
+        return self._xpath_index
+
+
+class DomTracker:
+    """
+    Serves get_state's element tree from a per-page cache.
+
+    Stats are kept per step (`last_step`) and in total (`get_stats()`).
+    """
+
+    def __init__(self):
+        self._caches: "weakref.WeakKeyDictionary[Page, DomTreeCache]" = weakref.WeakKeyDictionary()
+        self._stats = {"hits": 0, "patches": 0, "misses": 0, "time_saved": 0.0}
+        self.last_step: Dict = {}
+
+    @staticmethod
+    async def install(page: Page):
+        """Start tracking a page that was opened before the init script was registered"""
+        try:
+            await page.evaluate(DOM_TRACKER_JS)
+        except Exception as e:
+            logger.debug(f"Failed to install DOM tracker: {e}")
+
+    async def get_dom_state(self, page: Page, url: str, build, highlight_elements: bool) -> DOMState:
+        """
+        Return the element tree of the page, from cache when possible.
+
+        Args:
+            page: Page to extract
+            url: Current URL of the page, part of the cache key
+            build: Coroutine function doing a full rebuild, returns a DOMState
+            highlight_elements: Whether highlights have to be on the page afterwards
+
+        Returns:
+            DOMState: The element tree and selector map
+        """
+        start = time.perf_counter()
+        cache = self._caches.get(page)
+        if cache is None:
+            cache = self._caches[page] = DomTreeCache()
+        try:
+            probe = await page.evaluate(_PROBE_JS)
+        except Exception as e:
+            logger.debug(f"DOM tracker probe failed: {e}")
+            probe = None
+
+        key = None
+        if probe is not None:
+            key = (probe["id"], probe["version"], tuple(probe["scroll"]), tuple(probe["viewport"]), url)
+            outcome = None
+            if cache.dom_state is not None and cache.key is not None:
+                if key == cache.key:
+                    outcome = "hit"
+                elif key[0] == cache.key[0] and key[2:] == cache.key[2:] and not probe["structural"] \
+                        and probe["dirty"] and await self._patch_texts(page, cache, probe["dirty"]):
+                    outcome = "patch"
+            if outcome is not None:
+                # after a text patch the boxes may be a few pixels off until the next rebuild
+                if highlight_elements and cache.highlight_html:
+                    await self._restore_highlights(page, cache.highlight_html)
+                cache.key = key
+                elapsed = time.perf_counter() - start
+                saved = max(0.0, cache.build_time - elapsed)
+                self._stats["hits" if outcome == "hit" else "patches"] += 1
+                self._stats["time_saved"] += saved
+                self.last_step = {"outcome": outcome, "time": elapsed, "time_saved": saved}
+                return cache.dom_state
+
+        dom_state = await build()
+        highlight_html = None
+        if highlight_elements:
+            try:
+                highlight_html = await page.evaluate(_SAVE_HIGHLIGHTS_JS)
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+        if key is not None:
+            cache.store(key, dom_state, highlight_html, elapsed)
+        else:
+            cache.invalidate()
+        self._stats["misses"] += 1
+        self.last_step = {"outcome": "miss", "time": elapsed, "time_saved": 0.0}
+        return dom_state
+
+    @staticmethod
+    async def _patch_texts(page: Page, cache: DomTreeCache, xpaths: list) -> bool:
+        index = cache.xpath_index()
+        elements = [index.get(xpath) for xpath in xpaths]
+        if any(element is None for element in elements):
+            return False
+        try:
+            texts = await page.evaluate(_TEXTS_JS, xpaths)
+        except Exception:
+            return False
+
+        updates = []
+        for element, new_texts in zip(elements, texts):
+            text_nodes = [child for child in element.children if isinstance(child, DOMTextNode)]
+            if new_texts is None or len(new_texts) != len(text_nodes):
+                # a text node appeared or vanished, the tree shape changed
+                return False
+            updates.extend(zip(text_nodes, new_texts))
+        for text_node, text in updates:
+            text_node.text = text
+        return True
+
+    @staticmethod
+    async def _restore_highlights(page: Page, highlight_html: str):
+        try:
+            await page.evaluate(_RESTORE_HIGHLIGHTS_JS, highlight_html)
+        except Exception as e:
+            logger.debug(f"Failed to restore highlights: {e}")
+
+    def forget(self, page: Page):
+        self._caches.pop(page, None)
+
+    def get_stats(self) -> Dict:
+        lookups = self._stats["hits"] + self._stats["patches"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": (self._stats["hits"] + self._stats["patches"]) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,234 @@
+"""
+Request interception that keeps agents from downloading what they never look at.
+
+Requests are dropped by resource type (fonts, media, optionally images) and by
+domain, using a compact ad/tracker blocklist matched with a suffix trie so a
+lookup costs one dict hop per label of the host name.
+
+Counters are kept per agent step and reported in the step events of the run
+("network"). Blocked requests never transfer anything, so the bytes saved
+(estimated_bytes_saved) are an estimate from typical sizes per resource
+type, not a measurement.
+"""
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from playwright.async_api import BrowserContext as PlaywrightBrowserContext
+from playwright.async_api import Route
+
+logger = logging.getLogger(__name__)
+
+# Resource types blocked by each profile
+NETWORK_FILTER_PROFILES = {
+    "off": frozenset(),
+    "balanced": frozenset({"font", "media"}),
+    "aggressive": frozenset({"font", "media", "texttrack", "manifest", "eventsource"}),
+}
+
+# Profiles that also consult the domain blocklist
+_DOMAIN_BLOCKING_PROFILES = {"balanced", "aggressive"}
+
+# Ad networks, trackers and analytics beacons that never carry page content
+DEFAULT_BLOCKLIST = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com",
+    "googletagmanager.com", "googletagservices.com", "adservice.google.com", "pagead2.googlesyndication.com",
+    "amazon-adsystem.com", "adnxs.com", "adsrvr.org", "advertising.com", "rubiconproject.com",
+    "pubmatic.com", "openx.net", "casalemedia.com", "criteo.com", "criteo.net", "taboola.com",
+    "outbrain.com", "moatads.com", "doubleverify.com", "adsafeprotected.com", "scorecardresearch.com",
+    "quantserve.com", "quantcount.com", "chartbeat.com", "chartbeat.net", "hotjar.com", "mixpanel.com",
+    "segment.io", "fullstory.com", "mouseflow.com", "crazyegg.com", "newrelic.com", "nr-data.net",
+    "bidswitch.net", "smartadserver.com", "teads.tv", "sharethrough.com", "33across.com", "yieldmo.com",
+    "media.net", "zemanta.com", "bluekai.com", "krxd.net", "exelator.com", "demdex.net", "omtrdc.net",
+    "connect.facebook.net", "ads.linkedin.com", "analytics.twitter.com", "ads-twitter.com",
+    "static.ads-twitter.com", "bat.bing.com", "clarity.ms", "onesignal.com", "pushwoosh.com",
+)
+
+# Typical transfer size per resource type, used to estimate what a blocked request would have cost
+_ESTIMATED_BYTES = {
+    "image": 40_000,
+    "media": 500_000,
+    "font": 35_000,
+    "script": 25_000,
+    "stylesheet": 15_000,
+    "document": 30_000,
+    "xhr": 3_000,
+    "fetch": 3_000,
+}
+_DEFAULT_ESTIMATED_BYTES = 5_000
+
+
+class DomainSuffixTrie:
+    """
+    Set of domains where a host matches if it equals a domain or is one of its
+    subdomains. Labels are stored right to left: "ads.example.com" lives at
+    root["com"]["example"]["ads"].
+    """
+    _TERMINAL = ""
+
+    def __init__(self, domains: Iterable[str] = ()):
+        self._root: Dict[str, dict] = {}
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain: str):
+        labels = domain.strip().lower().strip(".").split(".")
+        if not labels or not labels[0]:
+            return
+        node = self._root
+        for label in reversed(labels):
+            if self._TERMINAL in node:
+                # a parent domain is already blocked, the subdomain is redundant
+                return
+            node = node.setdefault(label, {})
+        node.clear()  # every subdomain below is now covered
+        node[self._TERMINAL] = {}
+
+    def matches(self, host: str) -> bool:
+        node = self._root
+        for label in reversed(host.lower().rstrip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self._TERMINAL in node:
+                return True
+        return False
+
+    def __len__(self):
+        def count(node):
+            return 1 if self._TERMINAL in node else sum(count(child) for child in node.values())
+
+        return count(self._root)
+
+
+def load_blocklist_file(path: str) -> list:
+    """Read a blocklist with one domain per line. Hosts-file lines (`0.0.0.0 domain`) and # comments are accepted."""
+    domains = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            domains.append(line.split()[-1])
+    return domains
+
+
+class NetworkFilter:
+    """
+    Blocks requests on a Playwright context and counts what was saved.
+
+    Note that Playwright bypasses the HTTP cache for contexts with routes
+    installed, so the filter is only worth enabling with a blocking profile.
+    """
+
+    def __init__(
+            self,
+            profile: str = "balanced",
+            block_images: bool = False,
+            blocklist_file: Optional[str] = None,
+            extra_domains: Iterable[str] = (),
+    ):
+        if profile not in NETWORK_FILTER_PROFILES:
+            raise ValueError(f"Unknown network filter profile: {profile}")
+        self.profile = profile
+        self.blocked_types = set(NETWORK_FILTER_PROFILES[profile])
+        if block_images:
+            self.blocked_types.add("image")
+
+        self.domains = DomainSuffixTrie()
+        if profile in _DOMAIN_BLOCKING_PROFILES:
+            for domain in DEFAULT_BLOCKLIST:
+                self.domains.add(domain)
+            if blocklist_file:
+                for domain in load_blocklist_file(blocklist_file):
+                    self.domains.add(domain)
+        for domain in extra_domains:
+            self.domains.add(domain)
+
+        self._step_stats = self._empty_stats()
+        self._total_stats = self._empty_stats()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.blocked_types) or len(self.domains) > 0
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            "requests_seen": 0,
+            "requests_blocked": 0,
+            "estimated_bytes_saved": 0,
+            "blocked_by_type": {},
+            "blocked_by_domain": 0,
+            "filter_time": 0.0,
+        }
+
+    async def attach(self, context: PlaywrightBrowserContext):
+        """Install the interception route on a Playwright context"""
+        if not self.enabled:
+            return
+        await context.route("**/*", self._handle_route)
+        logger.debug(f"Network filter '{self.profile}' attached, blocking types "
+                     f"{sorted(self.blocked_types)} and {len(self.domains)} domains")
+
+    def should_block(self, url: str, resource_type: str, is_main_frame_navigation: bool = False) -> Optional[str]:
+        """Return the reason a request would be blocked, or None to let it through"""
+        if is_main_frame_navigation:
+            # never get in the way of a page the agent navigated to on purpose
+            return None
+        if resource_type in self.blocked_types:
+            return "type"
+        host = urlsplit(url).hostname
+        if host and self.domains.matches(host):
+            return "domain"
+        return None
+
+    async def _handle_route(self, route: Route):
+        start = time.perf_counter()
+        request = route.request
+        try:
+            is_main_frame_navigation = request.is_navigation_request() and request.frame.parent_frame is None
+        except Exception:
+            # frames of service workers are not available
+            is_main_frame_navigation = False
+        reason = self.should_block(request.url, request.resource_type, is_main_frame_navigation)
+        self._record(request.resource_type, reason, time.perf_counter() - start)
+
+        if reason is None:
+            await route.fallback()
+        else:
+            await route.abort("blockedbyclient")
+
+    def _record(self, resource_type: str, reason: Optional[str], elapsed: float):
+        for stats in (self._step_stats, self._total_stats):
+            stats["requests_seen"] += 1
+            stats["filter_time"] += elapsed
+            if reason is None:
+                continue
+            stats["requests_blocked"] += 1
+            stats["estimated_bytes_saved"] += _ESTIMATED_BYTES.get(resource_type, _DEFAULT_ESTIMATED_BYTES)
+            stats["blocked_by_type"][resource_type] = stats["blocked_by_type"].get(resource_type, 0) + 1
+            if reason == "domain":
+                stats["blocked_by_domain"] += 1
+
+    def take_step_stats(self) -> Dict:
+        """Return the counters since the previous call and start a new step, bytes saved are estimates"""
+        stats = self._step_stats
+        self._step_stats = self._empty_stats()
+        return stats
+
+    def get_total_stats(self) -> Dict:
+        return {**self._total_stats, "blocked_by_type": dict(self._total_stats["blocked_by_type"])}
+
+
+def block_images_for_vision(use_vision: bool) -> bool:
+    """
+    Resolve NETWORK_FILTER_BLOCK_IMAGES: "true" always blocks images, "auto"
+    blocks them only for agents running without vision.
+    """
+    mode = (os.getenv("NETWORK_FILTER_BLOCK_IMAGES") or "false").lower()
+    if mode not in ("false", "true", "auto"):
+        raise ValueError(f"Unknown NETWORK_FILTER_BLOCK_IMAGES value: {mode}")
+    return mode == "true" or (mode == "auto" and not use_vision)
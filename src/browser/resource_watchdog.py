@@ -0,0 +1,269 @@
+"""
+Resource watchdog for long-lived browsers.
+
+Heavy single page apps and video pages make Chromium grow without bound, and a
+browser kept open for days eventually takes the container down. The watchdog
+samples every registered browser: RSS and CPU of its process tree (process ids
+from CDP SystemInfo.getProcessInfo, usage from /proc) and, per context, the
+page count and JavaScript heap. Contexts past their thresholds are recycled by
+the agent between steps, browsers past theirs are replaced by the pool (or the
+webui) when they are handed back.
+"""
+import asyncio
+import logging
+import os
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    from .custom_browser import CustomBrowser
+    from .custom_context import CustomBrowserContext
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_MB = 1024 * 1024
+
+_JS_HEAP_SCRIPT = "() => (performance.memory ? performance.memory.usedJSHeapSize : 0)"
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Recycling thresholds, 0 disables a check.
+
+    max_browser_rss_mb: RSS of the whole browser process tree
+    max_browser_cpu_percent: CPU of the process tree averaged over one sample interval
+    max_context_heap_mb: JavaScript heap summed over the pages of a context
+    max_context_pages: open pages of a context
+    sample_interval: seconds a sample stays fresh, checks in between reuse it
+    """
+    max_browser_rss_mb: int = 3072
+    max_browser_cpu_percent: float = 0
+    max_context_heap_mb: int = 1024
+    max_context_pages: int = 20
+    sample_interval: float = 15.0
+
+    @classmethod
+    def from_env(cls) -> "ResourceLimits":
+        return cls(
+            max_browser_rss_mb=int(os.getenv("BROWSER_MAX_RSS_MB", "3072")),
+            max_browser_cpu_percent=float(os.getenv("BROWSER_MAX_CPU_PERCENT", "0")),
+            max_context_heap_mb=int(os.getenv("BROWSER_CONTEXT_MAX_HEAP_MB", "1024")),
+            max_context_pages=int(os.getenv("BROWSER_CONTEXT_MAX_PAGES", "20")),
+            sample_interval=float(os.getenv("BROWSER_WATCHDOG_INTERVAL", "15")),
+        )
+
+
+def resource_watchdog_enabled() -> bool:
+    return os.getenv("BROWSER_WATCHDOG_ENABLED", "true").lower() == "true"
+
+
+@dataclass
+class BrowserSample:
+    """One measurement of a browser and its contexts"""
+    timestamp: float = field(default_factory=time.time)
+    processes: int = 0
+    rss_bytes: Optional[int] = None
+    cpu_percent: Optional[float] = None
+    contexts: Dict[str, Dict] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        return {
+            "timestamp": self.timestamp,
+            "processes": self.processes,
+            "rss_mb": round(self.rss_bytes / _MB, 1) if self.rss_bytes is not None else None,
+            "cpu_percent": round(self.cpu_percent, 1) if self.cpu_percent is not None else None,
+            "contexts": self.contexts,
+        }
+
+
+def _read_rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _BrowserRecord:
+    def __init__(self):
+        self.cdp = None
+        self.last_sample: Optional[BrowserSample] = None
+        self.last_cpu_time: Optional[float] = None
+        self.last_cpu_wall: Optional[float] = None
+        self.context_recycles = 0
+        self.needs_recycle: Optional[str] = None
+        self.lock = asyncio.Lock()
+
+
+class ResourceWatchdog:
+    def __init__(self, limits: Optional[ResourceLimits] = None):
+        self.limits = limits or ResourceLimits.from_env()
+        self._browsers: "weakref.WeakKeyDictionary[CustomBrowser, _BrowserRecord]" = weakref.WeakKeyDictionary()
+        self._contexts: "weakref.WeakSet[CustomBrowserContext]" = weakref.WeakSet()
+        self._browsers_recycled = 0
+
+    def register_context(self, browser_context: "CustomBrowserContext"):
+        self._contexts.add(browser_context)
+        self._record(browser_context.browser)
+
+    def _record(self, browser: "CustomBrowser") -> _BrowserRecord:
+        record = self._browsers.get(browser)
+        if record is None:
+            record = self._browsers[browser] = _BrowserRecord()
+        return record
+
+    @staticmethod
+    def _is_local(browser: "CustomBrowser") -> bool:
+        # process ids of a browser reached over a CDP/WSS url belong to another host
+        return not (browser.config.cdp_url or browser.config.wss_url)
+
+    async def sample(self, browser: "CustomBrowser", force: bool = False) -> Optional[BrowserSample]:
+        """
+        Measure a browser, reusing the previous sample while it is fresh.
+
+        Args:
+            browser: The browser to measure
+            force: Ignore the sample interval
+
+        Returns:
+            Optional[BrowserSample]: The sample, None when the browser is not running
+        """
+        record = self._record(browser)
+        async with record.lock:
+            if not force and record.last_sample is not None \
+                    and time.time() - record.last_sample.timestamp < self.limits.sample_interval:
+                return record.last_sample
+            playwright_browser = browser.playwright_browser
+            if playwright_browser is None or not playwright_browser.is_connected():
+                return None
+
+            sample = BrowserSample()
+            if self._is_local(browser):
+                await self._sample_processes(playwright_browser, record, sample)
+            for browser_context in list(self._contexts):
+                if browser_context.browser is browser and browser_context.session is not None:
+                    sample.contexts[browser_context.context_id] = await self._sample_context(browser_context)
+            record.last_sample = sample
+            return sample
+
+    async def _sample_processes(self, playwright_browser, record: _BrowserRecord, sample: BrowserSample):
+        try:
+            if record.cdp is None:
+                record.cdp = await playwright_browser.new_browser_cdp_session()
+            info = await record.cdp.send("SystemInfo.getProcessInfo")
+        except Exception as e:
+            # not Chromium, or the browser is going away
+            logger.debug(f"Failed to read browser process info: {e}")
+            record.cdp = None
+            return
+
+        processes = info.get("processInfo", [])
+        sample.processes = len(processes)
+        rss = [_read_rss(process["id"]) for process in processes]
+        if any(value is not None for value in rss):
+            sample.rss_bytes = sum(value for value in rss if value is not None)
+
+        cpu_time = sum(process.get("cpuTime", 0.0) for process in processes)
+        now = time.monotonic()
+        if record.last_cpu_time is not None and now > record.last_cpu_wall:
+            # processes that exited since the last sample take their CPU time with them
+            delta = max(0.0, cpu_time - record.last_cpu_time)
+            sample.cpu_percent = 100.0 * delta / (now - record.last_cpu_wall)
+        record.last_cpu_time, record.last_cpu_wall = cpu_time, now
+
+    @staticmethod
+    async def _sample_context(browser_context: "CustomBrowserContext") -> Dict:
+        pages = browser_context.session.context.pages
+        heap = 0
+        for page in pages:
+            try:
+                heap += await asyncio.wait_for(page.evaluate(_JS_HEAP_SCRIPT), timeout=2)
+            except Exception:
+                # a busy or crashed page, its heap is unknown
+                continue
+        return {"pages": len(pages), "js_heap_mb": round(heap / _MB, 1)}
+
+    async def check_context(self, browser_context: "CustomBrowserContext") -> Optional[str]:
+        """
+        Decide whether a context should be recycled before its next step.
+
+        Returns:
+            Optional[str]: Why the context should be recycled, None when it is fine
+        """
+        sample = await self.sample(browser_context.browser)
+        if sample is None:
+            return None
+        record = self._record(browser_context.browser)
+        browser_reason = self._browser_over_limit(sample)
+        if browser_reason:
+            # fresh contexts hand their renderer memory back right away, the
+            # browser itself is replaced when it is released
+            record.needs_recycle = browser_reason
+        context_sample = sample.contexts.get(browser_context.context_id)
+        if context_sample is None:
+            return browser_reason
+
+        limits = self.limits
+        if limits.max_context_pages and context_sample["pages"] > limits.max_context_pages:
+            return f"{context_sample['pages']} pages open (limit {limits.max_context_pages})"
+        if limits.max_context_heap_mb and context_sample["js_heap_mb"] > limits.max_context_heap_mb:
+            return f"JS heap {context_sample['js_heap_mb']:.0f} MB (limit {limits.max_context_heap_mb} MB)"
+        return browser_reason
+
+    async def check_browser(self, browser: "CustomBrowser") -> Optional[str]:
+        """Return why a browser should be relaunched, None when it is fine"""
+        record = self._record(browser)
+        if record.needs_recycle:
+            return record.needs_recycle
+        sample = await self.sample(browser)
+        return self._browser_over_limit(sample) if sample else None
+
+    def _browser_over_limit(self, sample: BrowserSample) -> Optional[str]:
+        limits = self.limits
+        if limits.max_browser_rss_mb and sample.rss_bytes is not None \
+                and sample.rss_bytes > limits.max_browser_rss_mb * _MB:
+            return f"RSS {sample.rss_bytes / _MB:.0f} MB (limit {limits.max_browser_rss_mb} MB)"
+        if limits.max_browser_cpu_percent and sample.cpu_percent is not None \
+                and sample.cpu_percent > limits.max_browser_cpu_percent:
+            return f"CPU {sample.cpu_percent:.0f}% (limit {limits.max_browser_cpu_percent:.0f}%)"
+        return None
+
+    def record_context_recycle(self, browser_context: "CustomBrowserContext"):
+        self._record(browser_context.browser).context_recycles += 1
+
+    def record_browser_recycle(self, browser: "CustomBrowser"):
+        self._browsers.pop(browser, None)
+        self._browsers_recycled += 1
+
+    def get_metrics(self) -> Dict:
+        """Latest sample of every tracked browser"""
+        browsers = []
+        for browser, record in list(self._browsers.items()):
+            browsers.append({
+                "browser_id": id(browser),
+                "headless": browser.config.headless,
+                "sample": record.last_sample.to_dict() if record.last_sample else None,
+                "context_recycles": record.context_recycles,
+                "pending_recycle": record.needs_recycle,
+            })
+        return {
+            "enabled": resource_watchdog_enabled(),
+            "limits": self.limits.__dict__,
+            "browsers_recycled": self._browsers_recycled,
+            "browsers": browsers,
+        }
+
+
+_watchdog: Optional[ResourceWatchdog] = None
+
+
+def get_resource_watchdog() -> ResourceWatchdog:
+    """The process wide watchdog, samples are plain data and can be read from any event loop"""
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = ResourceWatchdog()
+    return _watchdog
@@ -0,0 +1,299 @@
+"""
+Live view of a browser context built on the CDP screencast.
+
+Chromium only emits a screencast frame when the page actually repainted, and it
+waits for every frame to be acknowledged before producing the next one. The
+source delays that acknowledgement to cap the frame rate and stops
+acknowledging while nobody watches, so an idle live view costs nothing and
+never competes with the agent for the page.
+
+Frames are fanned out to subscribers that may live on other event loops (the
+webui and the API server run on separate loops). Each subscriber only keeps the
+latest frame, slow consumers skip frames instead of queueing them.
+"""
+import asyncio
+import base64
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from playwright.async_api import CDPSession, Page
+
+if TYPE_CHECKING:
+    from .custom_context import CustomBrowserContext
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScreencastFrame:
+    """A JPEG frame of the screencast, kept base64 encoded as delivered by CDP"""
+    data: str
+    seq: int
+    timestamp: float
+    width: int
+    height: int
+
+    @property
+    def jpeg(self) -> bytes:
+        return base64.b64decode(self.data)
+
+
+class ScreencastSubscription:
+    """Latest-frame mailbox of one consumer, read it from the loop that created it"""
+
+    def __init__(self, source: "ScreencastSource"):
+        self.source = source
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.closed = False
+
+    def _offer(self, frame: Optional[ScreencastFrame]):
+        # runs on the subscriber loop, None signals the end of the stream
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(frame)
+
+    def push(self, frame: Optional[ScreencastFrame]):
+        if self._loop.is_closed():
+            self.closed = True
+            return
+        self._loop.call_soon_threadsafe(self._offer, frame)
+
+    async def next_frame(self, timeout: Optional[float] = None) -> Optional[ScreencastFrame]:
+        """
+        Wait for the next frame.
+
+        Args:
+            timeout: Seconds to wait, None waits until a frame arrives
+
+        Returns:
+            Optional[ScreencastFrame]: The frame, or None on timeout or when the screencast stopped
+        """
+        if self.closed:
+            return None
+        try:
+            frame = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if frame is None:
+            self.closed = True
+        return frame
+
+    def close(self):
+        self.source.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ScreencastFrame:
+        frame = await self.next_frame()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+
+class ScreencastSource:
+    """
+    Screencast of the current page of a browser context.
+
+    max_fps: upper bound of frames per second, enforced by delaying the frame ack
+    quality: JPEG quality 0-100
+    max_width, max_height: frames are scaled down to fit, the defaults come
+        from SCREENCAST_MAX_WIDTH / SCREENCAST_MAX_HEIGHT
+    """
+    # how often to check whether the agent switched tabs
+    PAGE_CHECK_INTERVAL = 1.0
+
+    def __init__(
+            self,
+            browser_context: "CustomBrowserContext",
+            max_fps: Optional[float] = None,
+            quality: Optional[int] = None,
+            max_width: Optional[int] = None,
+            max_height: Optional[int] = None,
+    ):
+        self.browser_context = browser_context
+        self.max_fps = max_fps or float(os.getenv("SCREENCAST_MAX_FPS", "5"))
+        self.quality = quality or int(os.getenv("SCREENCAST_QUALITY", "60"))
+        self.max_width = max_width or int(os.getenv("SCREENCAST_MAX_WIDTH", "1280"))
+        self.max_height = max_height or int(os.getenv("SCREENCAST_MAX_HEIGHT", "1100"))
+
+        self.latest_frame: Optional[ScreencastFrame] = None
+        self._subscribers: List[ScreencastSubscription] = []
+        self._page: Optional[Page] = None
+        self._cdp: Optional[CDPSession] = None
+        self._pending_ack: Optional[int] = None
+        self._last_ack = 0.0
+        self._ack_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = 0
+        self._stats = {"frames": 0, "frames_acked": 0, "page_switches": 0}
+        self.running = False
+
+    @property
+    def context_id(self) -> str:
+        return self.browser_context.context_id
+
+    async def start(self):
+        """Start streaming the current page. Safe to call repeatedly."""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        page = await self.browser_context.get_current_page()
+        await self._attach(page)
+        self.running = True
+        self._watch_task = asyncio.create_task(self._follow_current_page())
+        logger.debug(f"Screencast started for context {self.context_id}")
+
+    async def stop(self):
+        """Stop the screencast and end every subscription"""
+        if not self.running:
+            return
+        self.running = False
+        for task in (self._watch_task, self._ack_task):
+            if task:
+                task.cancel()
+        self._watch_task = self._ack_task = None
+        await self._detach()
+        for subscription in list(self._subscribers):
+            subscription.push(None)
+        self._subscribers.clear()
+        logger.debug(f"Screencast stopped for context {self.context_id}")
+
+    async def _attach(self, page: Page):
+        cdp = await page.context.new_cdp_session(page)
+        cdp.on("Page.screencastFrame", self._on_frame)
+        await cdp.send("Page.startScreencast", {
+            "format": "jpeg",
+            "quality": self.quality,
+            "maxWidth": self.max_width,
+            "maxHeight": self.max_height,
+        })
+        self._page, self._cdp = page, cdp
+        self._pending_ack = None
+
+    async def _detach(self):
+        cdp, self._cdp, self._page = self._cdp, None, None
+        self._pending_ack = None
+        if cdp is None:
+            return
+        try:
+            await cdp.send("Page.stopScreencast")
+            await cdp.detach()
+        except Exception as e:
+            # the page is usually already gone
+            logger.debug(f"Failed to stop screencast: {e}")
+
+    async def _follow_current_page(self):
+        while self.running:
+            await asyncio.sleep(self.PAGE_CHECK_INTERVAL)
+            try:
+                page = await self.browser_context.get_current_page()
+                if page is self._page and not page.is_closed():
+                    continue
+                await self._detach()
+                await self._attach(page)
+                self._stats["page_switches"] += 1
+            except Exception as e:
+                logger.debug(f"Screencast could not follow the current page: {e}")
+
+    def _on_frame(self, params: dict):
+        cdp = self._cdp
+        if cdp is None:
+            return
+        self._seq += 1
+        self._stats["frames"] += 1
+        metadata = params.get("metadata", {})
+        frame = ScreencastFrame(
+            data=params["data"],
+            seq=self._seq,
+            timestamp=metadata.get("timestamp", time.time()),
+            width=int(metadata.get("deviceWidth", 0)),
+            height=int(metadata.get("deviceHeight", 0)),
+        )
+        self.latest_frame = frame
+        for subscription in list(self._subscribers):
+            subscription.push(frame)
+
+        self._pending_ack = params["sessionId"]
+        if self._subscribers:
+            self._schedule_ack()
+
+    def _schedule_ack(self):
+        # Chromium sends nothing new until the previous frame is acked, the
+        # delay is what caps the frame rate
+        if self._ack_task and not self._ack_task.done():
+            return
+        delay = max(0.0, 1.0 / self.max_fps - (time.monotonic() - self._last_ack))
+        self._ack_task = asyncio.create_task(self._ack_after(delay))
+
+    async def _ack_after(self, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        session_id, cdp = self._pending_ack, self._cdp
+        if session_id is None or cdp is None:
+            return
+        self._pending_ack = None
+        self._last_ack = time.monotonic()
+        try:
+            await cdp.send("Page.screencastFrameAck", {"sessionId": session_id})
+            self._stats["frames_acked"] += 1
+        except Exception as e:
+            logger.debug(f"Failed to ack screencast frame: {e}")
+
+    def subscribe(self) -> ScreencastSubscription:
+        """
+        Subscribe from any event loop. The latest frame is delivered right away
+        so a new viewer does not wait for the next repaint.
+        """
+        subscription = ScreencastSubscription(self)
+        self._subscribers.append(subscription)
+        if self.latest_frame is not None:
+            subscription.push(self.latest_frame)
+        if self._loop is not None and not self._loop.is_closed():
+            # resume a screencast that stalled while nobody was watching
+            self._loop.call_soon_threadsafe(self._resume)
+        return subscription
+
+    def _resume(self):
+        if self._pending_ack is not None and self._subscribers:
+            self._schedule_ack()
+
+    def unsubscribe(self, subscription: ScreencastSubscription):
+        subscription.closed = True
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def get_stats(self) -> Dict:
+        return {
+            "context_id": self.context_id,
+            "running": self.running,
+            "subscribers": len(self._subscribers),
+            "max_fps": self.max_fps,
+            "page_url": self._page.url if self._page else None,
+            **self._stats,
+        }
+
+
+# Screencasts by browser context id, shared across event loops
+_screencasts: Dict[str, ScreencastSource] = {}
+
+
+def register_screencast(source: ScreencastSource):
+    _screencasts[source.context_id] = source
+
+
+def unregister_screencast(context_id: str):
+    _screencasts.pop(context_id, None)
+
+
+def get_screencast(context_id: str) -> Optional[ScreencastSource]:
+    return _screencasts.get(context_id)
+
+
+def list_screencasts() -> List[Dict]:
+    return [source.get_stats() for source in list(_screencasts.values())]
@@ -6,7 +6,7 @@ Coordinates between the agent, browser, and API.
 import logging
 from src.agent import Agent
 from src.browser import Browser
-from src.sandbox import Sandbox
+from src.sandbox import DEFAULT_SANDBOX_KEY, Sandbox, get_sandbox_manager
 from src.utils import utils
 
 logger = logging.getLogger(__name__)
@@ -16,8 +16,24 @@ class Controller:
         """Initialize the controller with agent and browser instances."""
         self.agent = Agent()
         self.browser = Browser()
-        self.sandbox = Sandbox()
         self.config = utils.ConfigManager()
+
+    @property
+    def sandbox(self) -> Sandbox:
+        """The shared default sandbox."""
+        return get_sandbox_manager().get(DEFAULT_SANDBOX_KEY)
+
+    def get_sandbox(self, client_id=None) -> Sandbox:
+        """
+        Get the sandbox of a client.
+        
+        Args:
+            client_id (str, optional): Client or run id, None for the shared default sandbox
+            
+        Returns:
+            Sandbox: The client's sandbox
+        """
+        return get_sandbox_manager().get(client_id)
         
     def run_task(self, task, additional_info=None):
         """
@@ -74,7 +90,7 @@ class Controller:
         return {
             "agent_status": self.agent.get_status(),
             "browser_status": self.browser.is_running(),
-            "sandbox_status": self.sandbox.is_running() if hasattr(self, "sandbox") else False,
+            "sandbox_status": self.sandbox.is_running(),
         }
         
     def run_research(self, task, settings=None):
@@ -84,19 +100,124 @@ class Controller:
         
         return deep_research(task, settings or {})
         
-    def execute_sandbox_command(self, command, timeout=None):
+    def execute_sandbox_command(self, command, timeout=None, client_id=None):
         """
         Execute a command in the sandbox.
         
         Args:
             command (str): The command to execute
             timeout (int, optional): Timeout in seconds
+            client_id (str, optional): Client or run whose sandbox runs the command
             
         Returns:
             dict: Result of the command execution
         """
-        if not self.sandbox.is_running():
-            self.sandbox.start()
+        sandbox = self.get_sandbox(client_id)
+        if not sandbox.is_running():
+            sandbox.start()
+            
+        return sandbox.execute_command(command, timeout)
+
+    async def execute_sandbox_command_async(self, command, timeout=None, session_id=None, client_id=None):
+        """
+        Execute a command in the sandbox without blocking the event loop.
+        
+        Args:
+            command (str): The command to execute
+            timeout (int, optional): Timeout in seconds
+            session_id (str, optional): Persistent shell session to run the command in
+            client_id (str, optional): Client or run whose sandbox runs the command
+            
+        Returns:
+            dict: Result of the command execution
+        """
+        sandbox = self.get_sandbox(client_id)
+        if not sandbox.is_running():
+            sandbox.start()
+            
+        return await sandbox.execute_command_async(command, timeout, session_id)
+
+    async def execute_sandbox_dag(self, nodes, max_parallel=None, cancel_on_failure=False, client_id=None):
+        """
+        Run a batch of commands with dependencies in the sandbox.
+        
+        Args:
+            nodes (list): Commands as {"id", "command", "depends_on", "timeout", "session_id"}
+            max_parallel (int, optional): Commands running at once
+            cancel_on_failure (bool): Cancel the whole batch at the first failure
+            client_id (str, optional): Client or run whose sandbox runs the commands
+            
+        Returns:
+            dict: Per command results and timings
+        """
+        sandbox = self.get_sandbox(client_id)
+        if not sandbox.is_running():
+            sandbox.start()
+            
+        return await sandbox.execute_dag(nodes, max_parallel, cancel_on_failure)
+
+    def start_sandbox_process(self, command, name=None, port=None, ready=None, ready_timeout=30.0, client_id=None):
+        """
+        Start a long running process in the sandbox, returning once it is ready.
+        
+        Args:
+            command (str): The command to run, `{port}` is replaced with the process port
+            name (str, optional): Name to refer to the process by
+            port (int, optional): Port of the process, 0 to allocate one
+            ready (dict, optional): Readiness probe, {"port": true} and/or {"log": regex}
+            ready_timeout (float): Seconds to wait for the probe
+            client_id (str, optional): Client or run whose sandbox runs the process
+            
+        Returns:
+            dict: The process id, pid, port and readiness
+        """
+        sandbox = self.get_sandbox(client_id)
+        if not sandbox.is_running():
+            sandbox.start()
             
-        return self.sandbox.execute_command(command, timeout)
+        return sandbox.start_process(command, name, port, ready, ready_timeout)
 
+    def snapshot_sandbox(self, name=None, client_id=None):
+        """
+        Snapshot the working directory of a sandbox.
+        
+        Args:
+            name (str, optional): Label of the snapshot
+            client_id (str, optional): Client or run whose sandbox is snapshotted
+            
+        Returns:
+            dict: The snapshot id and what was recorded
+        """
+        return self.get_sandbox(client_id).create_snapshot(name)
+
+    def restore_sandbox_snapshot(self, snapshot_id, client_id=None):
+        """
+        Reset the working directory of a sandbox to a snapshot.
+        
+        Args:
+            snapshot_id (str): The snapshot to restore
+            client_id (str, optional): Client or run whose sandbox is reset
+            
+        Returns:
+            dict: Files restored and removed
+        """
+        return self.get_sandbox(client_id).restore_snapshot(snapshot_id)
+
+    def stream_sandbox_command(self, command, timeout=None, session_id=None, client_id=None):
+        """
+        Execute a command in the sandbox, streaming its output.
+        
+        Args:
+            command (str): The command to execute
+            timeout (int, optional): Timeout in seconds
+            session_id (str, optional): Persistent shell session to run the command in
+            client_id (str, optional): Client or run whose sandbox runs the command
+            
+        Returns:
+            AsyncIterator[dict]: stdout/stderr events followed by an exit event
+        """
+        sandbox = self.get_sandbox(client_id)
+        if not sandbox.is_running():
+            sandbox.start()
+            
+        return sandbox.stream_command(command, timeout, session_id)
@@ -2,19 +2,53 @@
 """
 Sandbox module for executing shell commands in a safe environment.
 """
+import asyncio
+import contextlib
 import logging
 import os
+import shutil
+import signal
 import subprocess
 import tempfile
+import threading
 import shlex
+import time
 import uuid
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from .background import BackgroundProcesses, tail_file
+from .command_dag import run_dag, validate_dag
+from .executor import AsyncCommandExecutor, get_command_executor
+from .fs_index import EXCLUDED, FileIndex
+from .file_transfer import PathOutsideSandbox, file_info, iter_range, read_range, resolve_path, write_stream
+from .limits import CommandLimits, read_command_stats, wrap_command
+from .package_cache import CacheUsage, get_package_cache
+from .output_capture import CommandOutput, drain_pipe, read_output_range
+from .python_kernel import PythonKernel, count_kernels, discard_kernels, get_kernel_pool
+from .shell_session import ShellSession, count_shell_sessions, discard_shell_sessions, get_shell_session_pool
+from .snapshots import SnapshotStore
 
 logger = logging.getLogger(__name__)
 
+# Seconds a measured disk usage is trusted before the directory is walked again
+_DISK_USAGE_TTL = 5.0
+
+
+def _change_reports_enabled() -> bool:
+    return os.environ.get("SANDBOX_CHANGE_REPORTS", "true").lower() == "true"
+
+
+def _list_page_size() -> int:
+    return int(os.environ.get("SANDBOX_LIST_PAGE_SIZE", "1000"))
+
 class Sandbox:
-    def __init__(self):
-        """Initialize the sandbox environment."""
+    def __init__(self, disk_quota_mb: Optional[int] = None):
+        """
+        Initialize the sandbox environment.
+        
+        Args:
+            disk_quota_mb: Largest size of the working directory, commands are refused above it (0 for no limit)
+        """
         self._running = False
         # Load environment variables from .env file if present
         from dotenv import load_dotenv
@@ -25,6 +59,21 @@ class Sandbox:
         self.sandbox_timeout = int(os.environ.get("SANDBOX_TIMEOUT", "300"))
         self.session_id = str(uuid.uuid4())
         self.working_directory = os.path.join(tempfile.gettempdir(), f"ai-sandbox-{self.session_id}")
+        self.snapshot_directory = os.path.join(tempfile.gettempdir(), f"ai-sandbox-snapshots-{self.session_id}")
+        self.snapshots = SnapshotStore(self.snapshot_directory, self.working_directory)
+        self.package_cache = get_package_cache()
+        self.package_stats: Dict[str, int] = {}
+        self.background = BackgroundProcesses()
+        # size and mtime of every file, for change reports and listings
+        self.file_index = FileIndex(self.working_directory)
+        self.change_reports = _change_reports_enabled()
+        if disk_quota_mb is None:
+            disk_quota_mb = int(os.environ.get("SANDBOX_DISK_QUOTA_MB", "0"))
+        self.disk_quota_mb = disk_quota_mb
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.active_operations = 0
+        self._disk_usage = (0.0, 0)
         
         if not os.path.exists(self.working_directory) and self.sandbox_enabled:
             os.makedirs(self.working_directory, exist_ok=True)
@@ -57,6 +106,67 @@ class Sandbox:
             return True
         return False
     
+    @contextlib.contextmanager
+    def _in_use(self):
+        # keeps the sandbox manager from evicting a sandbox while it runs something
+        self.active_operations += 1
+        self.last_used = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active_operations -= 1
+            self.last_used = time.monotonic()
+
+    def is_busy(self) -> bool:
+        """Whether the sandbox runs a command, a background process, a shell session or a kernel"""
+        return bool(self.active_operations or self.background.running_count()
+                    or count_shell_sessions(self.session_id) or count_kernels(self.session_id))
+
+    def disk_usage(self, refresh: bool = False) -> int:
+        """
+        Get the size of the working directory.
+        
+        Args:
+            refresh: Walk the directory even if the last measurement is recent
+            
+        Returns:
+            int: Size in bytes
+        """
+        measured_at, size = self._disk_usage
+        if not refresh and time.monotonic() - measured_at < _DISK_USAGE_TTL:
+            return size
+        size = 0
+        for root, _, files in os.walk(self.working_directory):
+            for name in files:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    continue
+        self._disk_usage = (time.monotonic(), size)
+        return size
+
+    def _quota_error(self) -> Optional[str]:
+        if self.disk_quota_mb and self.disk_usage() > self.disk_quota_mb * 1024 * 1024:
+            return f"Sandbox disk quota of {self.disk_quota_mb} MB exceeded, delete files to continue"
+        return None
+
+    def close(self):
+        """Stop the sandbox, end its shell sessions and kernels and delete its working directory."""
+        self.stop()
+        self.background.stop_all()
+        discarded = discard_shell_sessions(self.session_id) + discard_kernels(self.session_id)
+        if discarded:
+            logger.info(f"Killed {discarded} shell session(s) and kernel(s) of sandbox {self.session_id}")
+        self.snapshots.close()
+        self.file_index.close()
+        if self.package_cache is not None:
+            try:
+                self.package_cache.promote(self.working_directory)
+            except OSError as e:
+                logger.error(f"Failed to promote packages of sandbox {self.session_id}: {e}")
+        shutil.rmtree(self.working_directory, ignore_errors=True)
+        logger.info(f"Removed sandbox working directory: {self.working_directory}")
+
     def execute_command(self, command: str, timeout: Optional[int] = None) -> Dict:
         """
         Execute a shell command in the sandbox environment.
@@ -81,40 +191,82 @@ class Sandbox:
                 
         if not timeout:
             timeout = self.sandbox_timeout
+        
+        quota_error = self._quota_error()
+        if quota_error:
+            return {
+                "success": False,
+                "stdout": "",
+                "stderr": quota_error,
+                "exit_code": 1
+            }
             
+        stats_path = None
         try:
-            # Use subprocess.run with safe arguments
+            # Use subprocess with safe arguments
             args = shlex.split(command)
             logger.info(f"Executing command in sandbox: {command}")
             
-            env = os.environ.copy()
-            env["SANDBOX_SESSION_ID"] = self.session_id
+            env = self._command_env()
+            # limits and accounting go through the launcher, see limits.py
+            args, env, stats_path = wrap_command(args, env, get_command_executor().limits)
             
-            result = subprocess.run(
-                args,
-                capture_output=True,
-                text=True,
-                cwd=self.working_directory,
-                timeout=timeout,
-                env=env,
-                shell=False
-            )
+            usage, observers = self._package_usage(command)
+            output = CommandOutput(self.working_directory, observers=observers)
+            self._start_change_report()
+            with self._in_use():
+                process = subprocess.Popen(
+                    args,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    cwd=self.working_directory,
+                    env=env,
+                    shell=False,
+                    start_new_session=True
+                )
+                # read both pipes as the command writes, only head and tail stay in memory
+                readers = [
+                    threading.Thread(target=drain_pipe, args=(process.stdout, output.streams["stdout"]), daemon=True),
+                    threading.Thread(target=drain_pipe, args=(process.stderr, output.streams["stderr"]), daemon=True),
+                ]
+                for reader in readers:
+                    reader.start()
+                # a child left in the background keeps the pipes open after the command exits,
+                # the readers are held to the same deadline
+                deadline = time.monotonic() + timeout
+                timed_out = False
+                try:
+                    process.wait(timeout=timeout)
+                    for reader in readers:
+                        reader.join(max(0.0, deadline - time.monotonic()))
+                    timed_out = any(reader.is_alive() for reader in readers)
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                if timed_out:
+                    # take down everything the command started, not just the direct child
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    process.wait()
+                    # a process that left the group can still hold the pipes, do not wait for it
+                    for reader in readers:
+                        reader.join(1.0)
+                output.close()
             
+            if timed_out:
+                output.write("stderr", f"\nCommand timed out after {timeout} seconds")
             return {
-                "success": result.returncode == 0,
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-                "exit_code": result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "stdout": "",
-                "stderr": f"Command timed out after {timeout} seconds",
-                "exit_code": 124
+                "success": not timed_out and process.returncode == 0,
+                **output.result(),
+                "exit_code": 124 if timed_out else process.returncode,
+                "resources": read_command_stats(stats_path),
+                **self._record_package_usage(usage),
+                **self._change_report()
             }
         except Exception as e:
             logger.error(f"Error executing command: {e}")
+            read_command_stats(stats_path)
             return {
                 "success": False,
                 "stdout": "",
@@ -122,17 +274,413 @@ class Sandbox:
                 "exit_code": 1
             }
     
-    def create_file(self, file_path: str, content: str) -> Dict:
+    def _start_change_report(self):
+        # changes made between commands (uploads, snapshots) are not the next command's,
+        # unless another command is running and has yet to report them
+        if self.change_reports and not self.active_operations:
+            try:
+                self.file_index.reset()
+            except OSError as e:
+                logger.error(f"Error indexing sandbox files: {e}")
+
+    def _change_report(self) -> Dict:
+        if not self.change_reports:
+            return {}
+        try:
+            return {"changes": self.file_index.report()}
+        except OSError as e:
+            logger.error(f"Error indexing sandbox files: {e}")
+            return {}
+
+    def _command_env(self) -> Dict[str, str]:
+        env = os.environ.copy()
+        env["SANDBOX_SESSION_ID"] = self.session_id
+        if self.package_cache is not None:
+            env.update(self.package_cache.env(self.working_directory))
+        return env
+
+    def _package_usage(self, command: str) -> Tuple[Optional[CacheUsage], Optional[Dict]]:
+        # counts package cache hits in the output of pip and npm commands
+        usage = self.package_cache.usage_for(command) if self.package_cache is not None else None
+        if usage is None:
+            return None, None
+        return usage, {"stdout": usage.feeder("stdout"), "stderr": usage.feeder("stderr")}
+
+    def _record_package_usage(self, usage: Optional[CacheUsage]) -> Dict:
+        if usage is None:
+            return {}
+        counts = usage.finish()
+        self.package_cache.record(counts)
+        for key, value in counts.items():
+            self.package_stats[key] = self.package_stats.get(key, 0) + value
+        return {"package_cache": counts}
+
+    async def stream_command(self, command: str, timeout: Optional[int] = None,
+                             session_id: Optional[str] = None) -> AsyncIterator[Dict]:
         """
-        Create a file in the sandbox environment.
+        Execute a shell command without blocking the event loop, yielding its output as it arrives.
         
         Args:
-            file_path: The path to the file
-            content: The content of the file
+            command: The command to execute
+            timeout: Timeout in seconds (defaults to sandbox_timeout)
+            session_id: Run in this persistent shell session, keeping cwd and env between commands
+            
+        Yields:
+            dict: stdout/stderr events, then an exit event with the exit code
+        """
+        if not self.is_running():
+            if self.sandbox_enabled:
+                self.start()
+            else:
+                yield {"type": "stderr", "data": "Sandbox is not enabled. Set ENABLE_SANDBOX=true in .env"}
+                yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+                return
+        
+        quota_error = self._quota_error()
+        if quota_error:
+            yield {"type": "stderr", "data": quota_error}
+            yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+            return
+        
+        if session_id:
+            try:
+                session = await get_shell_session_pool().acquire(
+                    self.session_id, session_id, self.working_directory, self._command_env())
+            except RuntimeError as e:
+                yield {"type": "stderr", "data": str(e)}
+                yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+                return
+            logger.info(f"Executing command in shell session {session_id}: {command}")
+            with self._in_use():
+                async for event in session.stream(command, timeout or self.sandbox_timeout):
+                    yield event
+            return
+        
+        try:
+            args = shlex.split(command)
+        except ValueError as e:
+            yield {"type": "stderr", "data": str(e)}
+            yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+            return
+        if not args:
+            yield {"type": "stderr", "data": "Command is empty"}
+            yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+            return
+            
+        logger.info(f"Executing command in sandbox: {command}")
+        try:
+            with self._in_use():
+                async for event in get_command_executor().stream(
+                        args, self.working_directory, self._command_env(), timeout or self.sandbox_timeout):
+                    yield event
+        except OSError as e:
+            # command not found, working directory missing
+            logger.error(f"Error executing command: {e}")
+            yield {"type": "stderr", "data": str(e)}
+            yield {"type": "exit", "exit_code": 127 if isinstance(e, FileNotFoundError) else 1,
+                   "timed_out": False, "duration": 0.0}
+
+    async def execute_command_async(self, command: str, timeout: Optional[int] = None,
+                                    session_id: Optional[str] = None) -> Dict:
+        """
+        Execute a shell command without blocking the event loop.
+        
+        Args:
+            command: The command to execute
+            timeout: Timeout in seconds (defaults to sandbox_timeout)
+            session_id: Run in this persistent shell session, keeping cwd and env between commands
+            
+        Returns:
+            dict: Result containing stdout, stderr, exit code and duration
+        """
+        usage, observers = self._package_usage(command)
+        output = CommandOutput(self.working_directory, observers=observers)
+        exit_event: Dict = {}
+        await asyncio.to_thread(self._start_change_report)
+        try:
+            async for event in self.stream_command(command, timeout, session_id):
+                if event["type"] in ("stdout", "stderr"):
+                    output.write(event["type"], event["data"])
+                else:
+                    exit_event = event
+        finally:
+            output.close()
+        return {
+            "success": exit_event.get("exit_code") == 0,
+            **output.result(),
+            "exit_code": exit_event.get("exit_code", 1),
+            "duration": exit_event.get("duration", 0.0),
+            "resources": exit_event.get("resources"),
+            **self._record_package_usage(usage),
+            **await asyncio.to_thread(self._change_report),
+            **({"session_id": session_id, "cwd": exit_event.get("cwd")} if session_id else {}),
+        }
+
+    def read_output(self, output_id: str, stream: str = "stdout", offset: int = 0, length: int = 65536) -> Dict:
+        """
+        Read part of the full output of a command whose result was truncated.
+
+        Args:
+            output_id: The output_id of the command result
+            stream: "stdout" or "stderr"
+            offset: First byte to read, negative counts from the end
+            length: Number of bytes to read
+
+        Returns:
+            dict: The data, its offset and length, the total size and whether the end was reached
+        """
+        return read_output_range(self.working_directory, output_id, stream, offset, length)
+
+    async def execute_dag(self, nodes: List[Dict], max_parallel: Optional[int] = None,
+                          cancel_on_failure: bool = False) -> Dict:
+        """
+        Run a batch of commands with dependencies, independent commands concurrently.
+        
+        Args:
+            nodes: Commands as {"id", "command", "depends_on": [ids], "timeout", "session_id"}
+            max_parallel: Commands running at once (defaults to SANDBOX_DAG_MAX_PARALLEL)
+            cancel_on_failure: Cancel the whole batch at the first failure instead of only skipping dependents
+            
+        Returns:
+            dict: Overall success and per command results with status (succeeded, failed, skipped,
+                cancelled), start and finish offsets and duration
+        """
+        try:
+            validate_dag(nodes)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        logger.info(f"Executing batch of {len(nodes)} commands in sandbox")
+        
+        async def run_node(node: Dict) -> Dict:
+            timeout = int(node["timeout"]) if node.get("timeout") else None
+            return await self.execute_command_async(node["command"], timeout, node.get("session_id"))
+            
+        with self._in_use():
+            return await run_dag(nodes, run_node, max_parallel, cancel_on_failure)
+
+    def start_process(self, command: str, name: Optional[str] = None, port: Optional[int] = None,
+                      ready: Optional[Dict] = None, ready_timeout: float = 30.0) -> Dict:
+        """
+        Start a long running process (dev server, database) without waiting for it to exit.
+        
+        Args:
+            command: The command to run, `{port}` is replaced with the process port
+            name: Name to refer to the process by
+            port: Port of the process, 0 to allocate a free one; passed as $PORT
+            ready: Readiness probe, {"port": true} for the process port, {"port": 5432}, {"log": "regex"}
+            ready_timeout: Seconds to wait for the probe
+            
+        Returns:
+            dict: Result containing the process id, pid, port and readiness, or error and the end of its log
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        quota_error = self._quota_error()
+        if quota_error:
+            return {
+                "success": False,
+                "error": quota_error
+            }
+        self.last_used = time.monotonic()
+        logger.info(f"Starting background process in sandbox: {command}")
+        return self.background.start(command, self.working_directory, self._command_env(), name, port,
+                                     ready, ready_timeout)
+
+    def list_processes(self) -> List[Dict]:
+        """List the background processes of this sandbox."""
+        self.last_used = time.monotonic()
+        return self.background.list()
+
+    def process_logs(self, process: str, lines: int = 100) -> Dict:
+        """
+        Get the end of the log of a background process.
+        
+        Args:
+            process: Process id or name
+            lines: Number of lines
+            
+        Returns:
+            dict: Result containing the log lines and the process status
+        """
+        background = self.background.get(process)
+        if background is None:
+            return {"success": False, "error": f"No background process {process}"}
+        return {"success": True, "logs": tail_file(background.log_path, lines), **background.get_info()}
+
+    def stop_process(self, process: str) -> Dict:
+        """
+        Stop a background process and everything it started.
+        
+        Args:
+            process: Process id or name
+            
+        Returns:
+            dict: Result containing the process status
+        """
+        info = self.background.stop(process)
+        if info is None:
+            return {"success": False, "error": f"No background process {process}"}
+        return {"success": True, **info}
+
+    def restart_process(self, process: str, ready_timeout: float = 30.0) -> Dict:
+        """
+        Restart a background process with the same command, port and readiness probe.
+        
+        Args:
+            process: Process id or name
+            ready_timeout: Seconds to wait for the probe
+            
+        Returns:
+            dict: Result like start_process
+        """
+        result = self.background.restart(process, ready_timeout)
+        if result is None:
+            return {"success": False, "error": f"No background process {process}"}
+        return result
+
+    async def close_shell_session(self, session_id: str) -> Dict:
+        """
+        Close a persistent shell session.
+        
+        Args:
+            session_id: The session to close
+            
+        Returns:
+            dict: Result of the operation
+        """
+        if await get_shell_session_pool().close(self.session_id, session_id):
+            return {"success": True, "message": f"Shell session {session_id} closed"}
+        return {"success": False, "error": f"No shell session {session_id}"}
+
+    def list_shell_sessions(self) -> List[Dict]:
+        """List the persistent shell sessions of this sandbox on the running event loop."""
+        return get_shell_session_pool().list_sessions(self.session_id)
+
+    async def stream_python(self, code: str, session_id: str = "default",
+                            timeout: Optional[int] = None) -> AsyncIterator[Dict]:
+        """
+        Run Python code in a persistent kernel, yielding its output as it arrives.
+        
+        Variables, imports and loaded data stay in the kernel between calls with
+        the same session_id. Open matplotlib figures are saved under figures/.
+        
+        Args:
+            code: The code cell to run
+            session_id: The kernel to run the cell in
+            timeout: Timeout in seconds (defaults to sandbox_timeout)
+            
+        Yields:
+            dict: stdout/stderr, result, figure and error events, then an exit event
+        """
+        if not self.is_running():
+            if self.sandbox_enabled:
+                self.start()
+            else:
+                yield {"type": "stderr", "data": "Sandbox is not enabled. Set ENABLE_SANDBOX=true in .env"}
+                yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+                return
+        
+        quota_error = self._quota_error()
+        if quota_error:
+            yield {"type": "stderr", "data": quota_error}
+            yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+            return
+        
+        try:
+            kernel = await get_kernel_pool().acquire(
+                self.session_id, session_id, self.working_directory, self._command_env())
+        except RuntimeError as e:
+            yield {"type": "stderr", "data": str(e)}
+            yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0}
+            return
+        logger.info(f"Executing code cell in python kernel {session_id}")
+        with self._in_use():
+            async for event in kernel.stream(code, timeout or self.sandbox_timeout):
+                yield event
+
+    async def execute_python(self, code: str, session_id: str = "default", timeout: Optional[int] = None) -> Dict:
+        """
+        Run Python code in a persistent kernel.
+        
+        Args:
+            code: The code cell to run
+            session_id: The kernel to run the cell in
+            timeout: Timeout in seconds (defaults to sandbox_timeout)
+            
+        Returns:
+            dict: Result containing stdout, stderr, the value of a trailing expression,
+                saved figures (relative to the working directory) and the error if the cell raised
+        """
+        output = CommandOutput(self.working_directory)
+        figures = []
+        result, error = None, None
+        exit_event: Dict = {}
+        await asyncio.to_thread(self._start_change_report)
+        try:
+            async for event in self.stream_python(code, session_id, timeout):
+                if event["type"] in ("stdout", "stderr"):
+                    output.write(event["type"], event["data"])
+                elif event["type"] == "result":
+                    result = event["data"]
+                elif event["type"] == "figure":
+                    figures.append(os.path.relpath(event["path"], self.working_directory))
+                elif event["type"] == "error":
+                    error = {key: event[key] for key in ("ename", "evalue", "traceback")}
+                else:
+                    exit_event = event
+        finally:
+            output.close()
+        return {
+            "success": exit_event.get("exit_code") == 0,
+            **output.result(),
+            "result": result,
+            "figures": figures,
+            "error": error,
+            "session_id": session_id,
+            "execution_count": exit_event.get("execution_count", 0),
+            "restarted": exit_event.get("restarted", False),
+            "duration": exit_event.get("duration", 0.0),
+            **await asyncio.to_thread(self._change_report),
+        }
+
+    async def close_python_kernel(self, session_id: str) -> Dict:
+        """
+        Shut down a persistent Python kernel.
+        
+        Args:
+            session_id: The kernel to shut down
             
         Returns:
             dict: Result of the operation
         """
+        if await get_kernel_pool().close(self.session_id, session_id):
+            return {"success": True, "message": f"Python kernel {session_id} closed"}
+        return {"success": False, "error": f"No python kernel {session_id}"}
+
+    def list_python_kernels(self) -> List[Dict]:
+        """List the persistent Python kernels of this sandbox on the running event loop."""
+        return get_kernel_pool().list_sessions(self.session_id)
+    
+    def resolve_path(self, path: str) -> str:
+        """
+        Resolve a path inside the working directory.
+        
+        Args:
+            path: Path relative to the working directory
+            
+        Returns:
+            str: The absolute path
+            
+        Raises:
+            PathOutsideSandbox: If the path, after following symlinks, leaves the working directory
+        """
+        return resolve_path(self.working_directory, path)
+
+    def _ensure_started(self) -> Optional[Dict]:
         if not self.is_running():
             if self.sandbox_enabled:
                 self.start()
@@ -141,14 +689,41 @@ class Sandbox:
                     "success": False,
                     "error": "Sandbox is not enabled. Set ENABLE_SANDBOX=true in .env"
                 }
+        return None
+
+    def create_file(self, file_path: str, content: Union[str, bytes]) -> Dict:
+        """
+        Create a file in the sandbox environment.
+        
+        Args:
+            file_path: The path to the file
+            content: The content of the file, bytes are written as they are
+            
+        Returns:
+            dict: Result of the operation
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+                
+        quota_error = self._quota_error()
+        if quota_error:
+            return {
+                "success": False,
+                "error": quota_error
+            }
+        self.last_used = time.monotonic()
                 
         try:
-            # Make sure the file path is within the working directory
-            full_path = os.path.join(self.working_directory, file_path)
+            full_path = self.resolve_path(file_path)
             os.makedirs(os.path.dirname(full_path), exist_ok=True)
             
-            with open(full_path, 'w') as f:
-                f.write(content)
+            if isinstance(content, bytes):
+                with open(full_path, 'wb') as f:
+                    f.write(content)
+            else:
+                with open(full_path, 'w') as f:
+                    f.write(content)
                 
             return {
                 "success": True,
@@ -161,36 +736,52 @@ class Sandbox:
                 "error": str(e)
             }
     
-    def read_file(self, file_path: str) -> Dict:
+    def read_file(self, file_path: str, offset: int = 0, length: Optional[int] = None) -> Dict:
         """
         Read a file from the sandbox environment.
         
         Args:
             file_path: The path to the file
+            offset: First byte to read, negative counts from the end
+            length: Number of bytes to read, None for the rest of the file
             
         Returns:
-            dict: Result containing the file content or error
+            dict: Result containing the file content (invalid UTF-8 replaced) and its size, or error
         """
-        if not self.is_running():
-            if self.sandbox_enabled:
-                self.start()
-            else:
-                return {
-                    "success": False,
-                    "error": "Sandbox is not enabled. Set ENABLE_SANDBOX=true in .env"
-                }
+        result = self.read_bytes(file_path, offset, length)
+        if result["success"]:
+            result["content"] = result.pop("data").decode("utf-8", errors="replace")
+        return result
+
+    def read_bytes(self, file_path: str, offset: int = 0, length: Optional[int] = None) -> Dict:
+        """
+        Read a byte range of a file, memory-mapped for large files.
+        
+        Args:
+            file_path: The path to the file
+            offset: First byte to read, negative counts from the end
+            length: Number of bytes to read, None for the rest of the file
+            
+        Returns:
+            dict: Result containing the data, the range read and the file size, or error
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        self.last_used = time.monotonic()
                 
         try:
-            # Make sure the file path is within the working directory
-            full_path = os.path.join(self.working_directory, file_path)
+            full_path = self.resolve_path(file_path)
+            size = os.path.getsize(full_path)
+            data = read_range(full_path, offset, length)
             
-            with open(full_path, 'r') as f:
-                content = f.read()
-                
             return {
                 "success": True,
-                "content": content,
-                "path": full_path
+                "data": data,
+                "path": full_path,
+                "offset": max(0, size + offset) if offset < 0 else offset,
+                "length": len(data),
+                "size": size
             }
         except Exception as e:
             logger.error(f"Error reading file: {e}")
@@ -198,16 +789,197 @@ class Sandbox:
                 "success": False,
                 "error": str(e)
             }
+
+    def iter_file(self, file_path: str, offset: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Stream a byte range of a file in chunks.
+        
+        Args:
+            file_path: The path to the file
+            offset: First byte to read
+            length: Number of bytes to read, None for the rest of the file
+            
+        Returns:
+            Iterator[bytes]: The chunks, the file is opened when iteration starts
+            
+        Raises:
+            PathOutsideSandbox: If the path leaves the working directory
+        """
+        self.last_used = time.monotonic()
+        return iter_range(self.resolve_path(file_path), offset, length)
+
+    def file_info(self, file_path: str, with_hash: bool = False) -> Dict:
+        """
+        Get size, modification time and optionally the SHA-256 of a file.
+        
+        Args:
+            file_path: The path to the file
+            with_hash: Hash the content, reads the whole file
+            
+        Returns:
+            dict: Result containing the file information or error
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        try:
+            full_path = self.resolve_path(file_path)
+            return {"success": True, "path": full_path, **file_info(full_path, with_hash)}
+        except Exception as e:
+            logger.error(f"Error reading file info: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    async def write_file_stream(self, file_path: str, chunks: AsyncIterator[bytes], append: bool = False,
+                                expected_sha256: Optional[str] = None) -> Dict:
+        """
+        Write a file from chunks as they arrive, replacing the target only once the upload is complete.
+        
+        Args:
+            file_path: The path to the file
+            chunks: The content
+            append: Add to the end of the file instead of replacing it
+            expected_sha256: Reject the upload if its SHA-256 differs
+            
+        Returns:
+            dict: Result containing the path, size and SHA-256 of the upload, or error
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        # measured once up front, the upload itself is counted as it arrives
+        used = self.disk_usage(refresh=True) if self.disk_quota_mb else 0
+        quota_error = self._quota_error()
+        if quota_error:
+            return {
+                "success": False,
+                "error": quota_error
+            }
+        
+        def check_quota(written: int) -> Optional[str]:
+            if self.disk_quota_mb and used + written > self.disk_quota_mb * 1024 * 1024:
+                return f"Upload exceeds the sandbox disk quota of {self.disk_quota_mb} MB"
+            return None
+            
+        try:
+            full_path = self.resolve_path(file_path)
+            with self._in_use():
+                result = await write_stream(full_path, chunks, append, expected_sha256, check=check_quota)
+            if result["success"]:
+                logger.info(f"Wrote {result['size']} bytes to {full_path}")
+            return result
+        except Exception as e:
+            logger.error(f"Error writing file: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
     
-    def list_files(self, directory: str = "") -> Dict:
+    def create_snapshot(self, name: Optional[str] = None) -> Dict:
+        """
+        Snapshot the working directory so it can be restored later.
+        
+        Args:
+            name: Label of the snapshot
+            
+        Returns:
+            dict: Result containing the snapshot id, file count and duration
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        try:
+            with self._in_use():
+                return {"success": True, **self.snapshots.create(name)}
+        except Exception as e:
+            logger.error(f"Error creating snapshot: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    def restore_snapshot(self, snapshot_id: str) -> Dict:
+        """
+        Reset the working directory to a snapshot, only touching files that differ.
+        
+        Args:
+            snapshot_id: The snapshot to restore
+            
+        Returns:
+            dict: Result containing the number of files restored and removed
+        """
+        error = self._ensure_started()
+        if error:
+            return error
+        if self.active_operations:
+            return {
+                "success": False,
+                "error": "Commands are running in the sandbox, wait for them to finish before restoring"
+            }
+        try:
+            with self._in_use():
+                result = self.snapshots.restore(snapshot_id)
+            self._disk_usage = (0.0, 0)
+            return result
+        except Exception as e:
+            logger.error(f"Error restoring snapshot: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    def list_snapshots(self) -> List[Dict]:
+        """List the snapshots of this sandbox, oldest first."""
+        return self.snapshots.list()
+
+    def delete_snapshot(self, snapshot_id: str) -> Dict:
+        """
+        Delete a snapshot.
+        
+        Args:
+            snapshot_id: The snapshot to delete
+            
+        Returns:
+            dict: Result of the operation
+        """
+        try:
+            if self.snapshots.delete(snapshot_id):
+                return {"success": True, "message": f"Snapshot {snapshot_id} deleted"}
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        return {"success": False, "error": f"No snapshot {snapshot_id}"}
+
+    def publish_packages(self) -> Dict:
+        """
+        Promote the wheels in this sandbox's overlay (SANDBOX_WHEELHOUSE) into the shared wheelhouse.
+        
+        Returns:
+            dict: Result containing the number of wheels promoted
+        """
+        if self.package_cache is None:
+            return {"success": False, "error": "Package cache is disabled, set SANDBOX_PACKAGE_CACHE=true"}
+        try:
+            return {"success": True, **self.package_cache.promote(self.working_directory)}
+        except OSError as e:
+            logger.error(f"Error promoting packages: {e}")
+            return {"success": False, "error": str(e)}
+
+    def list_files(self, directory: str = "", recursive: bool = False, offset: int = 0,
+                   limit: Optional[int] = None) -> Dict:
         """
         List files in a directory within the sandbox environment.
         
         Args:
             directory: The directory to list files from (relative to working directory)
+            recursive: Include everything below its subdirectories too
+            offset: Number of entries to skip, entries are sorted by path
+            limit: Largest number of entries returned (defaults to SANDBOX_LIST_PAGE_SIZE)
             
         Returns:
-            dict: Result containing the list of files
+            dict: Result containing the files with their size, type and modification time,
+                the total count and the offset of the next page
         """
         if not self.is_running():
             if self.sandbox_enabled:
@@ -219,14 +991,37 @@ class Sandbox:
                 }
                 
         try:
-            # Make sure the directory path is within the working directory
-            full_path = os.path.join(self.working_directory, directory)
-            
-            files = os.listdir(full_path)
+            full_path = self.resolve_path(directory)
+            if not os.path.isdir(full_path):
+                raise NotADirectoryError(f"{directory} is not a directory")
+            relative = os.path.relpath(full_path, self.working_directory)
+            relative = "" if relative == os.curdir else relative
+            if relative.split(os.sep)[0] in EXCLUDED:
+                # internal state is not indexed, list it directly
+                items = FileIndex(full_path, mode="scan").list("", recursive)
+                prefix = relative + os.sep
+            else:
+                items = self.file_index.list(relative, recursive)
+                prefix = ""
+            limit = _list_page_size() if limit is None else max(0, limit)
+            offset = max(0, offset)
+            page = items[offset:offset + limit]
+            start = len(relative) + 1 if relative and not prefix else 0
+            entries = [{
+                "name": path[start:],
+                "path": prefix + path,
+                "type": "directory" if is_dir else "file",
+                "size": size,
+                "modified": mtime_ns / 1e9,
+            } for path, (size, mtime_ns, is_dir) in page]
             
             return {
                 "success": True,
-                "files": files,
+                "files": [entry["name"] for entry in entries],
+                "entries": entries,
+                "total": len(items),
+                "offset": offset,
+                "next_offset": offset + len(page) if offset + len(page) < len(items) else None,
                 "directory": full_path
             }
         except Exception as e:
@@ -236,3 +1031,4 @@ class Sandbox:
                 "error": str(e)
             }
 
+from .manager import DEFAULT_SANDBOX_KEY, SandboxManager, get_sandbox_manager
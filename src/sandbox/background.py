@@ -0,0 +1,329 @@
+"""
+Long running processes of a sandbox: dev servers, databases, watchers.
+
+execute_command waits for a command to exit, so starting a server used to
+block the agent until the sandbox timeout. A background process runs
+detached in its own process group with stdout and stderr appended to
+`.sandbox/logs/<id>.log`, where it can be tailed. Its logs count against the
+disk quota like any other file of the sandbox.
+
+Starting a process can wait for it to become ready:
+- {"port": true}: the port allocated to the process accepts connections.
+- {"port": 5432}: that port accepts connections.
+- {"log": "Listening on"}: a regular expression matched in its log.
+A process that exits before it is ready is reported as failed, with the
+end of its log.
+
+Ports are allocated from SANDBOX_PORT_RANGE, checked free by binding them,
+and not handed out twice by this process. A process gets its port as $PORT,
+and `{port}` in its command is replaced with it.
+"""
+import logging
+import os
+import re
+import shlex
+import signal
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.path.join(".sandbox", "logs")
+
+_reserved_ports = set()
+_ports_lock = threading.Lock()
+
+
+def _port_range() -> range:
+    low, _, high = os.environ.get("SANDBOX_PORT_RANGE", "20000-29999").partition("-")
+    return range(int(low), int(high or low) + 1)
+
+
+def _max_background_processes() -> int:
+    return max(1, int(os.environ.get("SANDBOX_MAX_BACKGROUND_PROCESSES", "8")))
+
+
+def allocate_port() -> int:
+    """
+    Reserve a free TCP port from SANDBOX_PORT_RANGE.
+
+    Returns:
+        int: The port
+
+    Raises:
+        RuntimeError: If every port of the range is taken
+    """
+    ports = _port_range()
+    # start at a random offset, restarted servers rarely get their old port back from someone else
+    offset = int.from_bytes(os.urandom(2), "big") % len(ports)
+    with _ports_lock:
+        for index in range(len(ports)):
+            port = ports[(offset + index) % len(ports)]
+            if port in _reserved_ports:
+                continue
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.bind(("127.0.0.1", port))
+                except OSError:
+                    continue
+            _reserved_ports.add(port)
+            return port
+    raise RuntimeError(f"No free port in {ports.start}-{ports.stop - 1}")
+
+
+def release_port(port: Optional[int]):
+    with _ports_lock:
+        _reserved_ports.discard(port)
+
+
+def port_open(port: int, host: str = "127.0.0.1") -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def tail_file(path: str, lines: int = 100, block_size: int = 65536) -> str:
+    """The last lines of a file, read backwards in blocks"""
+    try:
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            data = b""
+            position = end
+            while position > 0 and data.count(b"\n") <= lines:
+                position = max(0, position - block_size)
+                f.seek(position)
+                data = f.read(end - position)
+    except FileNotFoundError:
+        return ""
+    return b"\n".join(data.split(b"\n")[-lines - 1:]).decode("utf-8", errors="replace")
+
+
+class BackgroundProcess:
+    """One detached process and the way it was started, so it can be restarted"""
+
+    def __init__(self, command: str, cwd: str, env: Dict[str, str], name: Optional[str] = None,
+                 port: Optional[int] = None, ready: Optional[Dict] = None, allocated_port: bool = False):
+        self.process_id = uuid.uuid4().hex[:8]
+        self.name = name or self.process_id
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.port = port
+        # an allocated port is released when the process is forgotten
+        self.allocated_port = allocated_port
+        self.ready_probe = ready or {}
+        self.log_path = os.path.join(cwd, LOG_DIR, f"{self.process_id}.log")
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.ready = False
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        args = [arg.replace("{port}", str(self.port)) for arg in shlex.split(self.command)] \
+            if self.port else shlex.split(self.command)
+        if not args:
+            raise ValueError("Command is empty")
+        env = dict(self.env)
+        if self.port:
+            env["PORT"] = str(self.port)
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, "ab") as log:
+            log.write(f"--- started {time.strftime('%Y-%m-%d %H:%M:%S')}: {' '.join(args)}\n".encode())
+            log.flush()
+            self.process = subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                cwd=self.cwd,
+                env=env,
+                start_new_session=True,
+            )
+        self.started_at = time.time()
+        self.ready = not self.ready_probe
+        logger.info(f"Started background process {self.name} (pid {self.process.pid}): {self.command}")
+
+    def check_ready(self) -> bool:
+        if self.ready or not self.running:
+            return self.ready
+        port = self.ready_probe.get("port")
+        if port:
+            port = self.port if port is True else int(port)
+            if not port or not port_open(port):
+                return False
+        pattern = self.ready_probe.get("log")
+        if pattern:
+            with open(self.log_path, "rb") as log:
+                if not re.search(pattern.encode(), log.read()):
+                    return False
+        self.ready = True
+        return True
+
+    def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self.check_ready():
+            if not self.running or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def stop(self, grace: float = 5.0):
+        if self.process is None:
+            return
+        if not self.running:
+            # the leader is gone, children it left in its group are not
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            self.ready = False
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+        except ProcessLookupError:
+            self.process.wait()
+        self.ready = False
+        logger.info(f"Stopped background process {self.name}")
+
+    def get_info(self) -> Dict:
+        exit_code = self.process.poll() if self.process else None
+        return {
+            "id": self.process_id,
+            "name": self.name,
+            "command": self.command,
+            "pid": self.process.pid if self.process else None,
+            "port": self.port,
+            "status": "running" if exit_code is None and self.process else "exited",
+            "exit_code": exit_code,
+            "ready": self.check_ready(),
+            "uptime": round(time.time() - self.started_at, 1) if exit_code is None and self.process else None,
+            "restarts": self.restarts,
+            "log": os.path.relpath(self.log_path, self.cwd),
+        }
+
+
+class BackgroundProcesses:
+    """The background processes of one sandbox"""
+
+    def __init__(self, max_processes: Optional[int] = None):
+        self.max_processes = max_processes or _max_background_processes()
+        self._processes: Dict[str, BackgroundProcess] = {}
+        self._lock = threading.RLock()
+
+    def start(self, command: str, cwd: str, env: Dict[str, str], name: Optional[str] = None,
+              port: Optional[int] = None, ready: Optional[Dict] = None, ready_timeout: float = 30.0) -> Dict:
+        """
+        Start a process and optionally wait until it is ready.
+
+        Args:
+            command: The command, `{port}` is replaced with the process port
+            cwd: Working directory
+            env: Environment
+            name: Name to find the process by, unique among running processes
+            port: Port of the process, 0 to allocate one
+            ready: Readiness probe, {"port": true | number} and/or {"log": regex}
+            ready_timeout: Seconds to wait for the probe
+
+        Returns:
+            dict: The process info, or an error with the end of the log
+        """
+        with self._lock:
+            running = [process for process in self._processes.values() if process.running]
+            if name and any(process.name == name for process in running):
+                return {"success": False, "error": f"A background process named {name} is running"}
+            if len(running) >= self.max_processes:
+                return {"success": False,
+                        "error": f"At most {self.max_processes} background processes can run per sandbox"}
+            self._forget_exited()
+            allocated = port == 0
+            if allocated:
+                port = allocate_port()
+            process = BackgroundProcess(command, cwd, env, name, port, ready, allocated)
+            try:
+                process.start()
+            except (OSError, ValueError) as e:
+                if allocated:
+                    release_port(port)
+                return {"success": False, "error": str(e)}
+            self._processes[process.process_id] = process
+        return self._await_ready(process, ready_timeout)
+
+    def _await_ready(self, process: BackgroundProcess, ready_timeout: float) -> Dict:
+        start = time.monotonic()
+        if process.wait_ready(ready_timeout):
+            return {"success": True, "ready_after": round(time.monotonic() - start, 3), **process.get_info()}
+        reason = "exited before it was ready" if not process.running else \
+            f"not ready after {ready_timeout} seconds, still running"
+        return {"success": False, "error": f"Background process {process.name} {reason}",
+                "logs": tail_file(process.log_path, 50), **process.get_info()}
+
+    def _forget_exited(self):
+        # keeps the last exited processes around for their logs, not all of them
+        exited = [process for process in self._processes.values() if not process.running]
+        for process in exited[:max(0, len(exited) - self.max_processes)]:
+            self._discard(process)
+
+    def _discard(self, process: BackgroundProcess):
+        self._processes.pop(process.process_id, None)
+        if process.allocated_port:
+            release_port(process.port)
+
+    def get(self, key: str) -> Optional[BackgroundProcess]:
+        """A process by id, or by name preferring the running one"""
+        with self._lock:
+            if key in self._processes:
+                return self._processes[key]
+            named = [process for process in self._processes.values() if process.name == key]
+            named.sort(key=lambda process: (process.running, process.started_at))
+            return named[-1] if named else None
+
+    def stop(self, key: str, grace: float = 5.0) -> Optional[Dict]:
+        process = self.get(key)
+        if process is None:
+            return None
+        process.stop(grace)
+        return process.get_info()
+
+    def restart(self, key: str, ready_timeout: float = 30.0, grace: float = 5.0) -> Optional[Dict]:
+        process = self.get(key)
+        if process is None:
+            return None
+        with self._lock:
+            process.stop(grace)
+            process.restarts += 1
+            try:
+                process.start()
+            except (OSError, ValueError) as e:
+                return {"success": False, "error": str(e)}
+        return self._await_ready(process, ready_timeout)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [process.get_info() for process in self._processes.values()]
+
+    def running_count(self) -> int:
+        with self._lock:
+            return sum(1 for process in self._processes.values() if process.running)
+
+    def stop_all(self, grace: float = 5.0):
+        with self._lock:
+            for process in list(self._processes.values()):
+                process.stop(grace)
+                self._discard(process)
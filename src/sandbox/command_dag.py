@@ -0,0 +1,172 @@
+"""
+Batches of sandbox commands with dependencies.
+
+An agent installing, linting and testing several modules used to spend one
+step per command, each waiting for the previous one. A batch is a DAG of
+nodes:
+
+    {"id": "lint-api", "command": "ruff check api", "depends_on": ["install"]}
+
+Nodes whose dependencies have succeeded run concurrently, up to max_parallel
+at a time (the executor's SANDBOX_MAX_CONCURRENT_COMMANDS still applies on
+top). A failed node fails fast along its dependency chains: everything that
+depends on it, directly or not, is skipped, while independent branches carry
+on. With cancel_on_failure the first failure also cancels running and
+pending nodes.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _dag_max_parallel() -> int:
+    return max(1, int(os.environ.get("SANDBOX_DAG_MAX_PARALLEL", "4")))
+
+
+def validate_dag(nodes: List[Dict]) -> List[str]:
+    """
+    Check a batch and order it topologically (Kahn's algorithm).
+
+    Args:
+        nodes: Nodes with id, command and optional depends_on
+
+    Returns:
+        List[str]: Node ids, every node after its dependencies
+
+    Raises:
+        ValueError: On missing fields, duplicate ids, unknown dependencies or cycles
+    """
+    ids = []
+    for index, node in enumerate(nodes):
+        if not isinstance(node, dict) or not node.get("id") or not node.get("command"):
+            raise ValueError(f"Node {index} needs an id and a command")
+        ids.append(str(node["id"]))
+    if len(set(ids)) != len(ids):
+        raise ValueError("Node ids must be unique")
+    indegree = {node_id: 0 for node_id in ids}
+    dependents = {node_id: [] for node_id in ids}
+    for node_id, node in zip(ids, nodes):
+        for dependency in map(str, node.get("depends_on") or []):
+            if dependency not in indegree:
+                raise ValueError(f"Node {node_id} depends on unknown node {dependency}")
+            indegree[node_id] += 1
+            dependents[dependency].append(node_id)
+    ready = deque(node_id for node_id in ids if not indegree[node_id])
+    order = []
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for dependent in dependents[node_id]:
+            indegree[dependent] -= 1
+            if not indegree[dependent]:
+                ready.append(dependent)
+    if len(order) != len(ids):
+        raise ValueError(f"Dependency cycle between {sorted(set(ids) - set(order))}")
+    return order
+
+
+async def run_dag(nodes: List[Dict], run_node: Callable[[Dict], Awaitable[Dict]],
+                  max_parallel: Optional[int] = None, cancel_on_failure: bool = False) -> Dict:
+    """
+    Run a batch, independent nodes concurrently.
+
+    Args:
+        nodes: Nodes with id, command and optional depends_on
+        run_node: Runs one node, returning a command result with success
+        max_parallel: Nodes running at once
+        cancel_on_failure: Stop the whole batch at the first failure
+
+    Returns:
+        dict: Overall success, per node results with status and timings, and the completion order
+
+    Raises:
+        ValueError: If the batch is not a valid DAG
+    """
+    validate_dag(nodes)
+    max_parallel = max(1, max_parallel or _dag_max_parallel())
+    by_id = {str(node["id"]): node for node in nodes}
+    dependents = {node_id: [] for node_id in by_id}
+    waiting_on = {}
+    for node_id, node in by_id.items():
+        waiting_on[node_id] = len(node.get("depends_on") or [])
+        for dependency in map(str, node.get("depends_on") or []):
+            dependents[dependency].append(node_id)
+
+    start = time.monotonic()
+    results: Dict[str, Dict] = {}
+    completed: List[str] = []
+    ready = deque(node_id for node_id in by_id if not waiting_on[node_id])
+    running: Dict[asyncio.Task, str] = {}
+    started_at: Dict[str, float] = {}
+    cancelled = False
+
+    def skip_dependents(failed: str):
+        pending = deque(dependents[failed])
+        while pending:
+            node_id = pending.popleft()
+            if node_id in results:
+                continue
+            results[node_id] = {"status": "skipped", "reason": f"dependency {failed} did not succeed"}
+            pending.extend(dependents[node_id])
+
+    try:
+        while ready or running:
+            while ready and len(running) < max_parallel and not cancelled:
+                node_id = ready.popleft()
+                started_at[node_id] = time.monotonic()
+                running[asyncio.create_task(run_node(by_id[node_id]))] = node_id
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                node_id = running.pop(task)
+                finished = time.monotonic()
+                if task.cancelled():
+                    results[node_id] = {"status": "cancelled", "started": round(started_at[node_id] - start, 3)}
+                    continue
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error(f"Batch node {node_id} raised: {e}")
+                    result = {"success": False, "stdout": "", "stderr": str(e), "exit_code": 1}
+                result.update({
+                    "status": "succeeded" if result.get("success") else "failed",
+                    "started": round(started_at[node_id] - start, 3),
+                    "finished": round(finished - start, 3),
+                    "duration": round(finished - started_at[node_id], 3),
+                })
+                results[node_id] = result
+                completed.append(node_id)
+                if result["success"]:
+                    for dependent in dependents[node_id]:
+                        waiting_on[dependent] -= 1
+                        if not waiting_on[dependent] and dependent not in results:
+                            ready.append(dependent)
+                else:
+                    skip_dependents(node_id)
+                    if cancel_on_failure and not cancelled:
+                        cancelled = True
+                        logger.info(f"Batch node {node_id} failed, cancelling the rest of the batch")
+                        for other in running:
+                            other.cancel()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    for node_id in by_id:
+        results.setdefault(node_id, {"status": "cancelled"})
+    return {
+        "success": all(result["status"] == "succeeded" for result in results.values()),
+        # in the order the nodes were given
+        "results": {node_id: results[node_id] for node_id in by_id},
+        "completed": completed,
+        "duration": round(time.monotonic() - start, 3),
+        "max_parallel": max_parallel,
+    }
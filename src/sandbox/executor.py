@@ -0,0 +1,228 @@
+"""
+Async command execution for the sandbox.
+
+Commands run with asyncio.create_subprocess_exec in their own session, so a
+timeout or a disconnected client kills the whole process group rather than
+just the direct child. Output is read incrementally and handed out as events,
+which the API forwards over SSE or a WebSocket. A semaphore per event loop
+bounds how many commands run at the same time; callers beyond the limit wait
+without blocking the loop.
+"""
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import time
+import weakref
+from typing import AsyncIterator, Dict, List, Optional
+
+from .limits import CommandLimits, read_command_stats, wrap_command
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 4096
+
+
+def _max_concurrent_commands() -> int:
+    return max(1, int(os.environ.get("SANDBOX_MAX_CONCURRENT_COMMANDS", "4")))
+
+
+def _kill_grace() -> float:
+    return float(os.environ.get("SANDBOX_KILL_GRACE", "5"))
+
+
+async def kill_process_group(process: asyncio.subprocess.Process, grace: float):
+    """SIGTERM the process group of a session leader, SIGKILL it if it is still there after the grace period"""
+    for sig, wait in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError as e:
+            logger.error(f"Failed to signal process group {process.pid}: {e}")
+            return
+        if wait is None:
+            break
+        try:
+            await asyncio.wait_for(process.wait(), timeout=wait)
+            # the leader is gone, make sure nothing it forked survives it
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return
+        except asyncio.TimeoutError:
+            continue
+    await process.wait()
+
+
+class AsyncCommandExecutor:
+    """
+    Runs sandbox commands without blocking the event loop.
+
+    Events are dicts: {"type": "stdout" | "stderr", "data": str} while the
+    command runs, then one {"type": "exit", "exit_code": int, "timed_out":
+    bool, "duration": float, "resources": dict | None}.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, kill_grace: Optional[float] = None,
+                 limits: Optional[CommandLimits] = None):
+        self.max_concurrency = max_concurrency or _max_concurrent_commands()
+        self.kill_grace = _kill_grace() if kill_grace is None else kill_grace
+        self.limits = limits or CommandLimits.from_env()
+        # the API server and the webui run on different event loops
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        self._running = 0
+        self._waiting = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def stream(self, args: List[str], cwd: str, env: Dict[str, str],
+                     timeout: Optional[float] = None, limits: Optional[CommandLimits] = None) -> AsyncIterator[Dict]:
+        """
+        Run a command and yield its output as it is produced.
+
+        Args:
+            args: Program and arguments
+            cwd: Working directory
+            env: Environment of the command
+            timeout: Seconds before the process group is killed, None for no limit
+            limits: Resource limits of this command, the executor's defaults when None
+
+        Yields:
+            Dict: Output events, the last one is the exit event
+        """
+        self._waiting += 1
+        try:
+            await self._semaphore().acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        process = None
+        stats_path = None
+        limits = limits or self.limits
+        try:
+            args, env, stats_path = wrap_command(args, env, limits)
+            start = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                env=env,
+                start_new_session=True,
+            )
+            queue: asyncio.Queue = asyncio.Queue()
+            readers = [
+                asyncio.create_task(self._pump(process.stdout, "stdout", queue)),
+                asyncio.create_task(self._pump(process.stderr, "stderr", queue)),
+            ]
+            deadline = start + timeout if timeout else None
+            timed_out = output_exceeded = False
+            output_size = 0
+            open_streams = len(readers)
+            try:
+                while open_streams:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        timed_out = True
+                        break
+                    try:
+                        event = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        timed_out = True
+                        break
+                    if event is None:
+                        open_streams -= 1
+                        continue
+                    yield event
+                    output_size += len(event["data"])
+                    if limits.output_bytes and output_size > limits.output_bytes:
+                        output_exceeded = True
+                        break
+
+                if timed_out:
+                    logger.warning(f"Command timed out after {timeout} seconds, killing process group {process.pid}")
+                    await kill_process_group(process, self.kill_grace)
+                elif output_exceeded:
+                    logger.warning(f"Command exceeded {limits.output_mb} MB of output, killing process group {process.pid}")
+                    await kill_process_group(process, self.kill_grace)
+                exit_code = await process.wait()
+                # drain what the readers picked up before the pipes closed
+                await asyncio.gather(*readers, return_exceptions=True)
+                while not queue.empty() and not output_exceeded:
+                    event = queue.get_nowait()
+                    if event is not None:
+                        yield event
+            finally:
+                for reader in readers:
+                    reader.cancel()
+
+            resources = read_command_stats(stats_path)
+            stats_path = None
+            if timed_out:
+                yield {"type": "stderr", "data": f"Command timed out after {timeout} seconds"}
+            elif output_exceeded:
+                yield {"type": "stderr", "data": f"Command killed after exceeding {limits.output_mb} MB of output"}
+                if resources is not None:
+                    resources["limit_exceeded"] = "output"
+            elif resources and resources.get("limit_exceeded"):
+                yield {"type": "stderr", "data": f"Command exceeded its {resources['limit_exceeded']} limit"}
+            yield {
+                "type": "exit",
+                "exit_code": 124 if timed_out else exit_code,
+                "timed_out": timed_out,
+                "duration": time.monotonic() - start,
+                "resources": resources,
+            }
+        finally:
+            if process is not None and process.returncode is None:
+                # the consumer went away (client disconnect, cancellation)
+                await kill_process_group(process, self.kill_grace)
+            read_command_stats(stats_path)
+            self._running -= 1
+            self._semaphore().release()
+
+    @staticmethod
+    async def _pump(stream: asyncio.StreamReader, name: str, queue: asyncio.Queue):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                chunk = await stream.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                text = decoder.decode(chunk)
+                if text:
+                    await queue.put({"type": name, "data": text})
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                await queue.put({"type": name, "data": tail})
+        finally:
+            await queue.put(None)
+
+    def get_stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "waiting": self._waiting,
+            "limits": self.limits.__dict__,
+        }
+
+
+_executor: Optional[AsyncCommandExecutor] = None
+
+
+def get_command_executor() -> AsyncCommandExecutor:
+    """The process wide executor, the concurrency limit applies per event loop"""
+    global _executor
+    if _executor is None:
+        _executor = AsyncCommandExecutor()
+    return _executor
@@ -0,0 +1,241 @@
+"""
+Chunked, ranged and memory-mapped file I/O for the sandbox.
+
+read_file/create_file move whole files as str, which does not work for
+multi-GB datasets or binaries. The helpers here move bytes in chunks:
+downloads read a byte range without loading the file (large files through
+mmap, so the page cache is used directly instead of copying through read
+buffers), uploads are written to a temporary file next to the target while
+their SHA-256 is computed and only replace the target once complete.
+
+Every path is resolved against the sandbox directory first, after following
+symlinks, so `../` and links pointing out of the sandbox are refused.
+"""
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Chunk size of transfers and hashing
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+
+def _mmap_threshold() -> int:
+    return int(os.environ.get("SANDBOX_MMAP_THRESHOLD_MB", "8")) * 1024 * 1024
+
+
+class PathOutsideSandbox(ValueError):
+    """A path resolves to a location outside the sandbox directory"""
+
+
+def resolve_path(working_directory: str, path: str) -> str:
+    """
+    Resolve a path inside the sandbox directory.
+
+    Args:
+        working_directory: The sandbox directory
+        path: Path relative to the sandbox directory, or absolute inside it
+
+    Returns:
+        str: The absolute path with symlinks resolved
+
+    Raises:
+        PathOutsideSandbox: If the path leaves the sandbox directory
+    """
+    root = os.path.realpath(working_directory)
+    full_path = os.path.realpath(os.path.join(root, path or ""))
+    if full_path != root and not full_path.startswith(root + os.sep):
+        raise PathOutsideSandbox(f"Path is outside the sandbox: {path}")
+    return full_path
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Parse a single range HTTP Range header.
+
+    Args:
+        header: Value like "bytes=0-99", "bytes=100-" or "bytes=-100"
+        size: Size of the file
+
+    Returns:
+        tuple: (offset, length), None for no or an unsupported header
+
+    Raises:
+        ValueError: If the range can not be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            length = min(int(end), size)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return size - length, length
+        offset = int(start)
+        last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        raise ValueError(f"Invalid range: {header}")
+    if offset >= size or last < offset:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return offset, last - offset + 1
+
+
+def read_range(path: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+    """
+    Read a byte range of a file, through mmap for large files.
+
+    Args:
+        path: Resolved file path
+        offset: First byte, negative counts from the end
+        length: Number of bytes, None for the rest of the file
+
+    Returns:
+        bytes: The data
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset < 0:
+            offset = max(0, size + offset)
+        end = size if length is None else min(size, offset + max(0, length))
+        if offset >= end:
+            return b""
+        if size >= _mmap_threshold():
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[offset:end]
+        f.seek(offset)
+        return f.read(end - offset)
+
+
+def iter_range(path: str, offset: int = 0, length: Optional[int] = None,
+               chunk_size: int = TRANSFER_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield a byte range of a file in chunks, for streaming responses.
+
+    Args:
+        path: Resolved file path
+        offset: First byte
+        length: Number of bytes, None for the rest of the file
+        chunk_size: Largest chunk
+
+    Yields:
+        bytes: The next chunk
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if offset >= end:
+            return
+        if size >= _mmap_threshold():
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for position in range(offset, end, chunk_size):
+                    yield mapped[position:min(end, position + chunk_size)]
+            return
+        f.seek(offset)
+        remaining = end - offset
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def hash_file(path: str, algorithm: str = "sha256") -> str:
+    """Hex digest of a file, read in chunks"""
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(TRANSFER_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def file_info(path: str, with_hash: bool = False) -> Dict:
+    stat = os.stat(path)
+    info = {
+        "size": stat.st_size,
+        "modified": stat.st_mtime,
+        "is_dir": os.path.isdir(path),
+        # cheap validator for caches and resumed downloads
+        "etag": f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}",
+    }
+    if with_hash and not info["is_dir"]:
+        info["sha256"] = hash_file(path)
+    return info
+
+
+async def write_stream(path: str, chunks: AsyncIterator[bytes], append: bool = False,
+                       expected_sha256: Optional[str] = None, max_bytes: Optional[int] = None,
+                       check: Optional[Callable[[int], Optional[str]]] = None) -> Dict:
+    """
+    Write an upload to a file as it arrives.
+
+    A new file or a replaced file is written to a temporary file in the same
+    directory and moved over the target once complete and verified, so a
+    failed upload never leaves a half written target. Appends go to the
+    target directly.
+
+    Args:
+        path: Resolved target path
+        chunks: The upload
+        append: Add to the end of the file instead of replacing it
+        expected_sha256: Digest the uploaded bytes must have
+        max_bytes: Largest upload
+        check: Called with the bytes written so far, returns an error to abort the upload
+
+    Returns:
+        dict: size and sha256 of the uploaded bytes, or an error
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if append:
+        target, temp_path = open(path, "ab"), None
+    else:
+        fd, temp_path = tempfile.mkstemp(prefix=".upload-", dir=os.path.dirname(path))
+        target = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    written = 0
+    error = None
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            written += len(chunk)
+            if max_bytes is not None and written > max_bytes:
+                error = f"Upload larger than {max_bytes} bytes"
+                break
+            error = check(written) if check else None
+            if error:
+                break
+            digest.update(chunk)
+            # file writes block, keep them off the event loop
+            await asyncio.to_thread(target.write, chunk)
+        target.close()
+        sha256 = digest.hexdigest()
+        if not error and expected_sha256 and sha256 != expected_sha256.lower():
+            error = f"SHA-256 mismatch: expected {expected_sha256}, got {sha256}"
+        if error:
+            return {"success": False, "error": error}
+        if temp_path:
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+            temp_path = None
+        return {"success": True, "path": path, "size": written, "sha256": sha256}
+    finally:
+        if not target.closed:
+            target.close()
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
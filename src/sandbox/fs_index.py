@@ -0,0 +1,346 @@
+"""
+Index of the files of a sandbox, for change reports and listings.
+
+After a command the agent used to spend a step running `ls` to see what the
+command did. The index keeps size and mtime of every path in the working
+directory, and each command result carries what changed since the previous
+report: paths added, modified and deleted, with sizes.
+
+On Linux the index follows the directory with inotify (through ctypes, no
+dependency): after a command only the paths that had events are stat'ed
+again, and directories created or moved in are scanned. Where inotify is
+not available, the watch limit (fs.inotify.max_user_watches) is reached or
+the event queue overflowed, the whole tree is walked and compared with the
+index instead. Directories are reported with a trailing "/".
+
+Reports are per sandbox, not per command: commands running at the same time
+in one sandbox share them. `.sandbox` (logs, spilled outputs) is not indexed.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import stat
+import struct
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXCLUDED = {".sandbox"}
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+               | _IN_DELETE | _IN_DELETE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# (size, mtime_ns, is_dir)
+Entry = Tuple[int, int, bool]
+
+
+def _change_report_mode() -> str:
+    return os.environ.get("SANDBOX_CHANGE_REPORT_MODE", "auto").lower()
+
+
+def _max_report_entries() -> int:
+    return int(os.environ.get("SANDBOX_CHANGE_REPORT_MAX_ENTRIES", "100"))
+
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            _libc.inotify_init1  # noqa: B018, raises AttributeError off Linux
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+
+def _stat_entry(path: str) -> Optional[Entry]:
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    is_dir = stat.S_ISDIR(info.st_mode)
+    return (0 if is_dir else info.st_size, info.st_mtime_ns, is_dir)
+
+
+class _Inotify:
+    """Recursive watch of a directory tree"""
+
+    def __init__(self, root: str):
+        libc = _inotify_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = libc
+        self.root = root
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+
+    def add(self, relative: str):
+        """Watch a directory, raises OSError (ENOSPC) when the watch limit is reached"""
+        path = os.path.join(self.root, relative) if relative else self.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+        self.watches[wd] = relative
+
+    def read(self) -> Tuple[Set[str], Set[str], bool]:
+        """Changed paths, changed directory trees and whether events were lost"""
+        paths, trees, overflow = set(), set(), False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & _IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None or not name:
+                    continue
+                relative = os.path.join(directory, os.fsdecode(name)) if directory else os.fsdecode(name)
+                if not directory and relative in EXCLUDED:
+                    continue
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO | _IN_MOVED_FROM | _IN_DELETE):
+                    trees.add(relative)
+                else:
+                    paths.add(relative)
+        return paths, trees, overflow
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileIndex:
+    """Size and mtime of every path below a root, and what changed since the last report"""
+
+    def __init__(self, root: str, mode: Optional[str] = None):
+        self.root = root
+        self.mode = mode or _change_report_mode()
+        self.entries: Dict[str, Entry] = {}
+        self.initialized = False
+        self._inotify: Optional[_Inotify] = None
+        # changes found by listings between two reports
+        self._pending: Dict[str, Tuple[Optional[Entry], Optional[Entry]]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def watching(self) -> bool:
+        return self._inotify is not None
+
+    def _walk(self, relative: str, into: Dict[str, Entry]):
+        """Add a directory and everything below it"""
+        path = os.path.join(self.root, relative) if relative else self.root
+        try:
+            iterator = os.scandir(path)
+        except OSError:
+            return
+        with iterator:
+            for item in iterator:
+                child = os.path.join(relative, item.name) if relative else item.name
+                if not relative and item.name in EXCLUDED:
+                    continue
+                try:
+                    info = item.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                is_dir = stat.S_ISDIR(info.st_mode)
+                into[child] = (0 if is_dir else info.st_size, info.st_mtime_ns, is_dir)
+                if is_dir:
+                    if self._inotify is not None:
+                        self._add_watch(child)
+                    self._walk(child, into)
+
+    def _add_watch(self, relative: str):
+        try:
+            self._inotify.add(relative)
+        except OSError as e:
+            logger.warning(f"Falling back to scanning {self.root} for change reports: {e}")
+            self._stop_watching()
+
+    def _stop_watching(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _initialize(self):
+        if self.mode != "scan":
+            try:
+                self._inotify = _Inotify(self.root)
+                self._inotify.add("")
+            except OSError as e:
+                if self.mode == "inotify":
+                    logger.warning(f"inotify not usable for {self.root}, scanning instead: {e}")
+                self._stop_watching()
+        entries: Dict[str, Entry] = {}
+        self._walk("", entries)
+        self.entries = entries
+        self.initialized = True
+
+    def sync(self):
+        """Bring the index up to date, remembering the changes for the next report"""
+        with self._lock:
+            if not self.initialized:
+                self._initialize()
+                return
+            if self._inotify is not None:
+                paths, trees, overflow = self._inotify.read()
+                if not overflow and self._inotify is not None:
+                    self._update(paths, trees)
+                    return
+                logger.info(f"inotify queue overflowed for {self.root}, rescanning")
+            self._rescan()
+
+    def _update(self, paths: Set[str], trees: Set[str]):
+        old: Dict[str, Entry] = {}
+        new: Dict[str, Entry] = {}
+        for tree in trees:
+            prefix = tree + os.sep
+            for path in [path for path in self.entries if path == tree or path.startswith(prefix)]:
+                old[path] = self.entries[path]
+            entry = _stat_entry(os.path.join(self.root, tree))
+            if entry is not None:
+                new[tree] = entry
+                if entry[2]:
+                    self._add_watch(tree)
+                    self._walk(tree, new)
+        for path in paths - set(old):
+            if path in self.entries:
+                old[path] = self.entries[path]
+            entry = _stat_entry(os.path.join(self.root, path))
+            if entry is not None:
+                new[path] = entry
+        for path in old:
+            self.entries.pop(path, None)
+        self.entries.update(new)
+        self._record(old, new)
+
+    def _rescan(self):
+        new: Dict[str, Entry] = {}
+        self._walk("", new)
+        old, self.entries = self.entries, new
+        self._record(old, new)
+
+    def _record(self, old: Dict[str, Entry], new: Dict[str, Entry]):
+        for path in set(old) | set(new):
+            before, after = old.get(path), new.get(path)
+            if before == after:
+                continue
+            if path in self._pending:
+                before = self._pending[path][0]
+            if before == after or (before is not None and after is not None and before[2] and after[2]):
+                # back to where it was, or a directory whose mtime changed with its entries
+                self._pending.pop(path, None)
+                continue
+            self._pending[path] = (before, after)
+
+    def report(self, max_entries: Optional[int] = None) -> Dict:
+        """
+        What changed since the previous report.
+
+        Args:
+            max_entries: Largest number of paths listed per kind
+
+        Returns:
+            dict: added, modified and deleted paths with sizes, their counts, and whether lists were cut
+        """
+        max_entries = _max_report_entries() if max_entries is None else max_entries
+        with self._lock:
+            first = not self.initialized
+            self.sync()
+            pending, self._pending = self._pending, {}
+        added, modified, deleted = [], [], []
+        for path in sorted(pending):
+            before, after = pending[path]
+            if before is None:
+                added.append(self._describe(path, after))
+            elif after is None:
+                deleted.append(self._describe(path, before))
+            elif before[2] != after[2]:
+                deleted.append(self._describe(path, before))
+                added.append(self._describe(path, after))
+            else:
+                modified.append({**self._describe(path, after), "previous_size": before[0]})
+        report = {
+            "added": added[:max_entries],
+            "modified": modified[:max_entries],
+            "deleted": deleted[:max_entries],
+            "counts": {"added": len(added), "modified": len(modified), "deleted": len(deleted)},
+            "truncated": max(len(added), len(modified), len(deleted)) > max_entries,
+        }
+        if first:
+            report["baseline"] = True
+        return report
+
+    @staticmethod
+    def _describe(path: str, entry: Entry) -> Dict:
+        if entry[2]:
+            return {"path": path + "/"}
+        return {"path": path, "size": entry[0]}
+
+    def reset(self):
+        """Take the current state as the new baseline, dropping unreported changes"""
+        with self._lock:
+            self.sync()
+            self._pending = {}
+
+    def list(self, directory: str = "", recursive: bool = False) -> List[Tuple[str, Entry]]:
+        """
+        Paths below a directory with their entries, sorted.
+
+        Args:
+            directory: Directory relative to the root, "" for the root
+            recursive: Include everything below subdirectories too
+
+        Returns:
+            List: (relative path, (size, mtime_ns, is_dir)) pairs
+        """
+        with self._lock:
+            self.sync()
+            if not directory:
+                items = self.entries.items() if recursive else \
+                    [(path, entry) for path, entry in self.entries.items() if os.sep not in path]
+            else:
+                prefix = directory + os.sep
+                items = [(path, entry) for path, entry in self.entries.items() if path.startswith(prefix)
+                         and (recursive or os.sep not in path[len(prefix):])]
+            return sorted(items)
+
+    def close(self):
+        with self._lock:
+            self._stop_watching()
@@ -0,0 +1,179 @@
+"""
+Python kernel worker, started by python_kernel.PythonKernel.
+
+Reads one JSON request per line on stdin ({"id": ..., "code": ...}) and
+answers with JSON lines on the original stdout: stream output while the cell
+runs, then the value of a trailing expression, saved figures, an error if the
+cell raised, and a final "done" message. Cells share one globals dict, so
+imports and loaded data stay around between them.
+
+This file runs as a standalone script in the sandbox directory and must not
+import anything from the application.
+"""
+import ast
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+
+FLUSH_SIZE = 4096
+FLUSH_INTERVAL = 0.05
+# Keeps protocol lines well below the reader's line limit
+MAX_MESSAGE_TEXT = 1024 * 1024
+MAX_RESULT_REPR = 100_000
+
+
+class Channel:
+    """Protocol messages on a private copy of the original stdout"""
+
+    def __init__(self):
+        self._out = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        line = json.dumps(message)
+        with self._lock:
+            self._out.write(line + "\n")
+            self._out.flush()
+
+
+class StreamWriter:
+    """sys.stdout/sys.stderr replacement forwarding output in batches"""
+
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        if text:
+            self._buffer.append(text)
+            self._size += len(text)
+            if self._size >= FLUSH_SIZE or ("\n" in text and time.monotonic() - self._last_flush >= FLUSH_INTERVAL):
+                self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            text = "".join(self._buffer)
+            for offset in range(0, len(text), MAX_MESSAGE_TEXT):
+                self.channel.send({"type": "stream", "name": self.name, "text": text[offset:offset + MAX_MESSAGE_TEXT]})
+            self._buffer = []
+            self._size = 0
+        self._last_flush = time.monotonic()
+
+    def isatty(self):
+        return False
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+
+def _save_figures(figures_dir, execution_count):
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is None:
+        return []
+    paths = []
+    for number in pyplot.get_fignums():
+        os.makedirs(figures_dir, exist_ok=True)
+        path = os.path.join(figures_dir, f"cell{execution_count}_fig{number}.png")
+        pyplot.figure(number).savefig(path, bbox_inches="tight")
+        paths.append(path)
+    pyplot.close("all")
+    return paths
+
+
+def _run_cell(code, namespace, filename):
+    """Execute a cell, returning the repr of a trailing expression"""
+    tree = ast.parse(code, filename=filename, mode="exec")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+    exec(compile(tree, filename, "exec"), namespace)
+    if last is not None:
+        value = eval(compile(last, filename, "eval"), namespace)
+        if value is not None:
+            namespace["_"] = value
+            text = repr(value)
+            if len(text) > MAX_RESULT_REPR:
+                text = text[:MAX_RESULT_REPR] + f"... ({len(text) - MAX_RESULT_REPR} more characters)"
+            return text
+    return None
+
+
+def main():
+    memory_mb = int(os.environ.get("SANDBOX_KERNEL_MEMORY_MB", "0"))
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    # imports resolve against the sandbox directory, not the directory of this script
+    sys.path[0] = os.getcwd()
+    figures_dir = os.environ.get("SANDBOX_KERNEL_FIGURES_DIR", "figures")
+
+    channel = Channel()
+    # output of child processes and C extensions written to fd 1 ends up on stderr
+    os.dup2(2, 1)
+    stdout, stderr = StreamWriter(channel, "stdout"), StreamWriter(channel, "stderr")
+    sys.stdout, sys.stderr = stdout, stderr
+    stdin = sys.stdin
+    sys.stdin = open(os.devnull, "r")
+
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    execution_count = 0
+    channel.send({"type": "ready", "pid": os.getpid()})
+    while True:
+        try:
+            line = stdin.readline()
+        except KeyboardInterrupt:
+            # an interrupt that arrived after the cell finished
+            continue
+        if not line:
+            break
+        request = json.loads(line)
+        execution_count += 1
+        status = "ok"
+        try:
+            try:
+                result = _run_cell(request["code"], namespace, f"<cell {execution_count}>")
+                stdout.flush()
+                stderr.flush()
+                if result is not None:
+                    channel.send({"type": "result", "data": result})
+            except BaseException as e:
+                if isinstance(e, SystemExit):
+                    raise
+                status = "error"
+                stdout.flush()
+                stderr.flush()
+                lines = traceback.format_exception(type(e), e, e.__traceback__)
+                # drop the worker's own frames
+                lines = [lines[0]] + [entry for entry in lines[1:] if __file__ not in entry]
+                channel.send({"type": "error", "ename": type(e).__name__, "evalue": str(e),
+                              "traceback": "".join(lines)})
+            try:
+                for path in _save_figures(figures_dir, execution_count):
+                    channel.send({"type": "figure", "path": path})
+            except Exception as e:
+                channel.send({"type": "stream", "name": "stderr", "text": f"Failed to save figures: {e}\n"})
+            channel.send({"type": "done", "id": request.get("id"), "status": status,
+                          "execution_count": execution_count})
+        except KeyboardInterrupt:
+            # interrupted while reporting, the cell itself is over
+            channel.send({"type": "done", "id": request.get("id"), "status": "error",
+                          "execution_count": execution_count})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Launcher running one sandbox command under resource limits.
+
+Usage: python limited_exec.py <stats file> -- <program> [args...]
+
+The limits come from the environment (SANDBOX_LIMIT_*, see limits.py). The
+launcher optionally moves itself into a fresh cgroup v2 group, forks, applies
+rlimits in the child and execs the command. It then waits with wait4 and
+writes the measurements to the stats file as JSON:
+- CPU time and peak RSS from the rusage of the command tree.
+- I/O bytes from /proc/self/io, which includes waited-for children.
+- The cgroup's own counters when one was used.
+The launcher exits with the command's exit code.
+
+This file runs as a standalone script and must not import anything from the
+application.
+"""
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+_MB = 1024 * 1024
+
+_LIMIT_SIGNALS = {
+    signal.SIGXCPU: "cpu",
+    signal.SIGXFSZ: "file_size",
+}
+
+
+def _env_int(name):
+    try:
+        return int(float(os.environ.get(name, "0")))
+    except ValueError:
+        return 0
+
+
+def _read_io():
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key.strip()] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _setup_cgroup(root, memory_mb, processes, cpu_percent):
+    """Create a cgroup for this command and move the launcher into it, None when not possible"""
+    path = os.path.join(root, f"cmd-{os.getpid()}")
+    try:
+        try:
+            # let the children of the root use the controllers, fails harmlessly when already set
+            _write(os.path.join(root, "cgroup.subtree_control"), "+memory +pids +cpu")
+        except OSError:
+            pass
+        os.mkdir(path)
+        if memory_mb:
+            _write(os.path.join(path, "memory.max"), str(memory_mb * _MB))
+            _write(os.path.join(path, "memory.swap.max"), "0")
+        if processes:
+            _write(os.path.join(path, "pids.max"), str(processes))
+        if cpu_percent:
+            _write(os.path.join(path, "cpu.max"), f"{cpu_percent * 1000} 100000")
+        _write(os.path.join(path, "cgroup.procs"), str(os.getpid()))
+        return path
+    except OSError as e:
+        sys.stderr.write(f"limited_exec: cgroup limits not applied: {e}\n")
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return None
+
+
+def _read_cgroup(path):
+    stats = {}
+    for name in ("memory.peak", "memory.events", "cpu.stat", "pids.peak"):
+        try:
+            with open(os.path.join(path, name), "r") as f:
+                content = f.read().strip()
+        except OSError:
+            continue
+        if name in ("memory.peak", "pids.peak"):
+            stats[name] = int(content)
+        else:
+            stats[name] = {key: int(value) for key, value in (line.split() for line in content.splitlines())}
+    return stats
+
+
+def _remove_cgroup(path):
+    # the launcher has to leave the group before it can be removed
+    try:
+        parent = os.path.dirname(path)
+        _write(os.path.join(parent, "cgroup.procs"), str(os.getpid()))
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[2] != "--":
+        sys.stderr.write("usage: limited_exec.py <stats file> -- <program> [args...]\n")
+        return 2
+    stats_path, args = sys.argv[1], sys.argv[3:]
+
+    cpu_seconds = _env_int("SANDBOX_LIMIT_CPU_SECONDS")
+    memory_mb = _env_int("SANDBOX_LIMIT_MEMORY_MB")
+    processes = _env_int("SANDBOX_LIMIT_PROCESSES")
+    file_size_mb = _env_int("SANDBOX_LIMIT_FILE_SIZE_MB")
+    cpu_percent = _env_int("SANDBOX_LIMIT_CPU_PERCENT")
+    cgroup_root = os.environ.get("SANDBOX_CGROUP_ROOT", "")
+
+    cgroup = _setup_cgroup(cgroup_root, memory_mb, processes, cpu_percent) if cgroup_root else None
+    io_before = _read_io()
+    start = time.monotonic()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # the interpreter ignores these, an exec'd command has to get the defaults back
+            for signum in (signal.SIGPIPE, signal.SIGXFSZ):
+                signal.signal(signum, signal.SIG_DFL)
+            if cpu_seconds:
+                # SIGXCPU at the soft limit, SIGKILL one second later
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+            if memory_mb and cgroup is None:
+                resource.setrlimit(resource.RLIMIT_AS, (memory_mb * _MB, memory_mb * _MB))
+            if processes and cgroup is None:
+                resource.setrlimit(resource.RLIMIT_NPROC, (processes, processes))
+            if file_size_mb:
+                resource.setrlimit(resource.RLIMIT_FSIZE, (file_size_mb * _MB, file_size_mb * _MB))
+            for name in ("SANDBOX_LIMIT_CPU_SECONDS", "SANDBOX_LIMIT_MEMORY_MB", "SANDBOX_LIMIT_PROCESSES",
+                         "SANDBOX_LIMIT_FILE_SIZE_MB", "SANDBOX_LIMIT_CPU_PERCENT", "SANDBOX_CGROUP_ROOT"):
+                os.environ.pop(name, None)
+            os.execvp(args[0], args)
+        except OSError as e:
+            sys.stderr.write(f"{args[0]}: {e.strerror}\n")
+            sys.stderr.flush()
+            os._exit(127 if isinstance(e, FileNotFoundError) else 126)
+
+    # a timeout signals the whole process group: let the command die, then report it
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+    _, status, usage = os.wait4(pid, 0)
+    wall = time.monotonic() - start
+    io_after = _read_io()
+
+    exit_code = os.waitstatus_to_exitcode(status)
+    term_signal = -exit_code if exit_code < 0 else None
+    if term_signal:
+        exit_code = 128 + term_signal
+
+    stats = {
+        "wall_time": round(wall, 3),
+        "cpu_user": round(usage.ru_utime, 3),
+        "cpu_system": round(usage.ru_stime, 3),
+        # largest single process of the tree, the cgroup below measures the whole tree
+        "max_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "read_bytes": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+        "write_bytes": io_after.get("wchar", 0) - io_before.get("wchar", 0),
+        "disk_read_bytes": io_after.get("read_bytes", 0) - io_before.get("read_bytes", 0),
+        "disk_write_bytes": io_after.get("write_bytes", 0) - io_before.get("write_bytes", 0),
+        "signal": term_signal,
+        "limit_exceeded": _LIMIT_SIGNALS.get(term_signal),
+        "cgroup": None,
+    }
+    if cgroup is not None:
+        cgroup_stats = _read_cgroup(cgroup)
+        stats["cgroup"] = cgroup_stats
+        if cgroup_stats.get("memory.events", {}).get("oom_kill"):
+            stats["limit_exceeded"] = "memory"
+        if "memory.peak" in cgroup_stats:
+            stats["max_rss_mb"] = round(cgroup_stats["memory.peak"] / _MB, 1)
+        _remove_cgroup(cgroup)
+    if cpu_seconds and term_signal == signal.SIGKILL and usage.ru_utime + usage.ru_stime >= cpu_seconds:
+        stats["limit_exceeded"] = "cpu"
+
+    try:
+        with open(stats_path, "w") as f:
+            json.dump(stats, f)
+    except OSError as e:
+        sys.stderr.write(f"limited_exec: failed to write stats: {e}\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Resource limits and accounting for sandbox commands.
+
+Without limits, one runaway command (`make -j`, a memory bomb, a fork loop)
+can starve the browser and the API server running on the same host. When
+limits or accounting are enabled, commands are started through
+limited_exec.py, which applies rlimits, or a cgroup v2 group when
+SANDBOX_CGROUP_ROOT points at a delegated cgroup directory, and reports what
+the command used: CPU time, peak RSS and I/O bytes.
+
+rlimits are per process (CPU, address space, file size) or per user (process
+count): a command that forks many small processes gets past the memory limit,
+and the process limit counts every process of the sandbox user. A cgroup
+limits the whole command tree and measures it as a whole.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LAUNCHER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "limited_exec.py")
+
+
+@dataclass
+class CommandLimits:
+    """
+    Per command limits, 0 disables a limit.
+
+    cpu_seconds: CPU time (user + system)
+    memory_mb: address space per process, memory of the whole tree with a cgroup
+    processes: processes of the sandbox user, processes of the tree with a cgroup
+    file_size_mb: largest file the command may write
+    output_mb: stdout + stderr, the command is killed past it
+    cpu_percent: CPU bandwidth, only with a cgroup
+    cgroup_root: delegated cgroup v2 directory to create per command groups in
+    accounting: measure commands even when no limit is set
+    """
+    cpu_seconds: int = 0
+    memory_mb: int = 0
+    processes: int = 0
+    file_size_mb: int = 0
+    output_mb: int = 0
+    cpu_percent: int = 0
+    cgroup_root: str = ""
+    accounting: bool = True
+
+    @classmethod
+    def from_env(cls) -> "CommandLimits":
+        return cls(
+            cpu_seconds=int(os.environ.get("SANDBOX_LIMIT_CPU_SECONDS", "0")),
+            memory_mb=int(os.environ.get("SANDBOX_LIMIT_MEMORY_MB", "0")),
+            processes=int(os.environ.get("SANDBOX_LIMIT_PROCESSES", "0")),
+            file_size_mb=int(os.environ.get("SANDBOX_LIMIT_FILE_SIZE_MB", "0")),
+            output_mb=int(os.environ.get("SANDBOX_LIMIT_OUTPUT_MB", "0")),
+            cpu_percent=int(os.environ.get("SANDBOX_LIMIT_CPU_PERCENT", "0")),
+            cgroup_root=os.environ.get("SANDBOX_CGROUP_ROOT", ""),
+            accounting=os.environ.get("SANDBOX_RESOURCE_ACCOUNTING", "true").lower() == "true",
+        )
+
+    @property
+    def uses_launcher(self) -> bool:
+        return self.accounting or any((self.cpu_seconds, self.memory_mb, self.processes, self.file_size_mb,
+                                       self.cpu_percent, self.cgroup_root))
+
+    @property
+    def output_bytes(self) -> int:
+        return self.output_mb * 1024 * 1024
+
+
+def wrap_command(args: List[str], env: Dict[str, str],
+                 limits: CommandLimits) -> Tuple[List[str], Dict[str, str], Optional[str]]:
+    """
+    Route a command through the launcher when limits or accounting are enabled.
+
+    Args:
+        args: Program and arguments
+        env: Environment of the command
+        limits: Limits to apply
+
+    Returns:
+        Tuple: Arguments and environment to start, and the stats file to read afterwards (None without launcher)
+    """
+    if not limits.uses_launcher:
+        return args, env, None
+    fd, stats_path = tempfile.mkstemp(prefix="sandbox-stats-", suffix=".json")
+    os.close(fd)
+    env = dict(env)
+    env.update({
+        "SANDBOX_LIMIT_CPU_SECONDS": str(limits.cpu_seconds),
+        "SANDBOX_LIMIT_MEMORY_MB": str(limits.memory_mb),
+        "SANDBOX_LIMIT_PROCESSES": str(limits.processes),
+        "SANDBOX_LIMIT_FILE_SIZE_MB": str(limits.file_size_mb),
+        "SANDBOX_LIMIT_CPU_PERCENT": str(limits.cpu_percent),
+        "SANDBOX_CGROUP_ROOT": limits.cgroup_root,
+    })
+    # the launcher only needs the standard library, skipping site keeps its startup short
+    return [sys.executable, "-S", "-E", LAUNCHER_PATH, stats_path, "--", *args], env, stats_path
+
+
+def read_command_stats(stats_path: Optional[str]) -> Optional[Dict]:
+    """Read and delete the stats file written by the launcher, None when there is none"""
+    if not stats_path:
+        return None
+    try:
+        with open(stats_path, "r") as f:
+            content = f.read()
+        return json.loads(content) if content else None
+    except (OSError, ValueError) as e:
+        logger.debug(f"No resource stats for command: {e}")
+        return None
+    finally:
+        try:
+            os.remove(stats_path)
+        except OSError:
+            pass
@@ -0,0 +1,236 @@
+"""
+Sandbox sessions per client or run.
+
+The API server, the controller and the agent controller used to construct
+their own Sandbox, all three sharing nothing but the host, and none of the
+`ai-sandbox-<uuid>` directories was ever removed. The manager hands out one
+Sandbox per key (a client id, a run id), each with its own working
+directory, disk quota, shell sessions and kernels.
+
+At most SANDBOX_MAX_SESSIONS sandboxes exist at a time: when a new key comes
+in the least recently used sandbox that runs nothing (no command, background
+process, shell session or kernel) is evicted to make room, and sandboxes idle
+for SANDBOX_SESSION_IDLE_TIMEOUT seconds are closed. Closing kills whatever
+still runs in the sandbox and deletes its directory, which takes a while on
+large trees, so evicted and idle sandboxes are closed by a background reaper
+thread and lookups from event loops never wait for it. Directories left
+behind by an earlier process are removed on start.
+"""
+import atexit
+import glob
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from . import Sandbox
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SANDBOX_KEY = "default"
+
+
+def _max_sandbox_sessions() -> int:
+    return max(1, int(os.environ.get("SANDBOX_MAX_SESSIONS", "8")))
+
+
+def _sandbox_idle_timeout() -> float:
+    return float(os.environ.get("SANDBOX_SESSION_IDLE_TIMEOUT", "3600"))
+
+
+class SandboxManager:
+    """Thread safe registry of sandboxes, shared by every event loop of the process"""
+
+    def __init__(self, max_sessions: Optional[int] = None, idle_timeout: Optional[float] = None,
+                 disk_quota_mb: Optional[int] = None):
+        self.max_sessions = max_sessions or _max_sandbox_sessions()
+        self.idle_timeout = _sandbox_idle_timeout() if idle_timeout is None else idle_timeout
+        self.disk_quota_mb = disk_quota_mb
+        self._sandboxes: "OrderedDict[str, Sandbox]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._evicted = 0
+        self._closing: "queue.Queue[Tuple[str, Sandbox]]" = queue.Queue()
+        self._reaper: Optional[threading.Thread] = None
+
+    def get(self, key: Optional[str] = None) -> Sandbox:
+        """
+        Get the sandbox of a client or run, creating it on first use.
+
+        Args:
+            key: Client or run id, None for the shared default sandbox
+
+        Returns:
+            Sandbox: The started sandbox
+        """
+        key = key or DEFAULT_SANDBOX_KEY
+        self._start_reaper()
+        with self._lock:
+            sandbox = self._sandboxes.get(key)
+            if sandbox is None:
+                if len(self._sandboxes) >= self.max_sessions:
+                    self._evict_one()
+                sandbox = Sandbox(disk_quota_mb=self.disk_quota_mb)
+                sandbox.start()
+                self._sandboxes[key] = sandbox
+                logger.info(f"Created sandbox {sandbox.session_id} for {key}")
+            self._sandboxes.move_to_end(key)
+            sandbox.last_used = time.monotonic()
+            return sandbox
+
+    def _evict_one(self):
+        for key, sandbox in self._sandboxes.items():
+            if not sandbox.is_busy():
+                logger.info(f"Evicting least recently used sandbox of {key}")
+                self._closing.put((key, self._detach(key)))
+                return
+        # every sandbox is running something, go over the limit rather than kill a command or a server
+        logger.warning(f"All {len(self._sandboxes)} sandboxes are busy, exceeding SANDBOX_MAX_SESSIONS")
+
+    def _detach(self, key: str) -> Sandbox:
+        self._evicted += 1
+        return self._sandboxes.pop(key)
+
+    @staticmethod
+    def _close_sandbox(key: str, sandbox: Sandbox):
+        try:
+            sandbox.close()
+        except Exception as e:
+            logger.error(f"Failed to clean up sandbox of {key}: {e}")
+
+    def _remove(self, key: str):
+        self._close_sandbox(key, self._detach(key))
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="sandbox-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            interval = min(60.0, max(1.0, self.idle_timeout / 2)) if self.idle_timeout else 60.0
+            try:
+                key, sandbox = self._closing.get(timeout=interval)
+            except queue.Empty:
+                self.reap_idle()
+                continue
+            try:
+                self._close_sandbox(key, sandbox)
+            finally:
+                self._closing.task_done()
+
+    def wait_closed(self):
+        """Wait until the reaper has closed every evicted sandbox"""
+        self._closing.join()
+
+    def close(self, key: str) -> bool:
+        """Close the sandbox of a client or run and delete its files, blocking, run it off the event loop"""
+        with self._lock:
+            if key not in self._sandboxes:
+                return False
+            sandbox = self._detach(key)
+        self._close_sandbox(key, sandbox)
+        return True
+
+    def reap_idle(self) -> int:
+        """
+        Close sandboxes that have not been used for idle_timeout seconds, called by the reaper thread.
+        Sandboxes with running commands, background processes, shell sessions or kernels are kept.
+        """
+        if not self.idle_timeout:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [(key, self._detach(key)) for key, sandbox in list(self._sandboxes.items())
+                       if now - sandbox.last_used > self.idle_timeout and not sandbox.is_busy()]
+        for key, sandbox in expired:
+            logger.info(f"Closing sandbox of {key} after {self.idle_timeout:.0f}s idle")
+            self._close_sandbox(key, sandbox)
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            sandboxes = [(key, self._detach(key)) for key in list(self._sandboxes)]
+        while True:
+            try:
+                sandboxes.append(self._closing.get_nowait())
+            except queue.Empty:
+                break
+            self._closing.task_done()
+        for key, sandbox in sandboxes:
+            self._close_sandbox(key, sandbox)
+
+    def cleanup_stale_directories(self) -> int:
+        """
+        Delete sandbox directories that no sandbox of this process owns.
+
+        Only directories untouched for idle_timeout seconds are removed, so
+        sandboxes of other processes on the same host are left alone.
+
+        Returns:
+            int: Number of directories removed
+        """
+        with self._lock:
+            owned = {path for sandbox in self._sandboxes.values()
+                     for path in (sandbox.working_directory, sandbox.snapshot_directory)}
+        cutoff = time.time() - (self.idle_timeout or _sandbox_idle_timeout())
+        removed = 0
+        for path in glob.glob(os.path.join(tempfile.gettempdir(), "ai-sandbox-*")):
+            try:
+                if path in owned or os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} stale sandbox director{'y' if removed == 1 else 'ies'}")
+        return removed
+
+    def list_sessions(self) -> List[Dict]:
+        """The sandboxes with their disk usage, walks their directories so run it off the event loop"""
+        now = time.monotonic()
+        with self._lock:
+            sandboxes = list(self._sandboxes.items())
+        # measured outside the lock, lookups do not wait for the directory walks
+        return [{
+            "key": key,
+            "sandbox_id": sandbox.session_id,
+            "working_directory": sandbox.working_directory,
+            "active_operations": sandbox.active_operations,
+            "busy": sandbox.is_busy(),
+            "idle_seconds": round(now - sandbox.last_used, 1),
+            "disk_usage_mb": round(sandbox.disk_usage() / (1024 * 1024), 1),
+            "disk_quota_mb": sandbox.disk_quota_mb,
+        } for key, sandbox in sandboxes]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sandboxes),
+                "max_sessions": self.max_sessions,
+                "idle_timeout": self.idle_timeout,
+                "evicted": self._evicted,
+            }
+
+
+_manager: Optional[SandboxManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_sandbox_manager() -> SandboxManager:
+    """The process wide sandbox manager"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SandboxManager()
+            _manager.cleanup_stale_directories()
+            atexit.register(_manager.close_all)
+        return _manager
@@ -0,0 +1,224 @@
+"""
+Bounded capture of command output.
+
+A chatty build or a `cat` of a large file can print hundreds of megabytes,
+all of which used to be held in memory and returned as JSON. A capture keeps
+the first and the last max_bytes / 2 bytes of a stream in memory. While the
+output stays below max_bytes nothing touches the disk; once it grows past it,
+the complete output is spilled to `.sandbox/outputs/` in the sandbox
+directory, where it can be read back in ranges.
+"""
+import logging
+import os
+import uuid
+from collections import deque
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = os.path.join(".sandbox", "outputs")
+
+
+def _output_max_bytes() -> int:
+    return int(os.environ.get("SANDBOX_OUTPUT_MAX_BYTES", str(1024 * 1024)))
+
+
+def _output_spill_enabled() -> bool:
+    return os.environ.get("SANDBOX_OUTPUT_SPILL", "true").lower() == "true"
+
+
+def _output_spill_keep() -> int:
+    return int(os.environ.get("SANDBOX_OUTPUT_SPILL_KEEP", "50"))
+
+
+class OutputCapture:
+    """Head and tail of one stream in memory, the whole stream in a spill file once it gets large"""
+
+    def __init__(self, spill_path: Optional[str], max_bytes: Optional[int] = None,
+                 observer: Optional[Callable[[bytes], None]] = None):
+        self.max_bytes = _output_max_bytes() if max_bytes is None else max_bytes
+        self.head_limit = self.max_bytes // 2
+        self.tail_limit = self.max_bytes - self.head_limit
+        self.spill_path = spill_path
+        self.total_bytes = 0
+        self._head = bytearray()
+        self._tail: deque = deque()
+        self._tail_size = 0
+        self._spill = None
+        # sees every chunk, e.g. to count package cache hits
+        self.observer = observer
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > self.max_bytes
+
+    @property
+    def spilled(self) -> bool:
+        return self._spill is not None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if not data:
+            return
+        if self.observer is not None:
+            self.observer(data)
+        self.total_bytes += len(data)
+        if self._spill is not None:
+            self._spill.write(data)
+        elif self.truncated and self.spill_path:
+            self._start_spill(data)
+
+        room = self.head_limit - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data:
+            self._tail.append(data)
+            self._tail_size += len(data)
+            while self._tail_size > self.tail_limit:
+                excess = self._tail_size - self.tail_limit
+                first = self._tail[0]
+                if len(first) <= excess:
+                    self._tail.popleft()
+                    self._tail_size -= len(first)
+                else:
+                    self._tail[0] = first[excess:]
+                    self._tail_size -= excess
+
+    def _start_spill(self, data: bytes):
+        # nothing has been dropped yet: head + tail + this chunk is everything so far
+        try:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            self._spill = open(self.spill_path, "wb")
+            self._spill.write(bytes(self._head))
+            for chunk in self._tail:
+                self._spill.write(chunk)
+            self._spill.write(data)
+        except OSError as e:
+            logger.error(f"Failed to spill command output to {self.spill_path}: {e}")
+            self._spill = None
+            self.spill_path = None
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+
+    def text(self, spill_name: Optional[str] = None) -> str:
+        """The captured output, with a marker where the middle was left out"""
+        head = bytes(self._head).decode("utf-8", errors="replace")
+        if not self.truncated:
+            return head + b"".join(self._tail).decode("utf-8", errors="replace")
+        tail = b"".join(self._tail).decode("utf-8", errors="replace")
+        omitted = self.total_bytes - len(self._head) - self._tail_size
+        where = f", full output in {spill_name}" if self.spilled and spill_name else ""
+        return f"{head}\n... [{omitted} bytes omitted{where}] ...\n{tail}"
+
+
+class CommandOutput:
+    """stdout and stderr captures of one command"""
+
+    def __init__(self, working_directory: Optional[str], max_bytes: Optional[int] = None,
+                 observers: Optional[Dict[str, Callable[[bytes], None]]] = None):
+        self.output_id = uuid.uuid4().hex[:16]
+        self.working_directory = working_directory
+        spill = working_directory is not None and _output_spill_enabled()
+        self.streams = {
+            name: OutputCapture(self._path(name) if spill else None, max_bytes, (observers or {}).get(name))
+            for name in ("stdout", "stderr")
+        }
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.working_directory, OUTPUT_DIR, f"{self.output_id}.{name}")
+
+    def write(self, name: str, data):
+        self.streams[name].write(data)
+
+    def close(self):
+        for capture in self.streams.values():
+            capture.close()
+        if any(capture.spilled for capture in self.streams.values()):
+            prune_outputs(os.path.join(self.working_directory, OUTPUT_DIR))
+
+    def result(self) -> Dict:
+        """stdout/stderr text plus sizes, and the output id when something was spilled"""
+        result = {}
+        for name, capture in self.streams.items():
+            relative = os.path.join(OUTPUT_DIR, f"{self.output_id}.{name}")
+            result[name] = capture.text(relative)
+            result[f"{name}_bytes"] = capture.total_bytes
+        result["truncated"] = any(capture.truncated for capture in self.streams.values())
+        if any(capture.spilled for capture in self.streams.values()):
+            result["output_id"] = self.output_id
+        return result
+
+
+def drain_pipe(pipe, capture: OutputCapture, chunk_size: int = 65536):
+    """Copy a binary pipe into a capture until EOF, run in a thread per pipe"""
+    try:
+        while True:
+            chunk = pipe.read1(chunk_size) if hasattr(pipe, "read1") else pipe.read(chunk_size)
+            if not chunk:
+                break
+            capture.write(chunk)
+    finally:
+        pipe.close()
+
+
+def prune_outputs(directory: str, keep: Optional[int] = None):
+    """Delete all but the newest `keep` spilled outputs"""
+    keep = _output_spill_keep() if keep is None else keep
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except OSError:
+        return
+    outputs = {}
+    for entry in entries:
+        output_id = entry.name.split(".")[0]
+        outputs[output_id] = max(outputs.get(output_id, 0), entry.stat().st_mtime)
+    oldest = sorted(outputs, key=outputs.get)
+    for output_id in oldest[:max(0, len(oldest) - keep)]:
+        for name in ("stdout", "stderr"):
+            try:
+                os.remove(os.path.join(directory, f"{output_id}.{name}"))
+            except OSError:
+                pass
+
+
+def read_output_range(working_directory: str, output_id: str, stream: str = "stdout",
+                      offset: int = 0, length: int = 65536) -> Dict:
+    """
+    Read part of a spilled output.
+
+    Args:
+        working_directory: Sandbox directory the output was spilled in
+        output_id: Id returned with the command result
+        stream: "stdout" or "stderr"
+        offset: First byte to read, negative counts from the end
+        length: Number of bytes to read
+
+    Returns:
+        dict: The data and its range, or an error
+    """
+    if stream not in ("stdout", "stderr") or not output_id.isalnum():
+        return {"success": False, "error": "Invalid output id or stream"}
+    path = os.path.join(working_directory, OUTPUT_DIR, f"{output_id}.{stream}")
+    try:
+        with open(path, "rb") as f:
+            total = os.fstat(f.fileno()).st_size
+            if offset < 0:
+                offset = max(0, total + offset)
+            f.seek(offset)
+            data = f.read(max(0, length))
+    except FileNotFoundError:
+        return {"success": False, "error": f"No spilled {stream} for output {output_id}"}
+    except OSError as e:
+        return {"success": False, "error": str(e)}
+    return {
+        "success": True,
+        "data": data.decode("utf-8", errors="replace"),
+        "offset": offset,
+        "length": len(data),
+        "total_bytes": total,
+        "eof": offset + len(data) >= total,
+    }
@@ -0,0 +1,231 @@
+"""
+Package cache shared by all sandboxes.
+
+Every new sandbox used to download and build the same wheels and npm packages
+again. Commands now run with the package managers pointed at one cache
+directory per host (SANDBOX_PACKAGE_CACHE_DIR):
+
+- pip/uv use a shared PIP_CACHE_DIR/UV_CACHE_DIR. That holds the HTTP cache
+  and wheels built from sdists, so a package is built once per host.
+- npm uses a shared cache. Its cacache store is content addressed and safe for
+  concurrent use, and prefer-offline skips revalidating cached packuments.
+- A wheelhouse of content addressed wheels (objects/<sha256>) is published
+  under their file names in wheelhouse/. Commands never write to it; pip gets
+  it as find-links.
+
+Each sandbox has its own writable overlay, `.sandbox/wheelhouse`, which is also
+searched by pip and exported as SANDBOX_WHEELHOUSE (`pip wheel -w
+$SANDBOX_WHEELHOUSE ...`). Wheels put there are promoted into the shared
+wheelhouse when the sandbox closes, or on request. A file name already
+present in the shared wheelhouse is never replaced.
+
+With SANDBOX_PACKAGE_OFFLINE=true pip only installs from the wheelhouse and
+npm only from its cache. SANDBOX_PIP_INDEX_URL / SANDBOX_NPM_REGISTRY point
+at a local index or mirror instead.
+
+Hits and misses are counted from the output of package commands:
+- pip reports "Using cached" and wheelhouse files as hits, and "Downloading"
+  as misses.
+- npm only reports them at loglevel http, as "(cache hit)" and
+  "(cache miss)".
+"""
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+
+from .file_transfer import hash_file
+
+logger = logging.getLogger(__name__)
+
+OVERLAY_DIR = os.path.join(".sandbox", "wheelhouse")
+
+_PIP_HIT = re.compile(rb"^\s*(Using cached \S+|Processing \S+\.whl|File was already downloaded)")
+_PIP_MISS = re.compile(rb"^\s*Downloading \S+")
+_PIP_BUILD = re.compile(rb"^\s*Created wheel for ")
+_NPM_HIT = re.compile(rb"\(cache (hit|revalidated)\)")
+_NPM_MISS = re.compile(rb"\(cache (miss|stale|updated)\)")
+
+# Commands whose output is scanned for cache hits
+_PACKAGE_COMMAND = re.compile(r"\b(pip3?|uv|npm|npx|pnpm|yarn)\b")
+
+
+def package_cache_enabled() -> bool:
+    return os.environ.get("SANDBOX_PACKAGE_CACHE", "true").lower() == "true"
+
+
+def _package_cache_dir() -> str:
+    return os.environ.get("SANDBOX_PACKAGE_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "sandbox-packages")
+
+
+def _offline() -> bool:
+    return os.environ.get("SANDBOX_PACKAGE_OFFLINE", "false").lower() == "true"
+
+
+class CacheUsage:
+    """Hit and miss counter fed with the raw output of one command"""
+
+    def __init__(self):
+        self.counts = {"pip_hits": 0, "pip_misses": 0, "pip_builds": 0, "npm_hits": 0, "npm_misses": 0}
+        self._partial = {}
+
+    def feeder(self, stream: str) -> Callable[[bytes], None]:
+        """A callback for one output stream, lines may arrive split over several chunks"""
+        def feed(data: bytes):
+            lines = (self._partial.pop(stream, b"") + data).split(b"\n")
+            self._partial[stream] = lines.pop()
+            for line in lines:
+                self._count(line)
+        return feed
+
+    def finish(self) -> Dict[str, int]:
+        for line in self._partial.values():
+            self._count(line)
+        self._partial = {}
+        return self.counts
+
+    def _count(self, line: bytes):
+        if _PIP_HIT.match(line):
+            self.counts["pip_hits"] += 1
+        elif _PIP_MISS.match(line):
+            self.counts["pip_misses"] += 1
+        elif _PIP_BUILD.match(line):
+            self.counts["pip_builds"] += 1
+        elif _NPM_HIT.search(line):
+            self.counts["npm_hits"] += 1
+        elif _NPM_MISS.search(line):
+            self.counts["npm_misses"] += 1
+
+
+class PackageCache:
+    """The host wide cache directory and its statistics"""
+
+    def __init__(self, root: Optional[str] = None, offline: Optional[bool] = None):
+        self.root = root or _package_cache_dir()
+        self.offline = _offline() if offline is None else offline
+        self.pip_index_url = os.environ.get("SANDBOX_PIP_INDEX_URL", "")
+        self.npm_registry = os.environ.get("SANDBOX_NPM_REGISTRY", "")
+        self.wheelhouse = os.path.join(self.root, "wheelhouse")
+        self.objects = os.path.join(self.root, "objects")
+        for path in (self.wheelhouse, self.objects, os.path.join(self.root, "pip"),
+                     os.path.join(self.root, "uv"), os.path.join(self.root, "npm")):
+            os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"pip_hits": 0, "pip_misses": 0, "pip_builds": 0, "npm_hits": 0, "npm_misses": 0,
+                       "promoted": 0, "commands": 0}
+
+    def env(self, working_directory: str) -> Dict[str, str]:
+        """Environment pointing the package managers of a sandbox at the cache"""
+        overlay = os.path.join(working_directory, OVERLAY_DIR)
+        os.makedirs(overlay, exist_ok=True)
+        env = {
+            "PIP_CACHE_DIR": os.path.join(self.root, "pip"),
+            "UV_CACHE_DIR": os.path.join(self.root, "uv"),
+            # the sandbox's own wheels first, then the shared ones
+            "PIP_FIND_LINKS": f"{overlay} {self.wheelhouse}",
+            "UV_FIND_LINKS": f"{overlay},{self.wheelhouse}",
+            "SANDBOX_WHEELHOUSE": overlay,
+            "npm_config_cache": os.path.join(self.root, "npm"),
+            "npm_config_prefer_offline": "true",
+        }
+        if self.pip_index_url:
+            env["PIP_INDEX_URL"] = env["UV_INDEX_URL"] = self.pip_index_url
+        if self.npm_registry:
+            env["npm_config_registry"] = self.npm_registry
+        if self.offline:
+            env["PIP_NO_INDEX"] = "1"
+            env["UV_OFFLINE"] = "1"
+            env["npm_config_offline"] = "true"
+        return env
+
+    @staticmethod
+    def usage_for(command: str) -> Optional[CacheUsage]:
+        """A counter for a command that runs a package manager, None for any other command"""
+        return CacheUsage() if _PACKAGE_COMMAND.search(command) else None
+
+    def record(self, counts: Dict[str, int]):
+        with self._lock:
+            self._stats["commands"] += 1
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def promote(self, working_directory: str) -> Dict:
+        """
+        Move the wheels of a sandbox overlay into the shared wheelhouse.
+
+        Args:
+            working_directory: The sandbox directory
+
+        Returns:
+            dict: Wheels promoted and wheels already present
+        """
+        overlay = os.path.join(working_directory, OVERLAY_DIR)
+        promoted, present = 0, 0
+        try:
+            names = [name for name in os.listdir(overlay) if name.endswith((".whl", ".tar.gz", ".zip"))]
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            source = os.path.join(overlay, name)
+            published = os.path.join(self.wheelhouse, name)
+            if os.path.exists(published) or not os.path.isfile(source):
+                present += 1
+                continue
+            digest = hash_file(source)
+            obj = os.path.join(self.objects, digest[:2], digest)
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            if not os.path.exists(obj):
+                # copy, then rename: readers never see a partial object
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(obj))
+                os.close(fd)
+                shutil.copyfile(source, temp_path)
+                os.chmod(temp_path, 0o444)
+                os.replace(temp_path, obj)
+            try:
+                os.link(obj, published)
+            except FileExistsError:
+                present += 1
+                continue
+            except OSError:
+                shutil.copyfile(obj, published)
+            promoted += 1
+        if promoted:
+            logger.info(f"Promoted {promoted} package(s) from {overlay} into the shared wheelhouse")
+            with self._lock:
+                self._stats["promoted"] += promoted
+        return {"promoted": promoted, "already_present": present}
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        pip_total = stats["pip_hits"] + stats["pip_misses"]
+        stats.update({
+            "root": self.root,
+            "offline": self.offline,
+            "pip_hit_rate": round(stats["pip_hits"] / pip_total, 3) if pip_total else None,
+            "wheelhouse_packages": len(os.listdir(self.wheelhouse)),
+        })
+        return stats
+
+
+_cache: Optional[PackageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_package_cache() -> Optional[PackageCache]:
+    """The process wide package cache, None when disabled or the cache directory can not be created"""
+    global _cache
+    if not package_cache_enabled():
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = PackageCache()
+            except OSError as e:
+                logger.error(f"Package cache disabled, {_package_cache_dir()} is not usable: {e}")
+                return None
+        return _cache
@@ -0,0 +1,285 @@
+"""
+Persistent Python kernels for the sandbox.
+
+Data analysis tasks run many small code cells against the same data. A kernel
+is one long-lived interpreter (kernel_worker.py) per session: imports, loaded
+frames and variables stay in memory between cells, so pandas and matplotlib
+are imported once per session instead of once per command.
+
+Cells are sent as JSON lines; stdout/stderr come back while the cell runs,
+matplotlib figures still open at the end of a cell are saved under
+`figures/` in the sandbox directory. A cell past its timeout gets a
+KeyboardInterrupt first, which keeps the session state; a kernel that does not
+react within the grace period is killed and started fresh on the next cell.
+The address space of the worker is capped with RLIMIT_AS
+(SANDBOX_KERNEL_MEMORY_MB), so a runaway allocation raises MemoryError in the
+cell instead of pushing the host into swap.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import uuid
+import weakref
+from typing import AsyncIterator, Dict, Optional
+
+from .executor import READ_CHUNK_SIZE, kill_process_group
+from .shell_session import ShellSessionPool
+
+logger = logging.getLogger(__name__)
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernel_worker.py")
+
+# Seconds a kernel gets to start up and to react to an interrupt
+_STARTUP_TIMEOUT = 30.0
+_INTERRUPT_GRACE = 3.0
+
+# Largest protocol line, a cell printing more than this in one write is split by the worker
+_MAX_LINE = 32 * 1024 * 1024
+
+
+def _kernel_memory_mb() -> int:
+    return int(os.environ.get("SANDBOX_KERNEL_MEMORY_MB", "2048"))
+
+
+def _max_kernels() -> int:
+    return max(1, int(os.environ.get("SANDBOX_MAX_KERNELS", "4")))
+
+
+def _kernel_idle_timeout() -> float:
+    return float(os.environ.get("SANDBOX_KERNEL_IDLE_TIMEOUT", "1800"))
+
+
+class PythonKernel:
+    """One interpreter process, running one cell at a time"""
+
+    kind = "python kernel"
+
+    def __init__(self, session_id: str, cwd: str, env: Dict[str, str]):
+        self.session_id = session_id
+        self.cwd = cwd
+        self.env = env
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.execution_count = 0
+        self.restarts = 0
+        self._messages: Optional[asyncio.Queue] = None
+        self._readers = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def _start(self):
+        if self.process is not None:
+            self.restarts += 1
+        env = dict(self.env)
+        env["SANDBOX_KERNEL_MEMORY_MB"] = str(_kernel_memory_mb())
+        env["SANDBOX_KERNEL_FIGURES_DIR"] = os.path.join(self.cwd, "figures")
+        env["PYTHONUNBUFFERED"] = "1"
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            env=env,
+            start_new_session=True,
+            limit=_MAX_LINE,
+        )
+        self.execution_count = 0
+        self._messages = asyncio.Queue()
+        self._readers = [
+            asyncio.create_task(self._read_messages(self.process.stdout, self._messages)),
+            asyncio.create_task(self._read_stderr(self.process.stderr, self._messages)),
+        ]
+        output = []
+        deadline = time.monotonic() + _STARTUP_TIMEOUT
+        while True:
+            try:
+                message = await asyncio.wait_for(self._messages.get(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                message = {"type": "eof"}
+            if message.get("type") == "ready":
+                break
+            if message.get("type") == "eof":
+                await self._kill()
+                raise RuntimeError(f"Python kernel failed to start: {''.join(output)[-2000:]}")
+            # warnings printed while the interpreter starts
+            output.append(message.get("text", ""))
+        logger.info(f"Started python kernel {self.session_id} (pid {self.process.pid})")
+
+    @staticmethod
+    async def _read_messages(stream: asyncio.StreamReader, queue: asyncio.Queue):
+        try:
+            while True:
+                line = await stream.readline()
+                if not line:
+                    break
+                try:
+                    await queue.put(json.loads(line))
+                except ValueError:
+                    await queue.put({"type": "stream", "name": "stdout", "text": line.decode(errors="replace")})
+        finally:
+            await queue.put({"type": "eof"})
+
+    @staticmethod
+    async def _read_stderr(stream: asyncio.StreamReader, queue: asyncio.Queue):
+        # fd level output: subprocesses, C extensions, tracebacks of a dying worker
+        while True:
+            chunk = await stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            await queue.put({"type": "stream", "name": "stderr", "text": chunk.decode(errors="replace")})
+
+    async def stream(self, code: str, timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+        """
+        Run a code cell and yield its output as it is produced.
+
+        Args:
+            code: Python source, the value of a trailing expression is reported like in a notebook
+            timeout: Seconds before the cell is interrupted, None for no limit
+
+        Yields:
+            Dict: stdout/stderr, result, figure and error events, then an exit event
+        """
+        async with self._lock:
+            start = time.monotonic()
+            restarted = False
+            try:
+                if not self.alive:
+                    await self._start()
+            except Exception as e:
+                logger.error(f"Failed to start python kernel {self.session_id}: {e}")
+                yield {"type": "stderr", "data": str(e)}
+                yield {"type": "exit", "exit_code": 1, "timed_out": False, "duration": 0.0,
+                       "session_id": self.session_id, "execution_count": self.execution_count, "restarted": True}
+                return
+
+            request_id = uuid.uuid4().hex
+            status, timed_out, finished = "error", False, False
+            deadline = start + timeout if timeout else None
+            try:
+                self.process.stdin.write((json.dumps({"id": request_id, "code": code}) + "\n").encode())
+                await self.process.stdin.drain()
+                while True:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if not timed_out and remaining is not None and remaining <= 0:
+                        timed_out = True
+                        deadline = time.monotonic() + _INTERRUPT_GRACE
+                        logger.warning(f"Cell in python kernel {self.session_id} timed out after {timeout} seconds")
+                        try:
+                            os.kill(self.process.pid, signal.SIGINT)
+                        except ProcessLookupError:
+                            pass
+                        continue
+                    try:
+                        message = await asyncio.wait_for(self._messages.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        if timed_out:
+                            # no reaction to the interrupt
+                            break
+                        continue
+                    kind = message.get("type")
+                    if kind == "stream":
+                        yield {"type": message["name"], "data": message["text"]}
+                    elif kind == "result":
+                        yield {"type": "result", "data": message["data"]}
+                    elif kind == "figure":
+                        yield {"type": "figure", "path": message["path"]}
+                    elif kind == "error":
+                        yield {"type": "error", "ename": message["ename"], "evalue": message["evalue"],
+                               "traceback": message["traceback"]}
+                    elif kind == "done" and message.get("id") == request_id:
+                        status, finished = message["status"], True
+                        self.execution_count = message["execution_count"]
+                        break
+                    elif kind == "eof":
+                        yield {"type": "stderr", "data": "Python kernel exited, its state is lost"}
+                        break
+            except (BrokenPipeError, ConnectionResetError):
+                yield {"type": "stderr", "data": "Python kernel exited, its state is lost"}
+            finally:
+                if not finished:
+                    # unresponsive, exited, or the consumer went away mid-cell
+                    restarted = True
+                    await self._kill()
+                self.last_used = time.monotonic()
+
+            if timed_out:
+                yield {"type": "stderr", "data": f"Cell timed out after {timeout} seconds"
+                                                 + (", python kernel restarted" if restarted else "")}
+            yield {
+                "type": "exit",
+                "exit_code": 124 if timed_out else (0 if status == "ok" else 1),
+                "timed_out": timed_out,
+                "duration": time.monotonic() - start,
+                "session_id": self.session_id,
+                "execution_count": self.execution_count,
+                "restarted": restarted,
+            }
+
+    async def _kill(self):
+        for reader in self._readers:
+            reader.cancel()
+        self._readers = []
+        if self.alive:
+            await kill_process_group(self.process, _INTERRUPT_GRACE)
+        elif self.process is not None:
+            await self.process.wait()
+
+    async def close(self):
+        async with self._lock:
+            await self._kill()
+        logger.info(f"Closed {self.kind} {self.session_id}")
+
+    def terminate(self):
+        """Kill the interpreter right away, usable outside the kernel's event loop"""
+        if self.alive:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def get_info(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "alive": self.alive,
+            "busy": self.busy,
+            "execution_count": self.execution_count,
+            "restarts": self.restarts,
+            "created_at": self.created_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ShellSessionPool]" = weakref.WeakKeyDictionary()
+
+
+def get_kernel_pool() -> ShellSessionPool:
+    """The kernels of the running event loop"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = ShellSessionPool(max_sessions=_max_kernels(), idle_timeout=_kernel_idle_timeout(),
+                                               session_factory=PythonKernel)
+    return pool
+
+
+def discard_kernels(owner: str) -> int:
+    """Kill the kernels of a sandbox on every event loop"""
+    return sum(pool.discard_owner(owner) for pool in list(_pools.values()))
+
+
+def count_kernels(owner: str) -> int:
+    """Live kernels of a sandbox on every event loop"""
+    return sum(pool.count_owner(owner) for pool in list(_pools.values()))
@@ -0,0 +1,349 @@
+"""
+Persistent shell sessions for the sandbox.
+
+A session is one long-lived bash process. Commands are written to its stdin
+and passed to `eval`, so `cd`, exported variables, functions and aliases carry
+over to the next command, and pipes, globs and redirections work as in a
+terminal. After each command the shell prints a sentinel line with a marker
+unique to that command, followed by the exit status and the working directory,
+on stdout and once more on stderr; output is streamed until both sentinels
+have been read.
+
+A command that times out takes its session with it: the process group is
+killed and the next command starts a fresh shell in the sandbox directory.
+Sessions idle for longer than SANDBOX_SHELL_IDLE_TIMEOUT are closed, and when
+SANDBOX_MAX_SHELL_SESSIONS are open the least recently used idle one makes
+room for a new one.
+"""
+import asyncio
+import codecs
+import logging
+import os
+import shlex
+import signal
+import time
+import uuid
+import weakref
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .executor import READ_CHUNK_SIZE, _kill_grace, kill_process_group
+
+logger = logging.getLogger(__name__)
+
+_SENTINEL_PREFIX = "__SANDBOX_DONE_"
+
+
+def _max_shell_sessions() -> int:
+    return max(1, int(os.environ.get("SANDBOX_MAX_SHELL_SESSIONS", "16")))
+
+
+def _shell_idle_timeout() -> float:
+    return float(os.environ.get("SANDBOX_SHELL_IDLE_TIMEOUT", "900"))
+
+
+class ShellSession:
+    """One bash process, running one command at a time"""
+
+    kind = "shell session"
+
+    def __init__(self, session_id: str, cwd: str, env: Dict[str, str]):
+        self.session_id = session_id
+        self.initial_cwd = cwd
+        self.env = env
+        self.cwd = cwd
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.commands = 0
+        self.restarts = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def _start(self):
+        if self.process is not None:
+            self.restarts += 1
+        self.process = await asyncio.create_subprocess_exec(
+            "bash", "--noprofile", "--norc",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.initial_cwd,
+            env=self.env,
+            start_new_session=True,
+        )
+        self.cwd = self.initial_cwd
+        logger.info(f"Started shell session {self.session_id} (pid {self.process.pid})")
+
+    async def stream(self, command: str, timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+        """
+        Run a command in the session and yield its output as it is produced.
+
+        Args:
+            command: Shell command line, may span several lines
+            timeout: Seconds before the session is killed, None for no limit
+
+        Yields:
+            Dict: stdout/stderr events, then an exit event with the exit code and working directory
+        """
+        async with self._lock:
+            if not self.alive:
+                await self._start()
+            self.commands += 1
+            start = time.monotonic()
+            marker = f"{_SENTINEL_PREFIX}{uuid.uuid4().hex}__".encode()
+            # eval keeps a syntax error in the command from swallowing the sentinel lines
+            script = (
+                f"eval {shlex.quote(command)} < /dev/null\n"
+                f"__sandbox_rc=$?\n"
+                f"printf '\\n%s %d %s\\n' '{marker.decode()}' \"$__sandbox_rc\" \"$PWD\"\n"
+                f"printf '\\n%s\\n' '{marker.decode()}' >&2\n"
+            )
+            process = self.process
+            queue: asyncio.Queue = asyncio.Queue()
+            readers = [
+                asyncio.create_task(self._read_until(process.stdout, "stdout", marker, queue)),
+                asyncio.create_task(self._read_until(process.stderr, "stderr", marker, queue)),
+            ]
+            exit_code, timed_out, open_streams = None, False, len(readers)
+            deadline = start + timeout if timeout else None
+            try:
+                process.stdin.write(script.encode())
+                await process.stdin.drain()
+                while open_streams:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        timed_out = True
+                        break
+                    try:
+                        event = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        timed_out = True
+                        break
+                    if event is None:
+                        open_streams -= 1
+                    elif event["type"] == "status":
+                        exit_code, self.cwd = event["exit_code"], event["cwd"]
+                    else:
+                        yield event
+            except (BrokenPipeError, ConnectionResetError):
+                # the shell exited between two commands
+                pass
+            finally:
+                for reader in readers:
+                    reader.cancel()
+                if timed_out or exit_code is None:
+                    # timed out, `exit` in the command, or the consumer went away mid-command
+                    await self._kill()
+                self.last_used = time.monotonic()
+
+            if timed_out:
+                logger.warning(f"Command in shell session {self.session_id} timed out after {timeout} seconds")
+                yield {"type": "stderr", "data": f"Command timed out after {timeout} seconds, shell session restarted"}
+                exit_code = 124
+            elif exit_code is None:
+                exit_code = process.returncode if process.returncode is not None else 1
+            yield {
+                "type": "exit",
+                "exit_code": exit_code,
+                "timed_out": timed_out,
+                "duration": time.monotonic() - start,
+                "session_id": self.session_id,
+                "cwd": self.cwd,
+            }
+
+    @staticmethod
+    async def _read_until(stream: asyncio.StreamReader, name: str, marker: bytes, queue: asyncio.Queue):
+        """Forward output until the marker line, stdout also reports the exit status after it"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # the sentinel is printed after a newline of its own, the one that belongs to the output is kept
+        needle = b"\n" + marker
+        buffer = b""
+        try:
+            while True:
+                index = buffer.find(needle)
+                if index >= 0:
+                    text = decoder.decode(buffer[:index], final=True)
+                    if text:
+                        await queue.put({"type": name, "data": text})
+                    rest = buffer[index + len(needle):]
+                    while b"\n" not in rest:
+                        chunk = await stream.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            return
+                        rest += chunk
+                    if name == "stdout":
+                        exit_code, _, cwd = rest.split(b"\n", 1)[0].strip().partition(b" ")
+                        await queue.put({"type": "status", "exit_code": int(exit_code),
+                                         "cwd": cwd.decode(errors="replace")})
+                    return
+                # hold back what could be the start of a sentinel split across reads
+                keep = len(needle) - 1
+                if len(buffer) > keep:
+                    text = decoder.decode(buffer[:-keep])
+                    if text:
+                        await queue.put({"type": name, "data": text})
+                    buffer = buffer[-keep:]
+                chunk = await stream.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    text = decoder.decode(buffer, final=True)
+                    if text:
+                        await queue.put({"type": name, "data": text})
+                    return
+                buffer += chunk
+        finally:
+            await queue.put(None)
+
+    async def _kill(self):
+        if self.alive:
+            await kill_process_group(self.process, _kill_grace())
+        elif self.process is not None:
+            await self.process.wait()
+
+    async def close(self):
+        async with self._lock:
+            await self._kill()
+        logger.info(f"Closed {self.kind} {self.session_id}")
+
+    def terminate(self):
+        """Kill the process group right away, usable outside the session's event loop"""
+        if self.alive:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def get_info(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "alive": self.alive,
+            "busy": self.busy,
+            "cwd": self.cwd,
+            "commands": self.commands,
+            "restarts": self.restarts,
+            "created_at": self.created_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class ShellSessionPool:
+    """
+    Long-lived sessions of one event loop, keyed by (sandbox, session id).
+
+    Holds shell sessions by default, `session_factory` can be any class with
+    the ShellSession interface (the Python kernels use one too).
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, idle_timeout: Optional[float] = None,
+                 session_factory: Callable[[str, str, Dict[str, str]], ShellSession] = ShellSession):
+        self.max_sessions = max_sessions or _max_shell_sessions()
+        self.idle_timeout = _shell_idle_timeout() if idle_timeout is None else idle_timeout
+        self.session_factory = session_factory
+        self._sessions: Dict[Tuple[str, str], ShellSession] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def acquire(self, owner: str, session_id: str, cwd: str, env: Dict[str, str]) -> ShellSession:
+        """
+        Get the session with this id, creating it if needed.
+
+        Args:
+            owner: Id of the sandbox the session works in
+            session_id: Session id chosen by the caller
+            cwd: Directory a new shell starts in
+            env: Environment of a new shell
+
+        Returns:
+            ShellSession: The session, its shell is started on first use
+        """
+        key = (owner, session_id)
+        session = self._sessions.get(key)
+        if session is None:
+            if len(self._sessions) >= self.max_sessions:
+                await self._evict_one()
+            session = self._sessions[key] = self.session_factory(session_id, cwd, env)
+        session.last_used = time.monotonic()
+        if self.idle_timeout and (self._reaper is None or self._reaper.done()):
+            self._reaper = asyncio.create_task(self._reap_loop())
+        return session
+
+    async def _evict_one(self):
+        idle = [(key, session) for key, session in self._sessions.items() if not session.busy]
+        if not idle:
+            raise RuntimeError(f"All {self.max_sessions} sessions are busy")
+        key, session = min(idle, key=lambda item: item[1].last_used)
+        logger.info(f"Evicting least recently used {session.kind} {session.session_id}")
+        del self._sessions[key]
+        await session.close()
+
+    async def close(self, owner: str, session_id: str) -> bool:
+        session = self._sessions.pop((owner, session_id), None)
+        if session is None:
+            return False
+        await session.close()
+        return True
+
+    async def reap_idle(self):
+        """Close sessions that have not run a command for idle_timeout seconds"""
+        now = time.monotonic()
+        expired = [key for key, session in self._sessions.items()
+                   if not session.busy and now - session.last_used > self.idle_timeout]
+        for key in expired:
+            session = self._sessions.pop(key)
+            logger.info(f"Closing {session.kind} {session.session_id} after {self.idle_timeout:.0f}s idle")
+            await session.close()
+
+    async def _reap_loop(self):
+        while self._sessions:
+            await asyncio.sleep(min(30.0, max(1.0, self.idle_timeout / 2)))
+            await self.reap_idle()
+
+    async def close_all(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+
+    def discard_owner(self, owner: str) -> int:
+        """Kill and forget every session of a sandbox that is being removed"""
+        keys = [key for key in self._sessions if key[0] == owner]
+        for key in keys:
+            self._sessions.pop(key).terminate()
+        return len(keys)
+
+    def count_owner(self, owner: str) -> int:
+        """Live sessions of a sandbox, safe to call from another thread"""
+        return sum(1 for (session_owner, _), session in list(self._sessions.items())
+                   if session_owner == owner and session.alive)
+
+    def list_sessions(self, owner: Optional[str] = None) -> List[Dict]:
+        return [session.get_info() for (session_owner, _), session in self._sessions.items()
+                if owner is None or session_owner == owner]
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ShellSessionPool]" = weakref.WeakKeyDictionary()
+
+
+def get_shell_session_pool() -> ShellSessionPool:
+    """The pool of the running event loop, shell pipes cannot be shared between loops"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = ShellSessionPool()
+    return pool
+
+
+def discard_shell_sessions(owner: str) -> int:
+    """Kill the shell sessions of a sandbox on every event loop"""
+    return sum(pool.discard_owner(owner) for pool in list(_pools.values()))
+
+
+def count_shell_sessions(owner: str) -> int:
+    """Live shell sessions of a sandbox on every event loop"""
+    return sum(pool.count_owner(owner) for pool in list(_pools.values()))
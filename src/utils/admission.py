@@ -0,0 +1,505 @@
+"""
+Admission control for the API endpoints that start browsers and processes.
+
+Under a burst every agent, research and sandbox call used to start at once,
+each one launching a browser or a subprocess, until the box ran out of
+memory. Every such endpoint (/api/run-agent, /api/research, the sandbox
+command, batch, WebSocket, Python and background process endpoints) now has
+a gate:
+
+- a client (X-Client-Id, else its address) gets a token bucket per gate,
+  ADMISSION_CLIENT_RATE requests per second with bursts of
+  ADMISSION_CLIENT_BURST, beyond which it is refused right away;
+- at most ADMISSION_<GATE>_CONCURRENCY requests run at a time (0 for no
+  limit), and only while the gate's capacity probes report room: memory
+  headroom (MemAvailable, or the cgroup limit when lower), free job workers
+  and job queue room, the submission quota
+  (ADMISSION_SUBMISSIONS_PER_MINUTE, and a cooldown after the LLM provider
+  throttled a run);
+- other requests wait in a FIFO of at most ADMISSION_<GATE>_QUEUE entries
+  for up to ADMISSION_QUEUE_TIMEOUT seconds.
+
+AdmissionMiddleware holds a slot until the endpoint is done with it: the
+response is sent, a server-sent event stream ends or a WebSocket closes.
+Refused requests get a 429 with a Retry-After estimated from the gate's
+service times, refused WebSockets are closed with code 1013 (try again
+later). The gates count admitted, queued and refused requests.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+_CAPACITY_RECHECK = 0.5
+_MAX_RETRY_AFTER = 60
+
+
+def admission_enabled() -> bool:
+    return os.environ.get("ADMISSION_CONTROL", "true").lower() == "true"
+
+
+def _queue_timeout() -> float:
+    return float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+
+def _client_rate() -> float:
+    return float(os.environ.get("ADMISSION_CLIENT_RATE", "2"))
+
+
+def _client_burst() -> int:
+    return max(1, int(os.environ.get("ADMISSION_CLIENT_BURST", "10")))
+
+
+def _min_free_memory_mb() -> int:
+    return int(os.environ.get("ADMISSION_MIN_FREE_MEMORY_MB", "512"))
+
+
+def _provider_cooldown() -> float:
+    return float(os.environ.get("ADMISSION_PROVIDER_COOLDOWN", "30"))
+
+
+def gate_limits(name: str, concurrency: int, queue: int):
+    """ADMISSION_<NAME>_CONCURRENCY (0 for no limit) and ADMISSION_<NAME>_QUEUE, with defaults"""
+    prefix = f"ADMISSION_{name.upper().replace('-', '_')}"
+    return (max(0, int(os.environ.get(f"{prefix}_CONCURRENCY", str(concurrency)))),
+            max(0, int(os.environ.get(f"{prefix}_QUEUE", str(queue)))))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a gate refuses a request"""
+
+    def __init__(self, gate: str, reason: str, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.gate = gate
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class TokenBucket:
+    """rate tokens per second, at most burst of them saved up"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> int:
+        self._refill()
+        return int(self.tokens)
+
+    def take(self) -> float:
+        """Take a token, returns 0 or the seconds until one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float(_MAX_RETRY_AFTER)
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+def read_memory_available() -> Optional[int]:
+    """Bytes of memory that can still be used, the lower of MemAvailable and the cgroup headroom"""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                headroom = int(limit) - int(f.read().strip())
+            available = headroom if available is None else min(available, headroom)
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+class CapacityProbe:
+    """How many more requests a resource has room for, None when it sets no limit"""
+    name = "capacity"
+
+    def free(self) -> Optional[int]:
+        return None
+
+    async def refresh(self):
+        """Called before the gate looks at free(), for probes that measure off the event loop"""
+
+    def take(self):
+        """Called when a request is admitted"""
+
+    def retry_after(self) -> Optional[float]:
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"free": self.free()}
+
+
+class MemoryProbe(CapacityProbe):
+    """Requests that fit in the memory left above ADMISSION_MIN_FREE_MEMORY_MB"""
+    name = "memory"
+
+    def __init__(self, per_request_mb: int, min_free_mb: Optional[int] = None,
+                 reader: Callable[[], Optional[int]] = read_memory_available):
+        self.per_request_mb = per_request_mb
+        self.min_free_mb = _min_free_memory_mb() if min_free_mb is None else min_free_mb
+        self.reader = reader
+
+    def free(self) -> Optional[int]:
+        available = self.reader()
+        if available is None:
+            return None
+        headroom = available / _MB - self.min_free_mb
+        return max(0, int(headroom // self.per_request_mb)) if self.per_request_mb else (1 if headroom > 0 else 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        available = self.reader()
+        return {"free": self.free(), "available_mb": round(available / _MB) if available is not None else None,
+                "per_request_mb": self.per_request_mb, "min_free_mb": self.min_free_mb}
+
+
+class FunctionProbe(CapacityProbe):
+    """Capacity reported by a function, e.g. free job workers or pooled browsers. A coroutine function is awaited on refresh()."""
+
+    def __init__(self, name: str, free: Callable[[], Union[Optional[int], Awaitable[Optional[int]]]]):
+        self.name = name
+        self._free = free
+        self._is_async = asyncio.iscoroutinefunction(free)
+        self._measured: Optional[int] = None
+
+    def free(self) -> Optional[int]:
+        return self._measured if self._is_async else self._free()
+
+    async def refresh(self):
+        if self._is_async:
+            self._measured = await self._free()
+
+    def take(self):
+        # until the next refresh, count the admitted request against the last measurement
+        if self._is_async and self._measured is not None:
+            self._measured -= 1
+
+
+class SubmissionQuota(CapacityProbe):
+    """
+    Admitted submissions per minute, and a pause after the LLM provider throttled a run.
+
+    This counts requests admitted through the gates it is attached to, not
+    the LLM calls a run makes: a run makes a varying number of them, so set
+    the rate from the provider's quota divided by the calls a typical run uses.
+    """
+    name = "submissions"
+
+    def __init__(self, per_minute: Optional[float] = None):
+        rpm = float(os.environ.get("ADMISSION_SUBMISSIONS_PER_MINUTE", "0")) if per_minute is None \
+            else per_minute
+        self.bucket = TokenBucket(rpm / 60, max(1, int(rpm))) if rpm > 0 else None
+        self.cooldown_until = 0.0
+        self.throttled = 0
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """The provider refused a request (HTTP 429, quota exceeded), admit nothing for a while"""
+        retry_after = _provider_cooldown() if retry_after is None else retry_after
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+        self.throttled += 1
+        logger.warning(f"LLM provider throttled, holding submissions for {retry_after:.0f}s")
+
+    def free(self) -> Optional[int]:
+        if time.monotonic() < self.cooldown_until:
+            return 0
+        return self.bucket.available() if self.bucket is not None else None
+
+    def take(self):
+        if self.bucket is not None:
+            self.bucket.take()
+
+    def retry_after(self) -> Optional[float]:
+        cooldown = self.cooldown_until - time.monotonic()
+        if cooldown > 0:
+            return cooldown
+        if self.bucket is not None and self.bucket.available() < 1:
+            return (1 - self.bucket.tokens) / self.bucket.rate
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"free": self.free(), "throttled": self.throttled,
+                "cooldown": round(max(0.0, self.cooldown_until - time.monotonic()), 1)}
+
+
+class _Waiter:
+    def __init__(self):
+        self.future: Optional[asyncio.Future] = None
+
+
+class AdmissionGate:
+    """Concurrency limit, wait queue and per-client rate limit of one endpoint, on one event loop"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, probes: Optional[List[CapacityProbe]] = None,
+                 queue_timeout: Optional[float] = None, client_rate: Optional[float] = None,
+                 client_burst: Optional[int] = None):
+        """
+        Args:
+            name: Name of the gate in metrics and errors
+            max_concurrent: Requests running at once at most, 0 to only wait for the probes
+            max_queued: Requests waiting at most
+            probes: Capacities that must all have room before a request starts
+            queue_timeout: Seconds a request waits at most (defaults to ADMISSION_QUEUE_TIMEOUT)
+            client_rate: Requests per second per client (defaults to ADMISSION_CLIENT_RATE, 0 disables)
+            client_burst: Requests a client may save up (defaults to ADMISSION_CLIENT_BURST)
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.probes = probes or []
+        self.queue_timeout = _queue_timeout() if queue_timeout is None else queue_timeout
+        self.client_rate = _client_rate() if client_rate is None else client_rate
+        self.client_burst = client_burst or _client_burst()
+        self.active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0,
+                       "wait_total": 0.0, "service_total": 0.0, "served": 0}
+
+    def _blocking_probe(self) -> Optional[CapacityProbe]:
+        for probe in self.probes:
+            free = probe.free()
+            if free is not None and free < 1:
+                return probe
+        return None
+
+    def _can_start(self) -> bool:
+        return (not self.max_concurrent or self.active < self.max_concurrent) and self._blocking_probe() is None
+
+    async def _refresh_probes(self):
+        for probe in self.probes:
+            await probe.refresh()
+
+    def _start(self):
+        self.active += 1
+        self._stats["admitted"] += 1
+        for probe in self.probes:
+            probe.take()
+
+    def _retry_after(self) -> int:
+        """Seconds until the requests ahead are likely through"""
+        served = self._stats["served"]
+        service = self._stats["service_total"] / served if served else 1.0
+        estimate = service * (len(self._waiters) + 1) / max(1, self.max_concurrent or self.active)
+        probe = self._blocking_probe()
+        if probe is not None and probe.retry_after() is not None:
+            estimate = max(estimate, probe.retry_after())
+        return max(1, min(_MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def _reject(self, reason: str, detail: str, retry_after: Optional[int] = None) -> AdmissionRejected:
+        self._stats[reason] += 1
+        return AdmissionRejected(self.name, reason, retry_after or self._retry_after(), detail)
+
+    def _check_client(self, client: str):
+        if self.client_rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # clients that stopped calling have refilled, forget them
+                self._buckets = {key: value for key, value in self._buckets.items() if not value.full}
+            bucket = self._buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+        wait = bucket.take()
+        if wait:
+            raise self._reject("rate_limited", f"Too many {self.name} requests from {client}",
+                               max(1, math.ceil(wait)))
+
+    def _wake_next(self):
+        if self._waiters:
+            future = self._waiters[0].future
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def acquire(self, client: str) -> float:
+        """
+        Wait for a slot.
+
+        Args:
+            client: Client the request is counted against
+
+        Returns:
+            float: Seconds the request waited
+
+        Raises:
+            AdmissionRejected: When the client is over its rate, the queue is full or the wait timed out
+        """
+        self._check_client(client)
+        await self._refresh_probes()
+        if not self._waiters and self._can_start():
+            self._start()
+            return 0.0
+        if len(self._waiters) >= self.max_queued:
+            probe = self._blocking_probe()
+            raise self._reject("queue_full", f"{self.name} is at capacity"
+                               + (f" ({probe.name})" if probe is not None else "") + ", try again later")
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        try:
+            while True:
+                if self._waiters[0] is waiter:
+                    await self._refresh_probes()
+                if self._waiters[0] is waiter and self._can_start():
+                    self._waiters.popleft()
+                    self._start()
+                    waited = time.monotonic() - start
+                    self._stats["wait_total"] += waited
+                    # the next one may fit as well
+                    self._wake_next()
+                    return waited
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._reject("queue_timeout",
+                                       f"{self.name} request waited {self.queue_timeout:.0f}s without a slot")
+                if waiter.future is None or waiter.future.done():
+                    waiter.future = loop.create_future()
+                try:
+                    # capacity also frees up without a release (memory, quota), look again now and then
+                    await asyncio.wait_for(waiter.future, min(remaining, _CAPACITY_RECHECK))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiter in self._waiters:
+                head = self._waiters[0] is waiter
+                self._waiters.remove(waiter)
+                if head:
+                    self._wake_next()
+
+    def release(self, started: float):
+        """Free a slot taken at time.monotonic() `started`"""
+        self.active = max(0, self.active - 1)
+        self._stats["served"] += 1
+        self._stats["service_total"] += time.monotonic() - started
+        self._wake_next()
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued, served = self._stats["queued"], self._stats["served"]
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "waiting": len(self._waiters),
+            "max_queued": self.max_queued,
+            "admitted": self._stats["admitted"],
+            "queued": queued,
+            "rejected": {reason: self._stats[reason] for reason in ("rate_limited", "queue_full", "queue_timeout")},
+            "average_wait": round(self._stats["wait_total"] / queued, 3) if queued else None,
+            "average_service": round(self._stats["service_total"] / served, 3) if served else None,
+            "capacity": {probe.name: probe.get_stats() for probe in self.probes},
+        }
+
+
+class AdmissionController:
+    """The gates of the API server by request method and path"""
+
+    def __init__(self):
+        self.gates: Dict[str, AdmissionGate] = {}
+        self._routes: Dict[Tuple[str, str], AdmissionGate] = {}
+
+    def add(self, paths: Union[str, Iterable[str]], gate: AdmissionGate,
+            methods: Iterable[str] = ("POST",)) -> AdmissionGate:
+        """
+        Gate endpoints.
+
+        Args:
+            paths: Exact request path or paths sharing the gate
+            gate: The gate
+            methods: Request methods gated, "WEBSOCKET" for WebSocket connections
+        """
+        for path in [paths] if isinstance(paths, str) else paths:
+            self.gates[path] = gate
+            for method in methods:
+                self._routes[(method, path)] = gate
+        return gate
+
+    def gate_for(self, method: str, path: str) -> Optional[AdmissionGate]:
+        return self._routes.get((method, path))
+
+    def get_stats(self) -> Dict[str, Any]:
+        gates: Dict[str, Dict[str, Any]] = {}
+        for path, gate in self.gates.items():
+            entry = gates.setdefault(gate.name, {"paths": [], **gate.get_stats()})
+            entry["paths"].append(path)
+        return {"enabled": admission_enabled(), "gates": gates}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware putting the gated endpoints behind their gates.
+
+    Unlike an HTTP middleware, which returns once the response headers are
+    out, it holds the slot for the whole ASGI call, so a server-sent event
+    stream or a WebSocket keeps its slot until it ends.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not admission_enabled():
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"] if scope["type"] == "http" else "WEBSOCKET"
+        gate = self.controller.gate_for(method, scope["path"])
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        client = Headers(scope=scope).get("x-client-id") or (scope["client"][0] if scope.get("client") else "unknown")
+        try:
+            await gate.acquire(client)
+        except AdmissionRejected as e:
+            if scope["type"] == "websocket":
+                # closing before the accept refuses the handshake
+                await send({"type": "websocket.close", "code": 1013, "reason": e.detail[:120]})
+                return
+            response = JSONResponse(status_code=429, content={"detail": e.detail, "reason": e.reason, "gate": e.gate},
+                                    headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(started)
+
+
+_THROTTLE_PATTERN = re.compile(r"\b429\b|rate.?limit|too many requests|insufficient_quota|resource.?exhausted",
+                               re.IGNORECASE)
+
+
+def is_provider_throttle(error: Optional[str]) -> bool:
+    """Whether an error is an LLM provider refusing requests over its quota"""
+    return bool(error and _THROTTLE_PATTERN.search(str(error)))
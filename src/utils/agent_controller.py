@@ -8,7 +8,7 @@ import json
 import asyncio
 from typing import Dict, List, Optional, Any
 
-from src.sandbox import Sandbox
+from src.sandbox import Sandbox, get_sandbox_manager
 
 logger = logging.getLogger(__name__)
 
@@ -17,20 +17,28 @@ class AgentController:
     Controller for autonomous agent that can execute tasks in sandbox
     and other environments
     """
-    def __init__(self):
-        self.sandbox = Sandbox()
-        self.sandbox.start()
+    def __init__(self, sandbox_key: str = "agent", browser_lease=None):
+        self.sandbox_key = sandbox_key
+        # browser checked out of the pool for this controller, e.g. by a job worker
+        self.browser_lease = browser_lease
         self.tasks = []
         self.is_running = False
         self.current_task = None
     
-    async def execute_task(self, task: str, additional_context: Optional[str] = None) -> Dict[str, Any]:
+    @property
+    def sandbox(self) -> Sandbox:
+        """The sandbox of this controller, managed by the sandbox manager"""
+        return get_sandbox_manager().get(self.sandbox_key)
+    
+    async def execute_task(self, task: str, additional_context: Optional[str] = None,
+                           run_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Execute a task with the agent
         
         Args:
             task: The task to execute
             additional_context: Additional context or instructions
+            run_id: Run in the sandbox of this run instead of the controller's own
             
         Returns:
             Dict with execution results
@@ -46,7 +54,8 @@ class AgentController:
                 if not command or len(command) < 3:
                     command = "echo 'Hello from sandbox'"
                     
-                result = self.sandbox.execute_command(command)
+                sandbox = get_sandbox_manager().get(run_id) if run_id else self.sandbox
+                result = await sandbox.execute_command_async(command)
                 return {
                     "success": result.get("success", False),
                     "output": result.get("stdout", ""),
@@ -2,23 +2,17 @@ import asyncio
 
 
 class AgentState:
-    _instance = None
+    """Stop request and last browser state of one session, see session_registry"""
 
     def __init__(self):
-        if not hasattr(self, '_stop_requested'):
-            self._stop_requested = asyncio.Event()
-            self.last_valid_state = None  # store the last valid browser state
-            self.browser_state = {
-                "is_running": False,
-                "current_url": None,
-                "last_action": None,
-                "last_action_result": None
-            }
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(AgentState, cls).__new__(cls)
-        return cls._instance
+        self._stop_requested = asyncio.Event()
+        self.last_valid_state = None  # store the last valid browser state
+        self.browser_state = {
+            "is_running": False,
+            "current_url": None,
+            "last_action": None,
+            "last_action_result": None
+        }
 
     def request_stop(self):
         self._stop_requested.set()
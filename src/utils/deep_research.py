@@ -29,7 +29,8 @@ from langchain_core.messages import (
 from json_repair import repair_json
 from src.agent.custom_prompts import CustomSystemPrompt, CustomAgentMessagePrompt
 from src.browser.custom_browser import CustomBrowser
-from src.browser.custom_context import BrowserContextConfig, BrowserContext
+from src.browser.browser_pool import get_browser_pool, browser_pool_enabled
+from src.browser.custom_context import BrowserContextConfig, BrowserContext, CustomBrowserContextConfig
 from browser_use.browser.context import (
     BrowserContextConfig,
     BrowserContextWindowSize,
@@ -247,6 +248,34 @@ Provide your output as a JSON formatted list. Each item in the list must adhere
                 for page_id, page in enumerate(pages):
                     await page.close()
 
+            elif browser_pool_enabled():
+                # Parallel agents borrow warm browsers instead of launching one each
+                browser_pool = get_browser_pool(
+                    BrowserConfig(
+                        headless=kwargs.get("headless", False),
+                        disable_security=kwargs.get("disable_security", True),
+                    )
+                )
+                pooled_context_config = CustomBrowserContextConfig(use_vision=use_vision)
+
+                async def run_pooled_agent(query_task):
+                    async with browser_pool.checkout(context_config=pooled_context_config) as lease:
+                        agent = CustomAgent(
+                            task=query_task,
+                            llm=llm,
+                            add_infos=add_infos,
+                            browser=lease.browser,
+                            browser_context=lease.browser_context,
+                            use_vision=use_vision,
+                            system_prompt_class=CustomSystemPrompt,
+                            agent_prompt_class=CustomAgentMessagePrompt,
+                            max_actions_per_step=5,
+                            controller=controller,
+                        )
+                        return await agent.run(max_steps=kwargs.get("max_steps", 10))
+
+                query_results = await asyncio.gather(*[run_pooled_agent(task) for task in query_tasks])
+
             else:
                 agents = [CustomAgent(
                     task=task,
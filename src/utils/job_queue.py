@@ -0,0 +1,299 @@
+"""
+Job queue for agent tasks submitted through the API.
+
+POST /api/run-agent used to run the task inside the HTTP request, with one
+global agent controller, so the server ran one task at a time. Submitting a
+task now creates a job and returns its id; a pool of JOB_WORKERS async
+workers takes jobs from a bounded queue (JOB_QUEUE_SIZE, further submissions
+are refused) and runs them in parallel.
+
+Each worker holds its own sandbox (`job-worker-<n>` in the sandbox manager)
+and, with JOB_WORKER_BROWSER=true (off by default, the agent controller does
+not drive a browser), a browser leased from the pool on its first job and
+kept until the queue closes. Keep JOB_WORKERS at or below
+BROWSER_POOL_MAX_SIZE then, or workers wait for a browser.
+
+Finished jobs are kept for their results, the oldest ones beyond
+JOB_HISTORY are forgotten.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def _job_workers() -> int:
+    return max(1, int(os.environ.get("JOB_WORKERS", "4")))
+
+
+def _job_queue_size() -> int:
+    return max(1, int(os.environ.get("JOB_QUEUE_SIZE", "100")))
+
+
+def _job_history() -> int:
+    return max(1, int(os.environ.get("JOB_HISTORY", "1000")))
+
+
+def _worker_browser_enabled() -> bool:
+    return os.environ.get("JOB_WORKER_BROWSER", "false").lower() == "true"
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a job is submitted while JOB_QUEUE_SIZE jobs are waiting"""
+
+
+@dataclass
+class Job:
+    """One submitted task and what became of it"""
+    task: str
+    additional_info: str = ""
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    worker: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "task": self.task,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_time": round((self.started_at or self.finished_at or time.time()) - self.created_at, 3),
+            "run_time": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+            "worker": self.worker,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobWorker:
+    """A worker and the resources it keeps between jobs"""
+
+    def __init__(self, index: int, use_browser: bool):
+        self.index = index
+        self.sandbox_key = f"job-worker-{index}"
+        self.use_browser = use_browser
+        self.browser_lease = None
+        self.current: Optional[Job] = None
+        self.jobs_run = 0
+
+    async def lease_browser(self):
+        """The worker's browser, leased from the pool on first use, None when browsers are off"""
+        if self.browser_lease is None and self.use_browser:
+            from src.browser.browser_pool import browser_pool_enabled, get_browser_pool
+            if browser_pool_enabled():
+                try:
+                    self.browser_lease = await get_browser_pool().acquire()
+                except Exception as e:
+                    # the job still runs, tasks that need a browser fail on their own
+                    logger.error(f"Job worker {self.index} could not lease a browser: {e}")
+        return self.browser_lease
+
+    async def release(self):
+        if self.browser_lease is not None:
+            from src.browser.browser_pool import get_browser_pool
+            lease, self.browser_lease = self.browser_lease, None
+            try:
+                await get_browser_pool().release(lease)
+            except Exception as e:
+                logger.debug(f"Failed to release the browser of job worker {self.index}: {e}")
+
+
+class JobQueue:
+    """Bounded queue of jobs and the workers running them, on one event loop"""
+
+    def __init__(self, handler: Callable[[Job, JobWorker], Awaitable[Dict[str, Any]]],
+                 workers: Optional[int] = None, max_queued: Optional[int] = None,
+                 history: Optional[int] = None, use_browser: Optional[bool] = None):
+        """
+        Args:
+            handler: Runs a job on a worker and returns its result
+            workers: Jobs running at once (defaults to JOB_WORKERS)
+            max_queued: Jobs waiting at most (defaults to JOB_QUEUE_SIZE)
+            history: Finished jobs kept (defaults to JOB_HISTORY)
+            use_browser: Give every worker a pooled browser (defaults to JOB_WORKER_BROWSER)
+        """
+        self.handler = handler
+        self.worker_count = workers or _job_workers()
+        self.max_queued = max_queued or _job_queue_size()
+        self.history = history or _job_history()
+        self.use_browser = _worker_browser_enabled() if use_browser is None else use_browser
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.workers: List[JobWorker] = []
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        # cancelled jobs stay in the queue until a worker skips them
+        self._cancelled_queued = 0
+        self._closing = False
+        self._stats = {"submitted": 0, "rejected": 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0,
+                       "wait_total": 0.0, "run_total": 0.0}
+
+    def start(self):
+        """Start the workers on the running loop, does nothing when they run"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self.workers = [JobWorker(index, self.use_browser) for index in range(self.worker_count)]
+        self._tasks = [asyncio.create_task(self._work(worker)) for worker in self.workers]
+        logger.info(f"Started {self.worker_count} job worker(s)")
+
+    async def submit(self, task: str, additional_info: str = "") -> Job:
+        """
+        Queue a task.
+
+        Args:
+            task: The task to run
+            additional_info: Additional context or instructions
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        self.start()
+        if self._queued() >= self.max_queued:
+            self._stats["rejected"] += 1
+            raise JobQueueFull(f"{self._queued()} jobs are waiting, try again later")
+        job = Job(task=task, additional_info=additional_info or "")
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        self._stats["submitted"] += 1
+        self._forget_finished()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [job.to_dict() for job in self.jobs.values() if status is None or job.status == status]
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Wait until a job has finished, returns it (finished or not after timeout), None for unknown ids"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job, finished jobs are left as they are"""
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if job.status == QUEUED:
+            # the worker that takes it off the queue skips it
+            self._cancelled_queued += 1
+            self._finish(job, CANCELLED, error="Cancelled before it started")
+        else:
+            self._running[job_id].cancel()
+        return job
+
+    async def _work(self, worker: JobWorker):
+        while True:
+            job = await self._queue.get()
+            if job.status != QUEUED:
+                self._cancelled_queued -= 1
+                continue
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.worker = worker.index
+            worker.current = job
+            self._stats["wait_total"] += job.started_at - job.created_at
+            task = asyncio.create_task(self.handler(job, worker))
+            self._running[job.job_id] = task
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if self._closing:
+                    self._finish(job, CANCELLED, error="Job queue closed")
+                    raise
+                self._finish(job, CANCELLED, error="Cancelled while running")
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {e}")
+                self._finish(job, FAILED, error=str(e))
+            else:
+                self._finish(job, SUCCEEDED if result.get("success", True) else FAILED, result=result,
+                             error=result.get("error") if not result.get("success", True) else None)
+            finally:
+                self._running.pop(job.job_id, None)
+                worker.current = None
+                worker.jobs_run += 1
+
+    def _finish(self, job: Job, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        job.status = status
+        job.finished_at = time.time()
+        job.result = result
+        job.error = error
+        self._stats[status] += 1
+        if job.started_at:
+            self._stats["run_total"] += job.finished_at - job.started_at
+        job.done.set()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def _queued(self) -> int:
+        return self._queue.qsize() - self._cancelled_queued if self._queue is not None else 0
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, busy workers and job counts"""
+        started = self._stats[SUCCEEDED] + self._stats[FAILED] + len(self._running)
+        finished = self._stats[SUCCEEDED] + self._stats[FAILED] + self._stats[CANCELLED]
+        return {
+            "workers": self.worker_count,
+            "busy_workers": len(self._running),
+            "queued": self._queued(),
+            "max_queued": self.max_queued,
+            "running": len(self._running),
+            "submitted": self._stats["submitted"],
+            "rejected": self._stats["rejected"],
+            "succeeded": self._stats[SUCCEEDED],
+            "failed": self._stats[FAILED],
+            "cancelled": self._stats[CANCELLED],
+            "average_wait": round(self._stats["wait_total"] / started, 3) if started else None,
+            "average_run": round(self._stats["run_total"] / finished, 3) if finished else None,
+        }
+
+    async def close(self):
+        """Stop the workers, cancelling running jobs, and release their browsers"""
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for worker in self.workers:
+            await worker.release()
+        for job in self.jobs.values():
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED, error="Job queue closed")
+        self._tasks = []
+        self._queue = None
+        self._cancelled_queued = 0
+        self._closing = False
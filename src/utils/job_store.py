@@ -0,0 +1,292 @@
+"""
+Durable job store shared by the API server and the job worker processes.
+
+One process runs every agent on one core. With `main.py --workers N` jobs
+are run by N worker processes instead (see job_workers), and the API server
+and the workers coordinate through a SQLite database in WAL mode at
+JOB_STORE_PATH: the API server inserts jobs, a worker claims the oldest
+queued job in a write transaction, so no job is claimed twice, and writes the
+result back. Readers never block the writer in WAL mode, and status queries
+of the API do not wait for running jobs.
+
+StoreJobQueue is the front-end the API server uses in place of the
+in-process JobQueue: same methods, jobs live in the store. Jobs survive a
+restart of the API server; jobs that were running when their worker process
+died are failed, not run again, since an agent task may have had effects.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .job_queue import CANCELLED, FAILED, FINISHED, QUEUED, RUNNING, SUCCEEDED, Job, JobQueueFull, \
+    _job_history, _job_queue_size
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    additional_info TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker INTEGER,
+    pid INTEGER,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker INTEGER PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    jobs_run INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_COLUMNS = "job_id, task, additional_info, status, created_at, started_at, finished_at, worker, result, error"
+
+
+def job_store_path() -> Optional[str]:
+    """The job store of the worker processes, None when jobs run in the API process"""
+    return os.environ.get("JOB_STORE_PATH") or None
+
+
+def _poll_interval() -> float:
+    return float(os.environ.get("JOB_STORE_POLL_INTERVAL", "0.2"))
+
+
+class JobStore:
+    """Jobs and worker heartbeats in a SQLite database, one instance per process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # autocommit, transactions are opened explicitly where reads and writes must not interleave
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _job(row) -> Optional[Job]:
+        if row is None:
+            return None
+        job_id, task, additional_info, status, created_at, started_at, finished_at, worker, result, error = row
+        job = Job(task=task, additional_info=additional_info, job_id=job_id, status=status, created_at=created_at,
+                  started_at=started_at, finished_at=finished_at, worker=worker,
+                  result=json.loads(result) if result is not None else None, error=error)
+        if status in FINISHED:
+            job.done.set()
+        return job
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        return self._job(self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def submit(self, task: str, additional_info: str = "", max_queued: Optional[int] = None) -> Job:
+        """
+        Queue a task.
+
+        Args:
+            task: The task to run
+            additional_info: Additional context or instructions
+            max_queued: Jobs waiting at most (defaults to JOB_QUEUE_SIZE)
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        max_queued = max_queued or _job_queue_size()
+        job = Job(task=task, additional_info=additional_info or "")
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if queued >= max_queued:
+                    raise JobQueueFull(f"{queued} jobs are waiting, try again later")
+                self._db.execute(
+                    "INSERT INTO jobs (job_id, task, additional_info, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job.job_id, job.task, job.additional_info, QUEUED, job.created_at))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def claim(self, worker: int, pid: int) -> Optional[Job]:
+        """Take the oldest queued job for a worker, None when nothing is queued"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                       (QUEUED,)).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute("UPDATE jobs SET status = ?, started_at = ?, worker = ?, pid = ? WHERE job_id = ?",
+                                 (RUNNING, time.time(), worker, pid, row[0]))
+                job = self._get(row[0])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        """Record the outcome of a running job"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+                             "WHERE job_id = ? AND status = ?",
+                             (status, time.time(), json.dumps(result) if result is not None else None, error,
+                              job_id, RUNNING))
+            self._db.execute("UPDATE workers SET jobs_run = jobs_run + 1 WHERE worker = "
+                             "(SELECT worker FROM jobs WHERE job_id = ?)", (job_id,))
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job, or ask the worker of a running one to cancel it"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ? AND status = ?",
+                                 (CANCELLED, time.time(), "Cancelled before it started", job_id, QUEUED))
+                self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?",
+                                 (job_id, RUNNING))
+                job = self._get(job_id)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def fail_running(self, error: str, pid: Optional[int] = None) -> int:
+        """Fail the running jobs of a worker process that died, or of every process when pid is None"""
+        with self._lock:
+            query = "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ?"
+            args = [FAILED, time.time(), error, RUNNING]
+            if pid is not None:
+                query += " AND pid = ?"
+                args.append(pid)
+            return self._db.execute(query, args).rowcount
+
+    def heartbeat(self, worker: int, pid: int, started_at: float):
+        with self._lock:
+            self._db.execute("INSERT INTO workers (worker, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT (worker) DO UPDATE SET pid = excluded.pid, "
+                             "started_at = excluded.started_at, heartbeat_at = excluded.heartbeat_at",
+                             (worker, pid, started_at, time.time()))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._get(job_id)
+
+    def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            if status is None:
+                rows = self._db.execute(f"SELECT {_COLUMNS} FROM jobs ORDER BY created_at").fetchall()
+            else:
+                rows = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE status = ? ORDER BY created_at",
+                                        (status,)).fetchall()
+        return [self._job(row).to_dict() for row in rows]
+
+    def forget_finished(self, history: Optional[int] = None) -> int:
+        """Delete the oldest finished jobs beyond the JOB_HISTORY newest jobs"""
+        history = history or _job_history()
+        with self._lock:
+            return self._db.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND job_id NOT IN "
+                "(SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT ?)", (*FINISHED, history)).rowcount
+
+    def get_stats(self, worker_timeout: float = 10.0) -> Dict[str, Any]:
+        """Job counts, timings and the worker processes seen in the last worker_timeout seconds"""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            average_wait, average_run = self._db.execute(
+                "SELECT AVG(started_at - created_at), AVG(finished_at - started_at) FROM jobs "
+                "WHERE started_at IS NOT NULL").fetchone()
+            workers = self._db.execute("SELECT worker, pid, jobs_run FROM workers WHERE heartbeat_at > ?",
+                                       (time.time() - worker_timeout,)).fetchall()
+        return {
+            "workers": len(workers),
+            "busy_workers": counts.get(RUNNING, 0),
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "succeeded": counts.get(SUCCEEDED, 0),
+            "failed": counts.get(FAILED, 0),
+            "cancelled": counts.get(CANCELLED, 0),
+            "average_wait": round(average_wait, 3) if average_wait is not None else None,
+            "average_run": round(average_run, 3) if average_run is not None else None,
+            "processes": [{"worker": worker, "pid": pid, "jobs_run": jobs_run} for worker, pid, jobs_run in workers],
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class StoreJobQueue:
+    """The JobQueue interface of the API server, for jobs run by worker processes"""
+
+    def __init__(self, store: JobStore, max_queued: Optional[int] = None, history: Optional[int] = None):
+        self.store = store
+        self.max_queued = max_queued or _job_queue_size()
+        self.history = history or _job_history()
+        self._stats = {"submitted": 0, "rejected": 0}
+
+    def start(self):
+        """Nothing to start, the worker processes run the jobs"""
+
+    async def submit(self, task: str, additional_info: str = "") -> Job:
+        # SQLite calls wait on locks and disk, they run in a thread instead of on the event loop
+        try:
+            job = await asyncio.to_thread(self.store.submit, task, additional_info, self.max_queued)
+        except JobQueueFull:
+            self._stats["rejected"] += 1
+            raise
+        self._stats["submitted"] += 1
+        await asyncio.to_thread(self.store.forget_finished, self.history)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.list, status)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Poll the store until a job has finished, returns it (finished or not after timeout), None for unknown ids"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job.status in FINISHED or (deadline is not None and time.monotonic() >= deadline):
+                return job
+            delay = _poll_interval()
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(delay)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.store.cancel, job_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {**await asyncio.to_thread(self.store.get_stats), "max_queued": self.max_queued, **self._stats}
+
+    async def close(self):
+        await asyncio.to_thread(self.store.close)
@@ -0,0 +1,222 @@
+"""
+Worker processes running agent jobs from the job store.
+
+With `main.py --workers N` the supervisor starts N worker processes. Each one
+runs JOB_PROCESS_CONCURRENCY job slots on its own event loop, with its own
+browser pool, sandboxes and agent controllers, so prompt building, DOM
+parsing, image and JSON work of different agents use different cores. Slots
+claim jobs from the store (job_store) every JOB_STORE_POLL_INTERVAL seconds
+when idle, and cancel a running job when the API asked for it.
+
+Processes are started with the spawn method: a forked copy of a process with
+running event loops, browser drivers and threads is not safe to use. The
+supervisor restarts a worker process that exits and fails the jobs it was
+running.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .job_queue import CANCELLED, FAILED, SUCCEEDED, Job, JobWorker, _worker_browser_enabled
+from .job_store import JobStore, _poll_interval
+
+logger = logging.getLogger(__name__)
+
+
+def _process_concurrency() -> int:
+    return max(1, int(os.environ.get("JOB_PROCESS_CONCURRENCY", "1")))
+
+
+def _heartbeat_interval() -> float:
+    return max(_poll_interval(), 2.0)
+
+
+class JobProcess:
+    """The job slots of one worker process"""
+
+    def __init__(self, store: JobStore, index: int,
+                 handler: Optional[Callable[[Job, JobWorker], Awaitable[Dict[str, Any]]]] = None,
+                 concurrency: Optional[int] = None, use_browser: Optional[bool] = None):
+        """
+        Args:
+            store: The shared job store
+            index: Index of the process, its slots are numbered from index * concurrency
+            handler: Runs a job on a slot and returns its result (defaults to running the agent)
+            concurrency: Jobs running at once in this process (defaults to JOB_PROCESS_CONCURRENCY)
+            use_browser: Give every slot a pooled browser (defaults to JOB_WORKER_BROWSER)
+        """
+        self.store = store
+        self.index = index
+        self.handler = handler or self.run_agent_job
+        self.concurrency = concurrency or _process_concurrency()
+        use_browser = _worker_browser_enabled() if use_browser is None else use_browser
+        self.workers = [JobWorker(index * self.concurrency + slot, use_browser) for slot in range(self.concurrency)]
+        self.controllers: Dict[int, Any] = {}
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def run_agent_job(self, job: Job, worker: JobWorker) -> Dict[str, Any]:
+        """Run an agent task with the slot's sandbox and browser"""
+        from .agent_controller import AgentController
+        agent = self.controllers.get(worker.index)
+        if agent is None:
+            agent = AgentController(sandbox_key=worker.sandbox_key, browser_lease=await worker.lease_browser())
+            self.controllers[worker.index] = agent
+        return await agent.execute_task(job.task, job.additional_info)
+
+    def stop(self):
+        """Stop claiming jobs and cancel the running ones, from the process loop"""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self):
+        """Run the slots until stop() is called"""
+        self._stopping = asyncio.Event()
+        tasks = [asyncio.create_task(self._work(worker)) for worker in self.workers]
+        tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info(f"Job worker process {self.index} (pid {self.pid}) running {self.concurrency} slot(s)")
+        await self._stopping.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for worker in self.workers:
+            await worker.release()
+
+    async def _heartbeat(self):
+        while True:
+            for worker in self.workers:
+                await asyncio.to_thread(self.store.heartbeat, worker.index, self.pid, self.started_at)
+            await asyncio.sleep(_heartbeat_interval())
+
+    async def _work(self, worker: JobWorker):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, worker.index, self.pid)
+            if job is None:
+                await asyncio.sleep(_poll_interval())
+                continue
+            worker.current = job
+            task = asyncio.create_task(self.handler(job, worker))
+            try:
+                while not task.done():
+                    await asyncio.wait({task}, timeout=_poll_interval())
+                    if not task.done() and await asyncio.to_thread(self.store.cancel_requested, job.job_id):
+                        task.cancel()
+                result = task.result()
+            except asyncio.CancelledError:
+                if not task.done():
+                    # the process is stopping
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    await asyncio.to_thread(self.store.finish, job.job_id, CANCELLED,
+                                            error="Job worker process stopped")
+                    raise
+                await asyncio.to_thread(self.store.finish, job.job_id, CANCELLED, error="Cancelled while running")
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {e}")
+                await asyncio.to_thread(self.store.finish, job.job_id, FAILED, error=str(e))
+            else:
+                success = result.get("success", True)
+                await asyncio.to_thread(self.store.finish, job.job_id, SUCCEEDED if success else FAILED,
+                                        result=result, error=result.get("error") if not success else None)
+            finally:
+                worker.current = None
+                worker.jobs_run += 1
+
+
+def run_worker_process(index: int, store_path: str):
+    """Entry point of a worker process"""
+    logging.basicConfig(level=logging.INFO,
+                        format=f"%(asctime)s worker-{index} %(levelname)s [%(name)s] %(message)s")
+
+    async def main():
+        store = JobStore(store_path)
+        process = JobProcess(store, index)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, process.stop)
+        try:
+            await process.run()
+        finally:
+            store.close()
+
+    asyncio.run(main())
+
+
+class JobSupervisor:
+    """Starts the worker processes and restarts the ones that exit"""
+
+    def __init__(self, processes: int, store_path: str):
+        self.processes = processes
+        self.store_path = store_path
+        self.store: Optional[JobStore] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[Optional[multiprocessing.Process]] = [None] * processes
+        self._restarts = 0
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the worker processes and the thread watching them"""
+        self.store = JobStore(self.store_path)
+        interrupted = self.store.fail_running("Interrupted by a restart of the job workers")
+        if interrupted:
+            logger.warning(f"Failed {interrupted} job(s) left running by a previous run")
+        for index in range(self.processes):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._watch, name="job-supervisor", daemon=True)
+        self._monitor.start()
+        logger.info(f"Started {self.processes} job worker process(es) on {self.store_path}")
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=run_worker_process, args=(index, self.store_path),
+                                        name=f"job-worker-{index}", daemon=True)
+        process.start()
+        self._workers[index] = process
+
+    def _watch(self):
+        while not self._stopping.wait(1.0):
+            for index, process in enumerate(self._workers):
+                if process is None or process.is_alive() or self._stopping.is_set():
+                    continue
+                failed = self.store.fail_running(f"Job worker process exited with code {process.exitcode}",
+                                                 pid=process.pid)
+                logger.error(f"Job worker process {index} (pid {process.pid}) exited with code "
+                             f"{process.exitcode}, failed {failed} running job(s), restarting it")
+                self._restarts += 1
+                self._spawn(index)
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            "processes": [{"index": index, "pid": process.pid if process else None,
+                           "alive": bool(process and process.is_alive())}
+                          for index, process in enumerate(self._workers)],
+            "restarts": self._restarts,
+            "store": self.store_path,
+        }
+
+    def stop(self, timeout: float = 30.0):
+        """Stop the worker processes, cancelling their running jobs"""
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for process in self._workers:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._workers:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        if self.store is not None:
+            self.store.fail_running("Job worker processes stopped")
+            self.store.close()
+            self.store = None
@@ -0,0 +1,216 @@
+"""
+Agent, browser and stop state per session instead of per process.
+
+The webui used to keep the browser, the browser context and the agent in
+module globals, and AgentState was a process singleton: a second user
+replaced the first one's agent, and the stop button of one stopped the runs
+of all. Every webui user (the Gradio session hash) now gets a Session holding
+its own browser, browser context, agent and AgentState, so runs of different
+sessions proceed side by side in one process. The API server stops and
+inspects them by id. Sandboxes are not part of a session, the sandbox
+manager keeps one per client or run id.
+
+A session is closed when its browser tab disconnects, or after
+SESSION_IDLE_TIMEOUT seconds without a run: its agent is stopped and its kept
+open browser closed. A session closed while a run is in progress is released
+when that run ends.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from src.utils.agent_state import AgentState
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+
+def _session_idle_timeout() -> float:
+    return float(os.environ.get("SESSION_IDLE_TIMEOUT", "3600"))
+
+
+class Session:
+    """Browser, agent and stop state of one webui user"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.browser = None
+        self.browser_context = None
+        self.agent = None
+        self.agent_state = AgentState()
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.active_runs = 0
+        self.closed = False
+        # the loop the browser and the agent of the session live on
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def begin_run(self):
+        """Mark a run of the session as started, from the loop it runs on"""
+        self.active_runs += 1
+        self._loop = asyncio.get_running_loop()
+        self.touch()
+
+    async def end_run(self):
+        """Mark a run as ended, releasing the session if it was closed meanwhile"""
+        self.active_runs = max(0, self.active_runs - 1)
+        self.touch()
+        if self.closed and not self.active_runs:
+            await self._release()
+
+    def stop(self):
+        """Ask the session's agent and research to stop at the next safe point, from any thread"""
+        self.agent_state.request_stop()
+        agent = self.agent
+        if agent is None:
+            return
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(agent.stop)
+        else:
+            agent.stop()
+
+    async def close_browser(self):
+        """Close the session's browser context and browser"""
+        if self.browser_context:
+            await self.browser_context.close()
+            self.browser_context = None
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
+
+    async def close(self):
+        """Stop the session and release its browser, on the loop it belongs to"""
+        loop = self._loop
+        if loop is not None and loop.is_running() and loop is not asyncio.get_running_loop():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close(), loop))
+        else:
+            await self._close()
+
+    async def _close(self):
+        self.closed = True
+        self.stop()
+        if self.active_runs:
+            # the run releases the session when it ends, its browser is still in use
+            return
+        await self._release()
+
+    async def _release(self):
+        try:
+            await self.close_browser()
+        except Exception as e:
+            logger.error(f"Failed to close the browser of session {self.session_id}: {e}")
+            self.browser_context = self.browser = None
+        logger.info(f"Closed session {self.session_id}")
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "idle": round(time.monotonic() - self.last_active, 1),
+            "active_runs": self.active_runs,
+            "agent_running": self.agent is not None,
+            "browser_open": self.browser is not None,
+            "stop_requested": self.agent_state.is_stop_requested(),
+        }
+
+
+class SessionRegistry:
+    """Thread safe registry of sessions, shared by the webui and the API server"""
+
+    def __init__(self, idle_timeout: Optional[float] = None):
+        self.idle_timeout = _session_idle_timeout() if idle_timeout is None else idle_timeout
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = 0
+
+    def get(self, session_id: Optional[str] = None) -> Session:
+        """
+        Get a session, creating it on first use.
+
+        Args:
+            session_id: Gradio session hash, client or run id, None for the default session
+
+        Returns:
+            Session: The session
+        """
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.closed:
+                session = Session(session_id)
+                self._sessions[session_id] = session
+                logger.debug(f"Created session {session_id}")
+            self._sessions.move_to_end(session_id)
+            session.touch()
+            return session
+
+    def find(self, session_id: str) -> Optional[Session]:
+        """An existing session, None when there is none"""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    async def close(self, session_id: str) -> bool:
+        """Close a session and forget it, from any event loop"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._closed += 1
+        await session.close()
+        return True
+
+    async def reap_idle(self) -> int:
+        """Close sessions without a run for idle_timeout seconds"""
+        if not self.idle_timeout:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items()
+                       if not session.active_runs and now - session.last_active > self.idle_timeout]
+        for session_id in expired:
+            logger.info(f"Closing session {session_id} after {self.idle_timeout:.0f}s idle")
+            await self.close(session_id)
+        return len(expired)
+
+    async def close_all(self):
+        with self._lock:
+            session_ids = list(self._sessions)
+        for session_id in session_ids:
+            await self.close(session_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return [session.get_info() for session in sessions]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "running": sum(1 for session in sessions if session.active_runs),
+            "closed": self._closed,
+            "idle_timeout": self.idle_timeout,
+        }
+
+
+_registry: Optional[SessionRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry() -> SessionRegistry:
+    """The process wide session registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SessionRegistry()
+        return _registry
@@ -266,14 +266,18 @@ def get_latest_files(directory: str, file_types: list = ['.webm', '.zip']) -> Di
 
 async def capture_screenshot(browser_context):
     """Capture and encode a screenshot"""
-    # Extract the Playwright browser instance
-    playwright_browser = browser_context.browser.playwright_browser  # Ensure this is correct.
-
-    # Check if the browser instance is valid and if an existing context can be reused
-    if playwright_browser and playwright_browser.contexts:
-        playwright_context = playwright_browser.contexts[0]
+    # Prefer the context's own session, pooled browsers host more than one context
+    if browser_context.session is not None:
+        playwright_context = browser_context.session.context
     else:
-        return None
+        # Extract the Playwright browser instance
+        playwright_browser = browser_context.browser.playwright_browser  # Ensure this is correct.
+
+        # Check if the browser instance is valid and if an existing context can be reused
+        if playwright_browser and playwright_browser.contexts:
+            playwright_context = playwright_browser.contexts[0]
+        else:
+            return None
 
     # Access pages in the context
     pages = None
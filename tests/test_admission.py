@@ -0,0 +1,168 @@
+import asyncio
+import sys
+import time
+
+sys.path.append(".")
+
+from src.utils.admission import (AdmissionController, AdmissionGate, AdmissionMiddleware, AdmissionRejected,
+                                 MemoryProbe, SubmissionQuota, is_provider_throttle)
+
+MB = 1024 * 1024
+
+
+async def _rejected(gate, client="client"):
+    try:
+        await gate.acquire(client)
+    except AdmissionRejected as e:
+        return e
+    raise AssertionError("the request should have been refused")
+
+
+async def _run_admission():
+    # one runs, one waits, the next is refused with a Retry-After
+    gate = AdmissionGate("test", 1, 1, queue_timeout=0.3, client_rate=0)
+    await gate.acquire("client")
+    started = time.monotonic()
+    waiting = asyncio.create_task(gate.acquire("client"))
+    await asyncio.sleep(0.05)
+    full = await _rejected(gate)
+    assert full.reason == "queue_full" and full.retry_after >= 1
+    gate.release(started)
+    assert await asyncio.wait_for(waiting, 1) > 0
+    stats = gate.get_stats()
+    assert stats["active"] == 1 and stats["admitted"] == 2 and stats["queued"] == 1 and stats["waiting"] == 0
+
+    # a request that gets no slot in time is refused, the queue is left clean
+    timeout = await _rejected(gate)
+    assert timeout.reason == "queue_timeout" and gate.get_stats()["waiting"] == 0
+    gate.release(time.monotonic())
+    assert gate.get_stats()["rejected"] == {"rate_limited": 0, "queue_full": 1, "queue_timeout": 1}
+
+    # waiters are admitted in order as slots free up
+    order = []
+
+    async def request(name):
+        await gate.acquire(name)
+        order.append(name)
+
+    gate.max_queued = 3
+    await gate.acquire("first")
+    tasks = [asyncio.create_task(request(name)) for name in ("a", "b", "c")]
+    await asyncio.sleep(0.05)
+    for _ in range(3):
+        gate.release(time.monotonic())
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*tasks)
+    assert order == ["a", "b", "c"]
+    gate.release(time.monotonic())
+
+    # per client token buckets
+    gate = AdmissionGate("test", 10, 0, client_rate=1, client_burst=2)
+    await gate.acquire("greedy")
+    await gate.acquire("greedy")
+    limited = await _rejected(gate, "greedy")
+    assert limited.reason == "rate_limited" and limited.retry_after == 1
+    await gate.acquire("polite")
+
+    # requests wait until there is memory for them
+    memory = {"available": 700 * MB}
+    probe = MemoryProbe(200, min_free_mb=512, reader=lambda: memory["available"])
+    gate = AdmissionGate("test", 10, 5, probes=[probe], queue_timeout=5, client_rate=0)
+    assert probe.free() == 0
+    waiting = asyncio.create_task(gate.acquire("client"))
+    await asyncio.sleep(0.1)
+    assert not waiting.done() and gate.get_stats()["capacity"]["memory"]["available_mb"] == 700
+    memory["available"] = 1200 * MB
+    assert await asyncio.wait_for(waiting, 2) > 0
+    assert probe.free() == 3
+
+    # the submission quota, and a pause after the provider throttled a run
+    quota = SubmissionQuota(per_minute=2)
+    gate = AdmissionGate("test", 10, 0, probes=[quota], client_rate=0)
+    await gate.acquire("client")
+    await gate.acquire("client")
+    assert (await _rejected(gate)).retry_after >= 29
+    quota = SubmissionQuota()
+    gate = AdmissionGate("test", 10, 0, probes=[quota], client_rate=0)
+    await gate.acquire("client")
+    quota.throttle(10)
+    assert (await _rejected(gate)).retry_after == 10 and quota.get_stats()["throttled"] == 1
+    assert is_provider_throttle("Error code: 429 - Rate limit reached") and not is_provider_throttle("Disk quota")
+
+    # the middleware holds the slot until a streamed response ends, and refuses with a 429
+    finish = asyncio.Event()
+
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"first", "more_body": True})
+        await finish.wait()
+        await send({"type": "http.response.body", "body": b""})
+
+    controller = AdmissionController()
+    gate = controller.add("/stream", AdmissionGate("stream", 1, 0, client_rate=0))
+    middleware = AdmissionMiddleware(streaming_app, controller)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "POST", "path": "/stream", "headers": [], "client": ("127.0.0.1", 1)}
+    stream = asyncio.create_task(middleware(scope, receive, send))
+    await asyncio.sleep(0.05)
+    assert sent[1]["body"] == b"first" and gate.active == 1
+    await middleware(scope, receive, send)
+    assert sent[-2]["status"] == 429 and b"queue_full" in sent[-1]["body"]
+    finish.set()
+    await stream
+    assert gate.active == 0
+
+
+def test_admission():
+    asyncio.run(_run_admission())
+
+
+def test_admission_api():
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+    from src.api.api_server import admission, app
+
+    gate = admission.gates["/api/sandbox/execute"]
+    gate.client_rate, gate.client_burst = 1, 2
+    with TestClient(app) as client:
+        statuses = [client.post("/api/sandbox/execute", json={"command": "echo hi"},
+                                headers={"X-Client-Id": "burst"}).status_code for _ in range(3)]
+        assert 429 not in statuses[:2] and statuses[2] == 429
+        response = client.post("/api/sandbox/execute", json={"command": "echo hi"}, headers={"X-Client-Id": "burst"})
+        assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+        assert response.json()["reason"] == "rate_limited"
+        # other clients and other endpoints are not affected
+        assert client.post("/api/sandbox/execute", json={"command": "echo hi"},
+                           headers={"X-Client-Id": "other"}).status_code != 429
+        metrics = client.get("/api/admission/metrics").json()
+        sandbox = metrics["gates"]["sandbox-execute"]
+        assert sandbox["rejected"]["rate_limited"] == 2 and sandbox["admitted"] == 3 and sandbox["active"] == 0
+        assert "memory" in sandbox["capacity"] and "jobs" in metrics["gates"]["run-agent"]["capacity"]
+        assert set(metrics["gates"]["research"]["capacity"]) == {"memory", "submissions"}
+        # run-agent calls waiting for their job hold a slot, there is a limit to them
+        assert metrics["gates"]["run-agent"]["max_concurrent"] > 0
+        assert sandbox["paths"] == ["/api/sandbox/execute", "/api/sandbox/execute/stream", "/api/sandbox/ws"]
+
+        # WebSockets hold their slot until they close, one beyond the gate's limit is refused with a 1013 close
+        gate.max_concurrent, gate.max_queued = 1, 0
+        with client.websocket_connect("/api/sandbox/ws", headers={"X-Client-Id": "ws"}):
+            assert gate.active == 1
+            try:
+                with client.websocket_connect("/api/sandbox/ws", headers={"X-Client-Id": "ws 2"}):
+                    raise AssertionError("the WebSocket should have been refused")
+            except WebSocketDisconnect as e:
+                assert e.code == 1013
+        assert gate.active == 0
+
+
+if __name__ == "__main__":
+    test_admission()
+    test_admission_api()
+    print("admission OK")
@@ -0,0 +1,154 @@
+import asyncio
+import base64
+import os
+import sys
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.append(".")
+
+from src.agent.agent_events import AgentFrame, create_event_stream, get_event_stream, list_event_streams, subscribe_all
+
+
+class FakeAction:
+    def __init__(self, **params):
+        self.params = params
+
+    def model_dump(self, exclude_unset=False):
+        return self.params
+
+
+class FakeAgent:
+    def __init__(self):
+        self.state = SimpleNamespace(paused=False, stopped=False)
+        self.step_timings = {"browser_state": 0.1, "llm": 1.2}
+        self.browser_context = SimpleNamespace(network_stats={"requests_seen": 10, "requests_blocked": 4,
+                                                               "estimated_bytes_saved": 80_000})
+
+    def pause(self):
+        self.state.paused = True
+
+    def resume(self):
+        self.state.paused = False
+
+    def stop(self):
+        self.state.stopped = True
+
+
+def model_output(goal):
+    brain = SimpleNamespace(evaluation_previous_goal="Success", important_contents="found it",
+                            thought="thinking", next_goal=goal)
+    return SimpleNamespace(current_state=brain, action=[FakeAction(click_element={"index": 3})])
+
+
+async def _run_agent_events():
+    png = b"\x89PNG fake"
+    state = SimpleNamespace(url="https://example.com", title="Example", screenshot=base64.b64encode(png).decode())
+
+    everything = subscribe_all()
+    stream = create_event_stream(task="find it")
+    agent = FakeAgent()
+    stream.attach(agent)
+    subscription = stream.subscribe()
+
+    await stream.on_step(state, model_output("click"), 2)
+    await stream.on_step_end([SimpleNamespace(is_done=False, extracted_content="clicked", error=None)],
+                             {"browser_state": 0.1, "llm": 1.2, "actions": 0.3, "step": 1.6}, 2)
+    items = [await subscription.next(1) for _ in range(4)]
+    assert [getattr(item, "type", "frame") for item in items] == ["run_started", "step", "step_end", "frame"]
+    step = items[1].to_dict()
+    assert step["step"] == 1 and step["next_goal"] == "click" and step["memory"] == "found it"
+    assert step["actions"] == [{"click_element": {"index": 3}}] and step["timings"]["llm"] == 1.2
+    assert step["network"]["requests_blocked"] == 4 and step["network"]["estimated_bytes_saved"] == 80_000
+    assert items[2].data["timings"]["actions"] == 0.3 and items[2].data["results"][0]["extracted_content"] == "clicked"
+    assert isinstance(items[3], AgentFrame) and items[3].png == png
+    assert await subscription.next(0.05) is None and not subscription.closed
+
+    # controls reach the agent on its loop
+    assert stream.control("pause")["status"] == "paused"
+    await asyncio.sleep(0)
+    assert agent.state.paused and stream.control("resume")["success"]
+    await asyncio.sleep(0)
+    assert not agent.state.paused
+    assert not stream.control("jump")["success"]
+
+    assert [(await subscription.next(1)).data["action"] for _ in range(2)] == ["pause", "resume"]
+
+    # a slow subscriber loses the oldest events, frames are conflated
+    assert subscription.max_queued == 6  # 5 and the replayed run_started
+    for index in range(8):
+        stream.publish("tick", {"index": index})
+        stream.publish_frame(index, bytes([index]))
+    await asyncio.sleep(0)
+    drained = []
+    while (item := await subscription.next(0.05)) is not None:
+        drained.append(item)
+    assert subscription.dropped == 2
+    assert [item.data["index"] for item in drained if getattr(item, "type", "") == "tick"] == [2, 3, 4, 5, 6, 7]
+    assert [item.png for item in drained if isinstance(item, AgentFrame)] == [bytes([7])]
+
+    # a subscriber on another loop replays what it missed
+    received = []
+
+    def other_loop():
+        async def consume():
+            late = stream.subscribe(after_seq=3, frames=False)
+            async for item in late:
+                received.append(item)
+        asyncio.run(consume())
+
+    thread = threading.Thread(target=other_loop)
+    thread.start()
+    await asyncio.sleep(0.1)
+    assert stream.control("stop")["status"] == "stopping"
+    await asyncio.sleep(0)
+    stream.finish()
+    thread.join(5)
+    assert received[0].seq == 4 and received[-1].type == "run_finished"
+    assert received[-1].data["status"] == "stopped" and stream.status == "stopped"
+    assert not any(isinstance(item, AgentFrame) for item in received)
+    assert not stream.control("resume")["success"]
+
+    # a finished run keeps its status, a later finish() does nothing
+    events = stream.history[-1].seq
+    stream.finish("cancelled")
+    assert stream.status == "stopped" and stream.history[-1].seq == events
+
+    # the firehose saw every event of the run, never frames, and kept the latest ones
+    seen = []
+    while (item := await everything.next(0.05)) is not None:
+        seen.append(item)
+    everything.close()
+    assert len(seen) + everything.dropped == stream.history[-1].seq and seen[-1].type == "run_finished"
+    assert all(isinstance(item, type(seen[0])) and item.run_id == stream.run_id for item in seen)
+    assert get_event_stream(stream.run_id) is stream
+    assert list_event_streams()[-1]["status"] == "stopped"
+
+    # finished runs replay their events and end
+    replay = stream.subscribe(frames=False)
+    assert len([item async for item in replay]) == min(stream.history.maxlen, stream.history[-1].seq)
+    return stream.run_id
+
+
+def test_agent_events():
+    with mock.patch.dict(os.environ, {"AGENT_EVENTS_QUEUE_SIZE": "5"}):
+        run_id = asyncio.run(_run_agent_events())
+
+    from fastapi.testclient import TestClient
+    sys.path.insert(0, "src")
+    from src.api.api_server import app
+    with TestClient(app) as client:
+        body = client.get(f"/api/agent/runs/{run_id}/events", headers={"Last-Event-ID": "3"}).text
+        assert body.startswith("id: 4\nevent: control\n") and "event: run_finished" in body
+        assert client.get("/api/agent/runs/nope/events").status_code == 404
+        assert client.post(f"/api/agent/runs/{run_id}/pause").status_code == 409
+        with client.websocket_connect(f"/api/agent/runs/{run_id}/ws?after=13") as websocket:
+            assert websocket.receive_json()["type"] == "control"
+            assert websocket.receive_json()["type"] == "run_finished"
+        assert any(run["run_id"] == run_id for run in client.get("/api/agent/runs").json()["runs"])
+
+
+if __name__ == "__main__":
+    test_agent_events()
+    print("agent events OK")
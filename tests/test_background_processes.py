@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import time
+import urllib.request
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.background import allocate_port, port_open, release_port, tail_file
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+async def _run_background_processes():
+    # ports are not handed out twice
+    ports = {allocate_port() for _ in range(20)}
+    assert len(ports) == 20 and all(21000 <= port <= 21099 for port in ports)
+    for port in ports:
+        release_port(port)
+
+    sandbox = Sandbox()
+    sandbox.start()
+    try:
+        sandbox.create_file("index.html", "hello from the sandbox")
+
+        # a server on an allocated port, ready once the port accepts connections
+        started = time.monotonic()
+        result = sandbox.start_process(f"{sys.executable} -m http.server {{port}} --bind 127.0.0.1",
+                                       name="web", port=0, ready={"port": True})
+        assert result["success"] and result["ready"] and result["status"] == "running", result
+        assert time.monotonic() - started < 10
+        port = result["port"]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/index.html") as response:
+            assert response.read() == b"hello from the sandbox"
+        assert "GET /index.html" in sandbox.process_logs("web")["logs"]
+
+        # names are unique among running processes
+        assert not sandbox.start_process("sleep 10", name="web")["success"]
+
+        # readiness from the log, and $PORT in the environment
+        result = sandbox.start_process("sh -c 'sleep 0.3; echo listening on $PORT; sleep 30'", name="worker",
+                                       port=0, ready={"log": r"listening on \d+"})
+        assert result["success"] and result["ready_after"] >= 0.3
+        assert f"listening on {result['port']}" in sandbox.process_logs(result["id"])["logs"]
+
+        # a process exiting before it is ready fails with its log
+        result = sandbox.start_process("sh -c 'echo missing config >&2; exit 2'", ready={"port": 21999})
+        assert not result["success"] and result["exit_code"] == 2 and "missing config" in result["logs"]
+
+        # a probe that never succeeds times out, the process keeps running
+        result = sandbox.start_process("sleep 30", name="slow", ready={"log": "never"}, ready_timeout=0.5)
+        assert not result["success"] and result["status"] == "running"
+        sandbox.stop_process("slow")
+
+        # restart keeps the port
+        pid = sandbox.process_logs("web")["pid"]
+        result = sandbox.restart_process("web")
+        assert result["success"] and result["port"] == port and result["restarts"] == 1 and result["pid"] != pid
+        assert not alive(pid) and port_open(port)
+
+        # stop kills the whole process group
+        result = sandbox.start_process("sh -c 'sleep 60 & sleep 60'", name="group")
+        time.sleep(0.2)
+        children = open(f"/proc/{result['pid']}/task/{result['pid']}/children").read().split()
+        assert sandbox.stop_process("group")["status"] == "exited"
+        time.sleep(0.2)
+        assert not any(alive(int(child)) for child in children)
+
+        statuses = {process["name"]: process["status"] for process in sandbox.list_processes()}
+        assert statuses["web"] == "running" and statuses["worker"] == "running" and statuses["group"] == "exited"
+        assert not sandbox.stop_process("missing")["success"]
+
+        # tail reads only the end
+        with open(os.path.join(sandbox.working_directory, "big.log"), "w") as f:
+            f.writelines(f"line {i}\n" for i in range(100000))
+        assert tail_file(os.path.join(sandbox.working_directory, "big.log"), 2) == "line 99998\nline 99999\n"
+    finally:
+        pids = [process["pid"] for process in sandbox.list_processes()]
+        sandbox.close()
+    assert not any(alive(pid) for pid in pids)
+    assert not port_open(port)
+
+
+def test_background_processes():
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true", "SANDBOX_PORT_RANGE": "21000-21099"}):
+        asyncio.run(_run_background_processes())
+
+
+if __name__ == "__main__":
+    test_background_processes()
+    print("background processes OK")
@@ -0,0 +1,93 @@
+import asyncio
+import sys
+
+sys.path.append(".")
+
+from src.browser.browser_automation import FILL_FORM_JS, BrowserAutomation
+
+
+class FakePage:
+    """Records every round trip; the form only knows CSS ids"""
+
+    def __init__(self):
+        self.url = "about:blank"
+        self.calls = []
+        self.values = {}
+
+    async def goto(self, url, wait_until="load"):
+        self.calls.append(("goto", url, wait_until))
+        self.url = url
+
+    async def evaluate(self, script, fields):
+        assert script == FILL_FORM_JS
+        self.calls.append(("evaluate", len(fields)))
+        results = []
+        for selector, value in fields:
+            if selector.startswith("#"):
+                self.values[selector] = value
+                results.append({"selector": selector, "success": True})
+            else:
+                results.append({"selector": selector, "success": False, "retry": True, "error": "not a CSS selector"})
+        return results
+
+    async def fill(self, selector, text):
+        self.calls.append(("fill", selector))
+        self.values[selector] = text
+
+    async def click(self, selector):
+        self.calls.append(("click", selector))
+        if selector == "#missing":
+            raise TimeoutError("Timeout 30000ms exceeded")
+
+    async def wait_for_selector(self, selector, state="visible", timeout=None):
+        self.calls.append(("wait_for_selector", selector, state))
+
+
+async def _run_execute_batch():
+    page = FakePage()
+    automation = BrowserAutomation(page)
+    result = await automation.execute_batch([
+        {"action": "navigate", "params": {"url": "https://example.com/signup"}},
+        {"action": "input_text", "params": {"selector": "#name", "text": "Ada"}},
+        {"action": "input_text", "params": {"selector": "#email", "text": "ada@example.com"}},
+        {"action": "input_text", "params": {"selector": "text=Password", "text": "secret"}},
+        {"action": "click", "params": {"selector": "#submit"}, "wait_for": {"selector": "#done"}},
+    ])
+    assert result["success"] and result["completed"] == 5, result
+    assert all(entry["duration"] >= 0 for entry in result["results"])
+    # three inputs in one evaluate, the Playwright-only selector retried with fill()
+    assert [call[0] for call in page.calls] == ["goto", "evaluate", "fill", "click", "wait_for_selector"]
+    assert page.calls[1] == ("evaluate", 3)
+    assert page.values == {"#name": "Ada", "#email": "ada@example.com", "text=Password": "secret"}
+    assert all(entry.get("batched") for entry in result["results"][1:4])
+
+    page.calls.clear()
+    result = await automation.execute_batch([
+        {"action": "click", "params": {"selector": "#missing"}},
+        {"action": "click", "params": {"selector": "#next"}},
+    ])
+    assert not result["success"] and result["completed"] == 0
+    assert "Timeout" in result["results"][0]["error"]
+    assert result["results"][1]["skipped"]
+    assert page.calls == [("click", "#missing")]
+
+    # two fills of the same field both run, the last one wins
+    page.calls.clear()
+    result = await automation.execute_batch([
+        {"action": "input_text", "params": {"selector": "#query", "text": "draft"}},
+        {"action": "input_text", "params": {"selector": "#note", "text": "n"}},
+        {"action": "input_text", "params": {"selector": "#query", "text": "final"}},
+    ])
+    assert result["success"] and result["completed"] == 3 and page.calls == [("evaluate", 3)]
+    assert page.values["#query"] == "final"
+
+    result = await automation.execute_action("fill_form", {"fields": {"#city": "Paris"}})
+    assert result["success"] and page.values["#city"] == "Paris"
+
+
+def test_execute_batch():
+    asyncio.run(_run_execute_batch())
+
+
+if __name__ == "__main__":
+    test_execute_batch()
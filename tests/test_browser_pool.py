@@ -0,0 +1,159 @@
+import asyncio
+import http.server
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+import sys
+
+sys.path.append(".")
+
+
+class _PageHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"<html><head><title>Pool test</title></head><body><p>pooled</p></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def _run_browser_pool():
+    from browser_use.browser.browser import BrowserConfig
+    from src.browser.browser_pool import BrowserPool, BrowserPoolConfig
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    pool = BrowserPool(BrowserPoolConfig(
+        size=2,
+        max_size=2,
+        max_uses_per_browser=2,
+        browser_config=BrowserConfig(headless=True),
+    ))
+    await pool.start()
+
+    async def visit(url):
+        start = time.time()
+        async with pool.checkout() as lease:
+            checkout_time = time.time() - start
+            page = await lease.browser_context.get_current_page()
+            await page.goto(url)
+            return checkout_time, await page.title()
+
+    try:
+        results = await asyncio.gather(*[visit(url) for _ in range(4)])
+        for checkout_time, title in results:
+            print(f"checkout: {checkout_time:.2f}s title: {title}")
+            assert title == "Pool test"
+        stats = pool.get_stats()
+        print(stats)
+        assert stats["checkouts"] == 4
+        assert stats["in_use"] == 0
+
+        # nothing a task stored is left for the next lease of the same browser
+        async with pool.checkout() as lease:
+            page = await lease.browser_context.get_current_page()
+            await page.goto(url)
+            await page.evaluate("localStorage.setItem('token', 'secret'); sessionStorage.setItem('token', 'secret')")
+            pooled = lease.pooled
+        while True:
+            async with pool.checkout() as lease:
+                if lease.pooled is pooled:
+                    page = await lease.browser_context.get_current_page()
+                    await page.goto(url)
+                    assert await page.evaluate("localStorage.getItem('token') || sessionStorage.getItem('token')") is None
+                    break
+    finally:
+        await pool.close()
+        server.shutdown()
+
+
+async def _run_launch_failure():
+    from browser_use.browser.browser import BrowserConfig
+    from src.browser.browser_pool import BrowserPool, BrowserPoolConfig
+
+    # waiters get the launch error instead of sitting out the checkout timeout
+    pool = BrowserPool(BrowserPoolConfig(
+        size=1,
+        max_size=1,
+        checkout_timeout=60,
+        browser_config=BrowserConfig(headless=True, chrome_instance_path="/nonexistent/chrome"),
+    ))
+    start = time.time()
+    try:
+        await pool.acquire()
+        raise AssertionError("the launch should have failed")
+    except RuntimeError as e:
+        assert "Failed to launch" in str(e), e
+    finally:
+        await pool.close()
+    assert time.time() - start < 30
+    assert pool.get_stats()["alive"] == 0
+
+
+class _StubContext:
+    async def reset_for_reuse(self):
+        pass
+
+
+class _StubBrowser:
+    def __init__(self, context_config):
+        self.browser = None
+        self.context = _StubContext()
+        self.context_config = context_config
+        self.uses = 0
+
+    async def is_healthy(self):
+        return True
+
+    async def close(self):
+        pass
+
+
+async def _run_stale_launch_failures():
+    from browser_use.browser.browser import BrowserConfig
+    from src.browser.browser_pool import BrowserPool, BrowserPoolConfig, _LaunchFailed
+
+    class StubPool(BrowserPool):
+        async def _launch(self):
+            await asyncio.sleep(0.05)
+            return _StubBrowser(self.config.context_config)
+
+    # a launch failure whose waiter gave up is neither a free browser nor an error for the next caller
+    pool = StubPool(BrowserPoolConfig(size=0, max_size=1, health_check_interval=0, checkout_timeout=5,
+                                      browser_config=BrowserConfig(headless=True)))
+    stale = _LaunchFailed(RuntimeError("launch failed"))
+    stale.created -= 1
+    pool._failures += 1
+    pool._idle.put_nowait(stale)
+    assert pool.free_browsers() == 1 and pool.get_stats()["idle"] == 0
+    lease = await pool.acquire()
+    assert isinstance(lease.pooled, _StubBrowser) and pool._failures == 0
+    await pool.release(lease)
+    assert pool.get_stats()["alive"] == 0 and not pool._launch_tasks
+    await pool.close()
+
+
+def test_browser_pool():
+    asyncio.run(_run_browser_pool())
+
+
+def test_launch_failure():
+    asyncio.run(_run_launch_failure())
+
+
+def test_stale_launch_failures():
+    asyncio.run(_run_stale_launch_failures())
+
+
+if __name__ == "__main__":
+    test_stale_launch_failures()
+    test_launch_failure()
+    test_browser_pool()
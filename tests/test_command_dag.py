@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.command_dag import run_dag, validate_dag
+
+
+async def _run_command_dag():
+    # validation
+    assert validate_dag([{"id": "b", "command": "x", "depends_on": ["a"]}, {"id": "a", "command": "x"}]) == ["a", "b"]
+    for nodes in ([{"id": "a"}],
+                  [{"id": "a", "command": "x"}, {"id": "a", "command": "y"}],
+                  [{"id": "a", "command": "x", "depends_on": ["missing"]}],
+                  [{"id": "a", "command": "x", "depends_on": ["b"]}, {"id": "b", "command": "x", "depends_on": ["a"]}]):
+        try:
+            validate_dag(nodes)
+            assert False, nodes
+        except ValueError:
+            pass
+
+    # the parallelism limit holds
+    running, peak = 0, 0
+
+    async def fake(node):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return {"success": node["command"] != "fail"}
+
+    result = await run_dag([{"id": str(i), "command": "ok"} for i in range(10)], fake, max_parallel=3)
+    assert result["success"] and peak == 3
+
+    sandbox = Sandbox()
+    sandbox.start()
+    try:
+        # independent branches run concurrently, dependents after their dependencies
+        result = await sandbox.execute_dag([
+            {"id": "setup", "command": "mkdir out"},
+            {"id": "a", "command": "sh -c 'sleep 0.5; echo a > out/a'", "depends_on": ["setup"]},
+            {"id": "b", "command": "sh -c 'sleep 0.5; echo b > out/b'", "depends_on": ["setup"]},
+            {"id": "c", "command": "sh -c 'sleep 0.5; echo c > out/c'", "depends_on": ["setup"]},
+            {"id": "merge", "command": "sh -c 'cat out/a out/b out/c'", "depends_on": ["a", "b", "c"]},
+        ])
+        assert result["success"], result
+        assert result["results"]["merge"]["stdout"] == "a\nb\nc\n"
+        assert result["completed"][0] == "setup" and result["completed"][-1] == "merge"
+        assert result["duration"] < 1.4, result["duration"]
+        for node in ("a", "b", "c"):
+            assert result["results"][node]["started"] >= result["results"]["setup"]["finished"]
+
+        # a failure skips its dependency chain, the independent branch still runs
+        result = await sandbox.execute_dag([
+            {"id": "build", "command": "sh -c 'exit 3'"},
+            {"id": "test", "command": "echo test", "depends_on": ["build"]},
+            {"id": "deploy", "command": "echo deploy", "depends_on": ["test"]},
+            {"id": "docs", "command": "echo docs"},
+        ])
+        statuses = {node_id: node["status"] for node_id, node in result["results"].items()}
+        assert not result["success"]
+        assert statuses == {"build": "failed", "test": "skipped", "deploy": "skipped", "docs": "succeeded"}
+        assert result["results"]["build"]["exit_code"] == 3
+
+        # cancel_on_failure stops the running and pending nodes
+        result = await sandbox.execute_dag([
+            {"id": "fail", "command": "sh -c 'sleep 0.2; exit 1'"},
+            {"id": "slow", "command": "sleep 10"},
+            {"id": "later", "command": "echo later", "depends_on": ["slow"]},
+        ], cancel_on_failure=True)
+        statuses = {node_id: node["status"] for node_id, node in result["results"].items()}
+        assert statuses == {"fail": "failed", "slow": "cancelled", "later": "cancelled"} and result["duration"] < 5
+
+        # invalid batches are refused before anything runs
+        result = await sandbox.execute_dag([{"id": "a", "command": "echo", "depends_on": ["a"]}])
+        assert not result["success"] and "cycle" in result["error"]
+    finally:
+        sandbox.close()
+
+
+def test_command_dag():
+    with mock.patch.dict(os.environ, {
+        "ENABLE_SANDBOX": "true",
+        "SANDBOX_RESOURCE_ACCOUNTING": "false",
+        "SANDBOX_MAX_CONCURRENT_COMMANDS": "8",
+    }):
+        asyncio.run(_run_command_dag())
+
+
+if __name__ == "__main__":
+    test_command_dag()
+    print("command dag OK")
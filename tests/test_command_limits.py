@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(".")
+
+from src.sandbox.executor import AsyncCommandExecutor
+from src.sandbox.limits import CommandLimits
+
+
+async def run(executor, args, limits=None, timeout=30):
+    events = [event async for event in executor.stream(args, tempfile.gettempdir(), os.environ.copy(),
+                                                      timeout, limits)]
+    stdout = "".join(event["data"] for event in events if event["type"] == "stdout")
+    stderr = "".join(event["data"] for event in events if event["type"] == "stderr")
+    return stdout, stderr, events[-1]
+
+
+async def _run_command_limits():
+    executor = AsyncCommandExecutor(kill_grace=1, limits=CommandLimits())
+
+    # accounting only: CPU, peak RSS and I/O of the command are reported
+    _, _, exit_event = await run(executor, [sys.executable, "-c",
+                                            "x = bytearray(100 * 1024 * 1024)\nfor _ in range(10 ** 6): pass"])
+    resources = exit_event["resources"]
+    assert exit_event["exit_code"] == 0 and resources["limit_exceeded"] is None
+    assert resources["max_rss_mb"] >= 100 and resources["cpu_user"] > 0
+    _, _, exit_event = await run(executor, ["sh", "-c", "head -c 300000 /dev/zero > /dev/null"])
+    assert exit_event["resources"]["write_bytes"] >= 300000
+
+    # CPU time limit
+    _, stderr, exit_event = await run(executor, [sys.executable, "-c", "while True: pass"],
+                                      CommandLimits(cpu_seconds=1))
+    assert exit_event["resources"]["limit_exceeded"] == "cpu" and "cpu limit" in stderr
+
+    # memory limit: the allocation fails inside the command
+    _, stderr, exit_event = await run(executor, [sys.executable, "-c", "x = bytearray(1024 ** 3)"],
+                                      CommandLimits(memory_mb=256))
+    assert exit_event["exit_code"] != 0 and "MemoryError" in stderr
+
+    # file size limit
+    big_file = os.path.join(tempfile.gettempdir(), f"command-limits-{os.getpid()}.bin")
+    _, _, exit_event = await run(executor, ["sh", "-c", f"exec head -c 3000000 /dev/zero > {big_file}"],
+                                 CommandLimits(file_size_mb=1))
+    assert exit_event["resources"]["limit_exceeded"] == "file_size"
+    assert os.path.getsize(big_file) == 1024 * 1024
+    os.remove(big_file)
+
+    # output limit
+    stdout, stderr, exit_event = await run(executor, ["yes"], CommandLimits(output_mb=1))
+    assert exit_event["resources"]["limit_exceeded"] == "output" and len(stdout) < 2 * 1024 * 1024
+
+    # no launcher without limits and accounting
+    _, _, exit_event = await run(executor, ["true"], CommandLimits(accounting=False))
+    assert exit_event["resources"] is None and exit_event["exit_code"] == 0
+
+
+def test_command_limits():
+    asyncio.run(_run_command_limits())
+
+
+if __name__ == "__main__":
+    test_command_limits()
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(".")
+
+from src.browser import dom_snapshot
+from src.browser.dom_snapshot import _SnapshotTreeBuilder, _Viewport
+
+
+class SnapshotBuilder:
+    """Builds a DOMSnapshot.captureSnapshot result by hand"""
+
+    def __init__(self):
+        self.strings = []
+        self.documents = []
+
+    def string(self, value):
+        if value not in self.strings:
+            self.strings.append(value)
+        return self.strings.index(value)
+
+    def document(self):
+        doc = {
+            "nodes": {"parentIndex": [], "nodeType": [], "nodeName": [], "nodeValue": [], "attributes": [],
+                      "backendNodeId": [], "isClickable": {"index": []}, "shadowRootType": {"index": [], "value": []},
+                      "contentDocumentIndex": {"index": [], "value": []}},
+            "layout": {"nodeIndex": [], "bounds": [], "styles": [], "paintOrders": []},
+            "scrollOffsetX": 0,
+            "scrollOffsetY": 0,
+        }
+        self.documents.append(doc)
+        self.node(doc, -1, 9, "#document")
+        return doc
+
+    def node(self, doc, parent, node_type, name, value="", attributes=None, bounds=None, paint=0,
+             display="block", visibility="visible", clickable=False):
+        nodes = doc["nodes"]
+        index = len(nodes["parentIndex"])
+        nodes["parentIndex"].append(parent)
+        nodes["nodeType"].append(node_type)
+        nodes["nodeName"].append(self.string(name))
+        nodes["nodeValue"].append(self.string(value) if value else -1)
+        flat = []
+        for key, attribute in (attributes or {}).items():
+            flat += [self.string(key), self.string(attribute)]
+        nodes["attributes"].append(flat)
+        nodes["backendNodeId"].append(1000 * len(self.documents) + index)
+        if clickable:
+            nodes["isClickable"]["index"].append(index)
+        if bounds is not None:
+            layout = doc["layout"]
+            layout["nodeIndex"].append(index)
+            layout["bounds"].append(list(bounds))
+            layout["styles"].append([self.string(display), self.string(visibility), self.string("1"),
+                                     self.string("auto")])
+            layout["paintOrders"].append(paint)
+        return index
+
+    def snapshot(self):
+        return {"documents": self.documents, "strings": self.strings}
+
+
+def make_page():
+    builder = SnapshotBuilder()
+    main = builder.document()
+    html = builder.node(main, 0, 1, "HTML", bounds=(0, 0, 800, 600), paint=0)
+    body = builder.node(main, html, 1, "BODY", bounds=(0, 0, 800, 600), paint=1)
+    nav = builder.node(main, body, 1, "DIV", bounds=(0, 0, 800, 50), paint=2)
+    link = builder.node(main, nav, 1, "A", attributes={"href": "/home"}, bounds=(10, 10, 60, 20), paint=3)
+    builder.node(main, link, 3, "#text", value=" Home ", bounds=(10, 10, 40, 20), paint=3)
+    builder.node(main, nav, 1, "A", bounds=(100, 10, 60, 20), paint=4)  # empty anchor, dropped
+    builder.node(main, nav, 1, "DIV", attributes={"class": "menu"}, bounds=(200, 10, 60, 20), paint=5,
+                 clickable=True)
+    covered = builder.node(main, body, 1, "BUTTON", bounds=(10, 100, 100, 30), paint=6)
+    builder.node(main, covered, 3, "#text", value="Hidden by overlay", bounds=(10, 100, 100, 30), paint=6)
+    builder.node(main, body, 1, "DIV", attributes={"id": "overlay"}, bounds=(0, 90, 800, 60), paint=7)
+    builder.node(main, body, 1, "SCRIPT", value="")
+    builder.node(main, body, 1, "INPUT", attributes={"type": "text"}, bounds=(10, 2000, 100, 30), paint=8)
+    builder.node(main, body, 1, "BUTTON", attributes={"style": "display:none"}, display="none")
+    frame = builder.node(main, body, 1, "IFRAME", attributes={"src": "/frame"}, bounds=(400, 200, 300, 200),
+                         paint=9)
+
+    frame_doc = builder.document()
+    main["nodes"]["contentDocumentIndex"]["index"].append(frame)
+    main["nodes"]["contentDocumentIndex"]["value"].append(1)
+    frame_html = builder.node(frame_doc, 0, 1, "HTML", bounds=(0, 0, 300, 200))
+    frame_body = builder.node(frame_doc, frame_html, 1, "BODY", bounds=(0, 0, 300, 200))
+    builder.node(frame_doc, frame_body, 1, "INPUT", attributes={"name": "q"}, bounds=(5, 5, 100, 20))
+    builder.node(frame_doc, frame_body, 1, "INPUT", attributes={"name": "page"}, bounds=(5, 30, 100, 20))
+    return builder.snapshot()
+
+
+def test_snapshot_tree_builder():
+    builder = _SnapshotTreeBuilder(make_page(), _Viewport(800, 600, 0), set())
+    root, selector_map = builder.build()
+
+    assert root.tag_name == "body" and root.xpath == "/body"
+    tags = [node.tag_name for node in selector_map.values()]
+    assert tags == ["a", "div", "input", "input"], tags
+    # the dropped empty anchor takes no index, numbering has no gaps like in the JS walker
+    assert sorted(selector_map) == [0, 1, 2, 3]
+
+    link = selector_map[0]
+    assert link.xpath == "html/body/div/a"
+    assert link.attributes == {"href": "/home"}
+    assert link.get_all_text_till_next_clickable_element() == "Home"
+
+    # the overlay wins the hit test, the button below it gets no highlight index
+    button = next(child for child in root.children if getattr(child, "tag_name", None) == "button")
+    assert button.highlight_index is None and button.is_visible
+
+    # the input below the fold is outside the viewport and not extracted
+    assert not any(getattr(child, "xpath", "") == "html/body/input" for child in root.children)
+
+    # elements in frames get xpaths relative to the frame document and the iframe as parent
+    frame_inputs = [node for node in selector_map.values() if node.parent and node.parent.tag_name == "body"
+                    and node.parent.parent and node.parent.parent.tag_name == "html"]
+    assert [node.xpath for node in frame_inputs] == ["html/body/input", "html/body/input[2]"]
+    assert frame_inputs[0].parent.parent.parent.tag_name == "iframe"
+
+    boxes = builder.highlight_boxes()
+    assert boxes[-1][:3] == [3, 405, 230]
+
+    text = root.clickable_elements_to_string()
+    assert "[0]<a Home/>" in text
+    assert "Hidden by overlay" in text
+
+
+def test_snapshot_tree_builder_without_numpy(monkeypatch):
+    monkeypatch.setattr(dom_snapshot, "np", None)
+    test_snapshot_tree_builder()
+
+
+async def benchmark_state_extractors(urls, rounds=3):
+    """Time browser_use's JS walker against the DOMSnapshot extractor on pages"""
+    from browser_use.browser.browser import BrowserConfig
+    from src.browser.custom_browser import CustomBrowser
+    from src.browser.custom_context import CustomBrowserContextConfig
+
+    browser = CustomBrowser(config=BrowserConfig(headless=True))
+    try:
+        for url in urls:
+            for extractor in ("js", "cdp_snapshot"):
+                context = await browser.new_context(config=CustomBrowserContextConfig(state_extractor=extractor))
+                page = await context.get_current_page()
+                await page.goto(url)
+                await page.wait_for_load_state()
+                timings = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    content = await context._get_clickable_elements(page)
+                    timings.append(time.perf_counter() - start)
+                print(f"{url} {extractor:>12}: best {min(timings) * 1000:.0f} ms, "
+                      f"{len(content.selector_map)} interactive elements")
+                await context.close()
+    finally:
+        await browser.close()
+
+
+def _article_page():
+    sections = "".join(
+        f"<h2>Section {section}</h2>" + "".join(
+            f"<p>Paragraph {paragraph} with <a href='/wiki/{section}_{paragraph}'>a link</a> and "
+            f"<a href='#cite-{paragraph}'><sup>[{paragraph}]</sup></a> citations.</p>"
+            for paragraph in range(20))
+        for section in range(30))
+    return (f"<html><body><nav>{''.join(f'<a href=/portal/{i}>Portal {i}</a>' for i in range(50))}</nav>"
+            f"<input type=search name=search><main>{sections}</main></body></html>")
+
+
+def _list_page():
+    rows = "".join(
+        f"<tr><td>{rank}.</td><td><a href='/item?id={rank}'>Story number {rank}</a> "
+        f"<span>(example.org)</span></td></tr><tr><td></td><td>{rank} points by "
+        f"<a href='/user?id={rank}'>user{rank}</a> | <a href='/hide?id={rank}'>hide</a> | "
+        f"<a href='/item?id={rank}'>{rank} comments</a></td></tr>"
+        for rank in range(1, 31))
+    return f"<html><body><table>{rows}</table><form><input name=q><button>Search</button></form></body></html>"
+
+
+def _app_page():
+    files = "".join(
+        f"<div role=row><span role=gridcell><a href='/tree/{index}'>file_{index}.py</a></span>"
+        f"<span role=gridcell>Commit message {index}</span><button aria-label='Menu {index}'>...</button></div>"
+        for index in range(200))
+    menus = "".join(f"<div role=menuitem tabindex=0 onclick=''>Action {index}</div>" for index in range(40))
+    return (f"<html><body><header><input placeholder='Search or jump to'><button>Sign in</button></header>"
+            f"<div role=menu>{menus}</div><div role=grid>{files}</div>"
+            f"<div style='display:none'>{menus}</div></body></html>")
+
+
+def test_state_extractor_benchmark():
+    # local pages shaped like an encyclopedia article, a link aggregator and a code host
+    with tempfile.TemporaryDirectory() as directory:
+        urls = []
+        for name, html in (("article", _article_page()), ("list", _list_page()), ("app", _app_page())):
+            path = os.path.join(directory, f"{name}.html")
+            with open(path, "w") as f:
+                f.write(html)
+            urls.append(pathlib.Path(path).as_uri())
+        asyncio.run(benchmark_state_extractors(urls))
+
+
+if __name__ == "__main__":
+    test_snapshot_tree_builder()
+    test_state_extractor_benchmark()
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+
+sys.path.append(".")
+
+from browser_use.dom.views import DOMElementNode, DOMState, DOMTextNode
+
+from src.browser import dom_tracker
+from src.browser.dom_tracker import DomTracker
+
+
+class FakePage:
+    """Answers the tracker's scripts from canned values"""
+
+    def __init__(self):
+        self.probe = {"id": "doc", "version": 0, "structural": False, "dirty": [],
+                      "scroll": [0, 0], "viewport": [800, 600]}
+        self.texts = {}
+        self.restored = 0
+
+    async def evaluate(self, script, arg=None):
+        if script == dom_tracker._PROBE_JS:
+            return dict(self.probe)
+        if script == dom_tracker._TEXTS_JS:
+            return [self.texts.get(xpath) for xpath in arg]
+        if script == dom_tracker._SAVE_HIGHLIGHTS_JS:
+            return "<div id='playwright-highlight-container'></div>"
+        if script == dom_tracker._RESTORE_HIGHLIGHTS_JS:
+            self.restored += 1
+            return None
+        raise AssertionError("unexpected script")
+
+
+def make_tree():
+    root = DOMElementNode(tag_name="body", xpath="/body", attributes={}, children=[], is_visible=False, parent=None)
+    counter = DOMElementNode(tag_name="span", xpath="html/body/span", attributes={}, children=[], is_visible=True,
+                             parent=root)
+    counter.children.append(DOMTextNode(text="1 item", is_visible=True, parent=counter))
+    root.children.append(counter)
+    return DOMState(element_tree=root, selector_map={})
+
+
+async def _run_dom_tracker():
+    page = FakePage()
+    tracker = DomTracker()
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return make_tree()
+
+    first = await tracker.get_dom_state(page, "https://example.com", build, highlight_elements=True)
+    assert tracker.last_step["outcome"] == "miss" and len(builds) == 1
+
+    # nothing changed: same tree, highlights put back
+    assert await tracker.get_dom_state(page, "https://example.com", build, True) is first
+    assert tracker.last_step["outcome"] == "hit" and page.restored == 1
+
+    # only the text of the span changed: patched in place
+    page.probe.update(version=1, dirty=["html/body/span"])
+    page.texts["html/body/span"] = ["2 items"]
+    patched = await tracker.get_dom_state(page, "https://example.com", build, True)
+    assert tracker.last_step["outcome"] == "patch" and len(builds) == 1
+    assert patched.element_tree.children[0].children[0].text == "2 items"
+
+    # scrolling, structural changes and navigations rebuild
+    page.probe.update(version=1, dirty=[], scroll=[0, 300])
+    await tracker.get_dom_state(page, "https://example.com", build, True)
+    page.probe.update(version=2, structural=True)
+    await tracker.get_dom_state(page, "https://example.com", build, True)
+    page.probe.update(version=2, structural=False)
+    await tracker.get_dom_state(page, "https://example.com/next", build, True)
+    assert len(builds) == 4
+
+    stats = tracker.get_stats()
+    assert stats["hits"] == 1 and stats["patches"] == 1 and stats["misses"] == 4
+    assert abs(stats["hit_ratio"] - 2 / 6) < 1e-9
+
+
+def test_dom_tracker():
+    asyncio.run(_run_dom_tracker())
+
+
+if __name__ == "__main__":
+    test_dom_tracker()
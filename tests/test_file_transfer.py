@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import os
+import sys
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.file_transfer import PathOutsideSandbox, parse_range
+
+
+async def chunks_of(data, size=100000):
+    for position in range(0, len(data), size):
+        yield data[position:position + size]
+
+
+async def _run_file_transfer():
+    # Range headers
+    assert parse_range(None, 100) is None and parse_range("bytes=0-9,20-29", 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 10)
+    assert parse_range("bytes=-5", 100) == (95, 5)
+    assert parse_range("bytes=50-1000", 100) == (50, 50)
+    for header in ("bytes=100-", "bytes=9-3", "bytes=a-b"):
+        try:
+            parse_range(header, 100)
+            assert False, header
+        except ValueError:
+            pass
+
+    sandbox = Sandbox(disk_quota_mb=5)
+    sandbox.start()
+    try:
+        # binary safe streaming upload with a verified hash, large enough to be read through mmap
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        digest = hashlib.sha256(data).hexdigest()
+        result = await sandbox.write_file_stream("data/blob.bin", chunks_of(data), expected_sha256=digest)
+        assert result["success"] and result["size"] == len(data) and result["sha256"] == digest
+        assert sandbox.file_info("data/blob.bin", with_hash=True)["sha256"] == digest
+
+        # ranged reads and chunked download
+        part = sandbox.read_bytes("data/blob.bin", 1000, 5000)
+        assert part["data"] == data[1000:6000] and part["size"] == len(data)
+        assert sandbox.read_bytes("data/blob.bin", -10)["data"] == data[-10:]
+        assert b"".join(sandbox.iter_file("data/blob.bin")) == data
+        assert b"".join(sandbox.iter_file("data/blob.bin", 123, 2 * 1024 * 1024)) == data[123:123 + 2 * 1024 * 1024]
+
+        # a wrong hash leaves the existing file alone
+        result = await sandbox.write_file_stream("data/blob.bin", chunks_of(b"other"), expected_sha256="0" * 64)
+        assert not result["success"] and "mismatch" in result["error"]
+        assert sandbox.file_info("data/blob.bin")["size"] == len(data)
+        assert [name for name in os.listdir(sandbox.resolve_path("data")) if name.startswith(".upload-")] == []
+
+        # appends
+        await sandbox.write_file_stream("log.txt", chunks_of(b"one\n"))
+        await sandbox.write_file_stream("log.txt", chunks_of(b"two\n"), append=True)
+        assert sandbox.read_file("log.txt")["content"] == "one\ntwo\n"
+
+        # the disk quota stops an upload midway
+        result = await sandbox.write_file_stream("big.bin", chunks_of(bytes(4 * 1024 * 1024)))
+        assert not result["success"] and "quota" in result["error"] and not os.path.exists(sandbox.resolve_path("big.bin"))
+
+        # text and bytes through create_file/read_file
+        assert sandbox.create_file("raw.bin", b"\x00\xff")["success"]
+        assert sandbox.read_bytes("raw.bin")["data"] == b"\x00\xff"
+        assert sandbox.read_file("raw.bin")["content"] == "\x00�"
+
+        # paths leaving the sandbox are refused, also through symlinks
+        for path in ("../outside.txt", "/etc/passwd"):
+            assert not sandbox.read_file(path)["success"]
+            assert not sandbox.create_file(path, "x")["success"]
+        os.symlink("/etc", sandbox.resolve_path("etc-link"))
+        assert not sandbox.read_file("etc-link/hostname")["success"]
+        try:
+            sandbox.iter_file("../x")
+            assert False
+        except PathOutsideSandbox:
+            pass
+        assert not sandbox.list_files("..")["success"]
+    finally:
+        sandbox.close()
+
+
+def test_file_transfer():
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true", "SANDBOX_MMAP_THRESHOLD_MB": "1"}):
+        asyncio.run(_run_file_transfer())
+
+
+if __name__ == "__main__":
+    test_file_transfer()
+    print("file transfer OK")
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sys
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.fs_index import FileIndex
+
+
+def paths(changes, kind):
+    return {entry["path"] for entry in changes[kind]}
+
+
+async def _run_fs_changes():
+    for mode in ("auto", "scan"):
+        os.environ["SANDBOX_CHANGE_REPORT_MODE"] = mode
+        sandbox = Sandbox()
+        sandbox.start()
+        try:
+            assert sandbox.create_file("keep.txt", "keep")["success"]
+            assert sandbox.create_file("old.txt", "old")["success"]
+
+            result = sandbox.execute_command("sh -c 'mkdir -p src/pkg && echo hi > src/pkg/a.py && echo x >> keep.txt && rm old.txt'")
+            assert result["success"], result
+            changes = result["changes"]
+            assert paths(changes, "added") == {"src/", "src/pkg/", "src/pkg/a.py"}, changes
+            assert paths(changes, "modified") == {"keep.txt"}, changes
+            assert changes["modified"][0] == {"path": "keep.txt", "size": 6, "previous_size": 4}
+            assert paths(changes, "deleted") == {"old.txt"}, changes
+            assert {"path": "src/pkg/a.py", "size": 3} in changes["added"]
+
+            # a command that changes nothing reports nothing, files written between commands are not its changes
+            assert sandbox.create_file("uploaded.txt", "u")["success"]
+            changes = (await sandbox.execute_command_async("true"))["changes"]
+            assert changes["counts"] == {"added": 0, "modified": 0, "deleted": 0}, changes
+
+            # moves and directory removals
+            changes = (await sandbox.execute_command_async("sh -c 'mv src lib && rm -r lib/pkg'"))["changes"]
+            assert paths(changes, "deleted") == {"src/", "src/pkg/", "src/pkg/a.py"}, changes
+            assert paths(changes, "added") == {"lib/"}, changes
+
+            # outputs spilled to .sandbox are internal
+            changes = sandbox.execute_command("sh -c 'mkdir -p .sandbox/x && touch .sandbox/x/y'")["changes"]
+            assert changes["counts"]["added"] == 0, changes
+
+            # lists are capped, counts are not
+            changes = sandbox.execute_command("sh -c 'for i in $(seq 1 20); do touch f$i; done'")["changes"]
+            assert changes["counts"]["added"] == 20
+            sandbox.file_index.reset()
+            assert FileIndex(sandbox.working_directory, mode).report(max_entries=5)["baseline"]
+
+            # listings with stat data and pagination, served from the index
+            listing = sandbox.list_files("", limit=10)
+            assert listing["total"] == 23 and len(listing["entries"]) == 10 and listing["next_offset"] == 10
+            assert listing["entries"][0]["name"] == "f1" and listing["entries"][0]["type"] == "file"
+            rest = sandbox.list_files("", offset=20)
+            assert rest["next_offset"] is None and [e["name"] for e in rest["entries"]][-2:] == ["lib", "uploaded.txt"]
+            sandbox.execute_command("sh -c 'mkdir -p lib/a/b && echo 12345 > lib/a/b/c.txt'")
+            listing = sandbox.list_files("lib", recursive=True)
+            assert listing["files"] == ["a", "a/b", "a/b/c.txt"], listing
+            assert listing["entries"][2]["path"] == "lib/a/b/c.txt" and listing["entries"][2]["size"] == 6
+            assert sandbox.list_files("lib")["files"] == ["a"]
+            assert sandbox.list_files(".sandbox/x")["files"] == ["y"]
+            assert not sandbox.list_files("keep.txt")["success"]
+            assert not sandbox.list_files("..")["success"]
+            if mode == "auto" and sys.platform.startswith("linux"):
+                assert sandbox.file_index.watching
+        finally:
+            sandbox.close()
+
+
+def test_fs_changes():
+    # the report mode set per round is undone with the rest on exit
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true"}):
+        asyncio.run(_run_fs_changes())
+
+
+if __name__ == "__main__":
+    test_fs_changes()
+    print("fs changes OK")
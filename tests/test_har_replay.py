@@ -0,0 +1,70 @@
+import asyncio
+import http.server
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.append(".")
+
+
+class _PageHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"<html><head><title>Recorded page</title></head><body><p>recorded</p></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def _run_har_replay(directory):
+    from browser_use.browser.browser import BrowserConfig
+    from src.browser.custom_browser import CustomBrowser
+    from src.browser.custom_context import CustomBrowserContextConfig
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    har_path = os.path.join(directory, "{run_id}.har.zip")
+    browser = CustomBrowser(config=BrowserConfig(headless=True))
+    try:
+        async def visit(har_mode):
+            # every context gets a fresh context id, the run id is what ties replay to the recording
+            context = await browser.new_context(config=CustomBrowserContextConfig(
+                har_mode=har_mode, har_path=har_path, har_run_id="checkout-flow"))
+            try:
+                page = await context.get_current_page()
+                await page.goto(url)
+                return await page.title()
+            finally:
+                await context.close()
+
+        assert await visit("record") == "Recorded page"
+        assert os.path.exists(os.path.join(directory, "checkout-flow.har.zip"))
+        server.shutdown()
+        server.server_close()
+        # the server is gone, the page can only come from the archive
+        assert await visit("replay") == "Recorded page"
+
+        try:
+            await browser.new_context(config=CustomBrowserContextConfig(
+                har_mode="replay", har_path=os.path.join(directory, "{context_id}.har")))
+            raise AssertionError("replaying a per-context path should be refused")
+        except ValueError:
+            pass
+    finally:
+        await browser.close()
+
+
+def test_har_replay():
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(_run_har_replay(directory))
+
+
+if __name__ == "__main__":
+    test_har_replay()
+    print("HAR replay OK")
@@ -0,0 +1,82 @@
+import asyncio
+import sys
+
+sys.path.append(".")
+
+from src.utils.job_queue import JobQueue, JobQueueFull
+
+
+async def _run_job_queue():
+    started = []
+
+    async def handler(job, worker):
+        started.append((job.task, worker.sandbox_key))
+        await asyncio.sleep(float(job.task.split()[-1]))
+        if job.task.startswith("fail"):
+            raise RuntimeError("boom")
+        return {"success": not job.task.startswith("error"), "output": job.task, "error": "bad"}
+
+    queue = JobQueue(handler, workers=2, max_queued=3, use_browser=False)
+    try:
+        # two workers run jobs in parallel, each with its own sandbox
+        jobs = [await queue.submit(f"sleep {0.3}") for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert (await queue.get_stats())["busy_workers"] == 2
+        assert {key for _, key in started} == {"job-worker-0", "job-worker-1"}
+        for job in jobs:
+            await queue.wait(job.job_id, 5)
+        assert all(job.status == "succeeded" and job.result["output"] == "sleep 0.3" for job in jobs)
+        assert max(job.finished_at for job in jobs) - min(job.started_at for job in jobs) < 0.5
+
+        # failures, raised or reported
+        failed = await queue.submit("fail 0")
+        errored = await queue.submit("error 0")
+        await queue.wait(failed.job_id, 5)
+        await queue.wait(errored.job_id, 5)
+        assert failed.status == "failed" and failed.error == "boom" and failed.result is None
+        assert errored.status == "failed" and errored.result["output"] == "error 0"
+
+        # cancel a running and a queued job, the queue is bounded
+        running = [await queue.submit("sleep 5"), await queue.submit("sleep 5")]
+        await asyncio.sleep(0.05)
+        queued = [await queue.submit("sleep 0"), await queue.submit("sleep 0"), await queue.submit("sleep 0")]
+        try:
+            await queue.submit("sleep 0")
+            assert False, "queue should be full"
+        except JobQueueFull:
+            pass
+        await queue.cancel(queued[0].job_id)
+        assert queued[0].status == "cancelled" and queued[0].started_at is None
+        # a cancelled job no longer takes room in the queue
+        assert (await queue.get_stats())["queued"] == 2
+        queued.append(await queue.submit("sleep 0"))
+        for job in running:
+            await queue.cancel(job.job_id)
+        for job in running + queued:
+            await queue.wait(job.job_id, 5)
+        assert [job.status for job in running] == ["cancelled", "cancelled"]
+        assert [job.status for job in queued] == ["cancelled", "succeeded", "succeeded", "succeeded"]
+
+        stats = await queue.get_stats()
+        assert stats["submitted"] == 10 and stats["rejected"] == 1 and stats["cancelled"] == 3
+        assert stats["succeeded"] == 5 and stats["failed"] == 2 and stats["queued"] == 0
+        assert len(await queue.list("cancelled")) == 3
+        assert (await queue.get(jobs[0].job_id)).to_dict()["run_time"] >= 0.3
+    finally:
+        await queue.close()
+
+    # closing cancels what is still queued or running
+    queue = JobQueue(handler, workers=1, use_browser=False)
+    running, waiting = await queue.submit("sleep 5"), await queue.submit("sleep 5")
+    await asyncio.sleep(0.05)
+    await queue.close()
+    assert running.status == waiting.status == "cancelled"
+
+
+def test_job_queue():
+    asyncio.run(_run_job_queue())
+
+
+if __name__ == "__main__":
+    test_job_queue()
+    print("job queue OK")
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.append(".")
+
+from src.utils.job_queue import JobQueueFull
+from src.utils.job_store import JobStore, StoreJobQueue
+from src.utils.job_workers import JobProcess, JobSupervisor
+
+
+async def _run_job_store(path):
+    store = JobStore(path)
+    queue = StoreJobQueue(store, max_queued=3)
+    try:
+        # jobs are claimed oldest first, once
+        first, second = await queue.submit("first"), await queue.submit("second", "context")
+        other = JobStore(path)
+        claimed = other.claim(0, 111)
+        assert claimed.job_id == first.job_id and claimed.status == "running" and claimed.worker == 0
+        assert store.claim(1, 222).job_id == second.job_id and store.claim(1, 222) is None
+        other.finish(first.job_id, "succeeded", result={"success": True, "output": "done"})
+        job = await queue.wait(first.job_id, 1)
+        assert job.status == "succeeded" and job.result["output"] == "done" and job.done.is_set()
+        assert job.to_dict()["run_time"] >= 0
+
+        # the queue is bounded, queued jobs are cancelled at once, running ones by their worker
+        waiting = [await queue.submit(f"wait {index}") for index in range(3)]
+        try:
+            await queue.submit("one too many")
+            raise AssertionError("the queue should be full")
+        except JobQueueFull:
+            pass
+        assert (await queue.cancel(waiting[0].job_id)).status == "cancelled"
+        assert (await queue.cancel(second.job_id)).status == "running" and other.cancel_requested(second.job_id)
+        assert (await queue.wait(second.job_id, 0.3)).status == "running"
+
+        # a worker process that died fails its jobs, other processes' jobs are left alone
+        assert store.fail_running("Job worker process exited", pid=111) == 0
+        assert store.fail_running("Job worker process exited", pid=222) == 1
+        assert (await queue.get(second.job_id)).error == "Job worker process exited"
+        assert await queue.get("missing") is None and await queue.wait("missing") is None
+
+        # slots of a process run the remaining jobs and honour cancellation
+        async def handler(job, worker):
+            await asyncio.sleep(5 if job.task == "wait 2" else 0)
+            return {"success": job.task != "wait 1", "output": job.task, "error": "bad"}
+
+        process = JobProcess(store, 3, handler, concurrency=2, use_browser=False)
+        runner = asyncio.create_task(process.run())
+        assert (await queue.wait(waiting[1].job_id, 5)).status == "failed"
+        await asyncio.sleep(0.3)
+        await queue.cancel(waiting[2].job_id)
+        cancelled = await queue.wait(waiting[2].job_id, 5)
+        assert cancelled.status == "cancelled" and cancelled.error == "Cancelled while running"
+        assert cancelled.worker in (6, 7)
+        stats = await queue.get_stats()
+        assert stats["workers"] == 2 and stats["succeeded"] == 1 and stats["failed"] == 2
+        assert stats["cancelled"] == 2 and stats["queued"] == 0 and stats["rejected"] == 1
+        process.stop()
+        await runner
+
+        assert [job["task"] for job in await queue.list("failed")] == ["second", "wait 1"]
+        assert store.forget_finished(2) == 3 and len(await queue.list()) == 2
+        other.close()
+    finally:
+        await queue.close()
+
+
+async def _run_worker_processes(path):
+    supervisor = JobSupervisor(2, path)
+    supervisor.start()
+    queue = StoreJobQueue(JobStore(path))
+    try:
+        jobs = [await queue.submit(f"task {index}") for index in range(6)]
+        for job in jobs:
+            job = await queue.wait(job.job_id, 60)
+            assert job.status == "succeeded", job.to_dict()
+            assert job.result["output"] == f"Task '{job.task}' received and processed"
+
+        # a worker process that dies is restarted
+        pid = supervisor.get_info()["processes"][0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 30
+        while supervisor.get_info()["processes"][0]["pid"] == pid and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        info = supervisor.get_info()
+        assert info["restarts"] == 1 and info["processes"][0]["pid"] != pid
+        job = await queue.wait((await queue.submit("after restart")).job_id, 60)
+        assert job.status == "succeeded"
+    finally:
+        await queue.close()
+        supervisor.stop()
+    assert not any(process["alive"] for process in supervisor.get_info()["processes"])
+
+
+def test_job_store():
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(_run_job_store(os.path.join(directory, "jobs.db")))
+
+
+def test_worker_processes():
+    with mock.patch.dict(os.environ, {"JOB_WORKER_BROWSER": "false"}), tempfile.TemporaryDirectory() as directory:
+        asyncio.run(_run_worker_processes(os.path.join(directory, "jobs.db")))
+
+
+if __name__ == "__main__":
+    test_job_store()
+    test_worker_processes()
+    print("job store OK")
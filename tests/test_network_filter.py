@@ -0,0 +1,74 @@
+import os
+import sys
+
+sys.path.append(".")
+
+
+def test_domain_suffix_trie():
+    from src.browser.network_filter import DomainSuffixTrie
+
+    trie = DomainSuffixTrie(["ads.example.com", "tracker.net"])
+    assert trie.matches("ads.example.com")
+    assert trie.matches("cdn.ads.example.com")
+    assert trie.matches("TRACKER.net.")
+    assert not trie.matches("example.com")
+    assert not trie.matches("nottracker.net")
+    assert len(trie) == 2
+
+    # a parent domain swallows its subdomains
+    trie.add("example.com")
+    assert trie.matches("www.example.com")
+    assert len(trie) == 2
+
+
+def test_network_filter_profiles():
+    from src.browser.network_filter import NetworkFilter
+
+    network_filter = NetworkFilter(profile="balanced", block_images=True)
+    assert network_filter.should_block("https://fonts.example.org/a.woff2", "font") == "type"
+    assert network_filter.should_block("https://example.org/logo.png", "image") == "type"
+    assert network_filter.should_block("https://securepubads.g.doubleclick.net/tag.js", "script") == "domain"
+    assert network_filter.should_block("https://example.org/app.js", "script") is None
+    # a page the agent navigates to is never blocked, even on a listed domain
+    assert network_filter.should_block("https://www.taboola.com/", "document", is_main_frame_navigation=True) is None
+
+    network_filter._record("font", "type", 0.0)
+    network_filter._record("script", None, 0.0)
+    stats = network_filter.take_step_stats()
+    assert stats["requests_seen"] == 2
+    assert stats["requests_blocked"] == 1
+    assert network_filter.take_step_stats()["requests_seen"] == 0
+    assert network_filter.get_total_stats()["requests_seen"] == 2
+
+    assert not NetworkFilter(profile="off").enabled
+
+
+def test_block_images_setting():
+    from src.browser.custom_context import CustomBrowserContextConfig
+    from src.browser.network_filter import block_images_for_vision
+
+    previous = os.environ.get("NETWORK_FILTER_BLOCK_IMAGES")
+    try:
+        os.environ["NETWORK_FILTER_BLOCK_IMAGES"] = "auto"
+        assert block_images_for_vision(use_vision=False) and not block_images_for_vision(use_vision=True)
+        # contexts leave the value to the same resolution, with the vision of their agent
+        assert CustomBrowserContextConfig().network_filter_block_images is None
+        os.environ["NETWORK_FILTER_BLOCK_IMAGES"] = "TRUE"
+        assert block_images_for_vision(use_vision=True)
+        os.environ["NETWORK_FILTER_BLOCK_IMAGES"] = "sometimes"
+        try:
+            block_images_for_vision(use_vision=True)
+            raise AssertionError("unknown values should be refused")
+        except ValueError:
+            pass
+    finally:
+        if previous is None:
+            os.environ.pop("NETWORK_FILTER_BLOCK_IMAGES", None)
+        else:
+            os.environ["NETWORK_FILTER_BLOCK_IMAGES"] = previous
+
+
+if __name__ == "__main__":
+    test_domain_suffix_trie()
+    test_network_filter_profiles()
+    test_block_images_setting()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.output_capture import CommandOutput, OutputCapture, prune_outputs
+
+
+async def _run_output_capture():
+    # small output is returned whole and never touches the disk
+    capture = OutputCapture(os.path.join(tempfile.gettempdir(), f"never-{os.getpid()}"), max_bytes=10)
+    capture.write("abc")
+    capture.write(b"defgh")
+    assert capture.text() == "abcdefgh" and not capture.truncated and not capture.spilled
+
+    # head and tail stay within the cap across chunk boundaries
+    capture = OutputCapture(None, max_bytes=10)
+    for i in range(100):
+        capture.write(str(i % 10) * 7)
+    assert capture.total_bytes == 700 and capture.truncated and not capture.spilled
+    assert len(capture._head) == 5 and capture._tail_size == 5
+    assert capture.text().startswith("00000\n... [690 bytes omitted] ...\n") and capture.text().endswith("99999")
+
+    sandbox = Sandbox()
+    sandbox.start()
+    try:
+        # sync path: a large output is truncated and spilled completely
+        result = sandbox.execute_command("seq 1 10000")
+        expected = "".join(f"{i}\n" for i in range(1, 10001))
+        assert result["success"] and result["truncated"] and result["stdout_bytes"] == len(expected)
+        assert len(result["stdout"]) < 1200 and result["stdout"].startswith("1\n2\n")
+        assert result["stdout"].endswith("9999\n10000\n") and "bytes omitted" in result["stdout"]
+        output_id = result["output_id"]
+
+        # ranged reads, also from the end
+        part = sandbox.read_output(output_id, "stdout", 0, 100)
+        assert part["success"] and part["data"] == expected[:100] and not part["eof"]
+        part = sandbox.read_output(output_id, "stdout", -6)
+        assert part["data"] == "10000\n" and part["eof"] and part["total_bytes"] == len(expected)
+        full = sandbox.read_output(output_id, "stdout", 0, 10 ** 6)
+        assert full["data"] == expected
+        assert not sandbox.read_output(output_id, "stderr")["success"]
+        assert not sandbox.read_output("../../etc", "stdout")["success"]
+
+        # small output: nothing spilled
+        result = sandbox.execute_command("echo hello")
+        assert result["stdout"] == "hello\n" and not result["truncated"] and "output_id" not in result
+
+        # async path and shell sessions use the same capture
+        result = await sandbox.execute_command_async("seq 1 10000")
+        assert result["truncated"] and sandbox.read_output(result["output_id"], "stdout", 0, 10 ** 6)["data"] == expected
+        result = await sandbox.execute_command_async("seq 1 10000", session_id="capture")
+        assert result["truncated"] and result["stdout"].endswith("10000\n")
+
+        # timeouts keep the output produced so far
+        result = sandbox.execute_command("sh -c 'echo started; sleep 10'", timeout=1)
+        assert result["exit_code"] == 124 and result["stdout"] == "started\n" and "timed out" in result["stderr"]
+        # a child left in the background holding the pipes does not outlast the timeout
+        started = time.monotonic()
+        result = sandbox.execute_command("bash -c 'sleep 12 & echo hi'", timeout=2)
+        assert result["exit_code"] == 124 and result["stdout"] == "hi\n" and time.monotonic() - started < 5
+    finally:
+        sandbox.close()
+
+    # only the newest spilled outputs are kept
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(5):
+            with open(os.path.join(directory, f"out{i}.stdout"), "w") as f:
+                f.write("x")
+            os.utime(os.path.join(directory, f"out{i}.stdout"), (i, i))
+        prune_outputs(directory, keep=2)
+        assert sorted(os.listdir(directory)) == ["out3.stdout", "out4.stdout"]
+    finally:
+        shutil.rmtree(directory)
+
+    # no working directory, no spilling
+    output = CommandOutput(None, max_bytes=4)
+    output.write("stdout", "0123456789")
+    output.close()
+    assert output.result()["truncated"] and "output_id" not in output.result()
+
+
+def test_output_capture():
+    with mock.patch.dict(os.environ, {
+        "ENABLE_SANDBOX": "true",
+        "SANDBOX_OUTPUT_MAX_BYTES": "1000",
+        "SANDBOX_RESOURCE_ACCOUNTING": "false",
+    }):
+        asyncio.run(_run_output_capture())
+
+
+if __name__ == "__main__":
+    test_output_capture()
+    print("output capture OK")
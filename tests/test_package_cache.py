@@ -0,0 +1,90 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.package_cache import OVERLAY_DIR, CacheUsage, PackageCache
+
+
+def build_wheel(directory):
+    """A minimal pure Python wheel"""
+    path = os.path.join(directory, "tinypkg-1.0-py3-none-any.whl")
+    with zipfile.ZipFile(path, "w") as wheel:
+        wheel.writestr("tinypkg/__init__.py", "VALUE = 42\n")
+        wheel.writestr("tinypkg-1.0.dist-info/METADATA", "Metadata-Version: 2.1\nName: tinypkg\nVersion: 1.0\n")
+        wheel.writestr("tinypkg-1.0.dist-info/WHEEL",
+                       "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n")
+        wheel.writestr("tinypkg-1.0.dist-info/RECORD", "")
+    return path
+
+
+async def _run_package_cache():
+    # lines split over chunks are counted once
+    usage = CacheUsage()
+    feed = usage.feeder("stdout")
+    feed(b"Collecting a\n  Using cac")
+    feed(b"hed a-1.0.whl (10 kB)\n  Downloading b-2.0.whl (5 kB)\nnpm http fetch GET 200 x 3ms (cache hit)")
+    assert usage.finish() == {"pip_hits": 1, "pip_misses": 1, "pip_builds": 0, "npm_hits": 1, "npm_misses": 0}
+    assert PackageCache.usage_for("ls -la") is None and PackageCache.usage_for("pip install x") is not None
+
+    root = tempfile.mkdtemp()
+    cache = PackageCache(root, offline=True)
+    first, second = Sandbox(), Sandbox()
+    try:
+        for sandbox in (first, second):
+            sandbox.package_cache = cache
+            sandbox.start()
+
+        # the first sandbox builds a wheel into its overlay and publishes it
+        env = first._command_env()
+        assert env["SANDBOX_WHEELHOUSE"] == os.path.join(first.working_directory, OVERLAY_DIR)
+        assert env["PIP_NO_INDEX"] == "1" and env["npm_config_cache"] == os.path.join(root, "npm")
+        build_wheel(env["SANDBOX_WHEELHOUSE"])
+        assert first.publish_packages() == {"success": True, "promoted": 1, "already_present": 0}
+        assert first.publish_packages()["already_present"] == 1
+        published = os.path.join(cache.wheelhouse, "tinypkg-1.0-py3-none-any.whl")
+        assert os.stat(published).st_nlink == 2
+
+        # the second sandbox installs it offline from the shared wheelhouse
+        result = await second.execute_command_async(
+            f"{sys.executable} -m pip install --no-deps --disable-pip-version-check --target site tinypkg")
+        assert result["success"], result["stderr"]
+        assert result["package_cache"]["pip_hits"] == 1 and result["package_cache"]["pip_misses"] == 0
+        assert os.path.exists(os.path.join(second.working_directory, "site", "tinypkg", "__init__.py"))
+        assert second.package_stats["pip_hits"] == 1
+
+        # offline, anything not cached fails instead of reaching the network
+        result = second.execute_command(
+            f"{sys.executable} -m pip install --no-deps --disable-pip-version-check --target site not-cached-pkg")
+        assert not result["success"] and "package_cache" in result
+
+        stats = cache.get_stats()
+        assert stats["commands"] == 2 and stats["pip_hits"] == 1 and stats["promoted"] == 1
+        assert stats["wheelhouse_packages"] == 1
+
+        # wheels left in an overlay are promoted when the sandbox closes
+        os.rename(published, published + ".bak")
+        build_wheel(os.path.join(second.working_directory, OVERLAY_DIR))
+        os.remove(published + ".bak")
+        second.close()
+        assert os.path.exists(published)
+    finally:
+        first.close()
+        second.close()
+        shutil.rmtree(root)
+
+
+def test_package_cache():
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true", "SANDBOX_RESOURCE_ACCOUNTING": "false"}):
+        asyncio.run(_run_package_cache())
+
+
+if __name__ == "__main__":
+    test_package_cache()
+    print("package cache OK")
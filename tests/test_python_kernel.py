@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(".")
+
+from src.sandbox.python_kernel import PythonKernel
+
+
+async def run(kernel, code, timeout=30):
+    events = [event async for event in kernel.stream(code, timeout)]
+    output = {"stdout": "", "stderr": "", "result": None, "figures": [], "error": None}
+    for event in events[:-1]:
+        if event["type"] in ("stdout", "stderr"):
+            output[event["type"]] += event["data"]
+        elif event["type"] == "result":
+            output["result"] = event["data"]
+        elif event["type"] == "figure":
+            output["figures"].append(event["path"])
+        elif event["type"] == "error":
+            output["error"] = event
+    return output, events[-1]
+
+
+async def _run_python_kernel():
+    workdir = tempfile.mkdtemp()
+    kernel = PythonKernel("test", workdir, os.environ.copy())
+
+    # globals survive between cells, a trailing expression is reported
+    await run(kernel, "import math\ndata = [1, 2, 3]")
+    output, exit_event = await run(kernel, "print('sum', sum(data))\nmath.sqrt(16)")
+    assert output["stdout"] == "sum 6\n" and output["result"] == "4.0"
+    assert exit_event["exit_code"] == 0 and exit_event["execution_count"] == 2
+
+    # errors come back with a traceback of the cell only
+    output, exit_event = await run(kernel, "undefined_name")
+    assert exit_event["exit_code"] == 1 and output["error"]["ename"] == "NameError"
+    assert "kernel_worker" not in output["error"]["traceback"]
+
+    # fd level output of child processes is captured too
+    output, _ = await run(kernel, "import os\nos.system('echo from-child')")
+    assert "from-child" in output["stderr"]
+
+    # a timeout interrupts the cell and keeps the state
+    output, exit_event = await run(kernel, "import time\nwhile True: time.sleep(0.01)", timeout=0.5)
+    assert exit_event["timed_out"] and exit_event["exit_code"] == 124 and not exit_event["restarted"]
+    assert output["error"]["ename"] == "KeyboardInterrupt"
+    output, _ = await run(kernel, "data")
+    assert output["result"] == "[1, 2, 3]"
+
+    # the memory limit turns a runaway allocation into a MemoryError
+    output, _ = await run(kernel, "block = bytearray(64 * 1024 ** 3)")
+    assert output["error"]["ename"] == "MemoryError"
+
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        output, _ = await run(kernel, "import matplotlib.pyplot as plt\nplt.plot([1, 2, 3])\nNone")
+        assert len(output["figures"]) == 1 and os.path.exists(output["figures"][0])
+
+    # exiting loses the state, the next cell starts a new interpreter
+    _, exit_event = await run(kernel, "raise SystemExit(0)")
+    assert exit_event["restarted"]
+    output, exit_event = await run(kernel, "'data' in globals()")
+    assert output["result"] == "False" and kernel.restarts == 1
+    await kernel.close()
+    assert not kernel.alive
+
+
+def test_python_kernel():
+    asyncio.run(_run_python_kernel())
+
+
+if __name__ == "__main__":
+    test_python_kernel()
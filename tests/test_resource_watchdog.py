@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(".")
+
+from browser_use.browser.browser import BrowserConfig
+
+from src.browser.resource_watchdog import ResourceLimits, ResourceWatchdog
+
+
+class FakeCDPSession:
+    def __init__(self):
+        self.cpu_time = 0.0
+
+    async def send(self, method, params=None):
+        assert method == "SystemInfo.getProcessInfo"
+        self.cpu_time += 0.5
+        # the test process stands in for the browser process
+        return {"processInfo": [{"type": "browser", "id": os.getpid(), "cpuTime": self.cpu_time}]}
+
+
+class FakePlaywrightBrowser:
+    async def new_browser_cdp_session(self):
+        return FakeCDPSession()
+
+    def is_connected(self):
+        return True
+
+
+class FakePage:
+    def __init__(self, heap):
+        self.heap = heap
+
+    async def evaluate(self, script):
+        return self.heap
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.config = BrowserConfig(headless=True)
+        self.playwright_browser = FakePlaywrightBrowser()
+
+
+class FakeSession:
+    def __init__(self, pages):
+        self.context = self
+        self.pages = pages
+
+
+class FakeBrowserContext:
+    def __init__(self, browser, context_id, pages):
+        self.browser = browser
+        self.context_id = context_id
+        self.session = FakeSession(pages)
+
+
+async def _run_resource_watchdog():
+    watchdog = ResourceWatchdog(ResourceLimits(
+        max_browser_rss_mb=100_000, max_context_heap_mb=64, max_context_pages=3, sample_interval=0))
+    browser = FakeBrowser()
+    small = FakeBrowserContext(browser, "small", [FakePage(10 * 1024 * 1024)])
+    leaky = FakeBrowserContext(browser, "leaky", [FakePage(50 * 1024 * 1024), FakePage(30 * 1024 * 1024)])
+    crowded = FakeBrowserContext(browser, "crowded", [FakePage(0) for _ in range(4)])
+    for browser_context in (small, leaky, crowded):
+        watchdog.register_context(browser_context)
+
+    sample = await watchdog.sample(browser)
+    assert sample.processes == 1 and sample.rss_bytes > 0
+    assert sample.contexts["leaky"] == {"pages": 2, "js_heap_mb": 80.0}
+
+    assert await watchdog.check_context(small) is None
+    assert "JS heap" in await watchdog.check_context(leaky)
+    assert "pages open" in await watchdog.check_context(crowded)
+    assert await watchdog.check_browser(browser) is None
+    assert watchdog.get_metrics()["browsers"][0]["sample"]["cpu_percent"] is not None
+
+    # an RSS limit below the test process size flags the whole browser
+    watchdog.limits.max_browser_rss_mb = 1
+    assert "RSS" in await watchdog.check_context(small)
+    assert "RSS" in await watchdog.check_browser(browser)
+    watchdog.record_browser_recycle(browser)
+    assert watchdog.get_metrics()["browsers_recycled"] == 1
+
+
+def test_resource_watchdog():
+    asyncio.run(_run_resource_watchdog())
+
+
+if __name__ == "__main__":
+    test_resource_watchdog()
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(".")
+
+from src.sandbox.executor import AsyncCommandExecutor
+
+
+async def _run_sandbox_executor():
+    executor = AsyncCommandExecutor(max_concurrency=2, kill_grace=1)
+    cwd = tempfile.gettempdir()
+    env = os.environ.copy()
+
+    events = [event async for event in executor.stream(
+        ["sh", "-c", "echo one; echo oops >&2; sleep 0.1; echo two"], cwd, env, timeout=10)]
+    stdout = "".join(event["data"] for event in events if event["type"] == "stdout")
+    stderr = "".join(event["data"] for event in events if event["type"] == "stderr")
+    assert stdout == "one\ntwo\n" and stderr == "oops\n"
+    assert events[-1]["type"] == "exit" and events[-1]["exit_code"] == 0 and not events[-1]["timed_out"]
+
+    # the timeout takes down the background child as well
+    pid_file = os.path.join(cwd, f"sandbox-executor-test-{os.getpid()}")
+    events = [event async for event in executor.stream(
+        ["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"], cwd, env, timeout=0.5)]
+    assert events[-1]["exit_code"] == 124 and events[-1]["timed_out"]
+    with open(pid_file) as f:
+        child = int(f.read())
+    os.remove(pid_file)
+    await asyncio.sleep(0.1)
+    try:
+        with open(f"/proc/{child}/stat") as f:
+            # killed but not reaped yet counts as gone
+            assert f.read().split(")")[-1].split()[0] == "Z", "background child survived the timeout"
+    except FileNotFoundError:
+        pass
+
+    # four commands, two slots: two rounds, and the loop stays responsive meanwhile
+    async def sleeper():
+        return [event async for event in executor.stream(["sleep", "0.3"], cwd, env)]
+
+    start = time.monotonic()
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while time.monotonic() - start < 0.5:
+            ticks += 1
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(*(sleeper() for _ in range(4)), ticker())
+    elapsed = time.monotonic() - start
+    assert 0.55 < elapsed < 1.5, elapsed
+    assert ticks >= 5
+    assert executor.get_stats()["running"] == 0
+
+
+def test_sandbox_executor():
+    asyncio.run(_run_sandbox_executor())
+
+
+if __name__ == "__main__":
+    test_sandbox_executor()
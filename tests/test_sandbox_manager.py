@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox.manager import SandboxManager
+
+
+async def _run_sandbox_manager():
+    manager = SandboxManager(max_sessions=2, idle_timeout=0, disk_quota_mb=1)
+    alice, bob = manager.get("alice"), manager.get("bob")
+    assert manager.get("alice") is alice and alice.working_directory != bob.working_directory
+
+    # working directories are isolated
+    alice.create_file("notes.txt", "alice")
+    result = await bob.execute_command_async("ls")
+    assert result["success"] and result["stdout"] == ""
+
+    # a shell session of an evicted sandbox dies with it
+    await alice.execute_command_async("sleep 60 &", session_id="shell")
+    assert alice.list_shell_sessions()[0]["alive"]
+
+    # bob is the least recently used once alice is looked up again, the reaper closes him
+    manager.get("alice")
+    carol = manager.get("carol")
+    assert [entry["key"] for entry in manager.list_sessions()] == ["alice", "carol"]
+    manager.wait_closed()
+    assert not os.path.exists(bob.working_directory)
+
+    # a sandbox with a live shell session or background process is not evicted
+    assert alice.is_busy() and manager.list_sessions()[0]["busy"]
+    assert carol.start_process("sleep 60", name="server")["success"] and carol.is_busy()
+    dave = manager.get("dave")
+    assert len(manager.list_sessions()) == 3
+    carol.stop_process("server")
+
+    # the disk quota refuses new work once exceeded
+    carol.create_file("big.bin", "x" * (2 * 1024 * 1024))
+    carol.disk_usage(refresh=True)
+    result = await carol.execute_command_async("true")
+    assert not result["success"] and "quota" in result["stderr"]
+    assert not carol.create_file("more.txt", "x")["success"]
+
+    # idle sandboxes are reaped, busy ones are kept however long they have been idle
+    assert dave.start_process("sleep 60", name="server")["success"]
+    manager.idle_timeout = 0.01
+    time.sleep(0.05)
+    assert manager.reap_idle() == 1
+    assert not os.path.exists(carol.working_directory)
+    assert os.path.exists(alice.working_directory) and os.path.exists(dave.working_directory)
+    dave.stop_process("server")
+
+    # with their shell sessions once those are gone
+    await alice.close_shell_session("shell")
+    time.sleep(0.05)
+    assert manager.reap_idle() == 2
+    assert not os.path.exists(alice.working_directory) and alice.list_shell_sessions() == []
+    assert not os.path.exists(dave.working_directory)
+    assert manager.get_stats()["evicted"] == 4
+
+
+def test_sandbox_manager():
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true"}):
+        asyncio.run(_run_sandbox_manager())
+
+
+if __name__ == "__main__":
+    test_sandbox_manager()
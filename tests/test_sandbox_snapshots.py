@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+from unittest import mock
+
+sys.path.append(".")
+
+from src.sandbox import Sandbox
+from src.sandbox.snapshots import SnapshotStore
+
+
+def tree(sandbox):
+    files = {}
+    for root, dirs, names in os.walk(sandbox.working_directory):
+        for name in dirs + names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, sandbox.working_directory)
+            if relative.startswith(".sandbox"):
+                continue
+            if os.path.islink(path):
+                files[relative] = "-> " + os.readlink(path)
+            elif os.path.isdir(path):
+                files[relative] = "dir"
+            else:
+                with open(path, "rb") as f:
+                    files[relative] = f.read()
+    return files
+
+
+async def _run_sandbox_snapshots():
+    for mode in ("auto", "tar"):
+        sandbox = Sandbox()
+        sandbox.start()
+        sandbox.snapshots = SnapshotStore(sandbox.snapshot_directory, sandbox.working_directory, mode=mode,
+                                          max_snapshots=2)
+        try:
+            sandbox.create_file("app/main.py", "print('v1')\n")
+            sandbox.create_file("app/data.bin", os.urandom(100000))
+            sandbox.create_file("README", "readme\n")
+            os.symlink("app/main.py", os.path.join(sandbox.working_directory, "main"))
+            baseline = tree(sandbox)
+
+            first = sandbox.create_snapshot("clean")
+            assert first["success"] and first["files"] == 3 and first["name"] == "clean"
+            assert first["mode"] == ("tar" if mode == "tar" else "hardlink") or first["mode"] == "reflink"
+
+            # break things: edit in place, delete, add files and directories, change a symlink
+            with open(os.path.join(sandbox.working_directory, "app/main.py"), "a") as f:
+                f.write("print('broken')\n")
+            os.remove(os.path.join(sandbox.working_directory, "README"))
+            sandbox.create_file("node_modules/pkg/index.js", "x")
+            os.remove(os.path.join(sandbox.working_directory, "main"))
+            os.symlink("README", os.path.join(sandbox.working_directory, "main"))
+            assert tree(sandbox) != baseline
+
+            # in place edits of the working directory never reach the snapshot
+            restored = sandbox.restore_snapshot(first["id"])
+            assert restored["success"] and tree(sandbox) == baseline
+            if mode != "tar":
+                # only what differed was touched
+                assert restored["restored"] == 3 and restored["unchanged"] == 2, restored
+
+            # a second snapshot shares unchanged files with the first
+            sandbox.create_file("README", "changed\n")
+            second = sandbox.create_snapshot()
+            if mode != "tar":
+                assert second["linked"] == 2
+            sandbox.restore_snapshot(first["id"])
+            assert tree(sandbox) == baseline
+            sandbox.restore_snapshot(second["id"])
+            assert sandbox.read_file("README")["content"] == "changed\n"
+
+            # the oldest snapshots go beyond max_snapshots, deleted ones can not be restored
+            third = sandbox.create_snapshot()
+            assert [snapshot["id"] for snapshot in sandbox.list_snapshots()] == [second["id"], third["id"]]
+            assert not sandbox.restore_snapshot(first["id"])["success"]
+            assert sandbox.delete_snapshot(third["id"])["success"]
+            assert not sandbox.delete_snapshot(third["id"])["success"]
+            assert not sandbox.delete_snapshot("../x")["success"]
+
+            # no restore while a command runs
+            with sandbox._in_use():
+                assert not sandbox.restore_snapshot(second["id"])["success"]
+        finally:
+            sandbox.close()
+        assert not os.path.exists(sandbox.snapshot_directory)
+
+
+def test_sandbox_snapshots():
+    with mock.patch.dict(os.environ, {"ENABLE_SANDBOX": "true", "SANDBOX_RESOURCE_ACCOUNTING": "false"}):
+        asyncio.run(_run_sandbox_snapshots())
+
+
+if __name__ == "__main__":
+    test_sandbox_snapshots()
+    print("sandbox snapshots OK")
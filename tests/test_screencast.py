@@ -0,0 +1,95 @@
+import asyncio
+import sys
+
+sys.path.append(".")
+
+from src.browser.screencast import ScreencastSource
+
+
+class FakeCDPSession:
+    def __init__(self):
+        self.handlers = {}
+        self.sent = []
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def send(self, method, params=None):
+        self.sent.append((method, params))
+
+    async def detach(self):
+        pass
+
+    def emit_frame(self, session_id):
+        self.handlers["Page.screencastFrame"]({
+            "data": "aGVsbG8=",
+            "sessionId": session_id,
+            "metadata": {"deviceWidth": 800, "deviceHeight": 600, "timestamp": 1.0},
+        })
+
+    def acks(self):
+        return [params["sessionId"] for method, params in self.sent if method == "Page.screencastFrameAck"]
+
+
+class FakePage:
+    def __init__(self):
+        self.cdp = FakeCDPSession()
+        self.context = self
+        self.url = "about:blank"
+
+    async def new_cdp_session(self, page):
+        return self.cdp
+
+    def is_closed(self):
+        return False
+
+
+class FakeBrowserContext:
+    context_id = "test-context"
+
+    def __init__(self):
+        self.page = FakePage()
+
+    async def get_current_page(self):
+        return self.page
+
+
+async def _run_screencast():
+    browser_context = FakeBrowserContext()
+    cdp = browser_context.page.cdp
+    source = ScreencastSource(browser_context, max_fps=20)
+    await source.start()
+    assert cdp.sent[0][0] == "Page.startScreencast"
+
+    # nobody is watching: the frame is kept but not acked, which pauses Chromium
+    cdp.emit_frame(1)
+    await asyncio.sleep(0.1)
+    assert cdp.acks() == []
+    assert source.latest_frame.jpeg == b"hello"
+
+    # a new viewer gets the latest frame immediately and resumes the stream
+    subscription = source.subscribe()
+    frame = await subscription.next_frame(timeout=1)
+    assert frame.seq == 1 and frame.width == 800
+    await asyncio.sleep(0.01)
+    assert cdp.acks() == [1]
+
+    # acks are spaced by the frame rate cap
+    cdp.emit_frame(2)
+    await asyncio.sleep(0.01)
+    assert cdp.acks() == [1]
+    await asyncio.sleep(0.1)
+    assert cdp.acks() == [1, 2]
+    assert (await subscription.next_frame(timeout=1)).seq == 2
+
+    await source.stop()
+    assert await subscription.next_frame(timeout=1) is None
+    assert subscription.closed
+
+
+def test_screencast():
+    asyncio.run(_run_screencast())
+
+
+if __name__ == "__main__":
+    test_screencast()
@@ -0,0 +1,114 @@
+import asyncio
+import sys
+import threading
+
+sys.path.append(".")
+
+from src.utils.session_registry import SessionRegistry
+
+
+class FakeAgent:
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+async def _run_session_registry():
+    registry = SessionRegistry(idle_timeout=0)
+
+    # sessions keep their own agent, browser and stop state
+    first, second = registry.get("tab-1"), registry.get("tab-2")
+    assert registry.get("tab-1") is first and first.agent_state is not second.agent_state
+    first.begin_run()
+    second.begin_run()
+    first.agent, second.agent = FakeAgent(), FakeAgent()
+    first.browser, second.browser = FakeBrowser(), FakeBrowser()
+    first.stop()
+    await asyncio.sleep(0)
+    assert first.agent.stopped and first.agent_state.is_stop_requested()
+    assert not second.agent.stopped and not second.agent_state.is_stop_requested()
+
+    # closing a session with a run in progress stops it and releases it when the run ends
+    browser = first.browser
+    assert await registry.close("tab-1")
+    assert registry.find("tab-1") is None and first.closed and not browser.closed
+    first.agent = None
+    await first.end_run()
+    assert browser.closed and first.browser is None
+    assert not await registry.close("tab-1")
+
+    # a closed session id gets a fresh session
+    assert registry.get("tab-1") is not first
+
+    # sessions are closed on the loop their browser lives on, from any other loop
+    browser = second.browser
+    await second.end_run()
+    closed = []
+    thread = threading.Thread(target=lambda: closed.append(asyncio.run(registry.close("tab-2"))))
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+    assert closed == [True] and browser.closed
+
+    # idle sessions are reaped, busy ones are kept
+    registry.idle_timeout = 0.05
+    idle, busy = registry.get("idle"), registry.get("busy")
+    busy.begin_run()
+    await asyncio.sleep(0.1)
+    assert await registry.reap_idle() == 2
+    assert [info["session_id"] for info in registry.list()] == ["busy"]
+    stats = registry.get_stats()
+    assert stats["sessions"] == 1 and stats["running"] == 1 and stats["closed"] == 4
+    await busy.end_run()
+    await registry.close_all()
+    assert registry.list() == []
+
+
+def test_session_registry():
+    asyncio.run(_run_session_registry())
+
+
+def test_sessions_api():
+    from fastapi.testclient import TestClient
+    from src.api.api_server import app
+    from src.utils.session_registry import get_session_registry
+
+    session = get_session_registry().get("api-tab")
+    session.agent = FakeAgent()
+    with TestClient(app) as client:
+        sessions = client.get("/api/sessions").json()
+        assert "api-tab" in [info["session_id"] for info in sessions["sessions"]]
+        assert client.post("/api/sessions/api-tab/stop").json()["success"]
+        assert session.agent.stopped and session.agent_state.is_stop_requested()
+        assert client.delete("/api/sessions/api-tab").status_code == 200
+        assert client.delete("/api/sessions/api-tab").status_code == 404
+        assert client.post("/api/sessions/api-tab/stop").status_code == 404
+        assert client.get("/api/agent/status").json()["sessions"]["closed"] >= 1
+
+        # the agent endpoints act on the caller's session, not on shared state
+        other = get_session_registry().get("api-other")
+        other.agent = FakeAgent()
+        status = client.get("/api/agent/status", headers={"X-Client-Id": "api-other"}).json()
+        assert status["session"]["session_id"] == "api-other" and not status["status"]["stop_requested"]
+        assert client.post("/api/agent/stop", params={"session_id": "api-other"}).json()["session_id"] == "api-other"
+        assert other.agent.stopped and other.agent_state.is_stop_requested()
+        status = client.get("/api/agent/status", params={"session_id": "api-other"}).json()
+        assert status["status"]["stop_requested"]
+        assert client.post("/api/agent/stop", headers={"X-Client-Id": "missing"}).status_code == 404
+        assert client.post("/api/agent/stop", params={"job_id": "missing"}).status_code == 404
+
+
+if __name__ == "__main__":
+    test_session_registry()
+    test_sessions_api()
+    print("session registry OK")
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(".")
+
+from src.sandbox.shell_session import ShellSessionPool
+
+
+async def run(session, command, timeout=10):
+    stdout, stderr, exit_event = [], [], None
+    async for event in session.stream(command, timeout):
+        if event["type"] == "stdout":
+            stdout.append(event["data"])
+        elif event["type"] == "stderr":
+            stderr.append(event["data"])
+        else:
+            exit_event = event
+    return "".join(stdout), "".join(stderr), exit_event
+
+
+async def _run_shell_session():
+    pool = ShellSessionPool(max_sessions=2, idle_timeout=0)
+    workdir = tempfile.mkdtemp()
+    session = await pool.acquire("sandbox", "s1", workdir, os.environ.copy())
+
+    # cwd, variables and functions survive between commands, pipes work
+    await run(session, "mkdir -p data && cd data && export GREETING=hello")
+    stdout, _, exit_event = await run(session, "pwd; echo $GREETING | tr a-z A-Z")
+    assert stdout == f"{workdir}/data\nHELLO\n", stdout
+    assert exit_event["exit_code"] == 0 and exit_event["cwd"] == f"{workdir}/data"
+
+    stdout, stderr, exit_event = await run(session, "printf 'no newline'; echo err >&2; false")
+    assert stdout == "no newline" and stderr == "err\n" and exit_event["exit_code"] == 1
+
+    # a syntax error does not eat the protocol
+    _, stderr, exit_event = await run(session, "echo 'unterminated")
+    assert exit_event["exit_code"] == 2 and stderr
+
+    # large output crosses many reads
+    stdout, _, _ = await run(session, "seq 1 20000")
+    assert stdout.splitlines()[-1] == "20000"
+
+    # the shell survives everything above without a restart
+    assert session.restarts == 0 and session.commands == 5
+
+    # a timeout restarts the shell in the sandbox directory
+    _, _, exit_event = await run(session, "sleep 30", timeout=0.5)
+    assert exit_event["timed_out"] and exit_event["exit_code"] == 124
+    stdout, _, _ = await run(session, "pwd")
+    assert stdout == f"{workdir}\n" and session.restarts == 1
+
+    # `exit` ends the shell, the next command gets a new one
+    _, _, exit_event = await run(session, "exit 3")
+    assert exit_event["exit_code"] == 3 and not session.alive
+    stdout, _, _ = await run(session, "echo back")
+    assert stdout == "back\n"
+
+    # the pool evicts the least recently used session when full
+    other = await pool.acquire("sandbox", "s2", workdir, os.environ.copy())
+    await run(other, "true")
+    await pool.acquire("sandbox", "s3", workdir, os.environ.copy())
+    assert [info["session_id"] for info in pool.list_sessions()] == ["s2", "s3"]
+    assert not session.alive
+
+    # repeated commands are much cheaper than a new process each
+    start = time.perf_counter()
+    for _ in range(20):
+        await run(other, "cd . && true")
+    assert time.perf_counter() - start < 5
+
+    pool.idle_timeout = 0.01
+    await asyncio.sleep(0.05)
+    await pool.reap_idle()
+    assert pool.list_sessions() == [] and not other.alive
+    await pool.close_all()
+
+
+def test_shell_session():
+    asyncio.run(_run_shell_session())
+
+
+if __name__ == "__main__":
+    test_shell_session()
@@ -25,26 +25,22 @@ from browser_use.browser.context import (
 )
 from langchain_ollama import ChatOllama
 from playwright.async_api import async_playwright
-from src.utils.agent_state import AgentState
+from src.utils.session_registry import DEFAULT_SESSION_ID, get_session_registry
 
 from src.utils import utils
 from src.agent.custom_agent import CustomAgent
+from src.agent.agent_events import create_event_stream
 from src.browser.custom_browser import CustomBrowser
 from src.agent.custom_prompts import CustomSystemPrompt, CustomAgentMessagePrompt
 from src.browser.custom_context import BrowserContextConfig, CustomBrowserContext
 from src.controller.custom_controller import CustomController
+from src.browser.browser_pool import get_browser_pool, browser_pool_enabled
+from src.browser.custom_context import CustomBrowserContextConfig
+from src.browser.resource_watchdog import get_resource_watchdog, resource_watchdog_enabled
 from gradio.themes import Citrus, Default, Glass, Monochrome, Ocean, Origin, Soft, Base
 from src.utils.utils import update_model_dropdown, get_latest_files, capture_screenshot, MissingAPIKeyError
 from src.utils import utils
 
-# Global variables for persistence
-_global_browser = None
-_global_browser_context = None
-_global_agent = None
-
-# Create the global agent state instance
-_global_agent_state = AgentState()
-
 # webui config
 webui_config_manager = utils.ConfigManager()
 
@@ -114,14 +110,44 @@ def resolve_sensitive_env_variables(text):
     return result
 
 
-async def stop_agent():
-    """Request the agent to stop and update UI with enhanced feedback"""
-    global _global_agent
+def use_browser_pool(use_own_browser, cdp_url, keep_browser_open):
+    """Runs that launch a throwaway browser can borrow a warm one from the pool instead"""
+    return browser_pool_enabled() and not use_own_browser and not cdp_url and not keep_browser_open
+
+
+def get_session(request=None):
+    """The session of the browser tab a request came from"""
+    return get_session_registry().get(getattr(request, "session_hash", None) or DEFAULT_SESSION_ID)
+
+
+async def close_session(request: gr.Request):
+    """Stop and release the session of a browser tab that disconnected"""
+    await get_session_registry().close(getattr(request, "session_hash", None) or DEFAULT_SESSION_ID)
 
+
+async def retire_browser_over_limit(session):
+    """Close a kept-open browser that outgrew its resource limits, the next run launches a fresh one"""
+    if not resource_watchdog_enabled() or not isinstance(session.browser, CustomBrowser):
+        return
+    reason = await get_resource_watchdog().check_browser(session.browser)
+    if reason is None:
+        return
+    logger.warning(f"♻️ Relaunching the browser: {reason}")
+    if session.browser_context:
+        await session.browser_context.close()
+        session.browser_context = None
+    get_resource_watchdog().record_browser_recycle(session.browser)
+    await session.browser.close()
+    session.browser = None
+
+
+async def stop_agent(request: gr.Request):
+    """Request the agent of this session to stop and update UI with enhanced feedback"""
     try:
-        if _global_agent is not None:
+        session = get_session_registry().find(getattr(request, "session_hash", None) or DEFAULT_SESSION_ID)
+        if session is not None and session.agent is not None:
             # Request stop
-            _global_agent.stop()
+            session.agent.stop()
         # Update UI immediately
         message = "Stop requested - the agent will halt at the next safe point"
         logger.info(f"🛑 {message}")
@@ -140,13 +166,11 @@ async def stop_agent():
         )
 
 
-async def stop_research_agent():
-    """Request the agent to stop and update UI with enhanced feedback"""
-    global _global_agent_state
-
+async def stop_research_agent(request: gr.Request):
+    """Request the research of this session to stop and update UI with enhanced feedback"""
     try:
         # Request stop
-        _global_agent_state.request_stop()
+        get_session(request).agent_state.request_stop()
 
         # Update UI immediately
         message = "Stop requested - the agent will halt at the next safe point"
@@ -191,8 +215,10 @@ async def run_browser_agent(
         max_actions_per_step,
         tool_calling_method,
         chrome_cdp,
-        max_input_tokens
+        max_input_tokens,
+        session=None
 ):
+    session = session or get_session()
     try:
         # Disable recording if the checkbox is unchecked
         if not enable_recording:
@@ -239,7 +265,8 @@ async def run_browser_agent(
                 max_actions_per_step=max_actions_per_step,
                 tool_calling_method=tool_calling_method,
                 chrome_cdp=chrome_cdp,
-                max_input_tokens=max_input_tokens
+                max_input_tokens=max_input_tokens,
+                session=session
             )
         elif agent_type == "custom":
             final_result, errors, model_actions, model_thoughts, trace_file, history_file = await run_custom_agent(
@@ -260,7 +287,8 @@ async def run_browser_agent(
                 max_actions_per_step=max_actions_per_step,
                 tool_calling_method=tool_calling_method,
                 chrome_cdp=chrome_cdp,
-                max_input_tokens=max_input_tokens
+                max_input_tokens=max_input_tokens,
+                session=session
             )
         else:
             raise ValueError(f"Invalid agent type: {agent_type}")
@@ -327,10 +355,12 @@ async def run_org_agent(
         max_actions_per_step,
         tool_calling_method,
         chrome_cdp,
-        max_input_tokens
+        max_input_tokens,
+        session
 ):
+    browser_pool = pool_lease = None
+    session.begin_run()
     try:
-        global _global_browser, _global_browser_context, _global_agent
 
         extra_chromium_args = [f"--window-size={window_w},{window_h}"]
         cdp_url = chrome_cdp
@@ -346,8 +376,30 @@ async def run_org_agent(
         else:
             chrome_path = None
 
-        if _global_browser is None:
-            _global_browser = Browser(
+        context_config = CustomBrowserContextConfig(
+            trace_path=save_trace_path if save_trace_path else None,
+            save_recording_path=save_recording_path if save_recording_path else None,
+            no_viewport=False,
+            browser_window_size=BrowserContextWindowSize(
+                width=window_w, height=window_h
+            ),
+            use_vision=use_vision,
+        )
+
+        if use_browser_pool(use_own_browser, cdp_url, keep_browser_open):
+            browser_pool = get_browser_pool(
+                BrowserConfig(
+                    headless=headless,
+                    disable_security=disable_security,
+                    extra_chromium_args=extra_chromium_args,
+                )
+            )
+            pool_lease = await browser_pool.acquire(context_config=context_config)
+            session.browser = pool_lease.browser
+            session.browser_context = pool_lease.browser_context
+
+        if session.browser is None:
+            session.browser = Browser(
                 config=BrowserConfig(
                     headless=headless,
                     cdp_url=cdp_url,
@@ -357,34 +409,25 @@ async def run_org_agent(
                 )
             )
 
-        if _global_browser_context is None:
-            _global_browser_context = await _global_browser.new_context(
-                config=BrowserContextConfig(
-                    trace_path=save_trace_path if save_trace_path else None,
-                    save_recording_path=save_recording_path if save_recording_path else None,
-                    no_viewport=False,
-                    browser_window_size=BrowserContextWindowSize(
-                        width=window_w, height=window_h
-                    ),
-                )
-            )
+        if session.browser_context is None:
+            session.browser_context = await session.browser.new_context(config=context_config)
 
-        if _global_agent is None:
-            _global_agent = Agent(
+        if session.agent is None:
+            session.agent = Agent(
                 task=task,
                 llm=llm,
                 use_vision=use_vision,
-                browser=_global_browser,
-                browser_context=_global_browser_context,
+                browser=session.browser,
+                browser_context=session.browser_context,
                 max_actions_per_step=max_actions_per_step,
                 tool_calling_method=tool_calling_method,
                 max_input_tokens=max_input_tokens,
                 generate_gif=True
             )
-        history = await _global_agent.run(max_steps=max_steps)
+        history = await session.agent.run(max_steps=max_steps)
 
-        history_file = os.path.join(save_agent_history_path, f"{_global_agent.state.agent_id}.json")
-        _global_agent.save_history(history_file)
+        history_file = os.path.join(save_agent_history_path, f"{session.agent.state.agent_id}.json")
+        session.agent.save_history(history_file)
 
         final_result = history.final_result()
         errors = history.errors()
@@ -400,16 +443,15 @@ async def run_org_agent(
         errors = str(e) + "\n" + traceback.format_exc()
         return '', errors, '', '', None, None
     finally:
-        _global_agent = None
+        session.agent = None
         # Handle cleanup based on persistence configuration
-        if not keep_browser_open:
-            if _global_browser_context:
-                await _global_browser_context.close()
-                _global_browser_context = None
-
-            if _global_browser:
-                await _global_browser.close()
-                _global_browser = None
+        if pool_lease is not None:
+            await browser_pool.release(pool_lease)
+            session.browser_context = None
+            session.browser = None
+        elif not keep_browser_open:
+            await session.close_browser()
+        await session.end_run()
 
 
 async def run_custom_agent(
@@ -430,10 +472,14 @@ async def run_custom_agent(
         max_actions_per_step,
         tool_calling_method,
         chrome_cdp,
-        max_input_tokens
+        max_input_tokens,
+        session
 ):
+    browser_pool = pool_lease = None
+    # live step events of this run, streamed by the API server
+    event_stream = create_event_stream(task=task)
+    session.begin_run()
     try:
-        global _global_browser, _global_browser_context, _global_agent
 
         extra_chromium_args = [f"--window-size={window_w},{window_h}"]
         cdp_url = chrome_cdp
@@ -451,10 +497,34 @@ async def run_custom_agent(
 
         controller = CustomController()
 
-        # Initialize global browser if needed
+        context_config = CustomBrowserContextConfig(
+            trace_path=save_trace_path if save_trace_path else None,
+            save_recording_path=save_recording_path if save_recording_path else None,
+            no_viewport=False,
+            browser_window_size=BrowserContextWindowSize(
+                width=window_w, height=window_h
+            ),
+            use_vision=use_vision,
+        )
+
+        if use_browser_pool(use_own_browser, cdp_url, keep_browser_open):
+            browser_pool = get_browser_pool(
+                BrowserConfig(
+                    headless=headless,
+                    disable_security=disable_security,
+                    extra_chromium_args=extra_chromium_args,
+                )
+            )
+            pool_lease = await browser_pool.acquire(context_config=context_config)
+            session.browser = pool_lease.browser
+            session.browser_context = pool_lease.browser_context
+        else:
+            await retire_browser_over_limit(session)
+
+        # Initialize the session's browser if needed
         # if chrome_cdp not empty string nor None
-        if (_global_browser is None) or (cdp_url and cdp_url != "" and cdp_url != None):
-            _global_browser = CustomBrowser(
+        if (session.browser is None) or (cdp_url and cdp_url != "" and cdp_url != None):
+            session.browser = CustomBrowser(
                 config=BrowserConfig(
                     headless=headless,
                     disable_security=disable_security,
@@ -464,39 +534,33 @@ async def run_custom_agent(
                 )
             )
 
-        if _global_browser_context is None or (chrome_cdp and cdp_url != "" and cdp_url != None):
-            _global_browser_context = await _global_browser.new_context(
-                config=BrowserContextConfig(
-                    trace_path=save_trace_path if save_trace_path else None,
-                    save_recording_path=save_recording_path if save_recording_path else None,
-                    no_viewport=False,
-                    browser_window_size=BrowserContextWindowSize(
-                        width=window_w, height=window_h
-                    ),
-                )
-            )
+        if session.browser_context is None or (chrome_cdp and cdp_url != "" and cdp_url != None):
+            session.browser_context = await session.browser.new_context(config=context_config)
 
         # Create and run agent
-        if _global_agent is None:
-            _global_agent = CustomAgent(
+        if session.agent is None:
+            session.agent = CustomAgent(
                 task=task,
                 add_infos=add_infos,
                 use_vision=use_vision,
                 llm=llm,
-                browser=_global_browser,
-                browser_context=_global_browser_context,
+                browser=session.browser,
+                browser_context=session.browser_context,
                 controller=controller,
                 system_prompt_class=CustomSystemPrompt,
                 agent_prompt_class=CustomAgentMessagePrompt,
                 max_actions_per_step=max_actions_per_step,
                 tool_calling_method=tool_calling_method,
                 max_input_tokens=max_input_tokens,
-                generate_gif=True
+                generate_gif=True,
+                register_new_step_callback=event_stream.on_step,
+                register_step_end_callback=event_stream.on_step_end,
             )
-        history = await _global_agent.run(max_steps=max_steps)
+        event_stream.attach(session.agent)
+        history = await session.agent.run(max_steps=max_steps)
 
-        history_file = os.path.join(save_agent_history_path, f"{_global_agent.state.agent_id}.json")
-        _global_agent.save_history(history_file)
+        history_file = os.path.join(save_agent_history_path, f"{session.agent.state.agent_id}.json")
+        session.agent.save_history(history_file)
 
         final_result = history.final_result()
         errors = history.errors()
@@ -505,23 +569,27 @@ async def run_custom_agent(
 
         trace_file = get_latest_files(save_trace_path)
 
+        event_stream.finish(result=final_result, error="\n".join(str(error) for error in errors if error) or None)
         return final_result, errors, model_actions, model_thoughts, trace_file.get('.zip'), history_file
     except Exception as e:
         import traceback
         traceback.print_exc()
         errors = str(e) + "\n" + traceback.format_exc()
+        event_stream.finish("failed", error=str(e))
         return '', errors, '', '', None, None
     finally:
-        _global_agent = None
+        if event_stream.finished_at is None:
+            # neither returned nor failed: the run was cancelled
+            event_stream.finish("cancelled")
+        session.agent = None
         # Handle cleanup based on persistence configuration
-        if not keep_browser_open:
-            if _global_browser_context:
-                await _global_browser_context.close()
-                _global_browser_context = None
-
-            if _global_browser:
-                await _global_browser.close()
-                _global_browser = None
+        if pool_lease is not None:
+            await browser_pool.release(pool_lease)
+            session.browser_context = None
+            session.browser = None
+        elif not keep_browser_open:
+            await session.close_browser()
+        await session.end_run()
 
 
 async def run_with_stream(
@@ -549,9 +617,11 @@ async def run_with_stream(
         max_actions_per_step,
         tool_calling_method,
         chrome_cdp,
-        max_input_tokens
+        max_input_tokens,
+        request: gr.Request
 ):
-    global _global_agent
+    session = get_session(request)
+    await get_session_registry().reap_idle()
 
     stream_vw = 80
     stream_vh = int(80 * window_h // window_w)
@@ -581,7 +651,8 @@ async def run_with_stream(
             max_actions_per_step=max_actions_per_step,
             tool_calling_method=tool_calling_method,
             chrome_cdp=chrome_cdp,
-            max_input_tokens=max_input_tokens
+            max_input_tokens=max_input_tokens,
+            session=session
         )
         # Add HTML content at the start of the result array
         yield [gr.update(visible=False)] + list(result)
@@ -614,7 +685,8 @@ async def run_with_stream(
                     max_actions_per_step=max_actions_per_step,
                     tool_calling_method=tool_calling_method,
                     chrome_cdp=chrome_cdp,
-                    max_input_tokens=max_input_tokens
+                    max_input_tokens=max_input_tokens,
+                    session=session
                 )
             )
 
@@ -623,18 +695,45 @@ async def run_with_stream(
             final_result = errors = model_actions = model_thoughts = ""
             recording_gif = trace = history_file = None
 
-            # Periodically update the stream while the agent task is running
+            # Stream the browser while the agent task is running. The CDP screencast only
+            # delivers a frame when the page repainted; browsers without it are polled.
+            screencast = None
+            screencast_failed = False
+            html_changed = True
             while not agent_task.done():
-                try:
-                    encoded_screenshot = await capture_screenshot(_global_browser_context)
-                    if encoded_screenshot is not None:
-                        html_content = f'<img src="data:image/jpeg;base64,{encoded_screenshot}" style="width:{stream_vw}vw; height:{stream_vh}vh ; border:1px solid #ccc;">'
-                    else:
+                if (screencast is None and not screencast_failed
+                        and isinstance(session.browser_context, CustomBrowserContext)
+                        and session.browser_context.session is not None):
+                    try:
+                        screencast = (await session.browser_context.start_screencast()).subscribe()
+                    except Exception as e:
+                        logger.debug(f"Screencast unavailable, falling back to screenshots: {e}")
+                        screencast_failed = True
+
+                if screencast is not None:
+                    frame = await screencast.next_frame(timeout=0.25)
+                    if frame is not None:
+                        html_content = f'<img src="data:image/jpeg;base64,{frame.data}" style="width:{stream_vw}vw; height:{stream_vh}vh ; border:1px solid #ccc;">'
+                        html_changed = True
+                    elif screencast.closed:
+                        # the context was closed or reset, start again on the next one
+                        screencast = None
+                else:
+                    try:
+                        encoded_screenshot = await capture_screenshot(session.browser_context)
+                        if encoded_screenshot is not None:
+                            html_content = f'<img src="data:image/jpeg;base64,{encoded_screenshot}" style="width:{stream_vw}vw; height:{stream_vh}vh ; border:1px solid #ccc;">'
+                        else:
+                            html_content = f"<h1 style='width:{stream_vw}vw; height:{stream_vh}vh'>Waiting for browser session...</h1>"
+                    except Exception as e:
                         html_content = f"<h1 style='width:{stream_vw}vw; height:{stream_vh}vh'>Waiting for browser session...</h1>"
-                except Exception as e:
-                    html_content = f"<h1 style='width:{stream_vw}vw; height:{stream_vh}vh'>Waiting for browser session...</h1>"
+                    html_changed = True
+                    await asyncio.sleep(0.1)
+
+                html_update = gr.HTML(value=html_content, visible=True) if html_changed else gr.update()
+                html_changed = False
 
-                if _global_agent and _global_agent.state.stopped:
+                if session.agent and session.agent.state.stopped:
                     yield [
                         gr.HTML(value=html_content, visible=True),
                         final_result,
@@ -650,7 +749,7 @@ async def run_with_stream(
                     break
                 else:
                     yield [
-                        gr.HTML(value=html_content, visible=True),
+                        html_update,
                         final_result,
                         errors,
                         model_actions,
@@ -661,7 +760,8 @@ async def run_with_stream(
                         gr.update(),  # Re-enable stop button
                         gr.update()  # Re-enable run button
                     ]
-                await asyncio.sleep(0.1)
+            if screencast is not None:
+                screencast.close()
 
             # Once the agent task completes, get the results
             try:
@@ -720,26 +820,18 @@ theme_map = {
 }
 
 
-async def close_global_browser():
-    global _global_browser, _global_browser_context
-
-    if _global_browser_context:
-        await _global_browser_context.close()
-        _global_browser_context = None
-
-    if _global_browser:
-        await _global_browser.close()
-        _global_browser = None
+async def close_session_browser(request: gr.Request):
+    await get_session(request).close_browser()
 
 
 async def run_deep_search(research_task, max_search_iteration_input, max_query_per_iter_input, llm_provider,
                           llm_model_name, llm_num_ctx, llm_temperature, llm_base_url, llm_api_key, use_vision,
-                          use_own_browser, headless, chrome_cdp):
+                          use_own_browser, headless, chrome_cdp, request: gr.Request):
     from src.utils.deep_research import deep_research
-    global _global_agent_state
+    session = get_session(request)
 
     # Clear any previous stop request
-    _global_agent_state.clear_stop()
+    session.agent_state.clear_stop()
 
     llm = utils.get_llm_model(
         provider=llm_provider,
@@ -749,14 +841,18 @@ async def run_deep_search(research_task, max_search_iteration_input, max_query_p
         base_url=llm_base_url,
         api_key=llm_api_key,
     )
-    markdown_content, file_path = await deep_research(research_task, llm, _global_agent_state,
-                                                      max_search_iterations=max_search_iteration_input,
-                                                      max_query_num=max_query_per_iter_input,
-                                                      use_vision=use_vision,
-                                                      headless=headless,
-                                                      use_own_browser=use_own_browser,
-                                                      chrome_cdp=chrome_cdp
-                                                      )
+    session.begin_run()
+    try:
+        markdown_content, file_path = await deep_research(research_task, llm, session.agent_state,
+                                                          max_search_iterations=max_search_iteration_input,
+                                                          max_query_num=max_query_per_iter_input,
+                                                          use_vision=use_vision,
+                                                          headless=headless,
+                                                          use_own_browser=use_own_browser,
+                                                          chrome_cdp=chrome_cdp
+                                                          )
+    finally:
+        await session.end_run()
 
     return markdown_content, file_path, gr.update(value="Stop", interactive=True), gr.update(interactive=True)
 
@@ -1170,8 +1266,10 @@ def create_ui(theme_name="Ocean"):
             outputs=save_recording_path
         )
 
-        use_own_browser.change(fn=close_global_browser)
-        keep_browser_open.change(fn=close_global_browser)
+        use_own_browser.change(fn=close_session_browser)
+        keep_browser_open.change(fn=close_session_browser)
+        # a closed tab stops its agent and frees its browser and sandbox
+        demo.unload(close_session)
 
         scan_and_register_components(demo)
         global webui_config_manager